@@ -0,0 +1,354 @@
+'''Precomputed aligned bases of every strain of a release and chromosome.
+
+Aligning a region (see ChromosomeBase.multi_strain_fasta) pads each strain's
+bases so that insertions line up, which needs the bases of every strain at
+every position before anything can be output.  An ".aligned" store holds all
+the strains (ChromosomeBases) of a release and chromosome already aligned in
+reference coordinates: every position has as many columns as the longest
+insertion at that position in any strain, and every strain's bases are
+padded to fill them.
+
+The store is split into chunks of CHUNK_SIZE positions, each a single
+contiguous block holding the rows of every strain for the chunk one after
+another, so a region is read with one read per chunk it touches and the
+requested strains are sliced out of it.  Only chunks with insertions keep
+the number of columns of each of their positions.  Insertion columns which
+none of the requested strains fill are left out of the result, so it is the
+same as aligning just those strains.
+
+A store lists the file tag of each strain's ChromosomeBase, and is only used
+when it holds every requested ChromosomeBase as it is now; it is rebuilt
+after batch imports or by the chromosome_build_aligned command.
+
+Store layout:
+  HEADER: magic, version, chunk size, first position, number of positions,
+    number of strains
+  STRAIN (one per strain, in row order): ChromosomeBase id, file tag
+  CHUNK (one per chunk): offset of the chunk, number of columns
+  chunks: the columns of each position (COLUMNS_TYPE, only if the chunk has
+    insertions), then the row of each strain
+
+'''
+
+import array
+import os
+import struct
+
+from django.conf import settings
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'PBAL'
+VERSION = 1
+
+# Number of positions in a chunk.
+CHUNK_SIZE = 4096
+
+HEADER = struct.Struct('<4sHIIII')
+STRAIN = struct.Struct('<I32s')
+CHUNK = struct.Struct('<QI')
+
+COLUMNS_TYPE = 'H'
+
+# The base of positions a strain has no data for, and the padding of
+# insertion columns a strain doesn't fill.
+PAD_CHAR = 'N'
+REALIGN_CHAR = '-'
+
+
+def store_path(release_id, chromosome_id):
+    '''Return the path of the aligned store of a release and chromosome.'''
+
+    return os.path.join(settings.PSEUDOBASE_CHROMOSOME_DATA_ROOT,
+      'release%s_chromosome%s.aligned' % (release_id, chromosome_id))
+
+
+class _StrainReader(object):
+    '''Reads the bases of a ChromosomeBase a chunk at a time.'''
+
+    def __init__(self, cb):
+        self.cb = cb
+        self._offset_size = array.array('I').itemsize
+        self._index_file = open(cb.index_file_path, 'rb')
+        self._data_file = open(cb.data_file_path, 'rb')
+
+    def read(self, start_position, end_position):
+        '''Return (bases, per position bases or None) from start to end.
+
+        Positions outside the ChromosomeBase are padded.  The bases of each
+        position are only split out when there is an insertion in the range.
+
+        '''
+
+        cb = self.cb
+        first = max(start_position, cb.start_position)
+        last = min(end_position, cb.end_position)
+        if first > last:
+            return PAD_CHAR * (end_position + 1 - start_position), None
+
+        count = last + 1 - first
+        offsets = array.array('I')
+        self._index_file.seek((first - cb.start_position) * self._offset_size)
+        offsets.fromstring(self._index_file.read((count + 1) *
+          self._offset_size))
+        self._data_file.seek(offsets[0])
+        if len(offsets) > count:
+            data = self._data_file.read(offsets[count] - offsets[0])
+        else:
+            data = self._data_file.read()
+            offsets.append(offsets[0] + len(data))
+
+        before = PAD_CHAR * (first - start_position)
+        after = PAD_CHAR * (end_position - last)
+        if len(data) == count:
+            return before + data + after, None
+
+        start = offsets[0]
+        return None, list(before) + [data[offsets[i] - start:
+          offsets[i + 1] - start] for i in xrange(count)] + list(after)
+
+    def close(self):
+        self._index_file.close()
+        self._data_file.close()
+
+
+def build_aligned_store(release, chromosome):
+    '''Write the aligned store of the strains of release on chromosome.
+
+    Returns the number of strains in the store, or None (removing any old
+    store) if there are none.
+
+    '''
+
+    from chromosome.models import ChromosomeBase
+
+    cbs = [cb for cb in ChromosomeBase.objects.filter(strain__release=release,
+      chromosome=chromosome).order_by('-strain__is_reference',
+      'strain__species__id', 'strain__name') if not cb.missing_data()]
+    path = store_path(release.id, chromosome.id)
+    if not cbs:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    first = min(cb.start_position for cb in cbs)
+    num_positions = max(cb.end_position for cb in cbs) + 1 - first
+    num_chunks = (num_positions + CHUNK_SIZE - 1) // CHUNK_SIZE
+    readers = [_StrainReader(cb) for cb in cbs]
+
+    tmp_path = path + '.part'
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, VERSION, CHUNK_SIZE, first, num_positions,
+          len(cbs)))
+        for cb in cbs:
+            f.write(STRAIN.pack(cb.id, str(cb.file_tag)))
+        chunk_index_offset = f.tell()
+        f.write(CHUNK.pack(0, 0) * num_chunks)
+
+        chunks = []
+        for chunk_start in xrange(first, first + num_positions, CHUNK_SIZE):
+            chunk_end = min(chunk_start + CHUNK_SIZE, first + num_positions) - 1
+            rows = [reader.read(chunk_start, chunk_end) for reader in readers]
+            chunks.append((f.tell(), _write_chunk(f, rows,
+              chunk_end + 1 - chunk_start)))
+
+        f.seek(chunk_index_offset)
+        f.write(''.join([CHUNK.pack(*chunk) for chunk in chunks]))
+    except:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        for reader in readers:
+            reader.close()
+    f.close()
+    os.rename(tmp_path, path)
+    return len(cbs)
+
+
+def _write_chunk(f, rows, num_positions):
+    '''Write the (bases, per position bases) rows of a chunk to f.
+
+    Returns the number of columns of the chunk.
+
+    '''
+
+    if all(bases is not None for bases, split in rows):
+        # No insertions, so one column per position.
+        for bases, split in rows:
+            f.write(bases)
+        return num_positions
+
+    columns = [1] * num_positions
+    for bases, split in rows:
+        if split is not None:
+            columns = [max(c, len(b)) for c, b in zip(columns, split)]
+    if max(columns) >= 1 << (8 * array.array(COLUMNS_TYPE).itemsize):
+        raise ValueError('Insertion too long for an aligned store')
+    num_columns = sum(columns)
+    if num_columns != num_positions:
+        f.write(array.array(COLUMNS_TYPE, columns).tostring())
+
+    for bases, split in rows:
+        f.write(''.join([b + REALIGN_CHAR * (c - len(b)) for b, c in zip(
+          split if split is not None else bases, columns)]))
+    return num_columns
+
+
+class AlignedStore(object):
+    '''Read access to the aligned store of a release and chromosome.'''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            (magic, version, self.chunk_size, self.start_position,
+              self.num_positions, num_strains) = HEADER.unpack(
+              f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a version %s aligned store: %s' % (
+                  VERSION, path))
+            # The row and file tag of each ChromosomeBase, by id.
+            self.strains = {}
+            for row in xrange(num_strains):
+                cb_id, file_tag = STRAIN.unpack(f.read(STRAIN.size))
+                self.strains[cb_id] = (row, file_tag.rstrip('\0'))
+            self._chunk_index_offset = f.tell()
+        finally:
+            f.close()
+        self.num_strains = num_strains
+        self.end_position = self.start_position + self.num_positions - 1
+
+    @classmethod
+    def for_chromosome_bases(cls, cbs):
+        '''Return the store holding all of cbs, or None if there isn't one.'''
+
+        keys = set((cb.strain.release_id, cb.chromosome_id) for cb in cbs)
+        if len(keys) != 1:
+            return None
+        release_id, chromosome_id = keys.pop()
+        if release_id is None:
+            return None
+        path = store_path(release_id, chromosome_id)
+        if not os.path.exists(path):
+            return None
+        store = cls(path)
+        if not store.holds(cbs):
+            return None
+        return store
+
+    def holds(self, cbs):
+        '''Return whether the store holds the current data of all of cbs.'''
+
+        for cb in cbs:
+            strain = self.strains.get(cb.id)
+            if strain is None or strain[1] != str(cb.file_tag):
+                return False
+        return True
+
+    def _read_chunk(self, f, n):
+        '''Return (columns of each position or None, row length, block).'''
+
+        f.seek(self._chunk_index_offset + n * CHUNK.size)
+        offset, num_columns = CHUNK.unpack(f.read(CHUNK.size))
+        chunk_positions = min(self.chunk_size,
+          self.num_positions - n * self.chunk_size)
+        columns = None
+        columns_size = 0
+        if num_columns != chunk_positions:
+            columns_size = chunk_positions * array.array(
+              COLUMNS_TYPE).itemsize
+        f.seek(offset)
+        block = f.read(columns_size + num_columns * self.num_strains)
+        if columns_size:
+            columns = array.array(COLUMNS_TYPE)
+            columns.fromstring(block[:columns_size])
+            block = block[columns_size:]
+        return columns, num_columns, block
+
+    def aligned_bases(self, cbs, start_position, end_position):
+        '''Return the aligned bases of each of cbs from start to end.
+
+        The bases are aligned amongst cbs only: insertion columns none of
+        them fill are left out.
+
+        '''
+
+        rows = [self.strains[cb.id][0] for cb in cbs]
+        pieces = [[] for cb in cbs]
+
+        first = max(start_position, self.start_position)
+        last = min(end_position, self.end_position)
+        if first > last:
+            return [PAD_CHAR * (end_position + 1 - start_position)] * len(cbs)
+
+        f = open(self.path, 'rb')
+        try:
+            for n in xrange((first - self.start_position) // self.chunk_size,
+              (last - self.start_position) // self.chunk_size + 1):
+                chunk_start = self.start_position + n * self.chunk_size
+                columns, num_columns, block = self._read_chunk(f, n)
+                begin = max(first, chunk_start) - chunk_start
+                end = min(last, chunk_start + self.chunk_size - 1) + 1 - \
+                  chunk_start
+                strain_rows = [block[row * num_columns:(row + 1) * num_columns]
+                  for row in rows]
+                for i, piece in enumerate(_select_columns(strain_rows,
+                  columns, begin, end)):
+                    pieces[i].append(piece)
+        finally:
+            f.close()
+
+        before = PAD_CHAR * (first - start_position)
+        after = PAD_CHAR * (end_position - last)
+        return [before + ''.join(p) + after for p in pieces]
+
+
+def _select_columns(strain_rows, columns, begin, end):
+    '''Return the columns of positions begin to end (exclusive) of rows.
+
+    Insertion columns only holding padding in all of the rows are left out.
+
+    '''
+
+    if columns is None:
+        return [row[begin:end] for row in strain_rows]
+
+    column = sum(columns[:begin])
+    # (start, end) column ranges to keep.
+    keep = []
+    keep_start = column
+    for width in columns[begin:end]:
+        if width > 1:
+            used = 1
+            for extra in xrange(width - 1, 0, -1):
+                if any(row[column + extra] != REALIGN_CHAR for row in
+                  strain_rows):
+                    used = extra + 1
+                    break
+            if used < width:
+                keep.append((keep_start, column + used))
+                keep_start = column + width
+        column += width
+    keep.append((keep_start, column))
+    return [''.join([row[a:b] for a, b in keep]) for row in strain_rows]
+
+
+def aligned_bases(cbs, start_position, end_position):
+    '''Return the aligned bases of each of cbs from the aligned store.
+
+    Returns None if there is no store holding all of cbs as they are now.
+
+    '''
+
+    try:
+        store = AlignedStore.for_chromosome_bases(cbs)
+    except (IOError, ValueError, struct.error):
+        log.exception('Error reading aligned store')
+        return None
+    if store is None:
+        return None
+    return store.aligned_bases(cbs, start_position, end_position)
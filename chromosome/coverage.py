@@ -0,0 +1,420 @@
+'''Compact storage and multi-resolution summaries of ChromosomeBase coverage.
+
+Coverage comes in long runs of the same value (every position filled from the
+reference has no coverage at all), so it is stored in a ".rlecov" file of
+run-length encoded blocks of RLE_BLOCK_SIZE positions.  A block holding more
+runs than is worthwhile is stored raw instead.  A block index at the end of
+the file gives the offset of every block, so reading a range only has to
+decode the blocks it touches.  (Older ChromosomeBases have a ".coverage" file
+of one byte per position instead, which the chromosome_compress_coverage
+command converts.)
+
+Coverage is still one value per position, which is far too much data to read
+when looking at a large region.  Each ChromosomeBase can therefore also have a
+".zoom" sidecar file holding the mean, minimum and maximum coverage of fixed
+size bins at several zoom levels (each ZOOM_FACTOR times coarser than the
+last), in the style of bigWig zoom levels.  A range query picks the finest
+resolution which fits the number of points asked for, so reading the coverage
+of a whole chromosome only takes a few thousand records.
+
+Run-length encoded coverage layout:
+  RLE_HEADER: magic, version, block size, number of positions, offset of the
+    block index
+  blocks: a block type byte, then either runs (RLE_RUN: value, run length
+    less one) or raw values
+  block index: the offset of each block, then the offset of the block index
+
+Zoom level sidecar layout:
+  HEADER: magic, version, first position, number of positions, number of
+    zoom levels
+  LEVEL (one per zoom level, finest first): bin size, number of bins
+  BIN (the bins of each level in turn): coverage sum, minimum and maximum
+
+'''
+
+import array
+import itertools
+import os
+import struct
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'PBCZ'
+VERSION = 1
+
+# Bin size of the finest zoom level, and the factor between zoom levels.
+BASE_BIN_SIZE = 128
+ZOOM_FACTOR = 8
+NUM_LEVELS = 5
+
+# Number of positions of coverage read at a time when building summaries
+# (a multiple of the coarsest bin size).
+READ_BLOCK_SIZE = BASE_BIN_SIZE * ZOOM_FACTOR ** (NUM_LEVELS - 1) * 2
+
+HEADER = struct.Struct('<4sHIIB')
+LEVEL = struct.Struct('<II')
+BIN = struct.Struct('<IBB')
+
+RLE_MAGIC = 'PBCR'
+RLE_VERSION = 1
+
+# Number of positions in each run-length encoded block (at most 65536, the
+# longest run RLE_RUN can hold).
+RLE_BLOCK_SIZE = 65536
+
+RLE_HEADER = struct.Struct('<4sHIIQ')
+RLE_INDEX = struct.Struct('<Q')
+RLE_RUN = struct.Struct('<BH')
+
+BLOCK_RUNS = '\x00'
+BLOCK_RAW = '\x01'
+
+
+def encode_block(values):
+    '''Return the encoding of one block of coverage values (an array('B')).'''
+
+    runs = [(value, len(list(run))) for value, run in
+      itertools.groupby(values)]
+    if len(runs) * RLE_RUN.size >= len(values):
+        return BLOCK_RAW + values.tostring()
+    return BLOCK_RUNS + ''.join([RLE_RUN.pack(value, length - 1)
+      for value, length in runs])
+
+
+def decode_block(data):
+    '''Return the coverage values (an array('B')) of an encoded block.'''
+
+    values = array.array('B')
+    if data[:1] == BLOCK_RAW:
+        values.fromstring(data[1:])
+        return values
+    for offset in xrange(1, len(data), RLE_RUN.size):
+        value, length = RLE_RUN.unpack_from(data, offset)
+        values.extend(array.array('B', [value]) * (length + 1))
+    return values
+
+
+class CoverageWriter(object):
+    '''Writes run-length encoded coverage a position at a time.
+
+    Coverage values must already be clipped to 0 - 255.  The file is only
+    complete (and readable) once close() has been called.
+
+    '''
+
+    def __init__(self, path, block_size=RLE_BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.num_positions = 0
+        self._block = array.array('B')
+        self._block_offsets = []
+        self._file = open(path, 'wb')
+        self._file.write(RLE_HEADER.pack(RLE_MAGIC, RLE_VERSION, block_size,
+          0, 0))
+
+    def append(self, coverage):
+        '''Append the coverage of the next position.'''
+
+        self._block.append(coverage)
+        if len(self._block) == self.block_size:
+            self._write_block()
+
+    def extend(self, coverage):
+        '''Append the coverage of several positions (an array('B')).'''
+
+        start = 0
+        while start < len(coverage):
+            end = start + self.block_size - len(self._block)
+            self._block.extend(coverage[start:end])
+            if len(self._block) == self.block_size:
+                self._write_block()
+            start = end
+
+    def _write_block(self):
+        self._block_offsets.append(self._file.tell())
+        self._file.write(encode_block(self._block))
+        self.num_positions += len(self._block)
+        self._block = array.array('B')
+
+    def close(self):
+        '''Write the last block and the block index, and close the file.'''
+
+        if self._block:
+            self._write_block()
+        index_offset = self._file.tell()
+        self._file.write(''.join([RLE_INDEX.pack(offset) for offset in
+          self._block_offsets + [index_offset]]))
+        self._file.seek(0)
+        self._file.write(RLE_HEADER.pack(RLE_MAGIC, RLE_VERSION,
+          self.block_size, self.num_positions, index_offset))
+        self._file.close()
+
+
+class RLECoverage(object):
+    '''Read access to a run-length encoded coverage file.'''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            (magic, version, self.block_size, self.num_positions,
+              self.index_offset) = RLE_HEADER.unpack(f.read(RLE_HEADER.size))
+        finally:
+            f.close()
+        if magic != RLE_MAGIC or version != RLE_VERSION:
+            raise ValueError('Not a version %s coverage file: %s' % (
+              RLE_VERSION, path))
+
+    def values(self, first, last):
+        '''Return the coverage at offsets first to last (inclusive).
+
+        Offsets count from 0 at the first position; the range is clipped to
+        the positions in the file.  The values are returned as an array of
+        bytes.
+
+        '''
+
+        first = max(first, 0)
+        last = min(last, self.num_positions - 1)
+        if first > last:
+            return array.array('B')
+
+        first_block = first // self.block_size
+        last_block = last // self.block_size
+        f = open(self.path, 'rb')
+        try:
+            num_offsets = last_block - first_block + 2
+            f.seek(self.index_offset + first_block * RLE_INDEX.size)
+            index = f.read(num_offsets * RLE_INDEX.size)
+            offsets = [RLE_INDEX.unpack_from(index, i * RLE_INDEX.size)[0]
+              for i in range(num_offsets)]
+            f.seek(offsets[0])
+            data = f.read(offsets[-1] - offsets[0])
+        finally:
+            f.close()
+
+        values = array.array('B')
+        for start, end in zip(offsets, offsets[1:]):
+            values.extend(decode_block(data[start - offsets[0]:
+              end - offsets[0]]))
+        skip = first - first_block * self.block_size
+        return values[skip:skip + last + 1 - first]
+
+
+def compress_coverage(cb, remove=True):
+    '''Convert the one byte per position coverage of cb to the compact format.
+
+    The old coverage file is removed once the new one is written, unless
+    remove is False.
+
+    '''
+
+    tmp_path = cb.coverage_rle_file_path + '.part'
+    writer = CoverageWriter(tmp_path)
+    f = open(cb.coverage_file_path, 'rb')
+    try:
+        while True:
+            coverage = array.array('B')
+            coverage.fromstring(f.read(RLE_BLOCK_SIZE * 16))
+            if not coverage:
+                break
+            writer.extend(coverage)
+        writer.close()
+    except:
+        f.close()
+        writer.close()
+        os.remove(tmp_path)
+        raise
+    f.close()
+    os.rename(tmp_path, cb.coverage_rle_file_path)
+    if remove:
+        os.remove(cb.coverage_file_path)
+
+
+class CoverageBin(object):
+    '''The coverage summary of the positions from start to end (inclusive).'''
+
+    __slots__ = ('start_position', 'end_position', 'mean', 'min', 'max')
+
+    def __init__(self, start_position, end_position, mean, min, max):
+        self.start_position = start_position
+        self.end_position = end_position
+        self.mean = mean
+        self.min = min
+        self.max = max
+
+
+def build_coverage_summaries(cb):
+    '''Write the coverage zoom level sidecar file of ChromosomeBase cb.'''
+
+    # The finest level is built from the coverage itself, and each coarser
+    # level from the level below it.
+    sums, mins, maxes = [], [], []
+    for block_start in xrange(cb.start_position, cb.end_position + 1,
+      READ_BLOCK_SIZE):
+        coverage = cb.coverage_values(block_start,
+          block_start + READ_BLOCK_SIZE - 1)
+        for i in xrange(0, len(coverage), BASE_BIN_SIZE):
+            values = coverage[i:i + BASE_BIN_SIZE]
+            sums.append(sum(values))
+            mins.append(min(values))
+            maxes.append(max(values))
+
+    levels = [(BASE_BIN_SIZE, sums, mins, maxes)]
+    for level in range(1, NUM_LEVELS):
+        bin_size, sums, mins, maxes = levels[-1]
+        levels.append((bin_size * ZOOM_FACTOR,
+          [sum(sums[i:i + ZOOM_FACTOR]) for i in
+            xrange(0, len(sums), ZOOM_FACTOR)],
+          [min(mins[i:i + ZOOM_FACTOR]) for i in
+            xrange(0, len(mins), ZOOM_FACTOR)],
+          [max(maxes[i:i + ZOOM_FACTOR]) for i in
+            xrange(0, len(maxes), ZOOM_FACTOR)]))
+
+    tmp_path = cb.coverage_zoom_file_path + '.part'
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, VERSION, cb.start_position, cb.total_bases,
+          len(levels)))
+        for bin_size, sums, mins, maxes in levels:
+            f.write(LEVEL.pack(bin_size, len(sums)))
+        for bin_size, sums, mins, maxes in levels:
+            f.write(''.join([BIN.pack(*b) for b in zip(sums, mins, maxes)]))
+    except:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    f.close()
+    os.rename(tmp_path, cb.coverage_zoom_file_path)
+
+
+class CoverageSummaries(object):
+    '''Read access to the coverage zoom level sidecar of a ChromosomeBase.'''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            (magic, version, self.start_position, self.num_positions,
+              num_levels) = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a version %s coverage zoom file: %s' % (
+                  VERSION, path))
+
+            # (bin size, number of bins, file offset of the first bin)
+            self.levels = []
+            offset = HEADER.size + num_levels * LEVEL.size
+            for level in range(num_levels):
+                bin_size, num_bins = LEVEL.unpack(f.read(LEVEL.size))
+                self.levels.append((bin_size, num_bins, offset))
+                offset += num_bins * BIN.size
+        finally:
+            f.close()
+        self.end_position = self.start_position + self.num_positions - 1
+
+    @classmethod
+    def for_chromosome_base(cls, cb):
+        '''Return the CoverageSummaries of cb, or None if there are none.'''
+
+        if not os.path.exists(cb.coverage_zoom_file_path):
+            return None
+        return cls(cb.coverage_zoom_file_path)
+
+    def bins(self, start_position, end_position, bin_size):
+        '''Return the CoverageBins of one zoom level covering a range.'''
+
+        start_position = max(start_position, self.start_position)
+        end_position = min(end_position, self.end_position)
+        for level_bin_size, num_bins, offset in self.levels:
+            if level_bin_size == bin_size:
+                break
+        else:
+            raise ValueError('No zoom level with bin size %s' % bin_size)
+        if start_position > end_position:
+            return []
+
+        first = (start_position - self.start_position) // bin_size
+        last = (end_position - self.start_position) // bin_size
+        f = open(self.path, 'rb')
+        try:
+            f.seek(offset + first * BIN.size)
+            data = f.read((last + 1 - first) * BIN.size)
+        finally:
+            f.close()
+
+        bins = []
+        for n in range(first, last + 1):
+            coverage_sum, coverage_min, coverage_max = BIN.unpack_from(data,
+              (n - first) * BIN.size)
+            bin_start = self.start_position + n * bin_size
+            bin_end = min(bin_start + bin_size - 1, self.end_position)
+            bins.append(CoverageBin(bin_start, bin_end,
+              float(coverage_sum) / (bin_end + 1 - bin_start), coverage_min,
+              coverage_max))
+        return bins
+
+    def bin_size_for(self, start_position, end_position, max_points):
+        '''Return the finest bin size giving at most max_points over a range.
+
+        None is returned if the range is small enough to need no summarising.
+
+        '''
+
+        num_positions = end_position + 1 - start_position
+        if num_positions <= max_points:
+            return None
+        for bin_size, num_bins, offset in self.levels:
+            if (num_positions + bin_size - 1) // bin_size <= max_points:
+                return bin_size
+        return self.levels[-1][0]
+
+
+def _binned_coverage(cb, start_position, end_position, bin_size):
+    '''Return CoverageBins of bin_size positions covering a range of cb,
+    summarised straight from the coverage data.
+
+    '''
+
+    bins = []
+    # Read whole bins at a time.
+    read_size = max(READ_BLOCK_SIZE // bin_size, 1) * bin_size
+    for block_start in xrange(start_position, end_position + 1, read_size):
+        block_end = min(block_start + read_size - 1, end_position)
+        coverage = cb.coverage_values(block_start, block_end)
+        for i in xrange(0, len(coverage), bin_size):
+            values = coverage[i:i + bin_size]
+            bin_start = block_start + i
+            bins.append(CoverageBin(bin_start, bin_start + len(values) - 1,
+              float(sum(values)) / len(values), min(values), max(values)))
+    return bins
+
+
+def coverage_range(cb, start_position, end_position, max_points=2000):
+    '''Return CoverageBins covering a range of cb at a suitable resolution.
+
+    The finest resolution giving at most max_points bins is used (the
+    coarsest zoom level is used for ranges too large for that).  Ranges with
+    no more than max_points positions are returned a position at a time,
+    straight from the coverage data.  Larger ranges of ChromosomeBases
+    without coverage summaries are summarised from the coverage data, in
+    bins of equal size giving at most max_points bins.
+
+    '''
+
+    summaries = CoverageSummaries.for_chromosome_base(cb)
+    if summaries is not None:
+        bin_size = summaries.bin_size_for(start_position, end_position,
+          max_points)
+        if bin_size is not None:
+            return summaries.bins(start_position, end_position, bin_size)
+
+    start_position, end_position = cb.clip(start_position, end_position)
+    num_positions = end_position + 1 - start_position
+    if num_positions > max_points:
+        return _binned_coverage(cb, start_position, end_position,
+          (num_positions + max_points - 1) // max_points)
+    return [CoverageBin(position, position, c, c, c) for position, c in
+      enumerate(cb.coverage_values(start_position, end_position),
+        start_position)]
@@ -0,0 +1,312 @@
+'''Export of whole strains (every chromosome) as FASTA deliveries.
+
+Each chromosome is read straight from its ChromosomeBase data file in large
+chunks and wrapped to FASTA lines in-process.  Chromosomes are compressed in
+parallel by a pool of worker processes, each to a file of its own next to
+the delivery, and the compressed files are then assembled (without being
+compressed again) into the delivery zip or gzipped FASTA file in order.
+
+A chromosome is exported either as the strain's sequence, as shown by
+searches (deletions removed and insertions included), or aligned to the
+reference, with exactly one base per position (deletions kept as "-" and
+insertions left out).
+
+Features (regions listed in a CSV file) are exported in the same way: they
+are grouped by chromosome and sorted by position, so that each chromosome's
+features are read in a single sweep through each strain's files, and the
+chromosomes are handed to the pool of workers.
+
+'''
+
+import array
+import itertools
+import multiprocessing
+import os
+import tempfile
+
+from django.db import connection
+
+from chromosome.models import ChromosomeBase
+from common.delivery import Deflater, DeliveryGzip, DeliveryZip, \
+  deflate_to_file
+
+import logging
+log = logging.getLogger(__name__)
+
+
+FASTA_LINE_LENGTH = 75
+
+# Number of bytes (or positions, when aligned) read at a time.
+READ_SIZE = 1 << 20
+
+
+def _sequence_chunks(cb):
+    '''Generator returning the bases of cb, without deletions, in chunks.'''
+
+    f = open(cb.data_file_path, 'rb')
+    try:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            yield data.replace('-', '')
+    finally:
+        f.close()
+
+
+def _aligned_chunks(cb):
+    '''Generator returning the base at each position of cb, in chunks.
+
+    The base at a position with an insertion is the first of its bases.
+
+    '''
+
+    offset_size = array.array('I').itemsize
+    positions = os.path.getsize(cb.index_file_path) // offset_size
+
+    index_file = open(cb.index_file_path, 'rb')
+    data_file = open(cb.data_file_path, 'rb')
+    try:
+        for first in xrange(0, positions, READ_SIZE):
+            count = min(READ_SIZE, positions - first)
+            # The offset of the position following the chunk (if there is
+            # one) marks the end of the chunk's data.
+            offsets = array.array('I')
+            index_file.seek(first * offset_size)
+            offsets.fromstring(index_file.read((count + 1) * offset_size))
+
+            start = offsets[0]
+            data_file.seek(start)
+            if len(offsets) > count:
+                data = data_file.read(offsets[count] - start)
+                offsets = offsets[:count]
+            else:
+                data = data_file.read()
+
+            if len(data) == count:
+                # No insertions, so one base per position already.
+                yield data
+            else:
+                yield ''.join([data[offset - start] for offset in offsets])
+    finally:
+        index_file.close()
+        data_file.close()
+
+
+def wrap_lines(chunks, width=FASTA_LINE_LENGTH):
+    '''Generator returning chunks of text as newline terminated lines.'''
+
+    remainder = ''
+    for chunk in chunks:
+        chunk = remainder + chunk
+        end = len(chunk) - len(chunk) % width
+        if end:
+            yield '\n'.join([chunk[i:i + width] for i in
+              xrange(0, end, width)]) + '\n'
+        remainder = chunk[end:]
+    if remainder:
+        yield remainder + '\n'
+
+
+def fasta_chunks(cb, aligned=False):
+    '''Generator returning the FASTA text of the whole of cb, in chunks.'''
+
+    yield '%s\n' % cb.fasta_header(cb.start_position, cb.end_position)
+    for chunk in wrap_lines(_aligned_chunks(cb) if aligned else
+      _sequence_chunks(cb)):
+        yield chunk
+
+
+def _init_worker():
+    '''Make sure each worker process opens its own database connection.'''
+    connection.close()
+
+
+def _compress_chromosome(task):
+    '''Compress the FASTA text of a ChromosomeBase to a file.
+
+    task is a (ChromosomeBase id, path, compression level, aligned) tuple.
+    This is a module level function so that it can be handed to a
+    multiprocessing pool.  Returns the (CRC-32, size) of the text.
+
+    '''
+
+    cb_id, path, level, aligned = task
+    cb = ChromosomeBase.objects.select_related('strain__species',
+      'strain__release', 'chromosome').get(id=cb_id)
+    return deflate_to_file(fasta_chunks(cb, aligned), path, level)
+
+
+def export_strains(relative_path, entries, gzip=False, level=None,
+  aligned=False, workers=1):
+    '''Export the chromosomes of entries to the delivery at relative_path.
+
+    entries lists the (entry name, ChromosomeBase) of each chromosome.  The
+    delivery is a zip with an entry per chromosome, or a single gzipped FASTA
+    file if gzip is set.  Chromosomes are compressed by a pool of worker
+    processes if workers is more than 1, and assembled in order.  Returns
+    the path of the delivery.
+
+    '''
+
+    if gzip:
+        delivery = DeliveryGzip(relative_path, level)
+    else:
+        delivery = DeliveryZip(relative_path, level)
+
+    tasks = []
+    pool = None
+    with delivery:
+        try:
+            for name, cb in entries:
+                handle, path = tempfile.mkstemp(suffix='.part',
+                  dir=os.path.dirname(delivery.path))
+                os.close(handle)
+                tasks.append((cb.id, path, delivery.level, aligned))
+
+            if workers > 1:
+                connection.close()
+                pool = multiprocessing.Pool(workers, _init_worker)
+                results = pool.imap(_compress_chromosome, tasks)
+            else:
+                results = itertools.imap(_compress_chromosome, tasks)
+
+            # Chromosomes are assembled in order as soon as they are ready,
+            # while the workers carry on with the rest.
+            for (name, cb), task, (crc, file_size) in itertools.izip(entries,
+              tasks, results):
+                if gzip:
+                    delivery.write_compressed(task[1], crc, file_size)
+                else:
+                    delivery.write_compressed(name, task[1], crc, file_size)
+                os.remove(task[1])
+                log.info('Exported: %s' % cb)
+        finally:
+            if pool is not None:
+                # Any work still outstanding (after an error) is abandoned.
+                pool.terminate()
+                pool.join()
+            for task in tasks:
+                if os.path.exists(task[1]):
+                    os.remove(task[1])
+    return delivery.path
+
+
+def _feature_fasta(cb, start, end, bases):
+    '''Return the FASTA text of bases, the feature from start to end in cb.'''
+
+    if start > cb.end_position:
+        lines = cb.wrap_data('No data beyond base %s available for this strain'
+          % cb.end_position)
+    else:
+        lines = [bases[i:i + FASTA_LINE_LENGTH] for i in
+          xrange(0, len(bases), FASTA_LINE_LENGTH)]
+    return '%s\n%s' % (cb.fasta_header(start, end),
+      ''.join([line + '\n' for line in lines]))
+
+
+def _compress_features(task):
+    '''Compress the multi-FASTA text of each feature on a chromosome.
+
+    task is a (chromosome name, species ids, features, path, compression
+    level) tuple, features listing the (feature id, start, end) of each
+    feature.  The text of each feature is compressed separately, one after
+    the other, to the file at path.  Returns path and the (feature id,
+    CRC-32, size, compressed size) of each feature, in the order they were
+    written.
+
+    '''
+
+    chromosome_name, species_ids, features, path, level = task
+    cbs = []
+    for cb in ChromosomeBase.objects.filter(chromosome__name=chromosome_name,
+      strain__species__id__in=species_ids).select_related('strain__species',
+      'strain__release', 'chromosome').order_by('-strain__is_reference',
+      'strain__species__id', 'strain__name'):
+        if cb.missing_data():
+            log.warning('Missing chromosomebase data: %s' % cb)
+        else:
+            cbs.append(cb)
+
+    # Each strain's files are swept once, from the first feature to the last.
+    features = sorted(features, key=lambda feature: feature[1:])
+    regions = [(start, end) for feature_id, start, end in features]
+    readers = [cb.regions_bases(regions) for cb in cbs]
+
+    results = []
+    output = open(path, 'wb')
+    try:
+        for feature_id, start, end in features:
+            deflater = Deflater(output, level)
+            for cb, reader in itertools.izip(cbs, readers):
+                deflater.write(_feature_fasta(cb, start, end, reader.next()))
+            if not cbs:
+                deflater.write('No data matching specified query!')
+            deflater.write('\n')
+            deflater.flush()
+            results.append((feature_id, deflater.crc, deflater.file_size,
+              deflater.compress_size))
+    finally:
+        output.close()
+        for reader in readers:
+            reader.close()
+    return (path, results)
+
+
+def export_features(relative_path, directory, features, species_ids,
+  level=None, workers=1):
+    '''Export features to the delivery zip at relative_path.
+
+    features lists the (feature id, chromosome name, start, end) of each
+    feature, and the multi-FASTA text of each (every strain of the species
+    with species_ids) is written to the entry "<directory>/<feature id>.txt".
+    Chromosomes are handled by a pool of worker processes if workers is more
+    than 1, and assembled as they finish.  Returns the path of the delivery.
+
+    '''
+
+    features_by_chromosome = {}
+    for feature_id, chromosome_name, start, end in features:
+        features_by_chromosome.setdefault(chromosome_name, []).append(
+          (feature_id, start, end))
+
+    tasks = []
+    pool = None
+    with DeliveryZip(relative_path, level) as delivery:
+        try:
+            for chromosome_name in sorted(features_by_chromosome):
+                handle, path = tempfile.mkstemp(suffix='.part',
+                  dir=os.path.dirname(delivery.path))
+                os.close(handle)
+                tasks.append((chromosome_name, list(species_ids),
+                  features_by_chromosome[chromosome_name], path,
+                  delivery.level))
+
+            if workers > 1:
+                connection.close()
+                pool = multiprocessing.Pool(workers, _init_worker)
+                results = pool.imap_unordered(_compress_features, tasks)
+            else:
+                results = itertools.imap(_compress_features, tasks)
+
+            # Chromosomes are assembled as soon as they are ready, in
+            # whichever order they finish.
+            for path, feature_results in results:
+                compressed = open(path, 'rb')
+                try:
+                    for feature_id, crc, file_size, compress_size in \
+                      feature_results:
+                        delivery.write_compressed_data('%s/%s.txt' % (
+                          directory, feature_id), compressed.read(
+                          compress_size), crc, file_size)
+                finally:
+                    compressed.close()
+                os.remove(path)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            for task in tasks:
+                if os.path.exists(task[3]):
+                    os.remove(task[3])
+    return delivery.path
@@ -0,0 +1,175 @@
+'''A catalog of the chromosome data files waiting to be preprocessed or imported.
+
+The import and preprocess pages list every file in the pending import and
+strain VCF directories along with its ChromosomeImporter.get_info(), which
+has to open (and often decompress the start of) each file.  The info of each
+file is therefore kept in the CatalogedFile table, valid for as long as the
+file's size and modification time are unchanged, so the pages only read
+files which are new or have changed.
+
+The catalog is kept current by the chromosome_scan_files command (run from
+cron, or left watching the directories).  Pages still catalog any file the
+scanner hasn't got to yet themselves.
+
+The parts of a file's info which depend on the database rather than the file
+(the release of a VCF file's strain, and whether a file's chromosome has
+been imported already) are looked up again whenever the info is used, as
+are the statistics of VCF files (which are usually counted as the file is
+uploaded, see chromosome.vcf_stats).
+
+'''
+
+import json
+import os
+
+import django.utils.timezone
+from django.conf import settings
+
+from chromosome.models import CatalogedFile, ChromosomeImporter
+from chromosome.vcf_stats import stored_file_stats
+from common.models import StrainSymbol
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def catalog_directories():
+    '''Return the directories whose files are cataloged.'''
+
+    return [os.path.abspath(
+      settings.PSEUDOBASE_CHROMOSOME_RAW_DATA_PENDING_PREFIX),
+      os.path.abspath(settings.PSEUDOBASE_CHROMOSOME_RAW_DATA_VCF_PREFIX)]
+
+
+def _files(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))
+      if os.path.isfile(os.path.join(directory, f))]
+
+
+def _preprocessed_directories():
+    '''Return the directories of preprocessed (split, filtered...) VCF files.
+
+    These are the subdirectories of each strain directory (named D...) in the
+    strain VCF directory.
+
+    '''
+
+    vcf_directory = os.path.abspath(
+      settings.PSEUDOBASE_CHROMOSOME_RAW_DATA_VCF_PREFIX)
+    if not os.path.isdir(vcf_directory):
+        return []
+    directories = []
+    for strain_dir in sorted(os.listdir(vcf_directory)):
+        strain_path = os.path.join(vcf_directory, strain_dir)
+        if strain_dir[:1] != 'D' or not os.path.isdir(strain_path):
+            continue
+        directories.extend([os.path.join(strain_path, d) for d in
+          sorted(os.listdir(strain_path)) if
+          os.path.isdir(os.path.join(strain_path, d))])
+    return directories
+
+
+def scanned_directories():
+    '''Return every directory whose files are cataloged.'''
+    return catalog_directories() + _preprocessed_directories()
+
+
+def directories_signature():
+    '''Return a value which changes whenever a cataloged directory changes.'''
+
+    return tuple((d, os.path.getmtime(d)) for d in scanned_directories()
+      if os.path.isdir(d))
+
+
+def catalog_file(path, stat=None):
+    '''Read the info of path into the catalog, returning its CatalogedFile.'''
+
+    path = os.path.abspath(path)
+    if stat is None:
+        stat = os.stat(path)
+    info = ChromosomeImporter(path).get_info(incl_rec_count=False)
+
+    try:
+        entry = CatalogedFile.objects.get(path=path)
+    except CatalogedFile.DoesNotExist:
+        entry = CatalogedFile(path=path)
+    entry.size = stat.st_size
+    entry.mtime = stat.st_mtime
+    entry.info = json.dumps(info)
+    entry.scanned_at = django.utils.timezone.now()
+    entry.save()
+    return entry
+
+
+def with_database_info(path, info):
+    '''Bring the database dependent parts of a file's info up to date.'''
+
+    if info.get('format') == 'VCF gzipped' and 'strain_name' in info:
+        try:
+            info['release_name'] = StrainSymbol.objects.get(
+              symbol=info['strain_name']).strain.release.name
+        except:
+            info['release_name'] = 'unknown'
+        stats = stored_file_stats(path)
+        if stats is not None:
+            info['rec_count'] = stats.num_records
+            info['chromosome_names'] = stats.chromosomes_dict()
+            info['num_chromosomes'] = len(info['chromosome_names'])
+            if stats.summary_flags is not None:
+                info['summary_flag_dict'] = stats.summary_flags_dict()
+    elif info.get('format') in ('Reference', 'Non-ref'):
+        info['exists_in_db'] = ChromosomeImporter(path).already_exists(
+          info['strain_name'], info['chromosome_name'])
+    return info
+
+
+def files_info(paths):
+    '''Return the info of each of paths, from the catalog where current.'''
+
+    paths = [os.path.abspath(path) for path in paths]
+    entries = dict((entry.path, entry) for entry in
+      CatalogedFile.objects.filter(path__in=paths))
+
+    infos = []
+    for path in paths:
+        stat = os.stat(path)
+        entry = entries.get(path)
+        if entry is None or entry.size != stat.st_size or \
+          entry.mtime != stat.st_mtime:
+            entry = catalog_file(path, stat)
+        infos.append(with_database_info(path, entry.info_dict()))
+    return infos
+
+
+def directory_files_info(directory):
+    '''Return the info of each file in directory, from the catalog.'''
+    return files_info(_files(directory))
+
+
+def refresh_catalog():
+    '''Catalog new and changed files, and forget files which have gone.
+
+    Returns the number of files (re)cataloged.
+
+    '''
+
+    paths = []
+    for directory in scanned_directories():
+        paths.extend(_files(directory))
+
+    scanned = 0
+    for path in paths:
+        stat = os.stat(path)
+        if CatalogedFile.objects.current(path, stat.st_size,
+          stat.st_mtime) is not None:
+            continue
+        try:
+            catalog_file(path, stat)
+            scanned += 1
+        except:
+            log.exception('Error cataloging: ' + path)
+
+    CatalogedFile.objects.exclude(path__in=paths).delete()
+    return scanned
@@ -0,0 +1,413 @@
+'''Insertion maps: where the strains of a release and chromosome have insertions.
+
+To align a region, every strain's bases at a position are padded to the
+length of the longest insertion at that position (see
+ChromosomeBase.multi_strain_fasta), and finding those lengths means reading
+every strain's bases for the region before any can be output.  Insertions
+are rare, though, so an ".insertions" map of a release and chromosome keeps
+the insertion positions and lengths of each strain (ChromosomeBase), and the
+union of them: the maximum insertion length at every position any strain
+has an insertion.  The padding of any set of strains then comes from the
+map, and each strain only has to be read once, for its own bases.
+
+The map is updated when a strain is imported or removed, without reading
+the other strains again, and is only used for ChromosomeBases it holds as
+they are now.  The chromosome_build_insertions command builds the maps of
+existing data.
+
+Map layout:
+  HEADER: magic, version, number of strains, number of union positions
+  STRAIN (one per strain): ChromosomeBase id, file tag, number of insertions
+  the insertion positions (POSITION_TYPE) and lengths (LENGTH_TYPE) of each
+    strain in turn, then the union positions and lengths
+
+'''
+
+import array
+import bisect
+import os
+import struct
+
+from django.conf import settings
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'PBIN'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHII')
+STRAIN = struct.Struct('<I32sI')
+
+POSITION_TYPE = 'I'
+LENGTH_TYPE = 'I'
+
+# Number of positions of the index read at a time when finding insertions.
+READ_SIZE = 1 << 20
+
+# The base of positions a strain has no data for, and the padding of
+# insertion columns a strain doesn't fill.
+PAD_CHAR = 'N'
+REALIGN_CHAR = '-'
+
+
+def map_path(release_id, chromosome_id):
+    '''Return the path of the insertion map of a release and chromosome.'''
+
+    return os.path.join(settings.PSEUDOBASE_CHROMOSOME_DATA_ROOT,
+      'release%s_chromosome%s.insertions' % (release_id, chromosome_id))
+
+
+def find_insertions(cb):
+    '''Return the (positions, lengths) arrays of the insertions of cb.
+
+    Only the index file is read (see inserted_positions).
+
+    '''
+
+    positions = array.array(POSITION_TYPE)
+    lengths = array.array(LENGTH_TYPE)
+    offset_size = array.array('I').itemsize
+    num_positions = os.path.getsize(cb.index_file_path) // offset_size
+    data_size = os.path.getsize(cb.data_file_path)
+
+    f = open(cb.index_file_path, 'rb')
+    try:
+        for first in xrange(0, num_positions, READ_SIZE):
+            count = min(READ_SIZE, num_positions - first)
+            offsets = array.array('I')
+            f.seek(first * offset_size)
+            offsets.fromstring(f.read((count + 1) * offset_size))
+            if len(offsets) == count:
+                offsets.append(data_size)
+
+            for i in inserted_positions(offsets, count):
+                positions.append(cb.start_position + first + i)
+                lengths.append(offsets[i + 1] - offsets[i])
+    finally:
+        f.close()
+    return positions, lengths
+
+
+def inserted_positions(offsets, count):
+    '''Return the positions (0 to count) of offsets holding insertions.
+
+    offsets holds the index offsets of count positions and the offset
+    following them.  Spans holding more bases than positions are split
+    until they are down to single positions, so the time taken mostly
+    depends on the number of insertions.
+
+    '''
+
+    positions = []
+    spans = [(0, count)]
+    while spans:
+        lo, hi = spans.pop()
+        if offsets[hi] - offsets[lo] <= hi - lo:
+            continue
+        if hi - lo == 1:
+            positions.append(lo)
+        else:
+            middle = (lo + hi) // 2
+            spans.append((middle, hi))
+            spans.append((lo, middle))
+    return positions
+
+
+class InsertionMap(object):
+    '''The insertion map of a release and chromosome.
+
+    Only the list of strains is read when a map is opened; the insertions
+    of a strain (and the union) are read when they are first needed.
+
+    '''
+
+    def __init__(self, path, load=True):
+        self.path = path
+        # [file tag, positions, lengths] by ChromosomeBase id, the arrays
+        # being None until read.
+        self.strains = {}
+        # The offset and number of insertions in the map file of each strain
+        # (and of the union) not read yet.
+        self._unread = {}
+        # The union of the strains' insertions, recomputed when needed after
+        # strains are added or removed.
+        self.positions = self.lengths = None
+        self._merged = False
+        if load and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def for_chromosome(cls, release_id, chromosome_id):
+        return cls(map_path(release_id, chromosome_id))
+
+    @classmethod
+    def for_chromosome_bases(cls, cbs):
+        '''Return the map holding all of cbs, or None if there isn't one.'''
+
+        keys = set((cb.strain.release_id, cb.chromosome_id) for cb in cbs)
+        if len(keys) != 1:
+            return None
+        release_id, chromosome_id = keys.pop()
+        if release_id is None:
+            return None
+        insertion_map = cls.for_chromosome(release_id, chromosome_id)
+        if not insertion_map.holds(cbs):
+            return None
+        return insertion_map
+
+    def _load(self):
+        f = open(self.path, 'rb')
+        try:
+            magic, version, num_strains, num_positions = HEADER.unpack(
+              f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a version %s insertion map: %s' % (
+                  VERSION, self.path))
+            strains = [STRAIN.unpack(f.read(STRAIN.size)) for i in
+              xrange(num_strains)]
+        finally:
+            f.close()
+
+        entry_size = array.array(POSITION_TYPE).itemsize + \
+          array.array(LENGTH_TYPE).itemsize
+        offset = HEADER.size + num_strains * STRAIN.size
+        for cb_id, file_tag, count in strains:
+            self.strains[cb_id] = [file_tag.rstrip('\0'), None, None]
+            self._unread[cb_id] = (offset, count)
+            offset += count * entry_size
+        self._unread[None] = (offset, num_positions)
+        self._merged = True
+
+    def _read(self, key):
+        '''Return the (positions, lengths) at key (a strain id, or None).'''
+
+        offset, count = self._unread.pop(key)
+        positions = array.array(POSITION_TYPE)
+        lengths = array.array(LENGTH_TYPE)
+        f = open(self.path, 'rb')
+        try:
+            f.seek(offset)
+            positions.fromfile(f, count)
+            lengths.fromfile(f, count)
+        finally:
+            f.close()
+        return positions, lengths
+
+    def _strain(self, cb_id):
+        '''Return [file tag, positions, lengths] of a strain, reading it.'''
+
+        strain = self.strains[cb_id]
+        if strain[1] is None:
+            strain[1:] = self._read(cb_id)
+        return strain
+
+    def save(self):
+        '''Write the map (or remove it, if it holds no strains).'''
+
+        if not self.strains:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        for cb_id in self.strains:
+            self._strain(cb_id)
+        self._merge()
+        tmp_path = self.path + '.part'
+        f = open(tmp_path, 'wb')
+        try:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.strains),
+              len(self.positions)))
+            cb_ids = sorted(self.strains)
+            for cb_id in cb_ids:
+                file_tag, positions, lengths = self.strains[cb_id]
+                f.write(STRAIN.pack(cb_id, file_tag, len(positions)))
+            for cb_id in cb_ids:
+                file_tag, positions, lengths = self.strains[cb_id]
+                positions.tofile(f)
+                lengths.tofile(f)
+            self.positions.tofile(f)
+            self.lengths.tofile(f)
+        except:
+            f.close()
+            os.remove(tmp_path)
+            raise
+        f.close()
+        os.rename(tmp_path, self.path)
+        # Everything is in memory now, so nothing is left to read.
+        self._unread = {}
+
+    def _merge(self):
+        '''Make sure the union of the insertions of the strains is current.'''
+
+        if self._merged:
+            if self.positions is None:
+                self.positions, self.lengths = self._read(None)
+            return
+
+        union = {}
+        for cb_id in self.strains:
+            file_tag, positions, lengths = self._strain(cb_id)
+            for position, length in zip(positions, lengths):
+                if length > union.get(position, 0):
+                    union[position] = length
+        self.positions = array.array(POSITION_TYPE, sorted(union))
+        self.lengths = array.array(LENGTH_TYPE,
+          [union[position] for position in self.positions])
+        self._merged = True
+
+    def add(self, cb):
+        '''Add (or replace) the insertions of ChromosomeBase cb.'''
+
+        # Read all the other strains before the file is replaced.
+        for cb_id in self.strains:
+            self._strain(cb_id)
+        positions, lengths = find_insertions(cb)
+        self.strains[cb.id] = [str(cb.file_tag), positions, lengths]
+        self._unread.pop(cb.id, None)
+        self._merged = False
+        self.positions = self.lengths = None
+
+    def remove(self, cb_id):
+        '''Remove the insertions of the ChromosomeBase with cb_id.'''
+
+        if cb_id in self.strains:
+            for other_id in self.strains:
+                self._strain(other_id)
+            del self.strains[cb_id]
+            self._merged = False
+            self.positions = self.lengths = None
+
+    def holds(self, cbs):
+        '''Return whether the map holds the current insertions of all of cbs.'''
+
+        for cb in cbs:
+            strain = self.strains.get(cb.id)
+            if strain is None or strain[0] != str(cb.file_tag):
+                return False
+        return True
+
+    def union(self, start_position, end_position):
+        '''Return the longest insertion at each position from start to end.
+
+        Returns a dict of length by position, of the positions where any
+        strain has an insertion.
+
+        '''
+
+        self._merge()
+        return _in_range(self.positions, self.lengths, start_position,
+          end_position)
+
+    def strain_insertions(self, cb_id, start_position, end_position):
+        '''Return the insertion lengths of one strain from start to end.'''
+
+        file_tag, positions, lengths = self._strain(cb_id)
+        return _in_range(positions, lengths, start_position, end_position)
+
+    def columns(self, cb_ids, start_position, end_position):
+        '''Return the longest insertion amongst cb_ids at each position.
+
+        Only positions where one of cb_ids has an insertion are included.
+
+        '''
+
+        if set(cb_ids) == set(self.strains):
+            return self.union(start_position, end_position)
+        columns = {}
+        for cb_id in cb_ids:
+            for position, length in self.strain_insertions(cb_id,
+              start_position, end_position).items():
+                if length > columns.get(position, 0):
+                    columns[position] = length
+        return columns
+
+
+def _in_range(positions, lengths, start_position, end_position):
+    '''Return a dict of the lengths of positions from start to end.'''
+
+    lo = bisect.bisect_left(positions, start_position)
+    hi = bisect.bisect_right(positions, end_position)
+    return dict(zip(positions[lo:hi], lengths[lo:hi]))
+
+
+def add_strain(cb):
+    '''Add the insertions of a newly imported ChromosomeBase to its map.'''
+
+    if cb.strain.release_id is None:
+        return
+    insertion_map = InsertionMap.for_chromosome(cb.strain.release_id,
+      cb.chromosome_id)
+    insertion_map.add(cb)
+    insertion_map.save()
+
+
+def remove_strain(cb):
+    '''Remove the insertions of a removed ChromosomeBase from its map.'''
+
+    if cb.strain.release_id is None:
+        return
+    insertion_map = InsertionMap.for_chromosome(cb.strain.release_id,
+      cb.chromosome_id)
+    insertion_map.remove(cb.id)
+    insertion_map.save()
+
+
+def _aligned_row(cb, own, columns, start_position, end_position):
+    '''Return the bases of cb from start to end, padded to columns.
+
+    own holds the insertion lengths of cb in the range.
+
+    '''
+
+    first = max(start_position, cb.start_position)
+    last = min(end_position, cb.end_position)
+    if first > last:
+        data = PAD_CHAR * (end_position + 1 - start_position)
+    else:
+        data = PAD_CHAR * (first - start_position) + cb._base_data(
+          cb._position_offset(first), cb._position_offset(last)) + \
+          PAD_CHAR * (end_position - last)
+    if not columns:
+        return data
+
+    pieces = []
+    i = 0
+    position = start_position
+    for column_position in sorted(columns):
+        # Positions up to the next padded one have a single base each.
+        plain = column_position - position
+        pieces.append(data[i:i + plain])
+        i += plain
+        length = own.get(column_position, 1)
+        pieces.append(data[i:i + length] +
+          REALIGN_CHAR * (columns[column_position] - length))
+        i += length
+        position = column_position + 1
+    pieces.append(data[i:])
+    return ''.join(pieces)
+
+
+def aligned_bases(cbs, start_position, end_position):
+    '''Return the aligned bases of each of cbs from start to end.
+
+    The padding comes from the insertion map, and each of cbs is read once.
+    Returns None if there is no map holding all of cbs as they are now.
+
+    '''
+
+    try:
+        insertion_map = InsertionMap.for_chromosome_bases(cbs)
+        if insertion_map is None:
+            return None
+        columns = insertion_map.columns([cb.id for cb in cbs],
+          start_position, end_position)
+        own = [insertion_map.strain_insertions(cb.id, start_position,
+          end_position) for cb in cbs]
+    except (IOError, ValueError, EOFError, struct.error):
+        log.exception('Error reading insertion map')
+        return None
+
+    return [_aligned_row(cb, cb_own, columns, start_position, end_position)
+      for cb, cb_own in zip(cbs, own)]
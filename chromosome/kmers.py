@@ -0,0 +1,399 @@
+'''K-mer indexes for finding short sequences (primers, motifs) in strains.
+
+Finding a short sequence in the strains of a chromosome otherwise means
+reading every base of every strain.  Each ChromosomeBase instead has a
+".kmers" sidecar file listing where every k-mer (every run of K bases, with
+deletions skipped) occurs in its data file, sorted by k-mer.  A sequence is
+found by looking up some of its k-mers, and checking the bases around each
+place they occur against the whole sequence.
+
+K-mers are encoded two bits per base, so only runs of A, C, G and T are
+indexed; any other base (such as N) ends a run.  Where a k-mer occurs is
+given as the data file offset of its first base, which is mapped to a
+position (through the index file) only for the matches.
+
+Matches with up to MAX_MISMATCHES mismatched bases can be found too.  The
+sequence is split into as many (non-overlapping) k-mers as fit, up to one
+more than the number of mismatches; at least one of them then has no more
+than its share of the mismatches, and the k-mers within that many
+mismatches of each are looked up.
+
+The sidecar is built when a ChromosomeBase is imported, or by the
+chromosome_build_kmer_index command for existing data.
+
+Sidecar layout:
+  HEADER: magic, version, k, number of distinct k-mers, number of k-mers
+  the distinct k-mers (CODE_TYPE, sorted), the index in the offsets of the
+    first occurrence of each (OFFSET_TYPE, plus the number of k-mers), then
+    the data file offset of every occurrence of every k-mer (OFFSET_TYPE,
+    sorted by k-mer and then offset)
+
+'''
+
+import array
+import itertools
+import mmap
+import os
+import struct
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'PBKM'
+VERSION = 1
+
+# The length of the indexed k-mers.
+K = 11
+
+HEADER = struct.Struct('<4sHBII')
+
+CODE_TYPE = 'I'
+OFFSET_TYPE = 'I'
+
+# Mismatches can be allowed in matches up to this many.
+MAX_MISMATCHES = 2
+
+# Sequences are refused if one of their k-mers (with the k-mers within the
+# allowed mismatches of it) occurs more than this many times in a strain.
+MAX_SEED_OFFSETS = 100000
+
+BASE_CODES = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+COMPLEMENTS = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+# The deletion character of the data files, which isn't part of the strain's
+# sequence.
+DELETION_CHAR = '-'
+
+
+def _kmers(data, k):
+    '''Generate the (code, offset) of every k-mer in data, in offset order.'''
+
+    mask = (1 << (2 * k)) - 1
+    code = 0
+    run = 0
+    # The offsets of the bases of the current k-mer.
+    offsets = [0] * k
+    for offset, base in enumerate(data):
+        if base == DELETION_CHAR:
+            continue
+        base_code = BASE_CODES.get(base.upper())
+        if base_code is None:
+            run = 0
+            continue
+        code = ((code << 2) | base_code) & mask
+        offsets[run % k] = offset
+        run += 1
+        if run >= k:
+            yield code, offsets[run % k]
+
+
+def build_kmer_index(cb, k=K):
+    '''Write the k-mer index sidecar file of ChromosomeBase cb.
+
+    Returns the number of k-mers indexed.
+
+    '''
+
+    f = open(cb.data_file_path, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if len(data) >= 1 << (8 * array.array(OFFSET_TYPE).itemsize):
+        raise ValueError('Data file too large for a k-mer index: %s' %
+          cb.data_file_path)
+
+    # A counting sort: count each k-mer, and then place the offsets of each
+    # after those of the k-mers before it.
+    counts = array.array(OFFSET_TYPE, [0]) * (1 << (2 * k))
+    for code, offset in _kmers(data, k):
+        counts[code] += 1
+
+    codes = array.array(CODE_TYPE)
+    starts = array.array(OFFSET_TYPE)
+    total = 0
+    for code, count in enumerate(counts):
+        if count:
+            codes.append(code)
+            starts.append(total)
+            counts[code] = total
+            total += count
+    starts.append(total)
+
+    offsets = array.array(OFFSET_TYPE, [0]) * total
+    for code, offset in _kmers(data, k):
+        offsets[counts[code]] = offset
+        counts[code] += 1
+    del counts
+
+    tmp_path = cb.kmer_index_file_path + '.part'
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, VERSION, k, len(codes), total))
+        codes.tofile(f)
+        starts.tofile(f)
+        offsets.tofile(f)
+    except:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    f.close()
+    os.rename(tmp_path, cb.kmer_index_file_path)
+    return total
+
+
+def encode(kmer):
+    '''Return the code of kmer (a string of A, C, G and T).'''
+
+    code = 0
+    for base in kmer:
+        code = (code << 2) | BASE_CODES[base]
+    return code
+
+
+def neighbours(kmer, mismatches):
+    '''Return the k-mers within mismatches mismatched bases of kmer.'''
+
+    found = [kmer]
+    for n in xrange(1, mismatches + 1):
+        for indexes in itertools.combinations(xrange(len(kmer)), n):
+            choices = [[b for b in BASE_CODES if b != kmer[i]]
+              for i in indexes]
+            for bases in itertools.product(*choices):
+                changed = list(kmer)
+                for i, base in zip(indexes, bases):
+                    changed[i] = base
+                found.append(''.join(changed))
+    return found
+
+
+def reverse_complement(bases):
+    '''Return the reverse complement of bases (of A, C, G and T).'''
+
+    return ''.join([COMPLEMENTS[b] for b in reversed(bases)])
+
+
+class KmerIndex(object):
+    '''Read access to the k-mer index sidecar of a ChromosomeBase.
+
+    The file is memory mapped, and looking up a k-mer bisects the distinct
+    k-mers in place.
+
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            (magic, version, self.k, self.num_codes,
+              self.num_kmers) = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a version %s k-mer index: %s' % (
+                  VERSION, path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        code_size = array.array(CODE_TYPE).itemsize
+        self._offset_size = array.array(OFFSET_TYPE).itemsize
+        self._code = struct.Struct('=' + CODE_TYPE)
+        self._starts_offset = HEADER.size + self.num_codes * code_size
+        self._offsets_offset = self._starts_offset + (self.num_codes + 1) * \
+          self._offset_size
+
+    @classmethod
+    def for_chromosome_base(cls, cb):
+        '''Return the KmerIndex of cb, or None if there is none.'''
+
+        if not os.path.exists(cb.kmer_index_file_path):
+            return None
+        return cls(cb.kmer_index_file_path)
+
+    def close(self):
+        self._map.close()
+
+    def _range(self, code):
+        '''Return the (first, end) indexes of the offsets of the k-mer code.'''
+
+        lo, hi = 0, self.num_codes
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self._code.unpack_from(self._map, HEADER.size +
+              middle * self._code.size)[0] < code:
+                lo = middle + 1
+            else:
+                hi = middle
+        if lo == self.num_codes or self._code.unpack_from(self._map,
+          HEADER.size + lo * self._code.size)[0] != code:
+            return 0, 0
+        return struct.unpack_from('=2' + OFFSET_TYPE, self._map,
+          self._starts_offset + lo * self._offset_size)
+
+    def count(self, code):
+        '''Return the number of times the k-mer code occurs.'''
+
+        first, end = self._range(code)
+        return end - first
+
+    def offsets(self, code):
+        '''Return the data file offsets where the k-mer code occurs.'''
+
+        first, end = self._range(code)
+        offsets = array.array(OFFSET_TYPE)
+        offsets.fromstring(self._map[self._offsets_offset + first *
+          self._offset_size:self._offsets_offset + end * self._offset_size])
+        return offsets
+
+
+class _StrainSequence(object):
+    '''Reads the bases of a ChromosomeBase around data file offsets.'''
+
+    def __init__(self, cb):
+        self.cb = cb
+        self._data_file = open(cb.data_file_path, 'rb')
+        self._index_file = open(cb.index_file_path, 'rb')
+        self._data_size = os.path.getsize(cb.data_file_path)
+        self._offset = struct.Struct('=I')
+        self._num_positions = os.path.getsize(cb.index_file_path) // \
+          self._offset.size
+
+    def bases_around(self, offset, before, length):
+        '''Return (first offset, bases) of the length bases starting before
+        bases before the one at offset, or None if there aren't enough.
+
+        Deletions are skipped.
+
+        '''
+
+        slack = 64
+        while True:
+            start = max(offset - before - slack, 0)
+            end = min(offset + length + slack, self._data_size)
+            self._data_file.seek(start)
+            data = self._data_file.read(end - start)
+            kept = [(start + i, b) for i, b in enumerate(data)
+              if b != DELETION_CHAR]
+            i = 0
+            while kept[i][0] < offset:
+                i += 1
+            enough_before = i >= before
+            enough_after = len(kept) - i + before >= length
+            if enough_before and enough_after:
+                kept = kept[i - before:i - before + length]
+                return kept[0][0], ''.join([b for o, b in kept])
+            if (not enough_before and start == 0) or (not enough_after and
+              end == self._data_size):
+                return None
+            # Too many deletions nearby; read more.
+            slack *= 4
+
+    def position(self, offset):
+        '''Return the position whose bases hold the base at offset.'''
+
+        lo, hi = 0, self._num_positions
+        while hi - lo > 1:
+            middle = (lo + hi) // 2
+            self._index_file.seek(middle * self._offset.size)
+            if self._offset.unpack(self._index_file.read(
+              self._offset.size))[0] <= offset:
+                lo = middle
+            else:
+                hi = middle
+        return self.cb.start_position + lo
+
+    def close(self):
+        self._data_file.close()
+        self._index_file.close()
+
+
+def _seeds(sequence, k, mismatches):
+    '''Return (index in sequence, k-mer codes) of the k-mers to look up.'''
+
+    num_seeds = min(mismatches + 1, len(sequence) // k)
+    allowed = mismatches // num_seeds
+    return [(i * k, [encode(kmer) for kmer in neighbours(
+      sequence[i * k:(i + 1) * k], allowed)]) for i in xrange(num_seeds)]
+
+
+def _count_mismatches(bases, sequence, limit):
+    '''Return the mismatches between bases and sequence (or limit + 1).'''
+
+    count = 0
+    for b, s in zip(bases.upper(), sequence):
+        if b != s:
+            count += 1
+            if count > limit:
+                break
+    return count
+
+
+def find_sequence(cbs, sequence, mismatches=0, max_hits=None):
+    '''Find sequence in the strains (ChromosomeBases) of cbs.
+
+    Both strands are searched.  Returns (hits, unindexed), hits being the
+    (cb, position, strand, matched bases, number of mismatches) of every
+    match, in cbs order and then by position, and unindexed the cbs with no
+    k-mer index.  The matched bases are those of the strain's forward
+    strand.
+
+    Raises ValueError if sequence can't be searched for, has a k-mer which
+    occurs too often (see MAX_SEED_OFFSETS), or has more than max_hits
+    matches.
+
+    '''
+
+    sequence = sequence.strip().upper()
+    if not sequence or sequence.strip('ACGT'):
+        raise ValueError('Sequences may only contain A, C, G and T')
+    if mismatches < 0 or mismatches > MAX_MISMATCHES:
+        raise ValueError('At most %s mismatches can be allowed' %
+          MAX_MISMATCHES)
+
+    strands = [('+', sequence)]
+    if reverse_complement(sequence) != sequence:
+        strands.append(('-', reverse_complement(sequence)))
+
+    hits = []
+    unindexed = []
+    for cb in cbs:
+        index = KmerIndex.for_chromosome_base(cb)
+        if index is None:
+            unindexed.append(cb)
+            continue
+        if len(sequence) < index.k:
+            index.close()
+            raise ValueError('Sequences must be at least %s bases long' %
+              index.k)
+
+        strain_sequence = _StrainSequence(cb)
+        try:
+            matches = {}
+            for strand, bases in strands:
+                for seed_start, codes in _seeds(bases, index.k, mismatches):
+                    if sum([index.count(code) for code in codes]) > \
+                      MAX_SEED_OFFSETS:
+                        raise ValueError('Sequence too common to search for '
+                          '(try a longer sequence or fewer mismatches)')
+                    for code in codes:
+                        for offset in index.offsets(code):
+                            around = strain_sequence.bases_around(offset,
+                              seed_start, len(bases))
+                            if around is None or (around[0], strand) in \
+                              matches:
+                                continue
+                            count = _count_mismatches(around[1], bases,
+                              mismatches)
+                            if count > mismatches:
+                                continue
+                            matches[(around[0], strand)] = (around[1], count)
+                            if max_hits is not None and \
+                              len(hits) + len(matches) > max_hits:
+                                raise ValueError('More than %s matches' %
+                                  max_hits)
+            for (offset, strand), (bases, count) in sorted(matches.items()):
+                hits.append((cb, strain_sequence.position(offset), strand,
+                  bases, count))
+        finally:
+            strain_sequence.close()
+            index.close()
+    return hits, unindexed
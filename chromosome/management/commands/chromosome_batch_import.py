@@ -12,6 +12,7 @@ distributed, efficient and sane method of batch processing.
 
 
 from django.core.management.base import BaseCommand
+from chromosome.aligned import build_aligned_store
 from chromosome.models import ChromosomeBatchImportProcess, ChromosomeImporter
 from optparse import make_option
 import logging
@@ -44,16 +45,32 @@ class Command(BaseCommand):
             
             batch_file_list = [batch_file.strip() for batch_file in request.original_request.split('\n')]
             
+            # The (release, chromosome) of each imported ChromosomeBase.
+            imported = set()
+
             #for pending_import_file in request.chromosomebatchimportlog_set.filter(status = 'P'):
             for batch_file in batch_file_list:
                 try:
                     chr_importer = ChromosomeImporter(batch_file,flybase_release=options['flybase_release'])
                     chr_importer.import_data(request)
                     chr_importer.print_summary()
+                    if chr_importer.cb.strain.release is not None:
+                        imported.add((chr_importer.cb.strain.release,
+                          chr_importer.cb.chromosome))
                     
                 except Exception as e:
                     print ('chromosome importer failed: ',batch_file, ' Reason: ',e)
                     pass
+
+            # Rebuild the aligned stores the imports have made out of date.
+            # Aligned searches fall back to reading each strain until they
+            # are rebuilt, so a failure here is only logged.
+            for release, chromosome in imported:
+                try:
+                    build_aligned_store(release, chromosome)
+                except Exception:
+                    log.exception('Error building aligned store: %s %s' % (
+                      release.name, chromosome.name))
             
   
             request.stop(batch_status='C')
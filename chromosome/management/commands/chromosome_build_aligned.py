@@ -0,0 +1,79 @@
+'''A custom Django administrative command for building aligned stores.
+
+Aligned chromosome searches are served from an ".aligned" store holding all
+the strains of a release and chromosome already aligned (see
+chromosome.aligned), when there is an up to date one.  Stores are rebuilt
+after batch imports; this command (re)builds them for existing data, e.g.:
+
+  # ./manage.py chromosome_build_aligned
+  # ./manage.py chromosome_build_aligned --stale
+  # ./manage.py chromosome_build_aligned -r r3.04 -c 2
+
+'''
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.aligned import AlignedStore, build_aligned_store, store_path
+from chromosome.models import ChromosomeBase
+from common.models import Chromosome, Release
+
+
+class Command(BaseCommand):
+    '''A custom command to build the aligned stores of releases.'''
+
+    help = 'Build the aligned stores of existing chromosome data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--release',
+                    dest='release_names',
+                    default=[],
+                    action='append',
+                    help='Only build stores for this release (repeatable)'),
+        make_option('-c', '--chromosome',
+                    dest='chromosome_names',
+                    default=[],
+                    action='append',
+                    help='Only build stores for this chromosome (repeatable)'),
+        make_option('--stale',
+                    dest='stale',
+                    action='store_true',
+                    default=False,
+                    help='Only build stores which are missing or out of date'),
+    )
+
+    def _is_current(self, release, chromosome):
+        '''Return whether the store of release and chromosome is up to date.'''
+
+        cbs = [cb for cb in ChromosomeBase.objects.filter(
+          strain__release=release, chromosome=chromosome)
+          if not cb.missing_data()]
+        try:
+            store = AlignedStore(store_path(release.id, chromosome.id))
+        except (IOError, ValueError):
+            return False
+        return store.num_strains == len(cbs) and store.holds(cbs)
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        releases = Release.objects.all()
+        if options['release_names']:
+            releases = releases.filter(name__in=options['release_names'])
+        chromosomes = Chromosome.objects.all()
+        if options['chromosome_names']:
+            chromosomes = chromosomes.filter(
+              name__in=options['chromosome_names'])
+
+        built = 0
+        for release in releases.order_by('name'):
+            for chromosome in chromosomes.order_by('name'):
+                if options['stale'] and self._is_current(release, chromosome):
+                    continue
+                num_strains = build_aligned_store(release, chromosome)
+                if num_strains:
+                    print('Built aligned store: %s %s (%s strains)' % (
+                      release.name, chromosome.name, num_strains))
+                    built += 1
+
+        print('Aligned stores built: ', built)
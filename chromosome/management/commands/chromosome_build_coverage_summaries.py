@@ -0,0 +1,61 @@
+'''A custom Django administrative command for building coverage summaries.
+
+The mean, minimum and maximum coverage at several zoom levels are precomputed
+into a ".zoom" sidecar file for each ChromosomeBase when it is imported.  This
+command (re)builds them for existing data, e.g.:
+
+  # ./manage.py chromosome_build_coverage_summaries
+  # ./manage.py chromosome_build_coverage_summaries --missing
+  # ./manage.py chromosome_build_coverage_summaries -s FLG14 -s ARIZ
+
+'''
+
+import os
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.models import ChromosomeBase
+from chromosome.coverage import build_coverage_summaries
+
+
+class Command(BaseCommand):
+    '''A custom command to build the coverage zoom files of ChromosomeBases.'''
+
+    help = 'Build the coverage zoom level files of existing chromosome data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-s', '--strain',
+                    dest='strain_symbols',
+                    default=[],
+                    action='append',
+                    help='Only build summaries for this strain symbol (repeatable)'),
+        make_option('-m', '--missing',
+                    dest='missing',
+                    action='store_true',
+                    default=False,
+                    help='Only build summaries which do not exist yet'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        cbs = ChromosomeBase.objects.select_related('strain', 'chromosome')
+        if options['strain_symbols']:
+            cbs = cbs.filter(strain__strainsymbol__symbol__in=[
+              s.upper() for s in options['strain_symbols']])
+
+        built = 0
+        for cb in cbs.order_by('strain__name', 'chromosome__name'):
+            if cb.missing_data():
+                print('Missing chromosomebase data: ', cb)
+                continue
+            if options['missing'] and os.path.exists(
+              cb.coverage_zoom_file_path):
+                continue
+
+            print('Building coverage summaries: ', cb)
+            build_coverage_summaries(cb)
+            built += 1
+
+        print('Coverage summaries built: ', built)
@@ -0,0 +1,68 @@
+'''A custom Django administrative command for building insertion maps.
+
+The insertion map of each release and chromosome (see chromosome.insertions)
+is updated as strains are imported and removed.  This command (re)builds the
+maps of existing data, e.g.:
+
+  # ./manage.py chromosome_build_insertions
+  # ./manage.py chromosome_build_insertions -r r3.04 -c 2
+
+'''
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.insertions import InsertionMap, map_path
+from chromosome.models import ChromosomeBase
+from common.models import Chromosome, Release
+
+
+class Command(BaseCommand):
+    '''A custom command to build the insertion maps of releases.'''
+
+    help = 'Build the insertion maps of existing chromosome data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--release',
+                    dest='release_names',
+                    default=[],
+                    action='append',
+                    help='Only build maps for this release (repeatable)'),
+        make_option('-c', '--chromosome',
+                    dest='chromosome_names',
+                    default=[],
+                    action='append',
+                    help='Only build maps for this chromosome (repeatable)'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        releases = Release.objects.all()
+        if options['release_names']:
+            releases = releases.filter(name__in=options['release_names'])
+        chromosomes = Chromosome.objects.all()
+        if options['chromosome_names']:
+            chromosomes = chromosomes.filter(
+              name__in=options['chromosome_names'])
+
+        built = 0
+        for release in releases.order_by('name'):
+            for chromosome in chromosomes.order_by('name'):
+                # Start from an empty map rather than the existing one.
+                insertion_map = InsertionMap(map_path(release.id,
+                  chromosome.id), load=False)
+                for cb in ChromosomeBase.objects.filter(strain__release=release,
+                  chromosome=chromosome).order_by('id'):
+                    if cb.missing_data():
+                        print('Missing chromosomebase data: ', cb)
+                        continue
+                    insertion_map.add(cb)
+                insertion_map.save()
+                if insertion_map.strains:
+                    print('Built insertion map: %s %s (%s strains, %s '
+                      'insertion positions)' % (release.name, chromosome.name,
+                      len(insertion_map.strains), len(insertion_map.positions)))
+                    built += 1
+
+        print('Insertion maps built: ', built)
@@ -0,0 +1,60 @@
+'''A custom Django administrative command for building k-mer indexes.
+
+The k-mers of each ChromosomeBase are indexed into a ".kmers" sidecar file
+when it is imported (see chromosome.kmers).  This command (re)builds the
+indexes of existing data, e.g.:
+
+  # ./manage.py chromosome_build_kmer_index
+  # ./manage.py chromosome_build_kmer_index --missing
+  # ./manage.py chromosome_build_kmer_index -s FLG14 -s ARIZ
+
+'''
+
+import os
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.kmers import build_kmer_index
+from chromosome.models import ChromosomeBase
+
+
+class Command(BaseCommand):
+    '''A custom command to build the k-mer indexes of ChromosomeBases.'''
+
+    help = 'Build the k-mer index sidecar files of existing chromosome data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-s', '--strain',
+                    dest='strain_symbols',
+                    default=[],
+                    action='append',
+                    help='Only build indexes for this strain symbol (repeatable)'),
+        make_option('-m', '--missing',
+                    dest='missing',
+                    action='store_true',
+                    default=False,
+                    help='Only build indexes which do not exist yet'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        cbs = ChromosomeBase.objects.select_related('strain', 'chromosome')
+        if options['strain_symbols']:
+            cbs = cbs.filter(strain__strainsymbol__symbol__in=[
+              s.upper() for s in options['strain_symbols']])
+
+        built = 0
+        for cb in cbs.order_by('strain__name', 'chromosome__name'):
+            if cb.missing_data():
+                print('Missing chromosomebase data: ', cb)
+                continue
+            if options['missing'] and os.path.exists(cb.kmer_index_file_path):
+                continue
+
+            print('Building k-mer index: ', cb)
+            build_kmer_index(cb)
+            built += 1
+
+        print('K-mer indexes built: ', built)
@@ -0,0 +1,60 @@
+'''A custom Django administrative command for building ChromosomeBase stats.
+
+The statistics served to JBrowse are precomputed into a ".stats" sidecar file
+for each ChromosomeBase when it is imported.  This command (re)builds them for
+existing data, e.g.:
+
+  # ./manage.py chromosome_build_stats
+  # ./manage.py chromosome_build_stats --missing
+  # ./manage.py chromosome_build_stats -s FLG14 -s ARIZ
+
+'''
+
+import os
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.models import ChromosomeBase
+from chromosome.stats import build_stats, reference_for
+
+
+class Command(BaseCommand):
+    '''A custom command to build the stats sidecar files of ChromosomeBases.'''
+
+    help = 'Build the JBrowse stats sidecar files of existing chromosome data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-s', '--strain',
+                    dest='strain_symbols',
+                    default=[],
+                    action='append',
+                    help='Only build stats for this strain symbol (repeatable)'),
+        make_option('-m', '--missing',
+                    dest='missing',
+                    action='store_true',
+                    default=False,
+                    help='Only build stats which do not exist yet'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        cbs = ChromosomeBase.objects.select_related('strain', 'chromosome')
+        if options['strain_symbols']:
+            cbs = cbs.filter(strain__strainsymbol__symbol__in=[
+              s.upper() for s in options['strain_symbols']])
+
+        built = 0
+        for cb in cbs.order_by('strain__name', 'chromosome__name'):
+            if cb.missing_data():
+                print('Missing chromosomebase data: ', cb)
+                continue
+            if options['missing'] and os.path.exists(cb.stats_file_path):
+                continue
+
+            print('Building stats: ', cb)
+            build_stats(cb, reference_for(cb))
+            built += 1
+
+        print('Stats built: ', built)
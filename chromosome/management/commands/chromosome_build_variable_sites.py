@@ -0,0 +1,57 @@
+'''A custom Django administrative command for building variable site indexes.
+
+The variable site index of each release and chromosome (see
+chromosome.variable_sites) is updated as strains are imported and removed.
+This command (re)builds the indexes of existing data, e.g.:
+
+  # ./manage.py chromosome_build_variable_sites
+  # ./manage.py chromosome_build_variable_sites -r r3.04 -c 2
+
+'''
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.variable_sites import build_variable_sites
+from common.models import Chromosome, Release
+
+
+class Command(BaseCommand):
+    '''A custom command to build the variable site indexes of releases.'''
+
+    help = 'Build the variable site indexes of existing chromosome data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--release',
+                    dest='release_names',
+                    default=[],
+                    action='append',
+                    help='Only build indexes for this release (repeatable)'),
+        make_option('-c', '--chromosome',
+                    dest='chromosome_names',
+                    default=[],
+                    action='append',
+                    help='Only build indexes for this chromosome (repeatable)'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        releases = Release.objects.all()
+        if options['release_names']:
+            releases = releases.filter(name__in=options['release_names'])
+        chromosomes = Chromosome.objects.all()
+        if options['chromosome_names']:
+            chromosomes = chromosomes.filter(
+              name__in=options['chromosome_names'])
+
+        built = 0
+        for release in releases.order_by('name'):
+            for chromosome in chromosomes.order_by('name'):
+                num_strains = build_variable_sites(release, chromosome)
+                if num_strains:
+                    print('Built variable site index: %s %s (%s strains)' % (
+                      release.name, chromosome.name, num_strains))
+                    built += 1
+
+        print('Variable site indexes built: ', built)
@@ -0,0 +1,65 @@
+'''A custom Django administrative command for compressing coverage files.
+
+Coverage used to be stored in a ".coverage" file of one byte per position.
+It is now imported into a run-length encoded ".rlecov" file instead; this
+command converts the coverage of existing ChromosomeBases, e.g.:
+
+  # ./manage.py chromosome_compress_coverage
+  # ./manage.py chromosome_compress_coverage -s FLG14 -s ARIZ
+  # ./manage.py chromosome_compress_coverage --keep
+
+'''
+
+import os
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.models import ChromosomeBase
+from chromosome.coverage import compress_coverage
+
+
+class Command(BaseCommand):
+    '''A custom command to convert ChromosomeBase coverage files.'''
+
+    help = 'Convert existing coverage files to the compressed coverage format.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-s', '--strain',
+                    dest='strain_symbols',
+                    default=[],
+                    action='append',
+                    help='Only convert coverage for this strain symbol (repeatable)'),
+        make_option('-k', '--keep',
+                    dest='keep',
+                    action='store_true',
+                    default=False,
+                    help='Keep the old coverage files after conversion'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        cbs = ChromosomeBase.objects.select_related('strain', 'chromosome')
+        if options['strain_symbols']:
+            cbs = cbs.filter(strain__strainsymbol__symbol__in=[
+              s.upper() for s in options['strain_symbols']])
+
+        converted = old_bytes = new_bytes = 0
+        for cb in cbs.order_by('strain__name', 'chromosome__name'):
+            if not os.path.exists(cb.coverage_file_path):
+                continue
+            if os.path.exists(cb.coverage_rle_file_path):
+                # Already converted (with --keep).
+                continue
+
+            print('Compressing coverage: ', cb)
+            old_bytes += os.path.getsize(cb.coverage_file_path)
+            compress_coverage(cb, remove=not options['keep'])
+            new_bytes += os.path.getsize(cb.coverage_rle_file_path)
+            converted += 1
+
+        print('Coverage files converted: ', converted)
+        if new_bytes:
+            print('Bytes before: %s after: %s (%.1fx smaller)' % (old_bytes,
+              new_bytes, float(old_bytes) / new_bytes))
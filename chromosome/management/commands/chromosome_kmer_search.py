@@ -0,0 +1,81 @@
+'''A custom Django administrative command for finding short sequences.
+
+Finds a short sequence (such as a primer or motif) on both strands of
+strains, using their k-mer indexes (see chromosome.kmers), and prints each
+match as tab separated strain, release, chromosome, position, strand, bases
+and number of mismatches, e.g.:
+
+  # ./manage.py chromosome_kmer_search ACGTTGCAAGGTCCA
+  # ./manage.py chromosome_kmer_search ACGTTGCAAGGTCCA -m 1 -c 2 -r r3.04
+  # ./manage.py chromosome_kmer_search ACGTTGCAAGGTCCA -s FLG14 -s ARIZ
+
+'''
+
+from django.core.management.base import BaseCommand, CommandError
+from optparse import make_option
+
+from chromosome.kmers import find_sequence
+from chromosome.models import ChromosomeBase
+
+
+class Command(BaseCommand):
+    '''A custom command to find a short sequence in strains.'''
+
+    args = '<sequence>'
+    help = 'Find a short sequence in strains using their k-mer indexes.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-m', '--mismatches',
+                    dest='mismatches',
+                    type='int',
+                    default=0,
+                    help='Number of mismatched bases allowed in matches'),
+        make_option('-s', '--strain',
+                    dest='strain_symbols',
+                    default=[],
+                    action='append',
+                    help='Only search this strain symbol (repeatable)'),
+        make_option('-c', '--chromosome',
+                    dest='chromosome_names',
+                    default=[],
+                    action='append',
+                    help='Only search this chromosome (repeatable)'),
+        make_option('-r', '--release',
+                    dest='release_names',
+                    default=[],
+                    action='append',
+                    help='Only search strains of this release (repeatable)'),
+    )
+
+    def handle(self, sequence=None, **options):
+        '''The main entry point for the Django management command.'''
+
+        if sequence is None:
+            raise CommandError('No sequence given')
+
+        cbs = ChromosomeBase.objects.select_related('strain__release',
+          'chromosome')
+        if options['strain_symbols']:
+            cbs = cbs.filter(strain__strainsymbol__symbol__in=[
+              s.upper() for s in options['strain_symbols']])
+        if options['chromosome_names']:
+            cbs = cbs.filter(chromosome__name__in=options['chromosome_names'])
+        if options['release_names']:
+            cbs = cbs.filter(strain__release__name__in=options['release_names'])
+        cbs = [cb for cb in cbs.order_by('-strain__is_reference',
+          'strain__species__id', 'strain__name', 'chromosome__name')
+          if not cb.missing_data()]
+
+        try:
+            hits, unindexed = find_sequence(cbs, sequence,
+              options['mismatches'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for cb, position, strand, bases, mismatches in hits:
+            print('\t'.join([cb.strain.name, cb.strain.release.name if
+              cb.strain.release else '', cb.chromosome.name, str(position),
+              strand, bases, str(mismatches)]))
+        for cb in unindexed:
+            print('No k-mer index: %s' % cb)
+        print('Matches: %s' % len(hits))
@@ -57,14 +57,51 @@ class Command(BaseCommand):
                 else:
                     print('Does not exist: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',index_path)
 
-                coverage_path = cb._get_coverage_file_path()
-                if os.path.isfile(coverage_path):
+                # Coverage is in the compressed file, or the one byte per
+                # position file for data which hasn't been converted.
+                coverage_paths = [path for path in [cb._get_coverage_rle_file_path(), cb._get_coverage_file_path()] if os.path.isfile(path)]
+                for coverage_path in coverage_paths:
                     dest_coverage_path = os.path.join(dest_dir, os.path.basename(coverage_path))
                     print('Moving: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',coverage_path, 'to: ',dest_coverage_path)
                     try:
                         shutil.move(coverage_path,dest_coverage_path)
                     except Exception as e:
                         print('Move failed from: ',coverage_path,' to: ',dest_coverage_path, ' error: ',e)
-                else:
-                    print('Does not exist: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',coverage_path)
+                if not coverage_paths:
+                    print('Does not exist: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',cb._get_coverage_rle_file_path())
+
+                stats_path = cb._get_stats_file_path()
+                if os.path.isfile(stats_path):
+                    dest_stats_path = os.path.join(dest_dir, os.path.basename(stats_path))
+                    print('Moving: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',stats_path, 'to: ',dest_stats_path)
+                    try:
+                        shutil.move(stats_path,dest_stats_path)
+                    except Exception as e:
+                        print('Move failed from: ',stats_path,' to: ',dest_stats_path, ' error: ',e)
+
+                zoom_path = cb._get_coverage_zoom_file_path()
+                if os.path.isfile(zoom_path):
+                    dest_zoom_path = os.path.join(dest_dir, os.path.basename(zoom_path))
+                    print('Moving: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',zoom_path, 'to: ',dest_zoom_path)
+                    try:
+                        shutil.move(zoom_path,dest_zoom_path)
+                    except Exception as e:
+                        print('Move failed from: ',zoom_path,' to: ',dest_zoom_path, ' error: ',e)
+
+                kmer_path = cb._get_kmer_index_file_path()
+                if os.path.isfile(kmer_path):
+                    dest_kmer_path = os.path.join(dest_dir, os.path.basename(kmer_path))
+                    print('Moving: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',kmer_path, 'to: ',dest_kmer_path)
+                    try:
+                        shutil.move(kmer_path,dest_kmer_path)
+                    except Exception as e:
+                        print('Move failed from: ',kmer_path,' to: ',dest_kmer_path, ' error: ',e)
 
+                genes_path = cb._get_gene_sequences_file_path()
+                if os.path.isfile(genes_path):
+                    dest_genes_path = os.path.join(dest_dir, os.path.basename(genes_path))
+                    print('Moving: ' + str(cb.chromosome.name) + ' tag: ' + cb.file_tag + ' path: ',genes_path, 'to: ',dest_genes_path)
+                    try:
+                        shutil.move(genes_path,dest_genes_path)
+                    except Exception as e:
+                        print('Move failed from: ',genes_path,' to: ',dest_genes_path, ' error: ',e)
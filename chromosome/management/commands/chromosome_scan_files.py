@@ -0,0 +1,48 @@
+'''A custom Django administrative command for refreshing the file catalog.
+
+The import and preprocess pages render the info of waiting chromosome data
+files from a catalog (see chromosome.file_catalog).  This command catalogs new
+and changed files, and forgets removed ones.  Run it from cron, or leave it
+watching the directories and rescanning whenever they change, e.g.:
+
+  # ./manage.py chromosome_scan_files
+  # ./manage.py chromosome_scan_files --watch 10
+
+'''
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from optparse import make_option
+
+from chromosome.file_catalog import directories_signature, refresh_catalog
+
+
+class Command(BaseCommand):
+    '''A custom command to keep the chromosome data file catalog current.'''
+
+    help = 'Catalog new and changed files waiting for preprocess or import.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--watch',
+                    dest='watch',
+                    type='int',
+                    default=0,
+                    help='Keep running, checking the directories for changes every WATCH seconds'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        signature = directories_signature()
+        print('Files cataloged: ', refresh_catalog())
+        connection.close()
+
+        while options['watch'] > 0:
+            time.sleep(options['watch'])
+            new_signature = directories_signature()
+            if new_signature != signature:
+                signature = new_signature
+                print('Files cataloged: ', refresh_catalog())
+                connection.close()
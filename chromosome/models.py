@@ -20,7 +20,11 @@ from django.db import connection, transaction
 from django.db.models import Q
 
 from chromosome.utils import VCFRecord
-from django.core.cache import get_cache
+from chromosome.vcf_stats import vcf_file_stats
+from chromosome.stats import build_strain_stats
+from chromosome import aligned, insertions, kmers, variable_sites
+from chromosome.coverage import CoverageWriter, RLECoverage, \
+  build_coverage_summaries
 import hashlib
 
 import logging
@@ -288,6 +292,31 @@ class ChromosomeBase(models.Model):
         '''Return the fule filesystem path to the coverage file.'''
         return self._get_data_file_path('.coverage')
     coverage_file_path = property(_get_coverage_file_path)
+
+    def _get_coverage_rle_file_path(self):
+        '''Return the full filesystem path to the compressed coverage file.'''
+        return self._get_data_file_path('.rlecov')
+    coverage_rle_file_path = property(_get_coverage_rle_file_path)
+
+    def _get_stats_file_path(self):
+        '''Return the full filesystem path to the stats sidecar file.'''
+        return self._get_data_file_path('.stats')
+    stats_file_path = property(_get_stats_file_path)
+
+    def _get_coverage_zoom_file_path(self):
+        '''Return the full filesystem path to the coverage zoom level file.'''
+        return self._get_data_file_path('.zoom')
+    coverage_zoom_file_path = property(_get_coverage_zoom_file_path)
+
+    def _get_kmer_index_file_path(self):
+        '''Return the full filesystem path to the k-mer index file.'''
+        return self._get_data_file_path('.kmers')
+    kmer_index_file_path = property(_get_kmer_index_file_path)
+
+    def _get_gene_sequences_file_path(self):
+        '''Return the full filesystem path to the gene sequence file.'''
+        return self._get_data_file_path('.genes')
+    gene_sequences_file_path = property(_get_gene_sequences_file_path)
  
     def _get_total_bases(self):
         '''Return the total number of bases in this sequence.'''
@@ -478,6 +507,230 @@ class ChromosomeBase(models.Model):
         self.cached_bases_data = {'start_position':start_position,'end_position':end_position,'bases':bases}
         return bases
 
+    def bases_in_range(self, start_position, end_position):
+        '''Return the bases at each position from start to end (inclusive).
+
+        The range is clipped to this sequence, and (first position, list of
+        bases per position) is returned.  Only the index entries for the range
+        are read, followed by a single read of the data file.
+
+        '''
+
+        start_position, end_position = self.clip(start_position, end_position)
+        if start_position > end_position:
+            return start_position, []
+
+        start = self._position_offset(start_position)
+        end = self._position_offset(end_position)
+
+        # The offset of the position following the range (if there is one)
+        # marks the end of the last position's bases.
+        offsets = self._get_byte_offset_ranges_from_index(start, end + 1)
+        if not offsets:
+            return start_position, []
+
+        f = open(self.data_file_path, 'rb')
+        try:
+            f.seek(offsets[0])
+            if len(offsets) > end + 1 - start:
+                data = f.read(offsets[-1] - offsets[0])
+            else:
+                data = f.read()
+                offsets.append(offsets[0] + len(data))
+        finally:
+            f.close()
+
+        first = offsets[0]
+        return start_position, [data[offsets[i] - first:offsets[i + 1] - first]
+          for i in range(len(offsets) - 1)]
+
+    def regions_bases(self, regions):
+        '''Generator which returns the bases of each of many regions.
+
+        regions is a sequence of (start position, end position) pairs, best
+        sorted by start position; the bases of each are returned in turn, as
+        by fasta_bases(wrapped=False).  The index and data files are only
+        opened once, however many regions there are.
+
+        '''
+
+        format = 'I'
+        format_size = struct.calcsize(format)
+
+        index_file = open(self.index_file_path, 'rb')
+        data_file = open(self.data_file_path, 'rb')
+        try:
+            for start_position, end_position in regions:
+                if self.outside_bounds(start_position, end_position):
+                    yield self.pad(start_position, end_position + 1)
+                    continue
+
+                start_position_clipped, end_position_clipped = self.clip(
+                  start_position, end_position)
+                index_file.seek(
+                  self._position_offset(start_position_clipped) * format_size)
+                start_data = index_file.read(format_size)
+                index_file.seek(
+                  (self._position_offset(end_position_clipped) + 1) * format_size)
+                end_data = index_file.read(format_size)
+
+                bases = ''
+                if start_data:
+                    start_offset = struct.unpack(format, start_data)[0]
+                    data_file.seek(start_offset)
+                    if end_data:
+                        bases = data_file.read(
+                          struct.unpack(format, end_data)[0] - start_offset)
+                    else:
+                        # The range runs to the end of the data file.
+                        bases = data_file.read()
+
+                yield self.pad(start_position, start_position_clipped) + \
+                  bases.replace('-', '') + \
+                  self.pad(end_position_clipped, end_position)
+        finally:
+            index_file.close()
+            data_file.close()
+
+    def bases_at(self, positions):
+        '''Generator which returns the bases at each of many positions.
+
+        positions is a sequence of positions, best sorted; the bases at each
+        (as stored, so "-" for a deletion and several bases for an insertion,
+        or padding outside the sequence) are returned in turn.  The index and
+        data files are only opened once.
+
+        '''
+
+        format = 'I'
+        format_size = struct.calcsize(format)
+
+        index_file = open(self.index_file_path, 'rb')
+        data_file = open(self.data_file_path, 'rb')
+        try:
+            for position in positions:
+                if not self.valid_position(position):
+                    yield self.pad(position, position + 1)
+                    continue
+
+                index_file.seek(self._position_offset(position) * format_size)
+                offsets = index_file.read(2 * format_size)
+                start_offset = struct.unpack(format, offsets[:format_size])[0]
+                data_file.seek(start_offset)
+                if len(offsets) > format_size:
+                    yield data_file.read(struct.unpack(format,
+                      offsets[format_size:])[0] - start_offset)
+                else:
+                    # The last position runs to the end of the data file.
+                    yield data_file.read()
+        finally:
+            index_file.close()
+            data_file.close()
+
+    def coverage_values(self, start_position, end_position):
+        '''Return the coverage at each position from start to end (inclusive).
+
+        The range is clipped to this sequence, and the coverage values are
+        returned as an array of bytes.  Coverage is read from the compressed
+        coverage file, or the one byte per position coverage file of
+        ChromosomeBases which haven't been converted yet.
+
+        '''
+
+        start_position, end_position = self.clip(start_position, end_position)
+        if os.path.exists(self.coverage_rle_file_path):
+            return RLECoverage(self.coverage_rle_file_path).values(
+              self._position_offset(start_position),
+              self._position_offset(end_position))
+
+        coverage = array.array('B')
+        if start_position > end_position:
+            return coverage
+
+        f = open(self.coverage_file_path, 'rb')
+        try:
+            f.seek(self._position_offset(start_position))
+            coverage.fromstring(f.read(end_position + 1 - start_position))
+        finally:
+            f.close()
+        return coverage
+
+    @staticmethod
+    def align_bases(ref_bases, bases):
+        '''Return the (seq, CIGAR, MD) alignment of bases to ref_bases.
+
+        Both are lists of the bases at each reference position, as stored in
+        the data files: a deletion character, a single base, or a base
+        followed by the bases inserted after it.
+
+        '''
+
+        seq = []
+        cigar = []
+        md = []
+        matched = 0
+        in_deletion = False
+
+        def add_op(op, length):
+            if cigar and cigar[-1][1] == op:
+                cigar[-1][0] += length
+            else:
+                cigar.append([length, op])
+
+        for ref_base, base in zip(ref_bases, bases):
+            ref_base = ref_base[:1].upper()
+            if base == ChromosomeBase.realign_char:
+                add_op('D', 1)
+                if not in_deletion:
+                    md.append('%s^' % matched)
+                    matched = 0
+                    in_deletion = True
+                md.append(ref_base)
+                continue
+
+            in_deletion = False
+            seq.append(base)
+            add_op('M', 1)
+            if base[:1].upper() == ref_base:
+                matched += 1
+            else:
+                md.append('%s%s' % (matched, ref_base))
+                matched = 0
+            if len(base) > 1:
+                add_op('I', len(base) - 1)
+        md.append(str(matched))
+
+        return (''.join(seq), ''.join(['%s%s' % (l, op) for l, op in cigar]),
+          ''.join(md))
+
+    def alignment_to(self, reference, start_position, end_position):
+        '''Return the alignment of this sequence to reference over a range.
+
+        The range is clipped to both sequences.  A dict with the (clipped)
+        start and end positions, seq, CIGAR and MD strings is returned, or
+        None if the sequences have no data in the range.
+
+        '''
+
+        start_position = max(start_position, self.start_position,
+          reference.start_position)
+        end_position = min(end_position, self.end_position,
+          reference.end_position)
+        if start_position > end_position:
+            return None
+
+        bases = self.bases_in_range(start_position, end_position)[1]
+        ref_bases = reference.bases_in_range(start_position, end_position)[1]
+        num_positions = min(len(bases), len(ref_bases))
+        if num_positions == 0:
+            return None
+
+        seq, cigar, md = ChromosomeBase.align_bases(ref_bases[:num_positions],
+          bases[:num_positions])
+        return {'start_position': start_position,
+          'end_position': start_position + num_positions - 1,
+          'seq': seq, 'cigar': cigar, 'md': md}
+
     def pad(self,base_from,base_to):
         pad = ChromosomeBase.pad_char * (base_to - base_from)
         return pad
@@ -524,10 +777,39 @@ class ChromosomeBase(models.Model):
         
         chromosomes = ChromosomeBase.objects.filter(
           chromosome=chromosome).filter(strain__species__in=species).order_by(
-            '-strain__is_reference', 'strain__species__id', 'strain__name')
+            '-strain__is_reference', 'strain__species__id',
+            'strain__name').select_related('strain__species',
+            'strain__release', 'chromosome')
 
         bases_per_position = []
         max_bases = None
+        stored_bases = None
+        if (len(chromosomes) < 2) or (not show_aligned):
+            pass
+        else:
+            # The aligned store (if there is an up to date one) holds the
+            # strains already aligned, see chromosome.aligned.  Otherwise the
+            # insertion map gives the padding without reading every strain
+            # twice, see chromosome.insertions.
+            available = [c for c in chromosomes if not c.missing_data()]
+            stored_bases = aligned.aligned_bases(available, start, end)
+            if stored_bases is None:
+                stored_bases = insertions.aligned_bases(available, start, end)
+            if stored_bases is not None:
+                stored_bases = dict(zip([c.id for c in available],
+                  stored_bases))
+
+        if stored_bases is not None:
+            for c in chromosomes:
+                if c.id not in stored_bases:
+                    print ('Missing chromosomebase data: ', c)
+                elif start > c.end_position:
+                    yield (c.fasta_header(start, end), c.fasta_bases(start, end))
+                else:
+                    yield (c.fasta_header(start, end),
+                      c.wrap_data(stored_bases[c.id]))
+            return
+
         if (len(chromosomes) < 2) or (not show_aligned):
             pass
         else:
@@ -762,6 +1044,77 @@ class ChromosomeBatchImportLog(ImportLog):
         '''Define the string representation of this class of object.'''
         return 'Status: %s Base Count: %s Imported: %s' % (self.status, self.base_count, str(self.end))
 
+
+
+class CatalogedFileManager(models.Manager):
+
+    def current(self, path, size, mtime):
+        '''Return the entry for path if it is still current (or None).'''
+
+        try:
+            entry = self.get(path=path)
+        except CatalogedFile.DoesNotExist:
+            return None
+        if entry.size != size or entry.mtime != mtime:
+            return None
+        return entry
+
+
+class CatalogedFile(models.Model):
+    '''The parsed info of a chromosome data file waiting to be processed.
+
+    Entries are only valid while the file's size and modification time are
+    unchanged (see chromosome.file_catalog).
+
+    '''
+
+    path = models.CharField(max_length=1024, unique=True)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    # The file's ChromosomeImporter.get_info(), as JSON.
+    info = models.TextField()
+    scanned_at = models.DateTimeField()
+
+    objects = CatalogedFileManager()
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return self.path
+
+    def info_dict(self):
+        '''Return the file's info as a dict.'''
+        return json.loads(self.info)
+
+
+
+class VCFFileStats(models.Model):
+    '''The statistics of a VCF file, keyed by a fingerprint of its content.
+
+    See chromosome.vcf_stats.
+
+    '''
+
+    fingerprint = models.CharField(max_length=100, unique=True)
+    # Lines, including header lines.
+    num_lines = models.BigIntegerField()
+    num_records = models.BigIntegerField()
+    # The number of records of each chromosome, as JSON.
+    chromosomes = models.TextField()
+    # The VCFRecord summary flag totals as JSON (null if not counted).
+    summary_flags = models.TextField(null=True, blank=True)
+    computed_at = models.DateTimeField()
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return '%s (%s records)' % (self.fingerprint, self.num_records)
+
+    def chromosomes_dict(self):
+        '''Return the number of records of each chromosome.'''
+        return json.loads(self.chromosomes)
+
+    def summary_flags_dict(self):
+        '''Return the summary flag totals (or {} if not counted).'''
+        return json.loads(self.summary_flags) if self.summary_flags else {}
     
 class ChromosomeImportFileReader(ImportFileReader):
     # Not a database table
@@ -859,76 +1212,20 @@ class ChromosomeVCFImportFileReader():
 
     def get_num_records(self,also_retrieve_chromosomes=False, also_retrieve_summary_flags=True):
        # Note: also_retrieve_summary_flags only takes effect if also_retrieve_chromosomes is True
+       # The counts come from the VCF statistics store (see chromosome.vcf_stats), so the file is only scanned the first time it is seen.
 
-        rec_num = 0
-        tot_summary_flags = [0 for i in range(len(VCFRecord.vcf_types))]
-
-        def_cache = get_cache('default')
-        #hash_key = hashfile(self.fPath)
-        hash_key = str(self.fPath) + '_' + str(os.path.getmtime(self.fPath))
-
-        hash_record = def_cache.get(hash_key)
-        if hash_record is None:
-            pass # No cached record found
-        else:
-            rec_num = hash_record['num_records']
-            if also_retrieve_chromosomes and also_retrieve_summary_flags:
-                if ('summary_flags_dict' in hash_record) and ('chromosomes' in hash_record):
-                    self.summary_flag_dict = hash_record['summary_flags_dict']
-                    self.chromosomes = hash_record['chromosomes']
-                    return rec_num
-                else:
-                    pass
-            elif also_retrieve_chromosomes:
-                if ('chromosomes' in hash_record):
-                    self.chromosomes = hash_record['chromosomes']
-                    return rec_num
-                else:
-                    pass
-            else:
-                return rec_num
-
-
-        vcf_file = gzip.open(self.fPath, 'r')
-        for line in vcf_file:
-            #i+=1
-            if also_retrieve_chromosomes:
-                line = line.decode('utf-8').rstrip()
-                if line[:1] == '#':
-                    pass
-                else:
-                    if rec_num  % 100000 == 0:
-                        print('_get_file_info progress: ' + str(rec_num) + ' file name: ' + self.fPath)
-                    rec_num += 1
-                    chrom = line.split('\t')[0]
-                    if chrom in self.chromosomes:
-                        self.chromosomes[chrom] +=1
-                    else:
-                        self.chromosomes[chrom] = 1
-
-                    if also_retrieve_summary_flags:
-                        v = VCFRecord(line)
-                        record_summary_flags = v.summary_flags()
-                        tot_summary_flags = [prev_tot + record_summary_flags[i] for i, prev_tot in enumerate(tot_summary_flags)]
-            else:
-                rec_num +=1
-
-        hash_record = {'num_records':rec_num}
+        stats = vcf_file_stats(self.fPath, summary_flags=also_retrieve_chromosomes and also_retrieve_summary_flags)
 
         if also_retrieve_chromosomes:
-            hash_record['chromosomes'] = self.chromosomes
+            self.chromosomes = stats.chromosomes_dict()
             if also_retrieve_summary_flags:
-                self.summary_flag_dict = VCFRecord.tot_summary_flags_to_meta_data(tot_summary_flags)
-                hash_record['summary_flags_dict'] = self.summary_flag_dict
+                self.summary_flag_dict = stats.summary_flags_dict()
             else:
-                self.summary_flag_dict  = {}
-
-
-        def_cache.set(hash_key, hash_record,604800)
+                self.summary_flag_dict = {}
+            return stats.num_records
 
-        vcf_file.close()
-
-        return rec_num
+        # Without chromosomes, every line (header lines included) is counted.
+        return stats.num_lines
 
 class ChromosomeImporter():
 #Not a database table
@@ -1012,10 +1309,6 @@ class ChromosomeImporter():
            chr = chromosome
         return (Chromosome.objects.get(name=chr), False)
   
-    def _coverage_index(self, n):
-        '''Pack n into a byte for use in the coverage index.'''
-        return struct.pack('B', n)
-  
     def _index(self, n):
         '''Pack n into an integer for use in the base index.'''
         return struct.pack('I', n)
@@ -1324,7 +1617,7 @@ class ChromosomeImporter():
         new_bases_total = bases_total+base_bytes
 
         # Coverage data.
-        self.coverage_file.write(self._coverage_index(coverage))
+        self.coverage_file.append(coverage)
 
         return new_bases_total,new_max_position
 
@@ -1411,7 +1704,7 @@ class ChromosomeImporter():
             bases_total += base_bytes
 
             # Coverage data.
-            self.coverage_file.write(self._coverage_index(data['coverage']))
+            self.coverage_file.append(data['coverage'])
 
             data = chromosome_reader.get_and_parse_next_line()
             n += 1
@@ -1458,7 +1751,7 @@ class ChromosomeImporter():
             # Open our data files.
             self.data_file = open(self.cb.data_file_path, 'w')
             self.index_file = open(self.cb.index_file_path, 'wb')
-            self.coverage_file = open(self.cb.coverage_file_path, 'w')  
+            self.coverage_file = CoverageWriter(self.cb.coverage_rle_file_path)
             
             chromosome_reader = None
 
@@ -1576,7 +1869,7 @@ class ChromosomeImporter():
                 self.coverage_file.close()
                 os.remove(self.cb.data_file_path)
                 os.remove(self.cb.index_file_path)
-                os.remove(self.cb.coverage_file_path)
+                os.remove(self.cb.coverage_rle_file_path)
                 
                 if chromosome_reader:
                    chromosome_reader.finalise()
@@ -1604,6 +1897,41 @@ class ChromosomeImporter():
             # Finalize the transaction and close the db connection.
             transaction.commit()
             transaction.leave_transaction_management()
+
+            # Precompute the statistics (of the other strains too, for a
+            # reference) and coverage summaries served to JBrowse, add the
+            # strain's insertions and variants to the insertion map and
+            # variable site index of its chromosome, and index its k-mers.
+            # The import has already succeeded, so a failure here is only
+            # logged (they can be rebuilt with the chromosome_build_stats,
+            # chromosome_build_coverage_summaries,
+            # chromosome_build_insertions, chromosome_build_variable_sites
+            # and chromosome_build_kmer_index commands).
+            try:
+                build_strain_stats(self.cb)
+            except:
+                log.exception('Error building stats for: ' + self.cb.file_tag)
+            try:
+                build_coverage_summaries(self.cb)
+            except:
+                log.exception('Error building coverage summaries for: ' +
+                  self.cb.file_tag)
+            try:
+                insertions.add_strain(self.cb)
+            except:
+                log.exception('Error updating insertion map for: ' +
+                  self.cb.file_tag)
+            try:
+                variable_sites.add_strain(self.cb)
+            except:
+                log.exception('Error updating variable site index for: ' +
+                  self.cb.file_tag)
+            try:
+                kmers.build_kmer_index(self.cb)
+            except:
+                log.exception('Error building k-mer index for: ' +
+                  self.cb.file_tag)
+
             connection.close()
         
 #            # All lines of chromosome data have been processed, so we can print a 
@@ -0,0 +1,329 @@
+'''Precomputed variant and coverage statistics of ChromosomeBase data.
+
+Each ChromosomeBase can have a ".stats" sidecar file alongside its data,
+index and coverage files.  The sidecar holds running totals of the number of
+variant positions (positions where the strain differs from the reference),
+coverage and squared coverage at every BIN_SIZE boundary.  The statistics of
+any region (and so of any zoom level JBrowse asks for) are then differences of
+two running totals, which take a constant number of reads to look up.
+
+Variant counts are exact at any position: the sidecar also lists every
+variant position, so the count within a bin is found from the positions of
+that bin alone.  Coverage totals are interpolated within a bin.
+
+Variants are counted against the reference of the strain's release as it is
+when the stats are built, so importing a reference rebuilds the stats of the
+other strains of its release on the chromosome.
+
+Sidecar layout:
+  HEADER: magic, version, bin size, first position, number of positions,
+    minimum coverage, maximum coverage
+  RECORD (one per bin boundary, starting with the first position): running
+    totals of variant positions, coverage and squared coverage
+  the variant positions (POSITION_TYPE, sorted)
+
+'''
+
+import array
+import bisect
+import itertools
+import math
+import os
+import struct
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'PBST'
+VERSION = 2
+
+# Number of positions between running totals.
+BIN_SIZE = 1000
+
+# Number of positions read at a time when building stats (a multiple of
+# BIN_SIZE).
+READ_SIZE = BIN_SIZE * 64
+
+HEADER = struct.Struct('<4sHIIIBB')
+RECORD = struct.Struct('<IQQ')
+
+POSITION_TYPE = 'I'
+
+
+def is_variant(base, ref_base):
+    '''Return whether base (the bases at one position) differs from ref_base.
+
+    Uncalled (N) positions are not counted as variants.
+
+    '''
+
+    if len(base) != 1:
+        # An insertion.
+        return True
+    base = base.upper()
+    return base != 'N' and base != ref_base.upper()
+
+
+def summarize(variants, coverage_sum, coverage_squares, length):
+    '''Return the JBrowse statistics of totals over length positions.'''
+
+    if length <= 0:
+        return {'featureCount': 0, 'featureDensity': 0}
+
+    mean = float(coverage_sum) / length
+    variance = max(float(coverage_squares) / length - mean * mean, 0)
+    return {'featureCount': int(round(variants)),
+      'featureDensity': float(variants) / length,
+      'scoreMean': mean, 'scoreStdDev': math.sqrt(variance)}
+
+
+def reference_for(cb):
+    '''Return the reference ChromosomeBase to compare cb with (or None).'''
+
+    from chromosome.models import ChromosomeBase
+
+    if cb.strain.is_reference:
+        return None
+    references = ChromosomeBase.objects.filter(chromosome=cb.chromosome,
+      strain__is_reference=True, strain__release=cb.strain.release)[:1]
+    return references[0] if references else None
+
+
+def _read_bases(cb, index_file, data_file, start_position, end_position):
+    '''Return the bases at each position from start to end of cb, read from
+    its open index and data files.
+
+    '''
+
+    offset_size = array.array('I').itemsize
+    count = end_position + 1 - start_position
+    offsets = array.array('I')
+    index_file.seek((start_position - cb.start_position) * offset_size)
+    offsets.fromstring(index_file.read((count + 1) * offset_size))
+    data_file.seek(offsets[0])
+    if len(offsets) > count:
+        data = data_file.read(offsets[count] - offsets[0])
+    else:
+        data = data_file.read()
+        offsets.append(offsets[0] + len(data))
+
+    first = offsets[0]
+    return [data[offsets[i] - first:offsets[i + 1] - first]
+      for i in xrange(count)]
+
+
+def build_stats(cb, reference=None):
+    '''Write the stats sidecar file of ChromosomeBase cb.
+
+    Variant positions are counted against the reference ChromosomeBase (if
+    there is none, no positions are counted as variants).  The data files
+    are read READ_SIZE positions at a time, and only opened once.
+
+    '''
+
+    coverage_min = 255
+    coverage_max = 0
+    coverage_sum = coverage_squares = 0
+    variant_positions = array.array(POSITION_TYPE)
+
+    paths = [cb.index_file_path, cb.data_file_path]
+    if reference is not None:
+        paths.extend([reference.index_file_path, reference.data_file_path])
+    files = []
+    tmp_path = cb.stats_file_path + '.part'
+    f = open(tmp_path, 'wb')
+    try:
+        for path in paths:
+            files.append(open(path, 'rb'))
+
+        f.write(HEADER.pack(MAGIC, VERSION, BIN_SIZE, cb.start_position,
+          cb.total_bases, 0, 0))
+        f.write(RECORD.pack(0, 0, 0))
+
+        for block_start in xrange(cb.start_position, cb.end_position + 1,
+          READ_SIZE):
+            block_end = min(block_start + READ_SIZE - 1, cb.end_position)
+
+            if reference is not None:
+                first = max(block_start, reference.start_position)
+                last = min(block_end, reference.end_position)
+                if first <= last:
+                    bases = _read_bases(cb, files[0], files[1], first, last)
+                    ref_bases = _read_bases(reference, files[2], files[3],
+                      first, last)
+                    variant_positions.extend([position for position, base,
+                      ref_base in itertools.izip(itertools.count(first),
+                      bases, ref_bases) if is_variant(base, ref_base)])
+
+            coverage = cb.coverage_values(block_start, block_end)
+            for bin_start in xrange(block_start, block_end + 1, BIN_SIZE):
+                values = coverage[bin_start - block_start:
+                  bin_start - block_start + BIN_SIZE]
+                if values:
+                    coverage_sum += sum(values)
+                    coverage_squares += sum([c * c for c in values])
+                    coverage_min = min(coverage_min, min(values))
+                    coverage_max = max(coverage_max, max(values))
+                variants = bisect.bisect_right(variant_positions,
+                  bin_start + BIN_SIZE - 1)
+                f.write(RECORD.pack(variants, coverage_sum, coverage_squares))
+
+        variant_positions.tofile(f)
+
+        if coverage_min > coverage_max:
+            coverage_min = coverage_max = 0
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, BIN_SIZE, cb.start_position,
+          cb.total_bases, coverage_min, coverage_max))
+    except:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        for data_file in files:
+            data_file.close()
+    f.close()
+    os.rename(tmp_path, cb.stats_file_path)
+
+
+def build_strain_stats(cb):
+    '''Build the stats of a newly imported ChromosomeBase.
+
+    Importing a reference rebuilds the stats of the other strains of its
+    release on the chromosome against it.
+
+    '''
+
+    from chromosome.models import ChromosomeBase
+
+    reference = reference_for(cb)
+    if reference is not None and reference.missing_data():
+        reference = None
+    build_stats(cb, reference)
+
+    if not cb.strain.is_reference or cb.strain.release_id is None:
+        return
+    for other in ChromosomeBase.objects.filter(chromosome=cb.chromosome,
+      strain__release=cb.strain.release_id,
+      strain__is_reference=False).select_related('strain'):
+        if not other.missing_data():
+            build_stats(other, cb)
+
+
+class ChromosomeStats(object):
+    '''Read access to the stats sidecar of a ChromosomeBase.'''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            (magic, version, self.bin_size, self.start_position,
+              self.num_positions, self.coverage_min,
+              self.coverage_max) = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a version %s stats file: %s' % (
+                  VERSION, path))
+            f.seek(self._record_offset(self._num_records() - 1))
+            self.totals = RECORD.unpack(f.read(RECORD.size))
+        finally:
+            f.close()
+        self.end_position = self.start_position + self.num_positions - 1
+
+    @classmethod
+    def for_chromosome_base(cls, cb):
+        '''Return the ChromosomeStats of cb, or None if there are none.'''
+
+        if not os.path.exists(cb.stats_file_path):
+            return None
+        return cls(cb.stats_file_path)
+
+    def _num_records(self):
+        return (self.num_positions + self.bin_size - 1) // self.bin_size + 1
+
+    def _record_offset(self, n):
+        return HEADER.size + n * RECORD.size
+
+    def _variants_before(self, f, first, last, position):
+        '''Return the number of the variant positions numbered first to last
+        (exclusive) which are before position.
+
+        '''
+
+        positions = array.array(POSITION_TYPE)
+        f.seek(self._record_offset(self._num_records()) +
+          first * positions.itemsize)
+        positions.fromstring(f.read((last - first) * positions.itemsize))
+        return bisect.bisect_left(positions, position)
+
+    def _totals_before(self, f, position):
+        '''Return the running totals before position.
+
+        The variant count is exact; the coverage totals are interpolated
+        within the bin holding position.
+
+        '''
+
+        offset = min(max(position - self.start_position, 0),
+          self.num_positions)
+        n, remainder = divmod(offset, self.bin_size)
+        f.seek(self._record_offset(n))
+        before = RECORD.unpack(f.read(RECORD.size))
+        if not remainder:
+            return before
+
+        after = RECORD.unpack(f.read(RECORD.size))
+        bin_positions = min(self.bin_size,
+          self.num_positions - n * self.bin_size)
+        fraction = float(remainder) / bin_positions
+        totals = [b + (a - b) * fraction for b, a in zip(before, after)]
+        totals[0] = before[0] + self._variants_before(f, before[0], after[0],
+          position)
+        return totals
+
+    def global_stats(self):
+        '''Return the statistics over the whole sequence.'''
+
+        stats = summarize(*(list(self.totals) + [self.num_positions]))
+        stats['scoreMin'] = self.coverage_min
+        stats['scoreMax'] = self.coverage_max
+        return stats
+
+    def region_stats(self, start_position, end_position):
+        '''Return the statistics of positions start to end (inclusive).'''
+
+        start_position = max(start_position, self.start_position)
+        end_position = min(end_position, self.end_position)
+        if start_position > end_position:
+            return summarize(0, 0, 0, 0)
+
+        f = open(self.path, 'rb')
+        try:
+            before = self._totals_before(f, start_position)
+            after = self._totals_before(f, end_position + 1)
+        finally:
+            f.close()
+        return summarize(*([a - b for a, b in zip(after, before)] +
+          [end_position + 1 - start_position]))
+
+    def variant_densities(self, start_position, end_position, bases_per_bin):
+        '''Return the number of variant positions in each bin of a region.
+
+        The region from start to end (inclusive) is split into bins of
+        bases_per_bin positions, starting at start_position.
+
+        '''
+
+        counts = []
+        f = open(self.path, 'rb')
+        try:
+            before = self._totals_before(f, start_position)[0]
+            for bin_start in xrange(start_position, end_position + 1,
+              bases_per_bin):
+                bin_end = min(bin_start + bases_per_bin, end_position + 1)
+                after = self._totals_before(f, bin_end)[0]
+                counts.append(after - before)
+                before = after
+        finally:
+            f.close()
+        return counts
@@ -0,0 +1,934 @@
+import array
+import gzip
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.client import Client
+from django.test.utils import override_settings
+
+from common.models import Chromosome, Release, Species, Strain, StrainSymbol
+from chromosome.models import CatalogedFile, ChromosomeBase, ChromosomeImporter, \
+    ChromosomeVCFImportFileReader, VCFFileStats
+from chromosome import vcf_stats
+from chromosome import file_catalog
+from chromosome import aligned
+from chromosome import export
+from chromosome import insertions
+from chromosome import kmers
+from chromosome import variable_sites
+from chromosome.stats import ChromosomeStats, build_stats, \
+    build_strain_stats, reference_for
+from chromosome.views import handle_uploaded_files
+from gene.models import CDS, Gene, GeneSymbol, GeneSymbolGroup, MRNA
+from gene import sequence_store
+from gene.symbol_index import invalidate_symbol_index
+from chromosome.coverage import CoverageSummaries, CoverageWriter, RLECoverage, \
+    build_coverage_summaries, compress_coverage, coverage_range
+
+
+class ChromosomeDataTestCase(TestCase):
+    '''Base class for tests needing ChromosomeBase data files.'''
+
+    def setUp(self):
+        self.data_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            PSEUDOBASE_CHROMOSOME_DATA_ROOT=self.data_root)
+        self.settings_override.enable()
+
+        self.species = Species.objects.create(name='just a test species', symbol='SYM')
+        self.release = Release.objects.create(name='r1', description='test release')
+        self.chromosome = Chromosome.objects.create(name='2')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.data_root)
+
+    def _add_chromosome_base(self, strain_name, bases, is_reference=False,
+            coverage=None):
+        '''Create a ChromosomeBase (and its files) holding bases per position.'''
+
+        strain = Strain.objects.create(name=strain_name, species=self.species,
+            release=self.release, is_reference=is_reference)
+        StrainSymbol.objects.create(symbol=strain_name.upper(), strain=strain)
+        cb = ChromosomeBase.objects.create(strain=strain,
+            chromosome=self.chromosome, start_position=1,
+            end_position=len(bases),
+            file_tag=ChromosomeBase.generate_file_tag())
+
+        offset = 0
+        with open(cb.data_file_path, 'wb') as data_file, \
+                open(cb.index_file_path, 'wb') as index_file, \
+                open(cb.coverage_file_path, 'wb') as coverage_file:
+            for i, base in enumerate(bases):
+                data_file.write(base)
+                index_file.write(struct.pack('I', offset))
+                offset += len(base)
+                coverage_file.write(struct.pack('B',
+                    coverage[i] if coverage else 0))
+        return cb
+
+
+class AlignmentTests(ChromosomeDataTestCase):
+
+    def test_align_bases(self):
+        self.assertEquals(ChromosomeBase.align_bases(list('AAAACCCGTTTGGC'),
+            ['A', '-', 'A', 'A', 'C', 'C', 'C', 'G', 'A', 'T', 'T', 'GAA', 'G', 'C']),
+            ('AAACCCGATTGAAGC', '1M1D10M2I2M', '1^A6T5'))
+        self.assertEquals(ChromosomeBase.align_bases(list('ACGT'), list('--GA')),
+            ('GA', '2D2M', '0^AC1T0'))
+
+    def test_bases_in_range(self):
+        cb = self._add_chromosome_base('Flg14', ['A', 'CT', '-', 'G'])
+        self.assertEquals(cb.bases_in_range(2, 3), (2, ['CT', '-']))
+        self.assertEquals(cb.bases_in_range(0, 10), (1, ['A', 'CT', '-', 'G']))
+
+    def test_jbrowse_features(self):
+        self._add_chromosome_base('MV2-25', list('ACGTACGT'), is_reference=True)
+        self._add_chromosome_base('Flg14', ['A', 'CT', '-', 'T', 'A', 'C', 'G', 'T'])
+        client = Client()
+
+        response = client.get('/jb/features/2', {'start': 0, 'end': 5, 'strain': 'flg14'})
+        features = json.loads(response.content)['features']
+        self.assertEquals(len(features), 1)
+        self.assertEquals((features[0]['start'], features[0]['end']), (0, 5))
+        self.assertEquals((features[0]['seq'], features[0]['cigar'], features[0]['md']),
+            ('ACTTA', '2M1I1D2M', '2^G2'))
+        self.assertTrue('max-age' in response['Cache-Control'])
+
+        response = client.get('/jb/features/2', {'start': 0, 'end': 5, 'strain': 'flg14'},
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+        response = client.get('/jb/features/2', {'start': 0, 'end': 5, 'strain': 'nosuchstrain'})
+        self.assertEquals(json.loads(response.content)['features'], [])
+
+
+class BulkSequenceTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(BulkSequenceTests, self).setUp()
+        self.ref_cb = self._add_chromosome_base('MV2-25', list('ACGTACGT'), is_reference=True)
+        self.cb = self._add_chromosome_base('Flg14', ['A', 'CT', '-', 'T', 'A', 'C', 'G', 'T'])
+
+        group = GeneSymbolGroup.objects.create(flybase_id='FBgn0000001')
+        for s in ['FBgn0000001', 'GA00001']:
+            GeneSymbol.objects.create(symbol=s, group=group)
+        Gene.objects.create(strain=self.ref_cb.strain, chromosome=self.chromosome,
+            start_position=2, end_position=4, import_code='FBgn0000001', strand='+',
+            bases='')
+        invalidate_symbol_index()
+
+    def test_regions_bases(self):
+        regions = [(1, 3), (2, 4), (7, 10), (20, 22)]
+        self.assertEquals(list(self.cb.regions_bases(regions)),
+            [self.cb.fasta_bases(s, e, wrapped=False) for s, e in regions[:3]] + ['NNN'])
+        self.assertEquals(list(self.cb.regions_bases(regions)), ['ACT', 'CTT', 'GTNN', 'NNN'])
+
+    @override_settings(SYMBOL_INDEX_CHECK_SECONDS=0)
+    def test_json(self):
+        response = Client().post('/api/sequences/', json.dumps({
+            'regions': ['2:1-3', '2:7..10'], 'genes': ['ga00001', 'nosuchgene'],
+            'species': 'SYM'}), content_type='application/json')
+        self.assertEquals(response.status_code, 200)
+        result = json.loads(''.join(response.streaming_content))
+        self.assertEquals(result['errors'], ['Unknown gene: nosuchgene'])
+        self.assertEquals([(s['strain'], s['query'], s['bases']) for s in result['sequences']], [
+            ('MV2-25', '2:1-3', 'ACG'), ('MV2-25', 'ga00001', 'CGT'), ('MV2-25', '2:7..10', 'GTNN'),
+            ('Flg14', '2:1-3', 'ACT'), ('Flg14', 'ga00001', 'CTT'), ('Flg14', '2:7..10', 'GTNN')])
+
+    def test_fasta(self):
+        response = Client().get('/api/sequences/', {'regions': '2:1-3,2:5-8',
+            'species': 'SYM', 'output': 'fasta'})
+        self.assertEquals(''.join(response.streaming_content).split('\n')[:4], [
+            '>just a test species|MV2-25|2|r1|1..3|2:1-3', 'ACG',
+            '>just a test species|MV2-25|2|r1|5..8|2:5-8', 'ACGT'])
+
+    def test_invalid(self):
+        client = Client()
+        self.assertEquals(client.get('/api/sequences/', {'regions': '2:1-3'}).status_code, 400)
+        self.assertEquals(client.get('/api/sequences/', {'regions': '2:3-1',
+            'species': 'SYM'}).status_code, 400)
+        self.assertEquals(client.get('/api/sequences/', {'regions': '2:1-3',
+            'species': 'NOPE'}).status_code, 400)
+        for body in ['not json', '["2:1-3"]', '{"regions": [1], "species": "SYM"}']:
+            self.assertEquals(client.post('/api/sequences/', body,
+                content_type='application/json').status_code, 400)
+
+    def test_limits(self):
+        response = Client().get('/api/sequences/', {'regions': '2:1-3,X:1-3',
+            'species': 'SYM'})
+        self.assertEquals(json.loads(''.join(response.streaming_content))['errors'],
+            ['Unknown chromosome: X'])
+
+        client = Client()
+        with override_settings(BULK_SEQUENCE_MAX_REGION_BASES=5):
+            self.assertEquals(client.get('/api/sequences/', {'regions': '2:1-6',
+                'species': 'SYM'}).status_code, 400)
+        # 2 strains of 3 and 4 bases.
+        with override_settings(BULK_SEQUENCE_MAX_BASES=13):
+            self.assertEquals(client.get('/api/sequences/', {'regions': '2:1-3,2:5-8',
+                'species': 'SYM'}).status_code, 400)
+        with override_settings(BULK_SEQUENCE_MAX_BASES=14):
+            self.assertEquals(client.get('/api/sequences/', {'regions': '2:1-3,2:5-8',
+                'species': 'SYM'}).status_code, 200)
+
+
+class StrainExportTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(StrainExportTests, self).setUp()
+        self.delivery_root = tempfile.mkdtemp()
+        self.delivery_override = override_settings(
+            PSEUDOBASE_DELIVERY_ROOT=self.delivery_root)
+        self.delivery_override.enable()
+        self.cb = self._add_chromosome_base('Flg14', ['A', 'CT', '-', 'G'] * 50)
+        self.read_size = export.READ_SIZE
+
+    def tearDown(self):
+        export.READ_SIZE = self.read_size
+        self.delivery_override.disable()
+        shutil.rmtree(self.delivery_root)
+        super(StrainExportTests, self).tearDown()
+
+    def test_fasta_chunks(self):
+        # Small reads make sure chunk boundaries are handled.
+        export.READ_SIZE = 3
+        lines = ''.join(export.fasta_chunks(self.cb)).split('\n')
+        self.assertEquals(lines[0], self.cb.fasta_header(1, 200))
+        self.assertEquals(lines[1:], ['ACTG' * 18 + 'ACT', 'G' + 'ACTG' * 18 + 'AC',
+            'TG' + 'ACTG' * 12, ''])
+
+        lines = ''.join(export.fasta_chunks(self.cb, aligned=True)).split('\n')
+        self.assertEquals(''.join(lines[1:]), 'AC-G' * 50)
+        self.assertEquals([len(l) for l in lines[1:]], [75, 75, 50, 0])
+
+    def test_export(self):
+        self._add_chromosome_base('MV2-25', list('ACGT'), is_reference=True)
+        call_command('chromosome_strain_export', strain_symbols=['flg14', 'mv2-25'])
+        results = zipfile.ZipFile(os.path.join(self.delivery_root,
+            os.listdir(self.delivery_root)[0]))
+        names = sorted(results.namelist())
+        self.assertEquals([n.split('/')[1] for n in names], ['FLG14_2.txt', 'MV2-25_2.txt'])
+        self.assertEquals(results.read(names[0]),
+            ''.join(export.fasta_chunks(self.cb)))
+        self.assertEquals(results.getinfo(names[0]).compress_type, zipfile.ZIP_DEFLATED)
+
+    def test_export_gzip(self):
+        call_command('chromosome_strain_export', str(self.cb.strain_id), 'FLG14',
+            gzip=True, aligned=True)
+        delivery_files = os.listdir(self.delivery_root)
+        self.assertEquals(len(delivery_files), 1)
+        self.assertTrue(delivery_files[0].endswith('.fa.gz'))
+        self.assertEquals(gzip.open(os.path.join(self.delivery_root,
+            delivery_files[0])).read(), ''.join(export.fasta_chunks(self.cb, aligned=True)))
+
+    def test_feature_export(self):
+        self._add_chromosome_base('MV2-25', list('ACGT' * 40), is_reference=True)
+        features = os.path.join(self.delivery_root, 'features.csv')
+        with open(features, 'w') as f:
+            f.write('f3,2,150,190\nf1,2,1,80\n\nf2,2,170,230\nf4,3,1,10\n')
+        call_command('chromosome_feature_export', features,
+            species_symbols=['SYM'], level=1)
+        os.remove(features)
+
+        results = zipfile.ZipFile(os.path.join(self.delivery_root,
+            os.listdir(self.delivery_root)[0]))
+        texts = dict((n.split('/')[1], results.read(n)) for n in results.namelist())
+        self.assertEquals(sorted(texts), ['f1.txt', 'f2.txt', 'f3.txt', 'f4.txt'])
+        for name, start, end in [('f1.txt', 1, 80), ('f2.txt', 170, 230),
+                ('f3.txt', 150, 190)]:
+            self.assertEquals(texts[name], ''.join(['%s\n%s' % (h, ''.join(
+                [l + '\n' for l in b])) for h, b in ChromosomeBase.multi_strain_fasta(
+                self.chromosome, [self.species], start, end)]) + '\n')
+        self.assertTrue('No data beyond base 160' in texts['f2.txt'])
+        self.assertEquals(texts['f4.txt'], 'No data matching specified query!\n')
+
+
+class AlignedStoreTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(AlignedStoreTests, self).setUp()
+        self.chunk_size = aligned.CHUNK_SIZE
+        aligned.CHUNK_SIZE = 7
+        ref_bases = list('ACGT' * 10)
+        self.ref_cb = self._add_chromosome_base('MV2-25', ref_bases, is_reference=True)
+        bases = list(ref_bases)
+        bases[5] = 'AGG'
+        bases[6] = '-'
+        bases[20] = 'CT'
+        self.cb = self._add_chromosome_base('Flg14', bases)
+        bases = list(ref_bases[:30])
+        bases[5] = 'AGGGT'
+        bases[13] = 'A'
+        self.cb2 = self._add_chromosome_base('Ariz', bases)
+
+    def tearDown(self):
+        aligned.CHUNK_SIZE = self.chunk_size
+        super(AlignedStoreTests, self).tearDown()
+
+    def _search(self, start, end):
+        return list(ChromosomeBase.multi_strain_fasta(self.chromosome,
+            [self.species], start, end, show_aligned=True))
+
+    def test_aligned_search(self):
+        expected = [self._search(s, e) for s, e in [(1, 40), (4, 25), (30, 45), (50, 60)]]
+        self.assertEquals(aligned.build_aligned_store(self.release, self.chromosome), 3)
+        self.assertEquals([self._search(s, e) for s, e in [(1, 40), (4, 25), (30, 45),
+            (50, 60)]], expected)
+        self.assertEquals(expected[1][2][1][0][:10], 'TAAGG---TA')
+
+        # Only the insertion columns of the strains asked for are kept.
+        cbs = [self.ref_cb, self.cb]
+        store = aligned.AlignedStore.for_chromosome_bases(cbs)
+        bases_per_position = [cb.get_bases_per_position(1, 40) for cb in cbs]
+        max_bases = ChromosomeBase.max_num_bases_per_position(bases_per_position)
+        self.assertEquals(store.aligned_bases(cbs, 1, 40), [cb.fasta_bases_formatted(1, 40,
+            max_bases, wrapped=False) for cb in cbs])
+
+    def test_out_of_date(self):
+        aligned.build_aligned_store(self.release, self.chromosome)
+        self.cb.file_tag = ChromosomeBase.generate_file_tag()
+        self.assertEquals(aligned.aligned_bases([self.ref_cb, self.cb], 1, 10), None)
+        self.assertEquals(aligned.aligned_bases([self.ref_cb, self.cb2], 1, 10),
+            ['ACGTAC----GTAC', 'ACGTAAGGGTGTAC'])
+
+
+class InsertionMapTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(InsertionMapTests, self).setUp()
+        ref_bases = list('ACGT' * 10)
+        self.ref_cb = self._add_chromosome_base('MV2-25', ref_bases, is_reference=True)
+        bases = list(ref_bases)
+        bases[5] = 'AGG'
+        bases[6] = '-'
+        bases[37] = 'CT'
+        self.cb = self._add_chromosome_base('Flg14', bases)
+        bases = list(ref_bases[:30])
+        bases[5] = 'AGGGT'
+        bases[13] = 'AC'
+        self.cb2 = self._add_chromosome_base('Ariz', bases)
+        self.read_size = insertions.READ_SIZE
+
+    def tearDown(self):
+        insertions.READ_SIZE = self.read_size
+        super(InsertionMapTests, self).tearDown()
+
+    def _formatted(self, cbs, start, end):
+        max_bases = ChromosomeBase.max_num_bases_per_position(
+            [cb.get_bases_per_position(start, end) for cb in cbs])
+        return [cb.fasta_bases_formatted(start, end, max_bases, wrapped=False) for cb in cbs]
+
+    def test_find_insertions(self):
+        insertions.READ_SIZE = 7
+        positions, lengths = insertions.find_insertions(self.cb)
+        self.assertEquals(list(zip(positions, lengths)), [(6, 3), (38, 2)])
+
+    def test_aligned_bases(self):
+        search = list(ChromosomeBase.multi_strain_fasta(self.chromosome, [self.species],
+            3, 35, show_aligned=True))
+        for cb in [self.ref_cb, self.cb, self.cb2]:
+            insertions.add_strain(cb)
+        self.assertEquals(insertions.InsertionMap.for_chromosome(self.release.id,
+            self.chromosome.id).union(1, 40), {6: 5, 14: 2, 38: 2})
+        self.assertEquals(list(ChromosomeBase.multi_strain_fasta(self.chromosome,
+            [self.species], 3, 35, show_aligned=True)), search)
+
+        for cbs, start, end in [([self.ref_cb, self.cb, self.cb2], 1, 45),
+                ([self.ref_cb, self.cb], 1, 40), ([self.cb2, self.ref_cb], 5, 14),
+                ([self.cb, self.cb2], 25, 50)]:
+            self.assertEquals(insertions.aligned_bases(cbs, start, end),
+                self._formatted(cbs, start, end))
+
+        insertions.remove_strain(self.cb2)
+        self.assertEquals(insertions.InsertionMap.for_chromosome(self.release.id,
+            self.chromosome.id).union(1, 40), {6: 3, 38: 2})
+        self.assertEquals(insertions.aligned_bases([self.ref_cb, self.cb2], 1, 10), None)
+
+
+class VariableSitesTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(VariableSitesTests, self).setUp()
+        ref_bases = list('ACGT' * 10)
+        self.ref_cb = self._add_chromosome_base('MV2-25', ref_bases, is_reference=True)
+        bases = list(ref_bases)
+        bases[5] = 'CGG'
+        bases[6] = '-'
+        bases[20] = 'n'
+        bases[21] = 'c'
+        self.cb = self._add_chromosome_base('Flg14', bases)
+        bases = list(ref_bases[:30])
+        bases[2] = 'A'
+        bases[6] = 'T'
+        self.cb2 = self._add_chromosome_base('Ariz', bases)
+        self.sizes = (variable_sites.READ_SIZE, variable_sites.BLOCK_SIZE)
+        variable_sites.READ_SIZE = 7
+        variable_sites.BLOCK_SIZE = 2
+
+    def tearDown(self):
+        variable_sites.READ_SIZE, variable_sites.BLOCK_SIZE = self.sizes
+        super(VariableSitesTests, self).tearDown()
+
+    def test_find_variants(self):
+        self.assertEquals(list(variable_sites.find_variants(self.cb, self.ref_cb)),
+            [6, 7, 21])
+        self.assertEquals(list(variable_sites.find_variants(self.cb2, self.ref_cb)),
+            [3, 7])
+
+    def test_index(self):
+        for cb in [self.cb, self.ref_cb, self.cb2]:
+            variable_sites.add_strain(cb)
+        index = variable_sites.VariableSites.for_chromosome_bases(
+            [self.cb, self.cb2], self.ref_cb)
+        self.assertEquals(index.num_sites, 4)
+        self.assertEquals(index.sites([self.cb.id, self.cb2.id], 1, 40), [3, 6, 7, 21])
+        self.assertEquals(index.sites([self.cb2.id], 4, 40), [7])
+        self.assertEquals(index.sites([self.ref_cb.id], 1, 40), [])
+        self.assertEquals(variable_sites.variable_columns([self.ref_cb, self.cb2],
+            self.ref_cb, 5, 10), [(7, 'G', ['G', 'T'])])
+
+        variable_sites.remove_strain(self.cb2)
+        index = variable_sites.VariableSites.for_chromosome(self.release.id,
+            self.chromosome.id)
+        self.assertEquals(index.sites([self.cb.id], 1, 40), [6, 7, 21])
+        self.assertEquals(variable_sites.variable_columns([self.cb2], self.ref_cb, 1, 40),
+            None)
+
+    def test_view(self):
+        variable_sites.build_variable_sites(self.release, self.chromosome)
+        client = Client()
+        response = client.get('/api/variable_sites/2', {'start': 1, 'end': 20,
+            'strains': 'flg14,ariz'})
+        self.assertEquals(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEquals(result['strains'], ['Flg14', 'Ariz'])
+        self.assertEquals(result['columns'], [
+            {'position': 3, 'reference': 'G', 'bases': ['G', 'A']},
+            {'position': 6, 'reference': 'C', 'bases': ['CGG', 'C']},
+            {'position': 7, 'reference': 'G', 'bases': ['-', 'T']}])
+        self.assertEquals(client.get('/api/variable_sites/2', {'start': 1, 'end': 20,
+            'strains': 'nope'}).status_code, 400)
+        self.assertEquals(client.get('/api/variable_sites/3', {'start': 1, 'end': 20,
+            'strains': 'flg14'}).status_code, 404)
+
+
+class KmerIndexTests(ChromosomeDataTestCase):
+
+    MOTIF = 'GATTACAGGC'
+
+    def setUp(self):
+        super(KmerIndexTests, self).setUp()
+        flank = 'ACGT' * 5
+        self.ref_cb = self._add_chromosome_base('MV2-25',
+            list(flank + self.MOTIF + flank), is_reference=True)
+        bases = list(flank + self.MOTIF + flank)
+        bases[24] = 'C'
+        self.cb = self._add_chromosome_base('Flg14', bases)
+        self.cb2 = self._add_chromosome_base('Ariz',
+            list(flank + 'GATT-ACAGGC' + flank))
+        for cb in [self.ref_cb, self.cb, self.cb2]:
+            kmers.build_kmer_index(cb, k=4)
+
+    def _hits(self, sequence, mismatches=0):
+        hits, unindexed = kmers.find_sequence([self.ref_cb, self.cb, self.cb2],
+            sequence, mismatches)
+        self.assertEquals(unindexed, [])
+        return [(cb.strain.name, position, strand, bases, count)
+            for cb, position, strand, bases, count in hits]
+
+    def test_index(self):
+        index = kmers.KmerIndex.for_chromosome_base(self.ref_cb)
+        self.assertEquals(index.num_kmers, 47)
+        self.assertEquals(list(index.offsets(kmers.encode('GATT'))), [20])
+        self.assertEquals(list(index.offsets(kmers.encode('ACGT'))),
+            [0, 4, 8, 12, 16, 30, 34, 38, 42, 46])
+        self.assertEquals(list(index.offsets(kmers.encode('TTTT'))), [])
+        self.assertEquals(index.count(kmers.encode('ACGT')), 10)
+        self.assertEquals(index.count(kmers.encode('TTTT')), 0)
+        index.close()
+
+    def test_find_sequence(self):
+        self.assertEquals(self._hits(self.MOTIF), [
+            ('MV2-25', 21, '+', self.MOTIF, 0),
+            ('Ariz', 21, '+', self.MOTIF, 0)])
+        self.assertEquals(self._hits('gcctgtaatc', 1), [
+            ('MV2-25', 21, '-', self.MOTIF, 0),
+            ('Flg14', 21, '-', 'GATTCCAGGC', 1),
+            ('Ariz', 21, '-', self.MOTIF, 0)])
+        self.assertRaises(ValueError, self._hits, 'GATTN')
+        self.assertRaises(ValueError, self._hits, 'GAT')
+
+        # Searches with too many matches, or too common k-mers, are refused.
+        self.assertRaises(ValueError, kmers.find_sequence, [self.ref_cb],
+            'ACGTACGT', max_hits=3)
+        max_seed_offsets = kmers.MAX_SEED_OFFSETS
+        kmers.MAX_SEED_OFFSETS = 5
+        try:
+            self.assertRaises(ValueError, self._hits, 'ACGTACGT')
+            self.assertEquals(len(self._hits(self.MOTIF)), 2)
+        finally:
+            kmers.MAX_SEED_OFFSETS = max_seed_offsets
+
+    def test_view(self):
+        client = Client()
+        response = client.get('/api/sequence_search/', {'sequence': 'gattacaggc',
+            'strains': 'mv2-25,flg14', 'mismatches': 1})
+        self.assertEquals(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEquals(result['hits'], [
+            {'strain': 'MV2-25', 'chromosome': '2', 'position': 21, 'strand': '+',
+             'bases': self.MOTIF, 'mismatches': 0},
+            {'strain': 'Flg14', 'chromosome': '2', 'position': 21, 'strand': '+',
+             'bases': 'GATTCCAGGC', 'mismatches': 1}])
+        response = client.get('/api/sequence_search/', {'sequence': 'gattacaggc',
+            'mismatches': 3})
+        self.assertEquals(response.status_code, 400)
+
+
+class GeneSequenceStoreTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(GeneSequenceStoreTests, self).setUp()
+        self.ref_cb = self._add_chromosome_base('MV2-25', list('ACGTACGTACGTACGT'),
+            is_reference=True)
+        bases = list('ACGTACGTACGTACGT')
+        bases[2] = 'GAA'
+        bases[5] = '-'
+        self.cb = self._add_chromosome_base('Flg14', bases)
+
+        for code, strand, transcripts in [
+                ('FBgn0000001', '+', [('atl-RA', [(2, 4)]), ('atl-RB', [(2, 4), (6, 9)])]),
+                ('FBgn0000002', '-', [('nc-RA', [(12, 14), (15, 18)])])]:
+            group = GeneSymbolGroup.objects.create(flybase_id=code)
+            GeneSymbol.objects.create(symbol=code, group=group)
+            gene = Gene.objects.create(strain=self.ref_cb.strain, chromosome=self.chromosome,
+                start_position=transcripts[-1][1][0][0], end_position=transcripts[-1][1][-1][1],
+                import_code=code, strand=strand, bases='')
+            for name, cds in transcripts:
+                mrna = MRNA.objects.create(name=name, gene=gene)
+                for num, (start, end) in enumerate(cds):
+                    CDS.objects.create(mRNA=mrna, start_position=start, end_position=end,
+                        num=num + 1)
+        invalidate_symbol_index()
+
+    def _fasta(self, symbol, show_aligned):
+        return [(h, list(b)) for h, b in Gene.multi_gene_fasta(symbol, [self.species],
+            show_aligned)]
+
+    @override_settings(SYMBOL_INDEX_CHECK_SECONDS=0)
+    def test_multi_gene_fasta(self):
+        expected = [(symbol, show_aligned, self._fasta(symbol, show_aligned))
+            for symbol in ['FBgn0000001', 'FBgn0000002'] for show_aligned in [False, True]]
+        self.assertEquals(expected[1][2][1][1], ['CGAAT-GTA'])
+
+        for cb in [self.ref_cb, self.cb]:
+            self.assertEquals(sequence_store.build_gene_sequences(cb), 2)
+        gene = Gene.objects.get(import_code='FBgn0000001')
+        stored = sequence_store.stored_sequence(gene, self.cb.strain)
+        self.assertEquals((stored.transcript_name, stored.transcript_start),
+            ('atl-RB', 2))
+        self.assertEquals(stored.positions, ['C', 'GAA', 'T', '-', 'G', 'T', 'A'])
+        self.assertEquals(stored.spliced, 'CGAATGTA')
+
+        bases_for_strain = MRNA.bases_for_strain
+        MRNA.bases_for_strain = None
+        try:
+            for symbol, show_aligned, fasta in expected:
+                self.assertEquals(self._fasta(symbol, show_aligned), fasta)
+        finally:
+            MRNA.bases_for_strain = bases_for_strain
+
+        # Served from the stores, a search takes the same queries (for the
+        # strains, genes and ChromosomeBases) however many strains there are.
+        with override_settings(SYMBOL_INDEX_CHECK_SECONDS=60):
+            self._fasta('FBgn0000001', True)
+            with self.assertNumQueries(3):
+                self._fasta('FBgn0000001', True)
+            cb2 = self._add_chromosome_base('Ariz', list('ACGTACGTACGTACGT'))
+            sequence_store.build_gene_sequences(cb2)
+            with self.assertNumQueries(3):
+                self.assertEquals(len(self._fasta('FBgn0000001', True)), 3)
+
+        # A new import of the strain has a new file tag, so isn't served
+        # from the old store.
+        self.cb.file_tag = ChromosomeBase.generate_file_tag()
+        self.assertEquals(sequence_store.GeneSequenceStore.for_chromosome_base(self.cb),
+            None)
+
+
+class StatsTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(StatsTests, self).setUp()
+        ref_bases = list('ACGT' * 625)
+        self.ref_cb = self._add_chromosome_base('MV2-25', ref_bases, is_reference=True)
+
+        # Variants at positions 1, 1001 (insertion), 1002 (deletion) and 2500;
+        # position 3 is uncalled.
+        bases = list(ref_bases)
+        bases[0] = 'T'
+        bases[1000] = 'AGG'
+        bases[1001] = '-'
+        bases[2] = 'N'
+        bases[2499] = 'A'
+        self.cb = self._add_chromosome_base('Flg14', bases,
+            coverage=[10] * 1000 + [20] * 1500)
+
+    def test_stats(self):
+        self.assertEquals(reference_for(self.cb).pk, self.ref_cb.pk)
+        self.assertEquals(reference_for(self.ref_cb), None)
+        build_stats(self.cb, reference_for(self.cb))
+        stats = ChromosomeStats.for_chromosome_base(self.cb)
+
+        global_stats = stats.global_stats()
+        self.assertEquals(global_stats['featureCount'], 4)
+        self.assertEquals((global_stats['scoreMin'], global_stats['scoreMax']), (10, 20))
+        self.assertAlmostEquals(global_stats['scoreMean'], 16)
+
+        region_stats = stats.region_stats(1001, 2000)
+        self.assertEquals(region_stats['featureCount'], 2)
+        self.assertAlmostEquals(region_stats['scoreMean'], 20)
+        self.assertAlmostEquals(region_stats['scoreStdDev'], 0)
+
+        self.assertEquals(stats.variant_densities(1, 2500, 1000), [1, 2, 1])
+
+        # Counts within a bin are exact.
+        self.assertEquals(stats.variant_densities(1, 8, 2), [1, 0, 0, 0])
+        self.assertEquals(stats.variant_densities(999, 1004, 3), [1, 1])
+        self.assertEquals(stats.region_stats(1002, 2499)['featureCount'], 1)
+
+    def test_reference_import(self):
+        # Stats built before the reference was imported count no variants.
+        self.ref_cb.strain.is_reference = False
+        self.ref_cb.strain.save()
+        build_strain_stats(self.cb)
+        self.assertEquals(ChromosomeStats.for_chromosome_base(
+            self.cb).global_stats()['featureCount'], 0)
+
+        self.ref_cb.strain.is_reference = True
+        self.ref_cb.strain.save()
+        build_strain_stats(self.ref_cb)
+        self.assertEquals(ChromosomeStats.for_chromosome_base(
+            self.cb).global_stats()['featureCount'], 4)
+
+    def test_jbrowse_stats(self):
+        build_stats(self.cb, reference_for(self.cb))
+        client = Client()
+
+        response = client.get('/jb/stats/global', {'strain': 'flg14'})
+        self.assertEquals(json.loads(response.content)['featureCount'], 4)
+
+        response = client.get('/jb/stats/region/2', {'strain': 'flg14', 'start': 1000, 'end': 2000})
+        self.assertEquals(json.loads(response.content)['featureCount'], 2)
+
+        response = client.get('/jb/stats/regionFeatureDensities/2',
+            {'strain': 'flg14', 'start': 0, 'end': 2000, 'basesPerBin': 1000})
+        self.assertEquals(json.loads(response.content),
+            {'bins': [1, 2], 'stats': {'basesPerBin': 1000, 'max': 2}})
+
+
+class CoverageSummaryTests(ChromosomeDataTestCase):
+
+    def setUp(self):
+        super(CoverageSummaryTests, self).setUp()
+        self.cb = self._add_chromosome_base('Flg14', ['A'] * 3000,
+            coverage=[10] * 1024 + [30] * 1000 + [i % 256 for i in range(976)])
+
+    def test_coverage_summaries(self):
+        build_coverage_summaries(self.cb)
+        summaries = CoverageSummaries.for_chromosome_base(self.cb)
+        self.assertEquals([level[:2] for level in summaries.levels[:3]],
+            [(128, 24), (1024, 3), (8192, 1)])
+
+        bins = summaries.bins(1, 2048, 1024)
+        self.assertEquals([(b.start_position, b.end_position) for b in bins],
+            [(1, 1024), (1025, 2048)])
+        self.assertAlmostEquals(bins[0].mean, 10)
+        self.assertEquals((bins[1].min, bins[1].max), (0, 30))
+        self.assertAlmostEquals(bins[1].mean, (30 * 1000 + sum(range(24))) / 1024.0)
+
+        last = summaries.bins(2900, 3500, 128)[-1]
+        self.assertEquals((last.start_position, last.end_position), (2945, 3000))
+        self.assertEquals((last.min, last.max), (152, 207))
+
+    def test_coverage_range(self):
+        # Without summaries (or for small windows) coverage is per position.
+        bins = coverage_range(self.cb, 1020, 1030, max_points=100)
+        self.assertEquals([b.mean for b in bins], [10] * 5 + [30] * 6)
+
+        # Larger windows without summaries are binned on the fly.
+        bins = coverage_range(self.cb, 1, 3000, max_points=3)
+        self.assertEquals([(b.start_position, b.end_position) for b in bins],
+            [(1, 1000), (1001, 2000), (2001, 3000)])
+        self.assertAlmostEquals(bins[0].mean, 10)
+        self.assertEquals((bins[1].min, bins[1].max), (10, 30))
+        self.assertEquals(len(coverage_range(self.cb, 1, 3000, max_points=7)), 7)
+
+        build_coverage_summaries(self.cb)
+        self.assertEquals(len(coverage_range(self.cb, 1, 3000, max_points=30)), 24)
+        self.assertEquals(len(coverage_range(self.cb, 1, 3000, max_points=10)), 3)
+        self.assertEquals(len(coverage_range(self.cb, 1, 3000, max_points=1)), 1)
+        self.assertEquals(len(coverage_range(self.cb, 1, 50, max_points=100)), 50)
+
+    def test_jbrowse_coverage(self):
+        build_coverage_summaries(self.cb)
+        client = Client()
+
+        response = client.get('/jb/coverage/features/2',
+            {'strain': 'flg14', 'start': 0, 'end': 2048, 'basesPerSpan': 1024})
+        features = json.loads(response.content)['features']
+        self.assertEquals([(f['start'], f['end'], f['score']) for f in features[:1]],
+            [(0, 1024, 10)])
+        self.assertEquals(len(features), 2)
+
+        response = client.get('/jb/coverage/features/2',
+            {'strain': 'flg14', 'start': 0, 'end': 2048, 'basesPerSpan': 1024},
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEquals(response.status_code, 304)
+
+
+class CoverageStorageTests(ChromosomeDataTestCase):
+
+    def test_round_trip(self):
+        # Runs, a block too varied for runs, and a final partial block.
+        coverage = array.array('B', [0] * 150 + range(100) + [7] * 55)
+        path = os.path.join(self.data_root, 'test.rlecov')
+        writer = CoverageWriter(path, block_size=100)
+        for c in coverage[:120]:
+            writer.append(c)
+        writer.extend(coverage[120:])
+        writer.close()
+
+        rle = RLECoverage(path)
+        self.assertEquals(rle.num_positions, len(coverage))
+        self.assertEquals(rle.values(0, 1000), coverage)
+        self.assertEquals(rle.values(95, 260), coverage[95:261])
+        self.assertEquals(rle.values(304, 304), array.array('B', [7]))
+        self.assertEquals(rle.values(305, 400), array.array('B'))
+
+    def test_compress_coverage(self):
+        values = [0] * 100000 + [12] * 50000 + [i % 40 for i in range(1000)]
+        cb = self._add_chromosome_base('Flg14', ['A'] * len(values), coverage=values)
+        cb.start_position, cb.end_position = 101, len(values) + 100
+        raw_size = os.path.getsize(cb.coverage_file_path)
+
+        compress_coverage(cb)
+        self.assertFalse(os.path.exists(cb.coverage_file_path))
+        self.assertTrue(os.path.getsize(cb.coverage_rle_file_path) * 10 < raw_size)
+        self.assertEquals(list(cb.coverage_values(1, len(values) + 100)), values)
+        self.assertEquals(list(cb.coverage_values(100100, 100102)), [0, 12, 12])
+
+
+class FileCatalogTests(TestCase):
+
+    VCF = ('##fileformat=VCFv4.2\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tFLG14\n'
+        '2\t1\t.\tA\tT\t50\tPASS\t.\tGT:AD\t1/1:0,10\n')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.pending_dir = os.path.join(self.root, 'pending')
+        self.vcf_dir = os.path.join(self.root, 'vcf')
+        os.makedirs(os.path.join(self.vcf_dir, 'DFLG14', 'split'))
+        os.mkdir(self.pending_dir)
+        self.settings_override = override_settings(
+            PSEUDOBASE_CHROMOSOME_RAW_DATA_PENDING_PREFIX=self.pending_dir,
+            PSEUDOBASE_CHROMOSOME_RAW_DATA_VCF_PREFIX=self.vcf_dir)
+        self.settings_override.enable()
+
+        self.get_info_calls = []
+        self.get_info = ChromosomeImporter.get_info
+        def counting_get_info(importer, *args, **kwargs):
+            self.get_info_calls.append(importer.chromosome_data_fname)
+            return self.get_info(importer, *args, **kwargs)
+        ChromosomeImporter.get_info = counting_get_info
+
+    def tearDown(self):
+        ChromosomeImporter.get_info = self.get_info
+        self.settings_override.disable()
+        shutil.rmtree(self.root)
+
+    def _write_vcf(self, path):
+        f = gzip.open(path, 'wb')
+        f.write(self.VCF)
+        f.close()
+
+    def test_catalog(self):
+        vcf_path = os.path.join(self.vcf_dir, 'flg14.vcf.gz')
+        self._write_vcf(vcf_path)
+        split_path = os.path.join(self.vcf_dir, 'DFLG14', 'split', 'flg14_2.vcf.gz')
+        self._write_vcf(split_path)
+        with open(os.path.join(self.pending_dir, 'notes.txt'), 'w') as f:
+            f.write('not chromosome data\n')
+
+        self.assertEquals(file_catalog.refresh_catalog(), 3)
+        self.assertEquals(file_catalog.refresh_catalog(), 0)
+        self.assertEquals(CatalogedFile.objects.count(), 3)
+
+        # Pages read the info from the catalog, with the release looked up.
+        del self.get_info_calls[:]
+        info = file_catalog.directory_files_info(self.vcf_dir)[0]
+        self.assertEquals((info['format'], info['chromosome_name'], info['strain_name'],
+            info['release_name']), ('VCF gzipped', '2', 'FLG14', 'unknown'))
+        self.assertEquals(self.get_info_calls, [])
+
+        # Changed files are read again, and removed files are forgotten.
+        with open(vcf_path, 'ab') as f:
+            f.write('\0')
+        os.remove(split_path)
+        file_catalog.directory_files_info(self.vcf_dir)
+        self.assertEquals(self.get_info_calls, ['flg14.vcf.gz'])
+        self.assertEquals(file_catalog.refresh_catalog(), 0)
+        self.assertEquals(CatalogedFile.objects.count(), 2)
+
+
+class VCFStatsTests(TestCase):
+
+    VCF = ('##fileformat=VCFv4.2\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tFLG14\n'
+        '2\t1\t.\tA\tT\t50\tPASS\t.\tGT:AD\t1/1:0,10\n'
+        '2\t2\t.\tC\t.\t50\tPASS\t.\tGT:AD\t0/0:8\n'
+        'XR_group6\t1\t.\tG\tA\t50\tPASS\t.\tGT:AD\t1/1:0,9\n')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'flg14.vcf.gz')
+        f = gzip.open(self.path, 'wb')
+        f.write(self.VCF)
+        f.close()
+
+        self.scanned_lines = []
+        self.add_line = vcf_stats.VCFStatsAccumulator.add_line
+        def counting_add_line(accumulator, line):
+            self.scanned_lines.append(line)
+            return self.add_line(accumulator, line)
+        vcf_stats.VCFStatsAccumulator.add_line = counting_add_line
+
+    def tearDown(self):
+        vcf_stats.VCFStatsAccumulator.add_line = self.add_line
+        shutil.rmtree(self.root)
+
+    def test_fingerprint(self):
+        fingerprint = vcf_stats.file_fingerprint(self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEquals(fingerprint, vcf_stats.fingerprint(len(data), data, data))
+        self.assertTrue(fingerprint.startswith('%s-' % len(data)))
+
+    def test_get_num_records(self):
+        reader = ChromosomeVCFImportFileReader(self.path)
+        self.assertEquals(reader.get_num_records(), 5)
+        self.assertEquals(len(self.scanned_lines), 5)
+
+        # Counting chromosomes and summary flags needs a second scan (and only
+        # one, even once the file has been moved).
+        self.assertEquals(reader.get_num_records(also_retrieve_chromosomes=True), 3)
+        self.assertEquals(reader.chromosomes, {'2': 2, 'XR_group6': 1})
+        self.assertEquals(reader.summary_flag_dict['HomAlt'], 2)
+        self.assertEquals(len(self.scanned_lines), 10)
+
+        moved_path = os.path.join(self.root, 'renamed.vcf.gz')
+        os.rename(self.path, moved_path)
+        reader = ChromosomeVCFImportFileReader(moved_path)
+        self.assertEquals(reader.get_num_records(also_retrieve_chromosomes=True), 3)
+        self.assertEquals(reader.summary_flag_dict['HomAlt'], 2)
+        self.assertEquals(reader.get_num_records(), 5)
+        self.assertEquals(len(self.scanned_lines), 10)
+        self.assertEquals(VCFFileStats.objects.count(), 1)
+
+    def _gzip_data(self, text):
+        path = os.path.join(self.root, 'member.gz')
+        f = gzip.open(path, 'wb')
+        f.write(text)
+        f.close()
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_stream_stats(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        stream_stats = vcf_stats.VCFStreamStats()
+        for i in range(0, len(data), 7):
+            stream_stats.write(data[i:i + 7])
+        self.assertTrue(stream_stats.close())
+        self.assertEquals(stream_stats.fingerprint(),
+          vcf_stats.file_fingerprint(self.path))
+        vcf_stats.record_stats(stream_stats.fingerprint(),
+          stream_stats.accumulator)
+        self.assertEquals(len(self.scanned_lines), 5)
+
+        # The file is never scanned again.
+        reader = ChromosomeVCFImportFileReader(self.path)
+        self.assertEquals(reader.get_num_records(also_retrieve_chromosomes=True), 3)
+        self.assertEquals(reader.chromosomes, {'2': 2, 'XR_group6': 1})
+        self.assertEquals(reader.summary_flag_dict['HomAlt'], 2)
+        self.assertEquals(reader.get_num_records(), 5)
+        self.assertEquals(len(self.scanned_lines), 5)
+
+    def test_stream_stats_multiple_members(self):
+        header, records = self.VCF.split('2\t1\t', 1)
+        data = self._gzip_data(header + '2\t1\t') + self._gzip_data(records)
+        stream_stats = vcf_stats.VCFStreamStats()
+        stream_stats.write(data)
+        self.assertTrue(stream_stats.close())
+        self.assertEquals(stream_stats.accumulator.num_records, 3)
+        self.assertEquals(stream_stats.accumulator.chromosomes,
+          {'2': 2, 'XR_group6': 1})
+
+    def test_stream_stats_truncated(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        stream_stats = vcf_stats.VCFStreamStats()
+        stream_stats.write(data[:-10])
+        self.assertFalse(stream_stats.close())
+        self.assertEquals(stream_stats.error, 'Truncated gzip data')
+
+        stream_stats = vcf_stats.VCFStreamStats()
+        stream_stats.write('not gzipped')
+        self.assertFalse(stream_stats.close())
+
+    def test_upload(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        upload_dir = os.path.join(self.root, 'upload')
+        os.mkdir(upload_dir)
+        errors = handle_uploaded_files(upload_dir, [
+          SimpleUploadedFile('flg14.vcf.gz', data),
+          SimpleUploadedFile('bad.vcf.gz', data[:-10])])
+        self.assertEquals(errors, [('bad.vcf.gz', 'Truncated gzip data')])
+        self.assertEquals(VCFFileStats.objects.count(), 1)
+
+        stats = vcf_stats.stored_file_stats(
+          os.path.join(upload_dir, 'flg14.vcf.gz'))
+        self.assertEquals(stats.num_records, 3)
+        self.assertEquals(stats.summary_flags_dict()['HomAlt'], 2)
+        self.assertEquals(vcf_stats.stored_file_stats(
+          os.path.join(upload_dir, 'bad.vcf.gz')), None)
+
+    def test_upload_without_ad(self):
+        # Records whose summary flags can't be counted (no AD field, too few
+        # columns, not UTF-8) don't stop the file being written and checked.
+        data = self._gzip_data(self.VCF.replace('GT:AD\t1/1:0,10', 'GT:DP\t1/1:10') +
+          '2\t3\t.\tG\n' + '2\t4\t.\tT\tA\t50\tPASS\t.\tGT:AD\t\xff\n')
+        upload_dir = os.path.join(self.root, 'upload')
+        os.mkdir(upload_dir)
+        errors = handle_uploaded_files(upload_dir, [
+          SimpleUploadedFile('flg14.vcf.gz', data),
+          SimpleUploadedFile('bad.vcf.gz', data[:-10])])
+        self.assertEquals(errors, [('bad.vcf.gz', 'Truncated gzip data')])
+        with open(os.path.join(upload_dir, 'flg14.vcf.gz'), 'rb') as f:
+            self.assertEquals(f.read(), data)
+
+        stats = vcf_stats.stored_file_stats(
+          os.path.join(upload_dir, 'flg14.vcf.gz'))
+        self.assertEquals(stats.num_records, 5)
+        self.assertEquals(stats.chromosomes_dict(), {'2': 4, 'XR_group6': 1})
+        self.assertEquals(stats.summary_flags_dict(), {})
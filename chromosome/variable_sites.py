@@ -0,0 +1,491 @@
+'''Variable site indexes: where the strains of a chromosome differ from the reference.
+
+Most positions of most strains are the same as the reference, and users
+often only want the positions where strains differ.  A ".variants" index of
+a release and chromosome lists every variable site: a position where any
+strain (ChromosomeBase) has a SNP, an insertion, a deletion or an uncalled
+base (N) where the reference doesn't.  Each site has a bitset of the strains
+which vary there, so the sites of any set of strains are found without
+reading the strains' data, in time proportional to the number of sites.
+
+Sites are kept in blocks of BLOCK_SIZE sites, each compressed with zlib as
+the differences between successive positions followed by the bitsets.  A
+block index gives the first position of each block, so a range query only
+decompresses the blocks it touches.
+
+The index is updated when a strain is imported or removed (only the strain
+itself is compared with the reference), and is only used for ChromosomeBases
+(and a reference) it holds as they are now.  The
+chromosome_build_variable_sites command builds the indexes of existing data.
+
+Index layout:
+  HEADER: magic, version, reference ChromosomeBase id, reference file tag,
+    number of strains, number of sites, number of blocks
+  STRAIN (one per strain, in bit order): ChromosomeBase id, file tag
+  BLOCK (one per block): first position, number of sites, offset and
+    compressed size of the block
+  blocks
+
+'''
+
+import array
+import bisect
+import os
+import struct
+import zlib
+
+from django.conf import settings
+
+from chromosome.insertions import inserted_positions
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'PBVS'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHI32sIII')
+STRAIN = struct.Struct('<I32s')
+BLOCK = struct.Struct('<IIQI')
+
+POSITION_TYPE = 'I'
+
+# Number of sites in a block.
+BLOCK_SIZE = 4096
+
+# Number of positions read at a time when comparing a strain with the
+# reference.
+READ_SIZE = 1 << 20
+
+
+def index_path(release_id, chromosome_id):
+    '''Return the path of the variable site index of a release and chromosome.'''
+
+    return os.path.join(settings.PSEUDOBASE_CHROMOSOME_DATA_ROOT,
+      'release%s_chromosome%s.variants' % (release_id, chromosome_id))
+
+
+def _position_bases(cb, index_file, data_file, start_position, end_position):
+    '''Return the first base of each position from start to end of cb.
+
+    Returns (bases, positions relative to start_position with insertions).
+
+    '''
+
+    offset_size = array.array('I').itemsize
+    count = end_position + 1 - start_position
+    offsets = array.array('I')
+    index_file.seek((start_position - cb.start_position) * offset_size)
+    offsets.fromstring(index_file.read((count + 1) * offset_size))
+    data_file.seek(offsets[0])
+    if len(offsets) > count:
+        data = data_file.read(offsets[count] - offsets[0])
+    else:
+        data = data_file.read()
+        offsets.append(offsets[0] + len(data))
+
+    if len(data) == count:
+        return data, []
+    start = offsets[0]
+    return ''.join([data[offsets[i] - start] for i in xrange(count)]), \
+      inserted_positions(offsets, count)
+
+
+def _differences(bases, ref_bases):
+    '''Return the sorted indexes where the strings bases and ref_bases differ.
+
+    Equal spans are skipped as a whole, so the time taken mostly depends on
+    the number of differences.
+
+    '''
+
+    differences = []
+    spans = [(0, min(len(bases), len(ref_bases)))]
+    while spans:
+        lo, hi = spans.pop()
+        if bases[lo:hi] == ref_bases[lo:hi]:
+            continue
+        if hi - lo == 1:
+            differences.append(lo)
+        else:
+            middle = (lo + hi) // 2
+            spans.append((middle, hi))
+            spans.append((lo, middle))
+    return differences
+
+
+def find_variants(cb, reference):
+    '''Return the array of the positions where cb differs from reference.
+
+    Only positions both have data for are compared, ignoring case.
+
+    '''
+
+    variants = array.array(POSITION_TYPE)
+    first = max(cb.start_position, reference.start_position)
+    last = min(cb.end_position, reference.end_position)
+
+    files = [open(path, 'rb') for path in (cb.index_file_path,
+      cb.data_file_path, reference.index_file_path, reference.data_file_path)]
+    try:
+        for start in xrange(first, last + 1, READ_SIZE):
+            end = min(start + READ_SIZE - 1, last)
+            bases, inserted = _position_bases(cb, files[0], files[1], start,
+              end)
+            ref_bases = _position_bases(reference, files[2], files[3], start,
+              end)[0]
+            differences = _differences(bases.upper(), ref_bases.upper())
+            if inserted:
+                differences = sorted(set(differences).union(inserted))
+            variants.extend([start + i for i in differences])
+    finally:
+        for f in files:
+            f.close()
+    return variants
+
+
+class VariableSites(object):
+    '''The variable site index of a release and chromosome.
+
+    Opening an index only reads its strains and block index.  Changing it
+    (with add and remove) reads all of its sites first.
+
+    '''
+
+    def __init__(self, path, load=True):
+        self.path = path
+        self.reference_id = 0
+        self.reference_tag = ''
+        # The ChromosomeBase id and file tag of each strain, in bit order.
+        self.strains = []
+        # The first position, number of sites, offset and compressed size of
+        # each block.
+        self.blocks = []
+        self.num_sites = 0
+        # The variant positions of each strain by id, once all the sites have
+        # been read to change the index.
+        self._variants = None
+        if load and os.path.exists(path):
+            self._load()
+
+    @classmethod
+    def for_chromosome(cls, release_id, chromosome_id):
+        return cls(index_path(release_id, chromosome_id))
+
+    @classmethod
+    def for_chromosome_bases(cls, cbs, reference):
+        '''Return the index holding all of cbs, or None if there isn't one.'''
+
+        keys = set((cb.strain.release_id, cb.chromosome_id) for cb in cbs)
+        if len(keys) != 1:
+            return None
+        release_id, chromosome_id = keys.pop()
+        if release_id is None:
+            return None
+        variable_sites = cls.for_chromosome(release_id, chromosome_id)
+        if not variable_sites.holds(cbs, reference):
+            return None
+        return variable_sites
+
+    def _load(self):
+        f = open(self.path, 'rb')
+        try:
+            (magic, version, self.reference_id, reference_tag, num_strains,
+              self.num_sites, num_blocks) = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a version %s variable site index: %s' % (
+                  VERSION, self.path))
+            self.reference_tag = reference_tag.rstrip('\0')
+            for i in xrange(num_strains):
+                cb_id, file_tag = STRAIN.unpack(f.read(STRAIN.size))
+                self.strains.append((cb_id, file_tag.rstrip('\0')))
+            self.blocks = [BLOCK.unpack(f.read(BLOCK.size)) for i in
+              xrange(num_blocks)]
+        finally:
+            f.close()
+
+    def holds(self, cbs, reference):
+        '''Return whether the index holds the current variants of all of cbs.
+
+        The variants must have been found against reference as it is now.
+
+        '''
+
+        if reference is None or self.reference_id != reference.id or \
+          self.reference_tag != str(reference.file_tag):
+            return False
+        strains = dict(self.strains)
+        for cb in cbs:
+            if cb.id != reference.id and strains.get(cb.id) != str(cb.file_tag):
+                return False
+        return True
+
+    def _read_block(self, f, n):
+        '''Return (positions, bitsets) of the sites of block n.'''
+
+        first, num_sites, offset, size = self.blocks[n]
+        f.seek(offset)
+        data = zlib.decompress(f.read(size))
+        deltas = array.array(POSITION_TYPE)
+        deltas.fromstring(data[:num_sites * deltas.itemsize])
+        positions = []
+        position = first
+        for delta in deltas:
+            position += delta
+            positions.append(position)
+        width = self._bitset_width()
+        bitsets = data[num_sites * deltas.itemsize:]
+        return positions, [bitsets[i * width:(i + 1) * width] for i in
+          xrange(num_sites)]
+
+    def _bitset_width(self):
+        return (len(self.strains) + 7) // 8
+
+    def sites(self, cb_ids, start_position, end_position):
+        '''Return the sorted positions from start to end where any of cb_ids vary.
+
+        cb_ids not in the index (such as the reference) have no sites.
+
+        '''
+
+        bits = dict((cb_id, i) for i, (cb_id, file_tag) in
+          enumerate(self.strains))
+        # The byte of the bitsets and mask of each strain asked for.
+        masks = {}
+        for cb_id in cb_ids:
+            if cb_id in bits:
+                byte, bit = divmod(bits[cb_id], 8)
+                masks[byte] = masks.get(byte, 0) | (1 << bit)
+        if not masks or not self.blocks:
+            return []
+        masks = masks.items()
+
+        sites = []
+        firsts = [block[0] for block in self.blocks]
+        f = open(self.path, 'rb')
+        try:
+            for n in xrange(max(bisect.bisect_right(firsts, start_position) - 1,
+              0), bisect.bisect_right(firsts, end_position)):
+                positions, bitsets = self._read_block(f, n)
+                for position, bitset in zip(positions, bitsets):
+                    if start_position <= position <= end_position and \
+                      any(ord(bitset[byte]) & mask for byte, mask in masks):
+                        sites.append(position)
+        finally:
+            f.close()
+        return sites
+
+    def _read_all(self):
+        '''Read the variants of every strain, so that the index can change.'''
+
+        if self._variants is not None:
+            return
+        variants = [array.array(POSITION_TYPE) for strain in self.strains]
+        f = open(self.path, 'rb') if self.blocks else None
+        try:
+            for n in xrange(len(self.blocks)):
+                positions, bitsets = self._read_block(f, n)
+                for position, bitset in zip(positions, bitsets):
+                    bits = _unpack_bitset(bitset)
+                    while bits:
+                        bit = bits & -bits
+                        variants[bit.bit_length() - 1].append(position)
+                        bits ^= bit
+        finally:
+            if f is not None:
+                f.close()
+        self._variants = dict((cb_id, (file_tag, strain_variants)) for
+          (cb_id, file_tag), strain_variants in zip(self.strains, variants))
+
+    def set_reference(self, reference):
+        '''Compare strains with reference from now on, forgetting all strains.'''
+
+        self._variants = {}
+        self.reference_id = reference.id
+        self.reference_tag = str(reference.file_tag)
+
+    def add(self, cb, reference):
+        '''Add (or replace) the variants of cb against reference.
+
+        reference must be the reference of the index, see set_reference.
+
+        '''
+
+        self._read_all()
+        self._variants[cb.id] = (str(cb.file_tag), find_variants(cb,
+          reference))
+
+    def remove(self, cb_id):
+        '''Remove the variants of the ChromosomeBase with cb_id.'''
+
+        self._read_all()
+        self._variants.pop(cb_id, None)
+
+    def save(self):
+        '''Write the index (or remove it, if it holds no strains).'''
+
+        self._read_all()
+        if not self._variants:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+
+        cb_ids = sorted(self._variants)
+        bitsets = {}
+        for i, cb_id in enumerate(cb_ids):
+            bit = 1 << i
+            for position in self._variants[cb_id][1]:
+                bitsets[position] = bitsets.get(position, 0) | bit
+        positions = sorted(bitsets)
+        width = (len(cb_ids) + 7) // 8
+
+        tmp_path = self.path + '.part'
+        f = open(tmp_path, 'wb')
+        try:
+            num_blocks = (len(positions) + BLOCK_SIZE - 1) // BLOCK_SIZE
+            header_size = HEADER.size + len(cb_ids) * STRAIN.size + \
+              num_blocks * BLOCK.size
+            f.seek(header_size)
+            blocks = []
+            for i in xrange(0, len(positions), BLOCK_SIZE):
+                block_positions = positions[i:i + BLOCK_SIZE]
+                first = block_positions[0]
+                deltas = array.array(POSITION_TYPE, [b - a for a, b in zip(
+                  [first] + block_positions[:-1], block_positions)])
+                data = zlib.compress(deltas.tostring() + ''.join(
+                  [_pack_bitset(bitsets[position], width) for position in
+                  block_positions]))
+                blocks.append((first, len(block_positions), f.tell(),
+                  len(data)))
+                f.write(data)
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, self.reference_id,
+              self.reference_tag, len(cb_ids), len(positions), num_blocks))
+            for cb_id in cb_ids:
+                f.write(STRAIN.pack(cb_id, self._variants[cb_id][0]))
+            for block in blocks:
+                f.write(BLOCK.pack(*block))
+        except:
+            f.close()
+            os.remove(tmp_path)
+            raise
+        f.close()
+        os.rename(tmp_path, self.path)
+
+        self.strains = [(cb_id, self._variants[cb_id][0]) for cb_id in cb_ids]
+        self.blocks = blocks
+        self.num_sites = len(positions)
+
+
+def _pack_bitset(bits, width):
+    '''Return the integer bits as width bytes, least significant first.'''
+
+    return ''.join([chr((bits >> (8 * i)) & 0xff) for i in xrange(width)])
+
+
+def _unpack_bitset(bitset):
+    '''Return the integer held by the bytes bitset (see _pack_bitset).'''
+
+    return int(bitset[::-1].encode('hex') or '0', 16)
+
+
+def build_variable_sites(release, chromosome):
+    '''Write the variable site index of the strains of release on chromosome.
+
+    Returns the number of strains in the index, or None (removing any old
+    index) if there is no reference or no other strains.
+
+    '''
+
+    from chromosome.models import ChromosomeBase
+
+    cbs = [cb for cb in ChromosomeBase.objects.filter(strain__release=release,
+      chromosome=chromosome).select_related('strain').order_by('id')
+      if not cb.missing_data()]
+    references = [cb for cb in cbs if cb.strain.is_reference]
+
+    variable_sites = VariableSites(index_path(release.id, chromosome.id),
+      load=False)
+    if references:
+        variable_sites.set_reference(references[0])
+        for cb in cbs:
+            if not cb.strain.is_reference:
+                variable_sites.add(cb, references[0])
+    variable_sites.save()
+    return len(variable_sites.strains) or None
+
+
+def add_strain(cb):
+    '''Add the variants of a newly imported ChromosomeBase to its index.
+
+    Importing a reference rebuilds the whole index against it.
+
+    '''
+
+    from chromosome.stats import reference_for
+
+    if cb.strain.release_id is None:
+        return
+    if cb.strain.is_reference:
+        build_variable_sites(cb.strain.release, cb.chromosome)
+        return
+
+    reference = reference_for(cb)
+    if reference is None or reference.missing_data():
+        return
+    variable_sites = VariableSites.for_chromosome(cb.strain.release_id,
+      cb.chromosome_id)
+    if variable_sites.reference_id != reference.id or \
+      variable_sites.reference_tag != str(reference.file_tag):
+        # The strains already in the index were compared with another
+        # reference (or there is no index yet).
+        build_variable_sites(cb.strain.release, cb.chromosome)
+        return
+    variable_sites.add(cb, reference)
+    variable_sites.save()
+
+
+def remove_strain(cb):
+    '''Remove the variants of a removed ChromosomeBase from its index.'''
+
+    if cb.strain.release_id is None:
+        return
+    path = index_path(cb.strain.release_id, cb.chromosome_id)
+    if cb.strain.is_reference:
+        # Nothing in the index can be compared with the reference any more.
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    variable_sites = VariableSites(path)
+    variable_sites.remove(cb.id)
+    variable_sites.save()
+
+
+def variable_columns(cbs, reference, start_position, end_position,
+  max_sites=None):
+    '''Return the variable sites of cbs from start to end, with their bases.
+
+    Returns a list of (position, reference bases, bases of each of cbs), or
+    None if there is no index holding all of cbs as they are now.  Raises
+    ValueError if there are more than max_sites sites.
+
+    '''
+
+    try:
+        variable_sites = VariableSites.for_chromosome_bases(cbs, reference)
+        if variable_sites is None:
+            return None
+        positions = variable_sites.sites([cb.id for cb in cbs],
+          start_position, end_position)
+    except (IOError, ValueError, zlib.error, struct.error):
+        log.exception('Error reading variable site index')
+        return None
+    if max_sites is not None and len(positions) > max_sites:
+        raise ValueError('More than %s variable sites' % max_sites)
+
+    ref_bases = list(reference.bases_at(positions))
+    bases = [list(cb.bases_at(positions)) for cb in cbs]
+    return [(position, ref_bases[i], [strain_bases[i] for strain_bases in
+      bases]) for i, position in enumerate(positions)]
@@ -0,0 +1,244 @@
+'''A durable store of VCF file statistics.
+
+Counting the records, chromosomes and summary flags of a VCF file means
+decompressing and reading the whole (often multi-GB) file.  The results are
+kept in the VCFFileStats table, keyed by a fingerprint of the file's content
+(its size and hashes of its first and last FINGERPRINT_BLOCK_SIZE bytes), so
+that a file is only ever scanned once, whatever it is called and wherever it
+is moved to.
+
+Uploaded files are scanned as they are uploaded (see VCFStreamStats), so
+their statistics are ready as soon as the upload finishes.
+
+'''
+
+import gzip
+import hashlib
+import json
+import os
+import zlib
+
+import django.utils.timezone
+
+from chromosome.utils import VCFRecord
+
+import logging
+log = logging.getLogger(__name__)
+
+
+FINGERPRINT_BLOCK_SIZE = 65536
+
+
+def fingerprint(size, head, tail):
+    '''Return the fingerprint of a file of size bytes from its head and tail.
+
+    head and tail are the first and last FINGERPRINT_BLOCK_SIZE bytes of the
+    file (which overlap for small files).
+
+    '''
+
+    return '%s-%s-%s' % (size, hashlib.md5(head).hexdigest(),
+      hashlib.md5(tail).hexdigest())
+
+
+def file_fingerprint(path):
+    '''Return the fingerprint of the file at path.'''
+
+    size = os.path.getsize(path)
+    f = open(path, 'rb')
+    try:
+        head = f.read(FINGERPRINT_BLOCK_SIZE)
+        f.seek(max(size - FINGERPRINT_BLOCK_SIZE, 0))
+        tail = f.read(FINGERPRINT_BLOCK_SIZE)
+    finally:
+        f.close()
+    return fingerprint(size, head, tail)
+
+
+class VCFStatsAccumulator(object):
+    '''Accumulates the statistics of a VCF file a line at a time.
+
+    Records whose summary flags can't be worked out (e.g. with no AD field,
+    too few columns or text which isn't UTF-8) stop the summary flags being
+    counted, with the reason in summary_flags_error; the lines, records and
+    chromosomes are still counted.
+
+    '''
+
+    def __init__(self, summary_flags=False):
+        self.num_lines = 0
+        self.num_records = 0
+        self.chromosomes = {}
+        self.summary_flags = summary_flags
+        self.summary_flags_error = None
+        self.tot_summary_flags = [0 for i in range(len(VCFRecord.vcf_types))]
+
+    def add_line(self, line):
+        '''Add a (decompressed) line of the file.'''
+
+        self.num_lines += 1
+        if line[:1] == '#':
+            return
+
+        self.num_records += 1
+        chrom = line.split('\t', 1)[0].decode('utf-8', 'replace')
+        self.chromosomes[chrom] = self.chromosomes.get(chrom, 0) + 1
+
+        if self.summary_flags and self.summary_flags_error is None:
+            try:
+                record_summary_flags = VCFRecord(
+                  line.decode('utf-8').rstrip()).summary_flags()
+            except (ValueError, IndexError, KeyError) as e:
+                self.summary_flags_error = 'Invalid VCF record %s: %s' % (
+                  self.num_records, e)
+                log.warning('Summary flags not counted: ' +
+                  self.summary_flags_error)
+                return
+            self.tot_summary_flags = [prev_tot + record_summary_flags[i]
+              for i, prev_tot in enumerate(self.tot_summary_flags)]
+
+    def summary_flag_dict(self):
+        '''Return the summary flag totals.
+
+        Returns None if they weren't accumulated, and {} if they couldn't be
+        counted.
+
+        '''
+
+        if not self.summary_flags:
+            return None
+        if self.summary_flags_error is not None:
+            return {}
+        return VCFRecord.tot_summary_flags_to_meta_data(self.tot_summary_flags)
+
+
+class VCFStreamStats(object):
+    '''Accumulates the statistics of a gzipped VCF file from its raw bytes.
+
+    The compressed data is passed to write() a chunk at a time (as it is
+    written to disk, say), and is decompressed incrementally; the file's
+    fingerprint is worked out along the way.  Files of several gzip members
+    (e.g. bgzipped files) are handled.
+
+    '''
+
+    def __init__(self, summary_flags=True):
+        self.accumulator = VCFStatsAccumulator(summary_flags=summary_flags)
+        self.size = 0
+        self.error = None
+        self._head = ''
+        self._tail = ''
+        self._partial_line = ''
+        self._decompressor = self._new_decompressor()
+
+    def _new_decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        '''Add the next chunk of the compressed file.'''
+
+        self.size += len(data)
+        if len(self._head) < FINGERPRINT_BLOCK_SIZE:
+            self._head += data[:FINGERPRINT_BLOCK_SIZE - len(self._head)]
+        self._tail = (self._tail + data)[-FINGERPRINT_BLOCK_SIZE:]
+
+        if self.error is not None:
+            return
+        try:
+            while data:
+                self._add_text(self._decompressor.decompress(data))
+                # Data after the end of a gzip member starts the next one.
+                data = self._decompressor.unused_data
+                if data:
+                    self._decompressor = self._new_decompressor()
+        except zlib.error as e:
+            self.error = 'Invalid gzip data: %s' % e
+
+    def _add_text(self, text):
+        lines = (self._partial_line + text).split('\n')
+        self._partial_line = lines.pop()
+        for line in lines:
+            self.accumulator.add_line(line + '\n')
+
+    def close(self):
+        '''Finish the file, returning whether it was complete and valid.'''
+
+        if self.error is None:
+            # A finished gzip stream leaves any further data unused, which is
+            # the only way to tell it has ended (decompressobj has no eof).
+            try:
+                self._decompressor.decompress('\0')
+                if self._decompressor.unused_data != '\0':
+                    self.error = 'Truncated gzip data'
+            except zlib.error:
+                self.error = 'Truncated gzip data'
+        if self.error is None and self._partial_line:
+            self.accumulator.add_line(self._partial_line)
+            self._partial_line = ''
+        return self.error is None
+
+    def fingerprint(self):
+        '''Return the fingerprint of the data written.'''
+        return fingerprint(self.size, self._head, self._tail)
+
+
+def record_stats(vcf_fingerprint, accumulator):
+    '''Store the statistics accumulated from the file with vcf_fingerprint.'''
+
+    from chromosome.models import VCFFileStats
+
+    try:
+        stats = VCFFileStats.objects.get(fingerprint=vcf_fingerprint)
+    except VCFFileStats.DoesNotExist:
+        stats = VCFFileStats(fingerprint=vcf_fingerprint)
+    stats.num_lines = accumulator.num_lines
+    stats.num_records = accumulator.num_records
+    stats.chromosomes = json.dumps(accumulator.chromosomes)
+    summary_flag_dict = accumulator.summary_flag_dict()
+    if summary_flag_dict is not None:
+        stats.summary_flags = json.dumps(summary_flag_dict)
+    stats.computed_at = django.utils.timezone.now()
+    stats.save()
+    return stats
+
+
+def stored_file_stats(path):
+    '''Return the stored VCFFileStats of the file at path, or None.'''
+
+    from chromosome.models import VCFFileStats
+
+    try:
+        return VCFFileStats.objects.get(fingerprint=file_fingerprint(path))
+    except VCFFileStats.DoesNotExist:
+        return None
+
+
+def vcf_file_stats(path, summary_flags=False):
+    '''Return the VCFFileStats of the gzipped VCF file at path.
+
+    The file is only scanned if it hasn't been seen before (or if summary
+    flags are wanted and haven't been counted yet).
+
+    '''
+
+    from chromosome.models import VCFFileStats
+
+    vcf_fingerprint = file_fingerprint(path)
+    try:
+        stats = VCFFileStats.objects.get(fingerprint=vcf_fingerprint)
+        if stats.summary_flags is not None or not summary_flags:
+            return stats
+    except VCFFileStats.DoesNotExist:
+        pass
+
+    accumulator = VCFStatsAccumulator(summary_flags=summary_flags)
+    vcf_file = gzip.open(path, 'r')
+    try:
+        for line in vcf_file:
+            accumulator.add_line(line)
+            if accumulator.num_lines % 100000 == 0:
+                log.info('VCF file stats progress: %s records of %s' % (
+                  accumulator.num_records, path))
+    finally:
+        vcf_file.close()
+    return record_stats(vcf_fingerprint, accumulator)
@@ -16,6 +16,8 @@ log = logging.getLogger(__name__)
 
 import chromosome.forms
 from chromosome.models import ChromosomeBase, ChromosomeImporter, ChromosomeBatchImportProcess, ChromosomeBatchImportLog, ChromosomeBatchPreprocess
+from chromosome import file_catalog, insertions, variable_sites
+from chromosome.vcf_stats import VCFStreamStats, record_stats
 
 
 def preprocess_files_old(request):
@@ -282,15 +284,10 @@ def import_files(request):
     files = [f for f in listdir(mypath) if isfile(join(mypath, f))]
    
     
-    files_info = []
-    for f in files:
-        c_importer = ChromosomeImporter(join(mypath, f))
-        file_info = c_importer.get_info(incl_rec_count = False)
-        
+    files_info = file_catalog.files_info([join(mypath, f) for f in files])
+    for file_info in files_info:
         if 'file_size' in file_info:
            file_info['file_size_MB'] = "%.2fMB" % file_info['file_size']
-           
-        files_info.append(file_info)
 
     num_valid_pending_files = 0        
     for f_info in files_info:
@@ -393,8 +390,7 @@ def import_progress(request):
             file_info['format'] = '*'
             print('fie info: ',file_info)
         else:    
-            c_importer = ChromosomeImporter(fl)   #join(mypath, f))
-            file_info = c_importer.get_info(incl_rec_count = False)
+            file_info = file_catalog.files_info([fl])[0]
             
             if 'file_size' in file_info:
                file_info['file_size_MB'] = "%.2fMB" % file_info['file_size']
@@ -488,9 +484,38 @@ def _delete_latest(request):
     if os.path.exists(chrBase.coverage_file_path): 
         os.remove(chrBase.coverage_file_path)
         print ('removed: ',chrBase.coverage_file_path)  
+
+    if os.path.exists(chrBase.coverage_rle_file_path):
+        os.remove(chrBase.coverage_rle_file_path)
+        print ('removed: ',chrBase.coverage_rle_file_path)
+
+    if os.path.exists(chrBase.stats_file_path):
+        os.remove(chrBase.stats_file_path)
+        print ('removed: ',chrBase.stats_file_path)
+
+    if os.path.exists(chrBase.coverage_zoom_file_path):
+        os.remove(chrBase.coverage_zoom_file_path)
+        print ('removed: ',chrBase.coverage_zoom_file_path)
+
+    if os.path.exists(chrBase.kmer_index_file_path):
+        os.remove(chrBase.kmer_index_file_path)
+        print ('removed: ',chrBase.kmer_index_file_path)
+
+    if os.path.exists(chrBase.gene_sequences_file_path):
+        os.remove(chrBase.gene_sequences_file_path)
+        print ('removed: ',chrBase.gene_sequences_file_path)
    
 
   
+    try:
+        insertions.remove_strain(chrBase)
+    except Exception:
+        log.exception('Error updating insertion map for: ' + tag)
+    try:
+        variable_sites.remove_strain(chrBase)
+    except Exception:
+        log.exception('Error updating variable site index for: ' + tag)
+
     chrBase.delete()
     #latestLog.delete()
     latestBatchLog.delete()
@@ -567,7 +592,7 @@ def audit(request):
     files = [f for f in listdir(proj_data_folder) if isfile(join(proj_data_folder, f))]
     directories = [d for d in listdir(proj_data_folder) if not isfile(join(proj_data_folder,d))]
     seq_files = [f for f in files if len(f.split('.')) == 1]
-    cov_files = [f for f in files if ( (len(f.split('.')) > 1) and (f.split('.')[1] == 'coverage'))]
+    cov_files = [f for f in files if ( (len(f.split('.')) > 1) and (f.split('.')[1] in ['coverage', 'rlecov']))]
     ind_files = [f for f in files if ((len(f.split('.')) > 1) and (f.split('.')[1] == 'index'))]
 
 
@@ -575,7 +600,7 @@ def audit(request):
 
     for f in file_tab:
         try:
-            if (f['file_tag'] + '.coverage') in cov_files:
+            if (f['file_tag'] + '.coverage') in cov_files or (f['file_tag'] + '.rlecov') in cov_files:
                 f['cov'] = 'Y'
             else:
                 f['cov'] = 'N'
@@ -604,10 +629,37 @@ def audit(request):
                               context_instance=RequestContext(request))
 
 def handle_uploaded_files(abspath, files):
+    '''Write uploaded files to abspath, counting VCF file statistics as they go.
+
+    Each gzipped VCF file is decompressed chunk by chunk while it is written,
+    so its statistics (and the check that it is complete) are stored without
+    reading the file again.  Counting the statistics never stops a file being
+    written in full.  Returns a list of (file name, error) for files which
+    failed the check.
+
+    '''
+
+    errors = []
     for i, file in enumerate(files):
+        stream_stats = None
+        if file.name.split('.')[-1] == 'gz' and file.name.split('.')[-2:-1] != ['fasta']:
+            stream_stats = VCFStreamStats(summary_flags=True)
         with open(os.path.join(abspath, file.name), 'wb+') as destination:
             for chunk in file.chunks():
                 destination.write(chunk)
+                if stream_stats is not None:
+                    try:
+                        stream_stats.write(chunk)
+                    except:
+                        log.exception('Error counting VCF file statistics: ' + file.name)
+                        stream_stats = None
+        if stream_stats is not None:
+            if stream_stats.close():
+                record_stats(stream_stats.fingerprint(), stream_stats.accumulator)
+            else:
+                log.warning('Uploaded file failed check: ' + file.name + ' ' + stream_stats.error)
+                errors.append((file.name, stream_stats.error))
+    return errors
 
 
 def preprocess_progress(request):
@@ -694,7 +746,9 @@ def preprocess(request):
             form = chromosome.forms.UploadForm(request.POST, request.FILES)
             if form.is_valid():
                 files = request.FILES.getlist('upload_file_field')
-                handle_uploaded_files(abspath, files)
+                for file_name, error in handle_uploaded_files(abspath, files):
+                    messages.error(request, 'Uploaded file ' + file_name + ' is not a valid gzipped file: ' + error,
+                                   extra_tags='html_safe alert alert-danger')
                 custom_data['files'] = files
                 custom_data['form'] = form
                 if len(files) == 0:
@@ -751,10 +805,7 @@ def preprocess(request):
     directories = [d for d in listdir(mypath) if not isfile(join(mypath, d))]
 
     files_info = []
-    for f in uploaded_files:
-        c_importer = ChromosomeImporter(join(mypath, f))
-        file_info = c_importer.get_info(incl_rec_count=False)
-
+    for file_info in file_catalog.files_info([join(mypath, f) for f in uploaded_files]):
         if 'file_size' in file_info:
             file_info['file_size_MB'] = "%.2fMB" % file_info['file_size']
 
@@ -786,16 +837,11 @@ def preprocess(request):
     custom_data['pending_import_path'] = pending_import_abspath
     pending_import_files = [f for f in listdir(pending_import_abspath) if isfile(join(pending_import_abspath, f))]
 
-    pending_import_files_info = []
-    for f in pending_import_files:
-        c_importer = ChromosomeImporter(join(pending_import_abspath, f))
-        pending_import_file_info = c_importer.get_info(incl_rec_count=False)
-
+    pending_import_files_info = file_catalog.files_info([join(pending_import_abspath, f) for f in pending_import_files])
+    for pending_import_file_info in pending_import_files_info:
         if 'file_size' in pending_import_file_info:
             pending_import_file_info['file_size_MB'] = "%.2fMB" % pending_import_file_info['file_size']
 
-        pending_import_files_info.append(pending_import_file_info)
-
     num_valid_pending_import_files = 0
     for pending_import_f_info in pending_import_files_info:
         if (pending_import_f_info['format'] == 'unknown'):
@@ -837,10 +883,7 @@ def preprocess(request):
                 strain_subdir_files = [f for f in listdir(strain_subdir) if
                                        isfile(join(strain_subdir, f))]
 
-                for f in strain_subdir_files:
-                    c_importer = ChromosomeImporter(join(strain_subdir, f))
-                    preprocessed_file_info = c_importer.get_info(incl_rec_count=False)
-
+                for preprocessed_file_info in file_catalog.files_info([join(strain_subdir, f) for f in strain_subdir_files]):
                     if 'file_size' in preprocessed_file_info:
                         preprocessed_file_info['file_size_MB'] = "%.2fMB" % preprocessed_file_info['file_size']
 
@@ -2,7 +2,7 @@
 
 from django.contrib import admin
 
-from common.models import Species, Strain, Release, Chromosome, StrainSymbol, StrainCollectionInfo, DocumentationType, Documentation, DocumentationAdmin
+from common.models import Species, Strain, Release, Chromosome, StrainSymbol, StrainCollectionInfo, DocumentationType, Documentation, DocumentationAdmin, IPGeolocation, SearchRequestLog
 
 
 admin.site.register(Species)
@@ -13,3 +13,5 @@ admin.site.register(StrainSymbol)
 admin.site.register(StrainCollectionInfo)
 admin.site.register(DocumentationType)
 admin.site.register(Documentation, DocumentationAdmin)
+admin.site.register(IPGeolocation)
+admin.site.register(SearchRequestLog)
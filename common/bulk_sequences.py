@@ -0,0 +1,249 @@
+'''Retrieval of the sequences of many regions and genes in one request.
+
+Pipelines needing the sequences of thousands of regions use the bulk
+sequence endpoint rather than a search per region.  The requested regions
+are grouped by the ChromosomeBase (strain and chromosome) holding them and
+sorted by position, so that each ChromosomeBase's files are opened once for
+all of its regions, and the sequences are generated one at a time so the
+response can be streamed.
+
+A region is given as "chromosome:start-end" (or "chromosome:start..end"),
+and a gene by any of its symbols.  The region of a gene is its span on the
+chromosome, taken from the strain's own gene record where it has one and
+from the reference strain of its release otherwise.
+
+'''
+
+import itertools
+import json
+import re
+
+from django.conf import settings
+
+from chromosome.models import ChromosomeBase
+from common.models import Species
+from gene.models import Gene
+from gene.symbol_index import get_symbol_index
+
+import logging
+log = logging.getLogger(__name__)
+
+
+REGION_RE = re.compile(
+  r'^(?P<chromosome>[^:\s]+):(?P<start>[0-9]+)(?:-|\.\.)(?P<end>[0-9]+)$')
+
+FASTA_LINE_LENGTH = 75
+
+
+class BulkQueryError(ValueError):
+    '''Raised for an invalid bulk sequence query.'''
+    pass
+
+
+def parse_region(region):
+    '''Return (region, chromosome name, start, end) for a region string.'''
+
+    match = REGION_RE.match(region.strip())
+    if match is None:
+        raise BulkQueryError('Invalid region: %s' % region)
+    start = int(match.group('start'))
+    end = int(match.group('end'))
+    if start < 1 or end < start:
+        raise BulkQueryError('Invalid region: %s' % region)
+    return (region.strip(), match.group('chromosome'), start, end)
+
+
+def _unique(values):
+    '''Return the non-blank values, stripped, without duplicates, in order.'''
+
+    seen = set()
+    unique = []
+    for value in values:
+        value = value.strip()
+        if value and value not in seen:
+            seen.add(value)
+            unique.append(value)
+    return unique
+
+
+class BulkQuery(object):
+    '''A request for the sequences of many regions and genes.
+
+    The sequences of each region and gene are found in every strain of the
+    requested species (given by symbol).  Genes, and the chromosomes of
+    regions, which can't be found are listed in errors rather than failing
+    the query.  Queries for more than BULK_SEQUENCE_MAX_REGION_BASES bases in
+    a region, or BULK_SEQUENCE_MAX_BASES bases in all (over every strain),
+    are refused.
+
+    '''
+
+    def __init__(self, regions=(), genes=(), species=()):
+        regions = _unique(regions)
+        genes = _unique(genes)
+        species = _unique(species)
+
+        if not regions and not genes:
+            raise BulkQueryError('No regions or genes given')
+        max_items = getattr(settings, 'BULK_SEQUENCE_MAX_ITEMS', 10000)
+        if len(regions) + len(genes) > max_items:
+            raise BulkQueryError('Too many regions and genes (maximum %s)' %
+              max_items)
+        if not species:
+            raise BulkQueryError('No species given')
+
+        self.errors = []
+        self.species = list(Species.objects.filter(symbol__in=species))
+        unknown_species = set(species) - set(s.symbol for s in self.species)
+        if unknown_species:
+            raise BulkQueryError('Unknown species: %s' %
+              ', '.join(sorted(unknown_species)))
+
+        # Regions by chromosome name, as (start, end, region).
+        self._regions = {}
+        max_region_bases = getattr(settings, 'BULK_SEQUENCE_MAX_REGION_BASES',
+          1000000)
+        for region, chromosome_name, start, end in [parse_region(r) for r in
+          regions]:
+            if end + 1 - start > max_region_bases:
+                raise BulkQueryError('Region too large: %s (maximum %s bases)'
+                  % (region, max_region_bases))
+            self._regions.setdefault(chromosome_name, []).append(
+              (start, end, region))
+        self._find_genes(genes)
+        self._check_chromosome_bases()
+
+    def _find_genes(self, symbols):
+        '''Look up the spans of the genes with symbols in one query.'''
+
+        # Gene spans as (start, end, symbol) by strain (for strain specific
+        # gene records) and release (for the reference strains' records), and
+        # then by chromosome name.
+        self._strain_genes = {}
+        self._release_genes = {}
+        # The symbols with a strain specific gene record, by strain.
+        self._strain_symbols = {}
+        if not symbols:
+            return
+
+        codes = {}
+        matches = get_symbol_index().resolve(symbols)
+        for symbol in symbols:
+            match = matches[symbol]
+            if match is None:
+                self.errors.append('Unknown gene: %s' % symbol)
+                continue
+            for code in match.all_symbols:
+                codes.setdefault(code, []).append(symbol)
+
+        found = set()
+        for import_code, strain_id, is_reference, release_id, \
+          chromosome_name, start, end in Gene.objects.filter(
+            import_code__in=codes.keys()).values_list('import_code',
+            'strain__id', 'strain__is_reference', 'strain__release__id',
+            'chromosome__name', 'start_position', 'end_position'):
+            for symbol in codes[import_code]:
+                found.add(symbol)
+                self._strain_genes.setdefault(strain_id, {}).setdefault(
+                  chromosome_name, []).append((start, end, symbol))
+                self._strain_symbols.setdefault(strain_id, set()).add(symbol)
+                if is_reference:
+                    self._release_genes.setdefault(release_id, {}).setdefault(
+                      chromosome_name, []).append((start, end, symbol))
+
+        self.errors.extend(['No gene records for: %s' % symbol for symbol in
+          symbols if matches[symbol] is not None and symbol not in found])
+
+    def _check_chromosome_bases(self):
+        '''Check the bases the query would return.
+
+        The chromosomes of regions which no strain has data for are listed
+        in errors, and BulkQueryError is raised if there are too many bases.
+
+        '''
+
+        max_bases = getattr(settings, 'BULK_SEQUENCE_MAX_BASES', 50000000)
+        total = 0
+        found = set()
+        for cb in self.chromosome_bases():
+            found.add(cb.chromosome.name)
+            total += sum([end + 1 - start for start, end, name in
+              self.regions_in(cb)])
+            if total > max_bases:
+                raise BulkQueryError('Too many bases requested (maximum %s)' %
+                  max_bases)
+
+        self.errors.extend(['Unknown chromosome: %s' % name for name in
+          sorted(set(self._regions) - found)])
+
+    def _chromosome_names(self):
+        '''Return the names of the chromosomes any region or gene is on.'''
+
+        names = set(self._regions)
+        for genes in self._strain_genes.values() + self._release_genes.values():
+            names.update(genes)
+        return names
+
+    def chromosome_bases(self):
+        '''Return the ChromosomeBases holding any of the regions or genes.'''
+
+        return ChromosomeBase.objects.filter(
+          chromosome__name__in=self._chromosome_names(),
+          strain__species__in=self.species).select_related(
+          'strain__species', 'strain__release', 'chromosome').order_by(
+          'chromosome__name', '-strain__is_reference', 'strain__species__id',
+          'strain__name')
+
+    def regions_in(self, cb):
+        '''Return the (start, end, region or gene) in cb, sorted by start.'''
+
+        chromosome_name = cb.chromosome.name
+        regions = list(self._regions.get(chromosome_name, []))
+        regions.extend(self._strain_genes.get(cb.strain_id, {}).get(
+          chromosome_name, []))
+        strain_symbols = self._strain_symbols.get(cb.strain_id, set())
+        regions.extend([gene for gene in self._release_genes.get(
+          cb.strain.release_id, {}).get(chromosome_name, [])
+          if gene[2] not in strain_symbols])
+        regions.sort()
+        return regions
+
+    def sequences(self):
+        '''Generator which returns a dict describing each sequence found.'''
+
+        for cb in self.chromosome_bases():
+            regions = self.regions_in(cb)
+            if not regions:
+                continue
+            if cb.missing_data():
+                log.warning('Missing chromosomebase data: %s' % cb)
+                continue
+
+            release_name = '' if cb.strain.release is None else \
+              cb.strain.release.name
+            all_bases = cb.regions_bases([(start, end) for start, end, name in
+              regions])
+            for (start, end, name), bases in itertools.izip(regions,
+              all_bases):
+                yield {'query': name, 'species': cb.strain.species.symbol,
+                  'strain': cb.strain.name, 'release': release_name,
+                  'chromosome': cb.chromosome.name, 'start': start, 'end': end,
+                  'header': '%s|%s' % (cb.fasta_header(start, end), name),
+                  'bases': bases}
+
+    def json_chunks(self):
+        '''Generator which returns the sequences as a JSON document, in parts.'''
+
+        yield '{"errors": %s, "sequences": [' % json.dumps(self.errors)
+        for i, sequence in enumerate(self.sequences()):
+            yield (',' if i else '') + json.dumps(sequence)
+        yield ']}'
+
+    def fasta_chunks(self):
+        '''Generator which returns the sequences as FASTA text, in parts.'''
+
+        for sequence in self.sequences():
+            bases = sequence['bases']
+            yield '%s\n%s\n' % (sequence['header'], '\n'.join(
+              [bases[i:i + FASTA_LINE_LENGTH] for i in
+              range(0, len(bases), FASTA_LINE_LENGTH)]))
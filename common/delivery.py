@@ -0,0 +1,414 @@
+'''Packaging and serving of deliveries (batch gene results and data exports).
+
+Deliveries are written straight into PSEUDOBASE_DELIVERY_ROOT, compressed as
+they are produced: a DeliveryZip streams each entry into a deflate compressed
+zip, and a DeliveryGzip writes a single gzipped file (e.g. a ".fa.gz").  Both
+are written to a ".part" file which is only renamed into place once it is
+complete, so a partial delivery is never served.  Data can also be
+compressed separately (e.g. by worker processes, see Deflater) and then
+added to a delivery without being compressed again.  The compression level is
+the PSEUDOBASE_DELIVERY_COMPRESSION_LEVEL setting (zlib's 1 to 9, default 6).
+
+Deliveries are downloaded through serve_delivery_file, which supports HTTP
+Range requests.  If the PSEUDOBASE_DELIVERY_SENDFILE setting is
+'x-sendfile' (Apache's mod_xsendfile, lighttpd) or 'x-accel-redirect'
+(nginx, with the internal location of the delivery directory given by the
+PSEUDOBASE_DELIVERY_ACCEL_PREFIX setting), sending the file is handed over
+to the web server instead.
+
+'''
+
+import binascii
+import mimetypes
+import os
+import re
+import struct
+import time
+import urllib
+import zipfile
+import zlib
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+
+import logging
+log = logging.getLogger(__name__)
+
+
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Size of the chunks files are read in when serving them.
+SERVE_CHUNK_SIZE = 65536
+
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+# The header (magic, method, flags, mtime, extra flags, OS) and trailer
+# (CRC-32, size) of a gzip member.
+GZIP_HEADER = struct.Struct('<BBBBIBB')
+GZIP_TRAILER = struct.Struct('<II')
+
+
+def compression_level(level=None):
+    '''Return level, or the configured delivery compression level.'''
+
+    if level is None:
+        level = getattr(settings, 'PSEUDOBASE_DELIVERY_COMPRESSION_LEVEL',
+          DEFAULT_COMPRESSION_LEVEL)
+    return level
+
+
+def delivery_path(relative_path):
+    '''Return the full path of a delivery file, creating its directory.'''
+
+    path = os.path.join(settings.PSEUDOBASE_DELIVERY_ROOT, relative_path)
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return path
+
+
+class _Delivery(object):
+    '''Base class for delivery files written via a ".part" file.'''
+
+    def __init__(self, relative_path):
+        self.path = delivery_path(relative_path)
+        self.partial_path = '%s.part' % self.path
+
+    def _close_file(self):
+        raise NotImplementedError
+
+    def close(self):
+        '''Finish the delivery, moving it into place.'''
+
+        self._close_file()
+        os.rename(self.partial_path, self.path)
+
+    def abort(self):
+        '''Abandon the delivery, removing what has been written so far.'''
+
+        try:
+            self._close_file()
+        except:
+            log.exception('Error closing delivery: ' + self.partial_path)
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Deflater(object):
+    '''Raw deflate compresses data to output, keeping its CRC-32 and sizes.
+
+    Compressed data can be put in a zip entry or gzip member as is, so work
+    can be compressed in parallel (e.g. to files, see deflate_to_file) and
+    then assembled into a delivery by DeliveryZip.write_compressed or
+    DeliveryGzip.write_compressed.
+
+    '''
+
+    def __init__(self, output, level=None):
+        self.output = output
+        self._compressor = zlib.compressobj(compression_level(level),
+          zlib.DEFLATED, -15)
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+
+    def write(self, data):
+        '''Compress data.'''
+
+        self.file_size += len(data)
+        self.crc = binascii.crc32(data, self.crc) & 0xffffffff
+        self._write_output(self._compressor.compress(data))
+
+    def _write_output(self, data):
+        self.compress_size += len(data)
+        self.output.write(data)
+
+    def flush(self):
+        '''Finish the compressed data.'''
+        self._write_output(self._compressor.flush())
+
+
+def deflate_to_file(chunks, path, level=None):
+    '''Compress the strings chunks to path, returning (CRC-32, size).'''
+
+    f = open(path, 'wb')
+    try:
+        deflater = Deflater(f, level)
+        for chunk in chunks:
+            deflater.write(chunk)
+        deflater.flush()
+    finally:
+        f.close()
+    return deflater.crc, deflater.file_size
+
+
+def _copy_file(path, output):
+    '''Copy the file at path to output, returning the number of bytes.'''
+
+    copied = 0
+    f = open(path, 'rb')
+    try:
+        while True:
+            data = f.read(SERVE_CHUNK_SIZE)
+            if not data:
+                break
+            output.write(data)
+            copied += len(data)
+    finally:
+        f.close()
+    return copied
+
+
+class _ZipEntry(object):
+    '''An entry being written into a DeliveryZip (see DeliveryZip.open).'''
+
+    def __init__(self, zip_file, name, level, size_hint):
+        self._zip_file = zip_file
+        self._zinfo = zipfile.ZipInfo(name, time.localtime()[:6])
+        self._zinfo.compress_type = zipfile.ZIP_DEFLATED
+        self._zinfo.external_attr = 0644 << 16L
+        self._zinfo.file_size = size_hint
+        self._zinfo.header_offset = zip_file.fp.tell()
+        self._zinfo.CRC = 0
+        self._zinfo.compress_size = 0
+        zip_file._writecheck(self._zinfo)
+        zip_file._didModify = True
+
+        # The header is written again with the real sizes and CRC once the
+        # entry is complete, so it must be the same size both times.
+        self._zip64 = size_hint * 1.05 > zipfile.ZIP64_LIMIT
+        zip_file.fp.write(self._zinfo.FileHeader(self._zip64))
+        self._deflater = Deflater(zip_file.fp, level)
+
+    def write(self, data):
+        '''Add data to the entry.'''
+        self._deflater.write(data)
+
+    def close(self):
+        '''Finish the entry.'''
+
+        self._deflater.flush()
+        self.finish(self._deflater.crc, self._deflater.file_size,
+          self._deflater.compress_size)
+
+    def finish(self, crc, file_size, compress_size):
+        '''Finish the entry, given the details of the data written.'''
+
+        if not self._zip64 and max(file_size,
+          compress_size) > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile(
+              'Entry too large without a size hint: ' + self._zinfo.filename)
+        self._zinfo.file_size = file_size
+        self._zinfo.compress_size = compress_size
+        self._zinfo.CRC = crc
+
+        fp = self._zip_file.fp
+        position = fp.tell()
+        fp.seek(self._zinfo.header_offset)
+        fp.write(self._zinfo.FileHeader(self._zip64))
+        fp.seek(position)
+        self._zip_file.filelist.append(self._zinfo)
+        self._zip_file.NameToInfo[self._zinfo.filename] = self._zinfo
+
+
+class DeliveryZip(_Delivery):
+    '''A deflate compressed zip delivery, written an entry at a time.
+
+    Entries are compressed as they are written (at level, or the configured
+    delivery compression level), so they never need to be held in memory or
+    written anywhere else first.  Only one entry can be written at a time.
+
+    '''
+
+    def __init__(self, relative_path, level=None):
+        super(DeliveryZip, self).__init__(relative_path)
+        self.level = compression_level(level)
+        self._zip_file = zipfile.ZipFile(self.partial_path, 'w',
+          zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def open(self, name, size_hint=0):
+        '''Start a new entry, returning an object to write() it with.
+
+        The entry must be closed before the next is opened.  size_hint is
+        the expected size of the entry, which must be given for entries of
+        more than 4GB.
+
+        '''
+
+        return _ZipEntry(self._zip_file, name, self.level, size_hint)
+
+    def write(self, name, data):
+        '''Add an entry holding data.'''
+
+        entry = self.open(name, len(data))
+        entry.write(data)
+        entry.close()
+
+    def write_compressed(self, name, path, crc, file_size):
+        '''Add an entry from a file of raw deflate compressed data.
+
+        crc and file_size are the CRC-32 and size of the uncompressed data
+        (as returned by deflate_to_file).
+
+        '''
+
+        entry = _ZipEntry(self._zip_file, name, self.level, file_size)
+        entry.finish(crc, file_size, _copy_file(path, self._zip_file.fp))
+
+    def write_compressed_data(self, name, data, crc, file_size):
+        '''Add an entry holding raw deflate compressed data.'''
+
+        entry = _ZipEntry(self._zip_file, name, self.level, file_size)
+        self._zip_file.fp.write(data)
+        entry.finish(crc, file_size, len(data))
+
+    def _close_file(self):
+        self._zip_file.close()
+
+
+class DeliveryGzip(_Delivery):
+    '''A gzipped delivery of a single file (e.g. a ".fa.gz").
+
+    The file is written as one or more gzip members (which gzip readers treat
+    as a single stream): one for the data written, and one for each file of
+    compressed data added.
+
+    '''
+
+    def __init__(self, relative_path, level=None):
+        super(DeliveryGzip, self).__init__(relative_path)
+        self.level = compression_level(level)
+        self._file = open(self.partial_path, 'wb')
+        self._deflater = None
+
+    def _write_member_header(self):
+        self._file.write(GZIP_HEADER.pack(0x1f, 0x8b, zlib.DEFLATED, 0,
+          int(time.time()), 0, 255))
+
+    def _write_member_trailer(self, crc, file_size):
+        self._file.write(GZIP_TRAILER.pack(crc, file_size & 0xffffffff))
+
+    def _end_member(self):
+        if self._deflater is not None:
+            self._deflater.flush()
+            self._write_member_trailer(self._deflater.crc,
+              self._deflater.file_size)
+            self._deflater = None
+
+    def write(self, data):
+        '''Add data to the file.'''
+
+        if self._deflater is None:
+            self._write_member_header()
+            self._deflater = Deflater(self._file, self.level)
+        self._deflater.write(data)
+
+    def write_compressed(self, path, crc, file_size):
+        '''Add a file of raw deflate compressed data (see DeliveryZip).'''
+
+        self._end_member()
+        self._write_member_header()
+        _copy_file(path, self._file)
+        self._write_member_trailer(crc, file_size)
+
+    def _close_file(self):
+        if not self._file.closed:
+            self._end_member()
+            self._file.close()
+
+
+def _file_range(path, start, length):
+    '''Generator returning length bytes of the file at path from start.'''
+
+    f = open(path, 'rb')
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(length, SERVE_CHUNK_SIZE))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def _requested_range(range_header, size):
+    '''Return the (first, last) bytes requested by a Range header.
+
+    Returns None if the whole file should be served (there is no header, or
+    it isn't a single byte range), and raises ValueError if the range can't
+    be satisfied.
+
+    '''
+
+    match = RANGE_RE.match(range_header or '')
+    if match is None or not (match.group('start') or match.group('end')):
+        return None
+    if match.group('start'):
+        first = int(match.group('start'))
+        last = int(match.group('end')) if match.group('end') else size - 1
+    else:
+        # A suffix range: the last n bytes.
+        first = max(size - int(match.group('end')), 0)
+        last = size - 1
+    last = min(last, size - 1)
+    if first > last:
+        raise ValueError('Unsatisfiable range')
+    return first, last
+
+
+def serve_delivery_file(request, path):
+    '''Return a response downloading the delivery file at path.'''
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    stat = os.stat(path)
+    sendfile = getattr(settings, 'PSEUDOBASE_DELIVERY_SENDFILE', None)
+
+    if sendfile == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    elif sendfile == 'x-accel-redirect':
+        relative_path = os.path.relpath(path,
+          os.path.realpath(settings.PSEUDOBASE_DELIVERY_ROOT))
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = '%s%s' % (getattr(settings,
+          'PSEUDOBASE_DELIVERY_ACCEL_PREFIX', '/protected_delivery/'),
+          urllib.quote(relative_path.replace(os.sep, '/')))
+    else:
+        try:
+            requested_range = _requested_range(request.META.get('HTTP_RANGE'),
+              stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % stat.st_size
+            return response
+
+        if requested_range is None:
+            first, last = 0, stat.st_size - 1
+            response = StreamingHttpResponse(
+              _file_range(path, 0, stat.st_size), content_type=content_type)
+        else:
+            first, last = requested_range
+            response = StreamingHttpResponse(
+              _file_range(path, first, last + 1 - first),
+              content_type=content_type, status=206)
+            response['Content-Range'] = 'bytes %s-%s/%s' % (first, last,
+              stat.st_size)
+        response['Content-Length'] = str(last + 1 - first)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Content-Disposition'] = 'attachment; filename="%s"' % \
+      os.path.basename(path)
+    return response
@@ -0,0 +1,176 @@
+'''Logging of search requests and background geolocation of their IPs.
+
+Search views only record the IP address and query of each request (as a
+SearchRequestLog), which costs a single insert.  The geolocate_search_requests
+command, run periodically from cron, then resolves the IP addresses of
+pending requests in batches.  The details of each IP address are kept in the
+IPGeolocation table, which acts as a persistent cache: an address is only
+looked up again once its details are IP_GEOLOCATION_MAX_AGE_DAYS old.
+
+An address the endpoint fails for (it can't be reached, answers with an error
+other than 404, or sends an invalid response) stays pending, but isn't looked
+up again until IP_GEOLOCATION_RETRY_MINUTES have passed, doubling with each
+failure (up to MAX_RETRY_DOUBLINGS times).  Addresses which have failed the
+fewest times are looked up first, so failing ones can't hold up the rest.
+
+The lookup endpoint is the IP_GEOLOCATION_URL setting, a URL with %s in
+place of the IP address which returns the details as JSON (any URL urllib2
+can open will do, so a file:// URL can stand in for the real service).
+
+'''
+
+import datetime
+import httplib
+import json
+import urllib2
+
+import django.utils.timezone
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.query import QuerySet
+
+import logging
+log = logging.getLogger(__name__)
+
+
+DEFAULT_GEOLOCATION_URL = 'https://ipapi.co/%s/json/'
+
+# The delay before looking up a failed address again doubles at most this
+# many times.
+MAX_RETRY_DOUBLINGS = 10
+
+
+def request_ip_address(request):
+    '''Return the IP address a request came from.'''
+
+    if request.environ.get('HTTP_X_FORWARDED_FOR') is None:
+        return request.environ['REMOTE_ADDR']
+    return request.environ['HTTP_X_FORWARDED_FOR']
+
+
+def _query_value(value):
+    '''Return value (e.g. from a form's cleaned_data) in a JSON friendly form.'''
+
+    if isinstance(value, dict):
+        return dict((k, _query_value(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple, QuerySet)):
+        return [_query_value(v) for v in value]
+    if isinstance(value, (basestring, int, long, float, bool)) or value is None:
+        return value
+    return unicode(value)
+
+
+def log_search_request(request, search_type, query):
+    '''Queue a search request for geolocation, returning its IP address.
+
+    query describes what was searched for, e.g. the cleaned_data of the
+    search form.  Failing to record the request never fails the search
+    itself.
+
+    '''
+
+    from common.models import SearchRequestLog
+
+    ip_address = request_ip_address(request)
+    try:
+        SearchRequestLog.objects.create(ip_address=ip_address,
+          search_type=search_type, query=json.dumps(_query_value(query)),
+          requested_at=django.utils.timezone.now())
+    except:
+        log.exception('Error logging search request from: ' + ip_address)
+    return ip_address
+
+
+def lookup_ip_details(ip_address):
+    '''Return the geolocation details of ip_address from the lookup endpoint.
+
+    Returns {} if the endpoint doesn't have any (answers 404), and raises
+    IOError if it can't be reached, answers with any other error (such as
+    429 or 5xx), or sends an invalid or incomplete response.
+
+    '''
+
+    url = getattr(settings, 'IP_GEOLOCATION_URL', DEFAULT_GEOLOCATION_URL)
+    timeout = getattr(settings, 'IP_GEOLOCATION_TIMEOUT', 10)
+    try:
+        response = urllib2.urlopen(url % urllib2.quote(ip_address),
+          timeout=timeout)
+        try:
+            return json.loads(response.read())
+        finally:
+            response.close()
+    except urllib2.HTTPError as e:
+        if e.code != 404:
+            raise
+        log.warning('No geolocation for %s: HTTP %s' % (ip_address, e.code))
+        return {}
+    except ValueError:
+        raise IOError('Invalid geolocation response for %s' % ip_address)
+    except httplib.HTTPException as e:
+        raise IOError('Bad geolocation response for %s: %r' % (ip_address, e))
+
+
+def _retry_later(ip_address, now):
+    '''Put off looking up ip_address again after a failed lookup.'''
+
+    from common.models import SearchRequestLog
+
+    pending = SearchRequestLog.objects.pending().filter(ip_address=ip_address)
+    attempts = (pending.aggregate(Max('geolocation_attempts'))[
+      'geolocation_attempts__max'] or 0) + 1
+    delay = datetime.timedelta(minutes=getattr(settings,
+      'IP_GEOLOCATION_RETRY_MINUTES', 10) * 2 ** min(attempts - 1,
+      MAX_RETRY_DOUBLINGS))
+    pending.update(geolocation_attempts=attempts,
+      geolocation_retry_at=now + delay)
+
+
+def geolocate_pending(batch_size=None):
+    '''Resolve the IP addresses of a batch of pending search requests.
+
+    Up to batch_size distinct IP addresses (the IP_GEOLOCATION_BATCH_SIZE
+    setting by default) are resolved, from the IPGeolocation cache where
+    possible.  Addresses which can't be looked up are left pending, to be
+    retried later.  Returns the number of search requests resolved.
+
+    '''
+
+    from common.models import IPGeolocation, SearchRequestLog
+
+    if batch_size is None:
+        batch_size = getattr(settings, 'IP_GEOLOCATION_BATCH_SIZE', 100)
+    max_age = datetime.timedelta(
+      days=getattr(settings, 'IP_GEOLOCATION_MAX_AGE_DAYS', 30))
+    now = django.utils.timezone.now()
+
+    pending = SearchRequestLog.objects.pending()
+    retrying = pending.filter(geolocation_retry_at__gt=now).values_list(
+      'ip_address', flat=True)
+    ip_addresses = [row['ip_address'] for row in pending.exclude(
+      ip_address__in=retrying).values('ip_address').annotate(
+      attempts=Max('geolocation_attempts')).order_by('attempts',
+      'ip_address')[:batch_size]]
+
+    cached = dict((g.ip_address, g) for g in
+      IPGeolocation.objects.filter(ip_address__in=ip_addresses))
+
+    resolved = 0
+    for ip_address in ip_addresses:
+        geolocation = cached.get(ip_address)
+        if geolocation is None or now - geolocation.looked_up_at > max_age:
+            try:
+                details = lookup_ip_details(ip_address)
+            except IOError as e:
+                log.warning('Geolocation lookup failed for %s: %s' % (
+                  ip_address, e))
+                _retry_later(ip_address, now)
+                continue
+            if geolocation is None:
+                geolocation = IPGeolocation(ip_address=ip_address)
+            geolocation.details = json.dumps(details)
+            geolocation.looked_up_at = now
+            geolocation.save()
+
+        resolved += SearchRequestLog.objects.pending().filter(
+          ip_address=ip_address).update(geolocation=geolocation)
+    return resolved
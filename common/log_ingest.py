@@ -0,0 +1,173 @@
+'''Incremental ingestion of the site log files for the logs page.
+
+The logs page lists the searches logged by the search views.  Rather than
+scanning every log file in full on every page view, new lines of the log
+files are parsed into the (indexed) LogEvent table, and the page paginates
+from there.
+
+How far each file has been read is remembered by inode in LogFileState, so
+only lines added since the last ingestion are read.  As the log files are
+rotated by renaming, a file keeps its inode (and so its offset) when it is
+renamed, and a new log file is read from the start.
+
+'''
+
+import datetime
+import os
+import re
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import transaction
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# The event type of log lines containing each marker (checked in order).
+EVENT_MARKERS = [
+    ('_render_chrom_search. Valid form', 'Online Chrom Search'),
+    ('_render_gene_search. Valid form', 'Online Gene Search'),
+    ('JBrowsing to Gene', 'JBrowse to gene'),
+    ('JBrowsing to Chrom', 'JBrowse to chrom region'),
+    ('Submitting gene batch search', 'Batch Gene Search'),
+]
+
+# A line of the "verbose" log format:
+#   asctime [levelname] [module / funcName ] message
+LINE_RE = re.compile(
+  r'^(?P<date>\d{4}-\d\d-\d\d) (?P<time>\d\d:\d\d:\d\d),(?P<ms>\d+) '
+  r'\[[^\]]*\] \[[^\]]*\] (?P<message>.*)$')
+
+# The IP address appended to logged searches (followed, on older lines, by
+# the IP's geolocation details).
+IP_RE = re.compile(r'\s*IP: (?P<ip_address>\S*?)(?: IP Details: .*)?$')
+
+
+def log_directory():
+    '''Return the directory holding the log files.'''
+    return os.path.join(settings.BASE_DIR, settings.LOG_FILE_PREFIX)
+
+
+def parse_line(line):
+    '''Return a LogEvent for a log line, or None if it doesn't log a search.'''
+
+    from common.models import LogEvent
+
+    for marker, event_type in EVENT_MARKERS:
+        if marker in line:
+            break
+    else:
+        return None
+
+    match = LINE_RE.match(line)
+    if match is None:
+        return None
+    logged_at = datetime.datetime.strptime('%s %s.%s' % (match.group('date'),
+      match.group('time'), match.group('ms')[:6]), '%Y-%m-%d %H:%M:%S.%f')
+    if settings.USE_TZ:
+        logged_at = django.utils.timezone.make_aware(logged_at,
+          django.utils.timezone.get_default_timezone())
+
+    query = match.group('message')
+    ip_address = ''
+    ip_match = IP_RE.search(query)
+    if ip_match is not None:
+        ip_address = ip_match.group('ip_address')
+        query = query[:ip_match.start()]
+
+    return LogEvent(event_type=event_type, logged_at=logged_at, query=query,
+      ip_address=ip_address[:255])
+
+
+def _file_key(stat, path):
+    '''Return the key identifying a log file across renames.'''
+
+    # Platforms without inodes report 0, so fall back to the path.
+    return str(stat.st_ino) if stat.st_ino else path
+
+
+def ingest_file(path, state):
+    '''Parse the lines of path added since state.offset into LogEvents.
+
+    Returns the number of events added; state is updated (but not saved).
+
+    '''
+
+    from common.models import LogEvent
+
+    if os.path.getsize(path) < state.offset:
+        # Truncated, so start again.
+        state.offset = 0
+
+    events = []
+    f = open(path, 'rb')
+    try:
+        f.seek(state.offset)
+        data = f.read()
+    finally:
+        f.close()
+
+    # A trailing partial line is left for next time.
+    end = data.rfind('\n') + 1
+    for line in data[:end].splitlines():
+        event = parse_line(line.decode('utf-8', 'replace'))
+        if event is not None:
+            events.append(event)
+    LogEvent.objects.bulk_create(events)
+
+    state.path = path
+    state.offset += end
+    return len(events)
+
+
+def ingest_logs():
+    '''Ingest the new lines of every log file, returning the events added.'''
+
+    from common.models import LogFileState
+
+    directory = log_directory()
+    if not os.path.isdir(directory):
+        return 0
+
+    seen = set()
+    added = 0
+
+    transaction.commit_unless_managed()
+    transaction.enter_transaction_management()
+    transaction.managed(True)
+    try:
+        # Locking the file states stops concurrent ingestions reading the
+        # same lines twice.
+        states = dict((state.file_key, state) for state in
+          LogFileState.objects.select_for_update())
+
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            key = _file_key(stat, path)
+            seen.add(key)
+
+            state = states.get(key)
+            if state is None:
+                state = LogFileState(file_key=key, offset=0)
+            elif state.path == path and state.offset == stat.st_size:
+                # Nothing new.
+                continue
+
+            added += ingest_file(path, state)
+            state.updated_at = django.utils.timezone.now()
+            state.save()
+
+        # Forget files which have been rotated away.
+        LogFileState.objects.exclude(file_key__in=seen).delete()
+    except:
+        transaction.rollback()
+        transaction.leave_transaction_management()
+        raise
+
+    transaction.commit()
+    transaction.leave_transaction_management()
+    return added
@@ -0,0 +1,46 @@
+'''A custom Django administrative command for geolocating search requests.
+
+Search views only queue the IP address and query of each request; this
+command resolves the geolocation of the queued IP addresses in batches (see
+common.geolocation).  It is designed to be run by cron periodically, e.g.:
+
+  # ./manage.py geolocate_search_requests
+  # ./manage.py geolocate_search_requests --batch-size 50 --batches 5
+
+'''
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from common.geolocation import geolocate_pending
+
+
+class Command(BaseCommand):
+    '''A custom command to geolocate the IP addresses of search requests.'''
+
+    help = 'Resolve the geolocation of queued search request IP addresses.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size',
+                    dest='batch_size',
+                    type='int',
+                    default=None,
+                    help='Number of IP addresses to resolve per batch (default: IP_GEOLOCATION_BATCH_SIZE setting)'),
+        make_option('-n', '--batches',
+                    dest='batches',
+                    type='int',
+                    default=1,
+                    help='Maximum number of batches to resolve'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        total = 0
+        for batch in range(options['batches']):
+            resolved = geolocate_pending(options['batch_size'])
+            total += resolved
+            if not resolved:
+                break
+
+        print('Search requests geolocated: ', total)
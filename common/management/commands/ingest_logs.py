@@ -0,0 +1,26 @@
+'''A custom Django administrative command for ingesting the log files.
+
+The logs page ingests new log lines itself before rendering, but this command
+can be run by cron periodically so that page views rarely have any to do:
+
+  # ./manage.py ingest_logs
+
+'''
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from common.log_ingest import ingest_logs
+
+
+class Command(BaseCommand):
+    '''A custom command to ingest new log lines into the LogEvent table.'''
+
+    help = 'Ingest new lines of the log files for the logs page.'
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        added = ingest_logs()
+        connection.close()
+        print('Log events added: ', added)
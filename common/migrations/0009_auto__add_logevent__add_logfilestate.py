@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'LogEvent'
+        db.create_table(u'common_logevent', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('event_type', self.gf('django.db.models.fields.CharField')(max_length=32, db_index=True)),
+            ('logged_at', self.gf('django.db.models.fields.DateTimeField')(db_index=True)),
+            ('query', self.gf('django.db.models.fields.TextField')()),
+            ('ip_address', self.gf('django.db.models.fields.CharField')(max_length=255, db_index=True)),
+        ))
+        db.send_create_signal(u'common', ['LogEvent'])
+
+        # Adding model 'LogFileState'
+        db.create_table(u'common_logfilestate', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('file_key', self.gf('django.db.models.fields.CharField')(unique=True, max_length=1024)),
+            ('path', self.gf('django.db.models.fields.CharField')(max_length=1024)),
+            ('offset', self.gf('django.db.models.fields.BigIntegerField')(default=0)),
+            ('updated_at', self.gf('django.db.models.fields.DateTimeField')(null=True)),
+        ))
+        db.send_create_signal(u'common', ['LogFileState'])
+
+
+    def backwards(self, orm):
+        # Deleting model 'LogEvent'
+        db.delete_table(u'common_logevent')
+
+        # Deleting model 'LogFileState'
+        db.delete_table(u'common_logfilestate')
+
+
+    models = {
+        u'common.chromosome': {
+            'Meta': {'object_name': 'Chromosome'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'common.documentation': {
+            'Meta': {'object_name': 'Documentation'},
+            'doctype': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.DocumentationType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sequence': ('django.db.models.fields.IntegerField', [], {}),
+            'text': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'common.documentationtype': {
+            'Meta': {'object_name': 'DocumentationType'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'common.ipgeolocation': {
+            'Meta': {'object_name': 'IPGeolocation'},
+            'details': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'looked_up_at': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'common.logevent': {
+            'Meta': {'object_name': 'LogEvent'},
+            'event_type': ('django.db.models.fields.CharField', [], {'max_length': '32', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'logged_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'query': ('django.db.models.fields.TextField', [], {})
+        },
+        u'common.logfilestate': {
+            'Meta': {'object_name': 'LogFileState'},
+            'file_key': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '1024'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'offset': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'path': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True'})
+        },
+        u'common.release': {
+            'Meta': {'object_name': 'Release'},
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '20'})
+        },
+        u'common.searchrequestlog': {
+            'Meta': {'object_name': 'SearchRequestLog'},
+            'geolocation': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.IPGeolocation']", 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'query': ('django.db.models.fields.TextField', [], {}),
+            'requested_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'search_type': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        u'common.species': {
+            'Meta': {'object_name': 'Species'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'symbol': ('django.db.models.fields.CharField', [], {'max_length': '16'})
+        },
+        u'common.strain': {
+            'Meta': {'ordering': "('release__name', 'species__name', '-is_reference')", 'object_name': 'Strain'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_reference': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'release': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Release']", 'null': 'True'}),
+            'species': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Species']"})
+        },
+        u'common.straincollectioninfo': {
+            'Meta': {'object_name': 'StrainCollectionInfo'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'info': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'strain': ('django.db.models.fields.related.OneToOneField', [], {'to': u"orm['common.Strain']", 'unique': 'True', 'on_delete': 'models.PROTECT'}),
+            'year': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'common.strainsymbol': {
+            'Meta': {'object_name': 'StrainSymbol'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'strain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Strain']"}),
+            'symbol': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['common']
\ No newline at end of file
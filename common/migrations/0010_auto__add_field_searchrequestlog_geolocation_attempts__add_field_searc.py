@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'SearchRequestLog.geolocation_attempts'
+        db.add_column(u'common_searchrequestlog', 'geolocation_attempts',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'SearchRequestLog.geolocation_retry_at'
+        db.add_column(u'common_searchrequestlog', 'geolocation_retry_at',
+                      self.gf('django.db.models.fields.DateTimeField')(db_index=True, null=True, blank=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'SearchRequestLog.geolocation_attempts'
+        db.delete_column(u'common_searchrequestlog', 'geolocation_attempts')
+
+        # Deleting field 'SearchRequestLog.geolocation_retry_at'
+        db.delete_column(u'common_searchrequestlog', 'geolocation_retry_at')
+
+
+    models = {
+        u'common.chromosome': {
+            'Meta': {'object_name': 'Chromosome'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'common.documentation': {
+            'Meta': {'object_name': 'Documentation'},
+            'doctype': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.DocumentationType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'sequence': ('django.db.models.fields.IntegerField', [], {}),
+            'text': ('django.db.models.fields.TextField', [], {'blank': 'True'})
+        },
+        u'common.documentationtype': {
+            'Meta': {'object_name': 'DocumentationType'},
+            'code': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'common.ipgeolocation': {
+            'Meta': {'object_name': 'IPGeolocation'},
+            'details': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'looked_up_at': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'common.logevent': {
+            'Meta': {'object_name': 'LogEvent'},
+            'event_type': ('django.db.models.fields.CharField', [], {'max_length': '32', 'db_index': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'logged_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'query': ('django.db.models.fields.TextField', [], {})
+        },
+        u'common.logfilestate': {
+            'Meta': {'object_name': 'LogFileState'},
+            'file_key': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '1024'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'offset': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'path': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True'})
+        },
+        u'common.release': {
+            'Meta': {'object_name': 'Release'},
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '20'})
+        },
+        u'common.searchrequestlog': {
+            'Meta': {'object_name': 'SearchRequestLog'},
+            'geolocation': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.IPGeolocation']", 'null': 'True', 'blank': 'True'}),
+            'geolocation_attempts': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'geolocation_retry_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'ip_address': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'query': ('django.db.models.fields.TextField', [], {}),
+            'requested_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'search_type': ('django.db.models.fields.CharField', [], {'max_length': '32'})
+        },
+        u'common.species': {
+            'Meta': {'object_name': 'Species'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'symbol': ('django.db.models.fields.CharField', [], {'max_length': '16'})
+        },
+        u'common.strain': {
+            'Meta': {'ordering': "('release__name', 'species__name', '-is_reference')", 'object_name': 'Strain'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_reference': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'release': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Release']", 'null': 'True'}),
+            'species': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Species']"})
+        },
+        u'common.straincollectioninfo': {
+            'Meta': {'object_name': 'StrainCollectionInfo'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'info': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'strain': ('django.db.models.fields.related.OneToOneField', [], {'to': u"orm['common.Strain']", 'unique': 'True', 'on_delete': 'models.PROTECT'}),
+            'year': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True', 'blank': 'True'})
+        },
+        u'common.strainsymbol': {
+            'Meta': {'object_name': 'StrainSymbol'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'strain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Strain']"}),
+            'symbol': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['common']
\ No newline at end of file
@@ -261,6 +261,21 @@ class ImportLog(models.Model):
         self.run_microseconds = (86400 * td.days + td.seconds) * \
           1000000 + td.microseconds
         return self.run_microseconds
+
+    @classmethod
+    def data_version(cls):
+        '''Return a version stamp of the data imported with this kind of log.
+
+        The stamp changes whenever an import finishes (or a resumed import
+        saves its progress).  Returns None if there have been no imports.
+
+        '''
+
+        latest = cls.objects.order_by('-end', '-pk').values_list('pk',
+          'end')[:1]
+        if not latest:
+            return None
+        return '%s:%s' % (latest[0][0], latest[0][1].isoformat())
   
     class Meta:
         '''Define Django-specific metadata.'''
@@ -337,6 +352,79 @@ class BatchProcess(models.Model):
         '''Define Django-specific metadata.'''
         abstract = True
 
+class IPGeolocation(models.Model):
+    '''The geolocation details of an IP address (see common.geolocation).'''
+
+    ip_address = models.CharField(max_length=255, unique=True)
+    # The details returned by the geolocation endpoint, as JSON.
+    details = models.TextField()
+    looked_up_at = models.DateTimeField()
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return self.ip_address
+
+    def details_dict(self):
+        '''Return the geolocation details as a dict.'''
+        return json.loads(self.details)
+
+
+class SearchRequestLogManager(models.Manager):
+
+    def pending(self):
+        '''Return the search requests which haven't been geolocated yet.'''
+        return self.filter(geolocation__isnull=True)
+
+
+class SearchRequestLog(models.Model):
+    '''A search request, queued for geolocation of its IP address.'''
+
+    ip_address = models.CharField(max_length=255, db_index=True)
+    search_type = models.CharField(max_length=32)
+    # What was searched for, as JSON.
+    query = models.TextField()
+    requested_at = models.DateTimeField(db_index=True)
+    geolocation = models.ForeignKey(IPGeolocation, null=True, blank=True)
+    # Failed lookups of the IP address, and when it may be looked up again.
+    geolocation_attempts = models.IntegerField(default=0)
+    geolocation_retry_at = models.DateTimeField(null=True, blank=True,
+      db_index=True)
+
+    objects = SearchRequestLogManager()
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return '%s %s %s' % (self.requested_at, self.search_type,
+          self.ip_address)
+
+
+class LogFileState(models.Model):
+    '''How far a log file has been ingested (see common.log_ingest).'''
+
+    # The file's inode (or path, where there are no inodes).
+    file_key = models.CharField(max_length=1024, unique=True)
+    path = models.CharField(max_length=1024)
+    offset = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return '%s (%s bytes)' % (self.path, self.offset)
+
+
+class LogEvent(models.Model):
+    '''A search logged in the log files, as shown on the logs page.'''
+
+    event_type = models.CharField(max_length=32, db_index=True)
+    logged_at = models.DateTimeField(db_index=True)
+    query = models.TextField()
+    ip_address = models.CharField(max_length=255, db_index=True)
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return '%s %s' % (self.logged_at, self.event_type)
+
+
 class DocumentationType(models.Model):
     code        = models.CharField(max_length=50)
     description = models.CharField(max_length=255)
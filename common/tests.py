@@ -1,5 +1,22 @@
+import gzip
+import httplib
+import json
+import os
+import shutil
+import tempfile
+import urllib2
+import zipfile
+
 from django.test import TestCase
+from django.test.client import Client, RequestFactory
+from django.test.utils import override_settings
 from common.models import Species,Strain,StrainCollectionInfo
+from common.models import IPGeolocation, SearchRequestLog
+from common import geolocation
+from common.geolocation import geolocate_pending, log_search_request
+from common.models import LogEvent, LogFileState
+from common.log_ingest import ingest_logs
+from common.delivery import DeliveryGzip, DeliveryZip
 
 class SpeciesTests(TestCase):
 
@@ -66,4 +83,226 @@ class StrainTests(TestCase):
             self.assertEquals(strain.formatted_info,'just a test strain, collected: 1976, somewhere')
             
         except Exception as e:
-               self.fail('Strain info test failed: ' + str(e))
\ No newline at end of file
+               self.fail('Strain info test failed: ' + str(e))
+
+
+class GeolocationTests(TestCase):
+
+    def setUp(self):
+        # A local stub of the geolocation endpoint.
+        self.stub_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.stub_dir, '10.0.0.1.json'), 'w') as f:
+            f.write(json.dumps({'country_name': 'Australia'}))
+        self.settings_override = override_settings(
+            IP_GEOLOCATION_URL='file://' + self.stub_dir + '/%s.json')
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.stub_dir)
+
+    def _search(self, ip_address):
+        request = RequestFactory().post('/', REMOTE_ADDR=ip_address)
+        species = Species.objects.create(name='just a test', symbol='SYM')
+        return log_search_request(request, 'gene',
+            {'gene': 'bcd', 'species': Species.objects.filter(pk=species.pk)})
+
+    def test_log_search_request(self):
+        self.assertEquals(self._search('10.0.0.1'), '10.0.0.1')
+        search = SearchRequestLog.objects.get()
+        self.assertEquals(json.loads(search.query),
+            {'gene': 'bcd', 'species': ['just a test (SYM)']})
+        self.assertEquals(search.geolocation, None)
+
+    def test_geolocate_pending(self):
+        self._search('10.0.0.1')
+        self._search('10.0.0.1')
+        self.assertEquals(geolocate_pending(), 2)
+        self.assertEquals(SearchRequestLog.objects.pending().count(), 0)
+        geolocation = IPGeolocation.objects.get(ip_address='10.0.0.1')
+        self.assertEquals(geolocation.details_dict(), {'country_name': 'Australia'})
+
+        # Later requests are resolved from the cache, and requests which can't
+        # be looked up stay pending.
+        os.remove(os.path.join(self.stub_dir, '10.0.0.1.json'))
+        self._search('10.0.0.1')
+        self._search('10.0.0.2')
+        self.assertEquals(geolocate_pending(), 1)
+        self.assertEquals([s.ip_address for s in SearchRequestLog.objects.pending()],
+            ['10.0.0.2'])
+
+    def test_failed_lookups(self):
+        self._search('10.0.0.2')
+        self.assertEquals(geolocate_pending(), 0)
+        search = SearchRequestLog.objects.get()
+        self.assertEquals(search.geolocation_attempts, 1)
+        self.assertTrue(search.geolocation_retry_at is not None)
+
+        # Failed addresses aren't looked up again until their retry time, nor
+        # do they hold up other addresses.
+        with open(os.path.join(self.stub_dir, '10.0.0.2.json'), 'w') as f:
+            f.write(json.dumps({'country_name': 'Chile'}))
+        self._search('10.0.0.1')
+        self.assertEquals(geolocate_pending(batch_size=1), 1)
+        self.assertEquals(geolocate_pending(), 0)
+
+        SearchRequestLog.objects.update(geolocation_retry_at=None)
+        self.assertEquals(geolocate_pending(), 1)
+        self.assertEquals(SearchRequestLog.objects.pending().count(), 0)
+
+    def test_lookup_errors(self):
+        urlopen = urllib2.urlopen
+        def failing_urlopen(url, timeout=None):
+            raise urllib2.HTTPError(url, self.code, 'Error', {}, None)
+        urllib2.urlopen = failing_urlopen
+        try:
+            # Only a 404 means there are no details.
+            self.code = 404
+            self.assertEquals(geolocation.lookup_ip_details('10.0.0.3'), {})
+            for self.code in (429, 503):
+                self.assertRaises(IOError, geolocation.lookup_ip_details,
+                    '10.0.0.3')
+
+            # A broken response fails the lookup too.
+            def broken_urlopen(url, timeout=None):
+                raise httplib.BadStatusLine('')
+            urllib2.urlopen = broken_urlopen
+            self.assertRaises(IOError, geolocation.lookup_ip_details, '10.0.0.3')
+        finally:
+            urllib2.urlopen = urlopen
+
+
+class LogIngestTests(TestCase):
+
+    CHROM_LINE = ('2021-03-04 05:06:07,089 [INFO] [views / _render_chromosome_search ] '
+        'In _render_chrom_search. Valid form.. Chr: 2 From: 1 To: 100 Aligned?: False '
+        'Species: []IP: 10.0.0.1 IP Details: {"country_name": "Australia"}\n')
+    GENE_LINE = ('2021-03-04 05:07:00,000 [INFO] [views / _render_gene_search ] '
+        'In _render_gene_search. Valid form.. Gene: bcd Aligned?: False Species: []IP: 10.0.0.2\n')
+
+    def setUp(self):
+        self.base_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.base_dir, 'logs'))
+        self.log_path = os.path.join(self.base_dir, 'logs', 'site.log')
+        self.settings_override = override_settings(BASE_DIR=self.base_dir,
+            LOG_FILE_PREFIX='logs/')
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.base_dir)
+
+    def _append(self, text, path=None):
+        with open(path or self.log_path, 'a') as f:
+            f.write(text)
+
+    def test_ingest_logs(self):
+        self._append(self.CHROM_LINE + '2021-03-04 05:06:08,000 [INFO] [views / index ] Posting\n')
+        self.assertEquals(ingest_logs(), 1)
+        event = LogEvent.objects.get()
+        self.assertEquals((event.event_type, event.ip_address),
+            ('Online Chrom Search', '10.0.0.1'))
+        self.assertTrue(event.query.endswith('Species: []'))
+        self.assertEquals(event.logged_at.minute, 6)
+
+        # Only new (complete) lines are read.
+        self._append(self.GENE_LINE + self.GENE_LINE[:20])
+        self.assertEquals(ingest_logs(), 1)
+        self.assertEquals(ingest_logs(), 0)
+        self._append(self.GENE_LINE[20:])
+        self.assertEquals(ingest_logs(), 1)
+
+        # A rotated file keeps its offset; the new file is read from the start.
+        os.rename(self.log_path, self.log_path + '.1')
+        self._append(self.GENE_LINE)
+        self.assertEquals(ingest_logs(), 1)
+        self.assertEquals(LogEvent.objects.count(), 4)
+        self.assertEquals(LogFileState.objects.count(), 2)
+
+    def test_logs_page(self):
+        self._append(self.CHROM_LINE + self.GENE_LINE)
+        with self.settings(LOGS_PER_PAGE=1):
+            response = Client().get('/logs/', {'page': 2})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([e.event_type for e in response.context['logs']],
+            ['Online Chrom Search'])
+
+
+class DeliveryTests(TestCase):
+
+    def setUp(self):
+        self.delivery_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            PSEUDOBASE_DELIVERY_ROOT=self.delivery_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.delivery_root)
+
+    def test_zip(self):
+        with DeliveryZip('tag/results.zip', level=9) as r_zip:
+            r_zip.write('results/a.txt', 'ACGT' * 1000)
+            entry = r_zip.open('results/b.txt')
+            for i in range(100):
+                entry.write('TTGCA' * 100)
+            entry.close()
+            self.assertFalse(os.path.exists(r_zip.path))
+
+        results = zipfile.ZipFile(os.path.join(self.delivery_root, 'tag', 'results.zip'))
+        self.assertEquals(results.testzip(), None)
+        self.assertEquals(results.read('results/a.txt'), 'ACGT' * 1000)
+        self.assertEquals(results.read('results/b.txt'), 'TTGCA' * 10000)
+        info = results.getinfo('results/b.txt')
+        self.assertEquals(info.compress_type, zipfile.ZIP_DEFLATED)
+        self.assertTrue(info.compress_size < info.file_size / 10)
+
+    def test_abort(self):
+        try:
+            with DeliveryGzip('results.fa.gz') as delivery:
+                delivery.write('>header\n')
+                raise ValueError('Export failed')
+        except ValueError:
+            pass
+        self.assertEquals(os.listdir(self.delivery_root), [])
+
+    def test_download(self):
+        with DeliveryGzip('tag/results.fa.gz') as delivery:
+            delivery.write('>header\nACGT\n')
+        data = open(delivery.path, 'rb').read()
+        self.assertEquals(gzip.open(delivery.path).read(), '>header\nACGT\n')
+        client = Client()
+
+        response = client.get('/delivery/tag/results.fa.gz', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(''.join(response.streaming_content), data)
+        self.assertEquals(response['Accept-Ranges'], 'bytes')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response = client.get('/delivery/tag/results.fa.gz', HTTP_RANGE='bytes=2-5')
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(''.join(response.streaming_content), data[2:6])
+        self.assertEquals(response['Content-Range'], 'bytes 2-5/%s' % len(data))
+
+        response = client.get('/delivery/tag/results.fa.gz', HTTP_RANGE='bytes=-4')
+        self.assertEquals(''.join(response.streaming_content), data[-4:])
+        response = client.get('/delivery/tag/results.fa.gz', HTTP_RANGE='bytes=%s-' % len(data))
+        self.assertEquals(response.status_code, 416)
+
+        self.assertEquals(client.get('/delivery/tag/nothing.zip').status_code, 404)
+        self.assertEquals(client.get('/delivery/tag/../../etc/x.gz').status_code, 404)
+
+    def test_sendfile(self):
+        with DeliveryGzip('tag/results.fa.gz') as delivery:
+            delivery.write('ACGT')
+        client = Client()
+
+        with self.settings(PSEUDOBASE_DELIVERY_SENDFILE='x-sendfile'):
+            response = client.get('/delivery/tag/results.fa.gz')
+        self.assertEquals(response['X-Sendfile'], os.path.realpath(delivery.path))
+        self.assertEquals(response.content, '')
+
+        with self.settings(PSEUDOBASE_DELIVERY_SENDFILE='x-accel-redirect',
+                PSEUDOBASE_DELIVERY_ACCEL_PREFIX='/internal/'):
+            response = client.get('/delivery/tag/results.fa.gz')
+        self.assertEquals(response['X-Accel-Redirect'], '/internal/tag/results.fa.gz')
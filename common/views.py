@@ -1,16 +1,20 @@
 '''Views for the common application.'''
 
+import hashlib
 import os
+import re
 
 import django.utils.timezone
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.conf import settings
 from django.contrib.sites.models import RequestSite
-from django.http import Http404
+from django.http import Http404, HttpResponseBadRequest, HttpResponseNotModified, \
+  StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
 from django.utils.datastructures import MultiValueDict
-from django.core.cache import get_cache
-import urllib
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.utils.cache import patch_cache_control
 
 # for jbrowse rest api
 from django.http import HttpResponse
@@ -18,46 +22,26 @@ import json
 
 import gene.forms
 import chromosome.forms
+from chromosome.kmers import find_sequence
 from chromosome.models import ChromosomeBase
+from chromosome.stats import ChromosomeStats, summarize
+from chromosome.coverage import coverage_range
+from chromosome.variable_sites import variable_columns
+from gene.interval_index import get_interval_index
 from gene.models import Gene, GeneSymbol, GeneBatchProcess
-from common.models import Species, Strain, Chromosome, Documentation
-from os import listdir
-from os.path import isfile, join
+from gene.symbol_index import get_symbol_index
+from common.bulk_sequences import BulkQuery, BulkQueryError
+from common.delivery import serve_delivery_file
+from common.geolocation import log_search_request
+from common.log_ingest import ingest_logs
+from common.models import Species, Strain, StrainSymbol, Chromosome, Documentation, LogEvent, \
+  Release
 
 import logging
 #logging.basicConfig(filename='test_logging_rbm.log',level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
 
-def get_ip_details(request):
-    def_cache = get_cache('default')
-
-    ip_address = None
-    if request.environ.get('HTTP_X_FORWARDED_FOR') is None:
-        ip_address = request.environ['REMOTE_ADDR']
-    else:
-        ip_address = request.environ['HTTP_X_FORWARDED_FOR']
-
-    cached_ip_dets = def_cache.get('ip_' + ip_address)
-    if cached_ip_dets is None:
-        #result = requests.get(f"http://ip-api.com/json/#{ip_address}")
-        try:
-            response = urllib.urlopen("https://ipapi.co/" + ip_address + "/json/")
-            status_code = response.getcode()
-            if status_code == 200:
-                data = response.read()
-                ip_dets = json.loads(data)
-            else:
-                ip_dets = {}
-            def_cache.set('ip_' + ip_address, json.dumps(ip_dets), 900)
-            return ip_address, ip_dets
-        except:
-            return ip_address, {}
-    else:
-        cached_ip_dets = json.loads(cached_ip_dets)
-        cached_ip_dets['from_cache'] = True
-        return ip_address, cached_ip_dets
-
 def _render_search_forms(request,
   chromosome_form=chromosome.forms.SearchForm(),
   gene_form=gene.forms.SearchForm()):
@@ -87,19 +71,43 @@ def _render_chromosome_search(request):
     custom_data = {}
     form = chromosome.forms.SearchForm(request.POST)
     if form.is_valid():
-        ip_address, ip_details = get_ip_details(request)
-        log.info('In _render_chrom_search. Valid form.. Chr: %s From: %s To: %s Aligned?: %s Species: %s' % (form.cleaned_data['chromosome'].name, form.cleaned_data['position'][0], form.cleaned_data['position'][1], form.cleaned_data['show_aligned'], form.cleaned_data['species']) + 'IP: ' + ip_address + ' IP Details: ' + json.dumps(ip_details) )
+        ip_address = log_search_request(request, 'chromosome', form.cleaned_data)
+        log.info('In _render_chrom_search. Valid form.. Chr: %s From: %s To: %s Aligned?: %s Species: %s' % (form.cleaned_data['chromosome'].name, form.cleaned_data['position'][0], form.cleaned_data['position'][1], form.cleaned_data['show_aligned'], form.cleaned_data['species']) + 'IP: ' + ip_address)
         custom_data['fasta_objects'] = ChromosomeBase.multi_strain_fasta(
           form.cleaned_data['chromosome'],
           form.cleaned_data['species'],
           form.cleaned_data['position'][0],
           form.cleaned_data['position'][1],
           form.cleaned_data['show_aligned'])
+        custom_data['overlapping_genes'] = _overlapping_genes(
+          form.cleaned_data['chromosome'],
+          form.cleaned_data['species'],
+          form.cleaned_data['position'][0],
+          form.cleaned_data['position'][1])
         return render_to_response('chromosome_fasta.html', custom_data,
           context_instance=RequestContext(request))
     log.warning('In _render_chrom_search. Not valid form')
     return _render_search_forms(request, chromosome_form=form)
 
+def _overlapping_genes(chromosome, species, start, end):
+    '''Return (release, genes) for the genes overlapping a chromosome range.
+
+    There is one entry for each release of the strains of species which has
+    genes in the range, each listing the genes (from the gene interval index)
+    sorted by start.
+
+    '''
+
+    overlapping = []
+    index = get_interval_index()
+    for release in Release.objects.filter(
+      strain__species__in=species).distinct().order_by('name'):
+        genes = index.chromosome(release.id, chromosome.id).overlapping_genes(
+          start, end)
+        if genes:
+            overlapping.append((release, genes))
+    return overlapping
+
 def assemble_jbrowse_chromosome_query_data(request):
 
     custom_data = {}
@@ -138,13 +146,7 @@ def assemble_jbrowse_gene_query_data(request):
 
     if form.is_valid():
         try:
-            try:
-                symbol = GeneSymbol.objects.get(symbol=GeneSymbol.normalize(form.cleaned_data['gene']))
-            except:
-                # Try case insensitive
-                symbol = GeneSymbol.objects.get(
-                    symbol__iexact=GeneSymbol.normalize(form.cleaned_data['gene']))
-            flybase_id = symbol.flybase_ID()
+            flybase_id = get_symbol_index().resolve_one(form.cleaned_data['gene']).flybase_id
             strain_genes = Gene.objects.filter(import_code=flybase_id).order_by('-strain__is_reference')
             gene = strain_genes[0]
             custom_data['chr'] = gene.chromosome.name
@@ -195,8 +197,8 @@ def assemble_general_browse_query_data():
 
 def _submit_new_gene_batch(request, form):
     '''Submit a new batch gene search for processing.'''
-    ip_address, ip_details = get_ip_details(request)
-    log.info('Submitting gene batch search. '+ str(form.cleaned_data) + 'IP: ' + ip_address + ' IP Details: ' + json.dumps(ip_details))
+    ip_address = log_search_request(request, 'gene_batch', form.cleaned_data)
+    log.info('Submitting gene batch search. '+ str(form.cleaned_data) + 'IP: ' + ip_address)
     gene_batch = GeneBatchProcess()
     gene_batch.submitted_at = django.utils.timezone.now()
     gene_batch.original_species  = ','.join(
@@ -230,18 +232,12 @@ def _render_gene_search(request):
         return _submit_new_gene_batch(request, form=form)
 
     try:
-        ip_address, ip_details = get_ip_details(request)
-        log.info('In _render_gene_search. Valid form.. Gene: %s Aligned?: %s Species: %s' % (form.cleaned_data['gene'], form.cleaned_data['show_aligned'], form.cleaned_data['species']) + 'IP: ' + ip_address + ' IP Details: ' + json.dumps(ip_details) )
-        gene_symbol = form.cleaned_data['gene']
-        try:
-            symbols = GeneSymbol.objects.get(
-              symbol=GeneSymbol.normalize(form.cleaned_data['gene'])).all_symbols()
-        except:
-            # Try case insensitive
-            symbol_record = GeneSymbol.objects.get(
-                symbol__iexact=GeneSymbol.normalize(form.cleaned_data['gene']))
-            symbols = symbol_record.all_symbols()
-            gene_symbol = symbol_record.symbol
+        ip_address = log_search_request(request, 'gene', form.cleaned_data)
+        log.info('In _render_gene_search. Valid form.. Gene: %s Aligned?: %s Species: %s' % (form.cleaned_data['gene'], form.cleaned_data['show_aligned'], form.cleaned_data['species']) + 'IP: ' + ip_address)
+        symbol_match = get_symbol_index().resolve_one(form.cleaned_data['gene'])
+        if symbol_match is None:
+            raise GeneSymbol.DoesNotExist('No gene symbol: %s' % form.cleaned_data['gene'])
+        gene_symbol = symbol_match.symbol
 
         fasta_objects = Gene.multi_gene_fasta(gene_symbol,
           form.cleaned_data['species'],form.cleaned_data['show_aligned'])
@@ -346,8 +342,8 @@ def index(request):
             form = chromosome.forms.SearchForm(request.POST)
             if form.is_valid():
                 custom_data = assemble_jbrowse_chromosome_query_data(request)
-                ip_address, ip_details = get_ip_details(request)
-                log.info('JBrowsing to Chrom region: %s' % custom_data +  'IP: ' + ip_address + ' IP Details: ' + json.dumps(ip_details))
+                ip_address = log_search_request(request, 'jbrowse_chromosome', form.cleaned_data)
+                log.info('JBrowsing to Chrom region: %s' % custom_data +  'IP: ' + ip_address)
                 return render_to_response('test_jb.html', custom_data,
                                           context_instance=RequestContext(request))
             else:
@@ -356,8 +352,8 @@ def index(request):
             form = gene.forms.SearchForm(request.POST, request.FILES)
             if form.is_valid():
                 custom_data = assemble_jbrowse_gene_query_data(request)
-                ip_address, ip_details = get_ip_details(request)
-                log.info('JBrowsing to Gene: %s' % custom_data + 'IP: ' + ip_address + ' IP Details: ' + json.dumps(ip_details))
+                ip_address = log_search_request(request, 'jbrowse_gene', form.cleaned_data)
+                log.info('JBrowsing to Gene: %s' % custom_data + 'IP: ' + ip_address)
                 return render_to_response('test_jb.html', custom_data,
                                           context_instance=RequestContext(request))
             else:
@@ -447,112 +443,522 @@ def delivery(request, code):
         return render_to_response('gene_delivery_not_ready.html', {}, 
           context_instance=RequestContext(request))
 
-def format_log(log_type, log_line):
-    log_line_data = log_line.split(' ')
-    if len(log_line_data) < 3:
-        formatted_log_line = ['','',' '.join(log_line_data)]
-    else:
-        formatted_log_line = [log_line_data[0], log_line_data[1], log_type, ' '.join(log_line_data[2:])]
-    return formatted_log_line
+
+def delivery_file(request, path):
+    '''Handle downloads of delivered files (see common.delivery).'''
+
+    delivery_root = os.path.realpath(settings.PSEUDOBASE_DELIVERY_ROOT)
+    file_path = os.path.realpath(os.path.join(delivery_root, path))
+    if not file_path.startswith(delivery_root + os.sep) or \
+      not os.path.isfile(file_path):
+        raise Http404
+
+    # Deliveries are already compressed, and compressing them again would
+    # break range requests.
+    request.META.pop('HTTP_ACCEPT_ENCODING', None)
+    return serve_delivery_file(request, file_path)
+
 
 def logs(request):
+    '''Render a page of the searches logged in the log files.
+
+    New log lines are ingested first (see common.log_ingest), so the cost of
+    a page view depends on how much has been logged since the last one rather
+    than on the size of the log files.
+
+    '''
+
     log.info('In logs')
 
-    log_dir = join(settings.BASE_DIR, settings.LOG_FILE_PREFIX)
-    files = [f for f in listdir(log_dir) if isfile(join(log_dir, f))]
-    files_info = []
-
-    custom_data = {'files': files}
-
-    custom_data['logs'] = []
-
-    for f in files:
-        full_name = join(log_dir, f)
-        with open(full_name) as file:
-             data = file.read()
-             data_lines = data.split('\n')
-             print('data: ',len(data_lines))
-             for line in data_lines:
-                 line_data = line.split(' ')
-                 if 'Valid form' in line:
-                    if 'render_chromosome_search' in line:
-                        custom_data['logs'].append(format_log('Online Chrom Search', line))
-                    elif 'render_gene_search' in line:
-                        custom_data['logs'].append(format_log('Online Gene Search', line))
-                 elif 'JBrowsing to Gene' in line:
-                     custom_data['logs'].append(format_log('JBrowse to gene', line))
-                 elif 'JBrowsing to Chrom' in line:
-                     custom_data['logs'].append(format_log('JBrowse to chrom region', line))
-                 elif 'Submitting gene batch search' in line:
-                     custom_data['logs'].append(format_log('Batch Gene Search', line))
-    custom_data['logs'].reverse()
+    try:
+        ingest_logs()
+    except:
+        log.exception('Error ingesting logs')
+
+    paginator = Paginator(LogEvent.objects.order_by('-logged_at', '-id'),
+      getattr(settings, 'LOGS_PER_PAGE', 100))
+    try:
+        page = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        page = paginator.page(1)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
 
+    custom_data = {'page': page, 'logs': page.object_list}
     return render_to_response('logs.html', custom_data,
                               context_instance=RequestContext(request))
 
 
 
-def jb_stats_global(request):
+def _jb_json_response(response_data, max_age=None):
+    '''Return a JBrowse REST API response, cacheable for max_age seconds.'''
 
-    response_data = {"featureDensity": 0.02,"featureCount": 234235,"scoreMin": 87,"scoreMax": 87,"scoreMean": 42,"scoreStdDev": 2.1}
+    response = HttpResponse(json.dumps(response_data),
+      content_type='application/json')
+    if max_age is not None:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
 
-    return HttpResponse(json.dumps(response_data), content_type="application/json")
+def _jb_bad_request(error):
+    '''Return a JBrowse REST API error response.'''
+    return HttpResponseBadRequest(json.dumps({'error': error}),
+      content_type='application/json')
+
+def _jb_window(request):
+    '''Return the (1-based, inclusive) positions of a JBrowse request window.
+
+    JBrowse passes the window as 0-based, half-open start and end parameters.
+    Raises ValueError if they are invalid.
+
+    '''
 
-def jb_get_features(request,ref_name=''):
     start = int(request.GET.get('start', '0'))
     end = int(request.GET.get('end', '0'))
-    strain = request.GET.get('strain', None)
+    if start < 0 or end < start:
+        raise ValueError('Invalid window')
+    return start + 1, end
+
+def _jb_strain(strain_symbol):
+    '''Return the Strain with strain_symbol (or None).'''
+
+    try:
+        return StrainSymbol.objects.get(symbol=strain_symbol.upper()).strain
+    except (AttributeError, StrainSymbol.DoesNotExist):
+        return None
+
+def _jb_chromosome_stats(ref_name, strain_symbol):
+    '''Return the ChromosomeStats of a strain's chromosome (or None).'''
+
+    strain = _jb_strain(strain_symbol)
+    if strain is None:
+        return None
+    cbs = ChromosomeBase.objects.filter(strain=strain,
+      chromosome__name=ref_name)[:1]
+    return ChromosomeStats.for_chromosome_base(cbs[0]) if cbs else None
+
+def jb_stats_global(request):
+    '''Serve the global statistics of a strain to JBrowse.
+
+    These are the variant density and coverage over all the strain's
+    chromosomes, taken from the precomputed stats of each.
+
+    '''
+
+    strain = _jb_strain(request.GET.get('strain', None))
+    all_stats = []
+    if strain is not None:
+        for cb in ChromosomeBase.objects.filter(strain=strain):
+            stats = ChromosomeStats.for_chromosome_base(cb)
+            if stats is not None:
+                all_stats.append(stats)
 
+    totals = [sum([stats.totals[i] for stats in all_stats]) for i in range(3)]
+    response_data = summarize(*(totals +
+      [sum([stats.num_positions for stats in all_stats])]))
+    if all_stats:
+        response_data['scoreMin'] = min([s.coverage_min for s in all_stats])
+        response_data['scoreMax'] = max([s.coverage_max for s in all_stats])
 
+    return _jb_json_response(response_data,
+      max_age=getattr(settings, 'JBROWSE_STATS_CACHE_SECONDS', 3600))
+
+def jb_stats_region(request, ref_name=''):
+    '''Serve the statistics of a strain over a window to JBrowse.'''
+
+    try:
+        start_position, end_position = _jb_window(request)
+    except ValueError:
+        return _jb_bad_request('Invalid window')
+
+    stats = _jb_chromosome_stats(ref_name, request.GET.get('strain', None))
+    if stats is None:
+        response_data = summarize(0, 0, 0, 0)
+    else:
+        response_data = stats.region_stats(start_position, end_position)
+
+    return _jb_json_response(response_data,
+      max_age=getattr(settings, 'JBROWSE_STATS_CACHE_SECONDS', 3600))
+
+def jb_stats_region_feature_densities(request, ref_name=''):
+    '''Serve binned variant counts of a strain over a window to JBrowse.'''
+
+    try:
+        start_position, end_position = _jb_window(request)
+        bases_per_bin = int(request.GET.get('basesPerBin', '0'))
+    except ValueError:
+        return _jb_bad_request('Invalid window')
+    if bases_per_bin <= 0:
+        return _jb_bad_request('Invalid basesPerBin')
+
+    max_bins = getattr(settings, 'JBROWSE_STATS_MAX_BINS', 10000)
+    if (end_position - start_position) // bases_per_bin >= max_bins:
+        return _jb_bad_request('More than %s bins requested' % max_bins)
+
+    stats = _jb_chromosome_stats(ref_name, request.GET.get('strain', None))
+    if stats is None:
+        bins = []
+    else:
+        bins = stats.variant_densities(start_position, end_position,
+          bases_per_bin)
+
+    return _jb_json_response({'bins': bins, 'stats': {
+      'basesPerBin': bases_per_bin, 'max': max(bins) if bins else 0}},
+      max_age=getattr(settings, 'JBROWSE_STATS_CACHE_SECONDS', 3600))
+
+def _jb_chromosome_bases(ref_name, strain_symbol):
+    '''Return the (strain, reference) ChromosomeBases for a JBrowse request.
+
+    Either may be None if it can't be found.
+
+    '''
+
+    strain = _jb_strain(strain_symbol)
     if strain is None:
-        pass
-    elif strain == 'Flg14':
+        return None, None
+
+    chromosome_bases = ChromosomeBase.objects.filter(chromosome__name=ref_name,
+      strain__release=strain.release).select_related('strain')
+    strain_cb = chromosome_bases.filter(strain=strain)[:1]
+    ref_cb = chromosome_bases.filter(strain__is_reference=True)[:1]
+    return (strain_cb[0] if strain_cb else None,
+      ref_cb[0] if ref_cb else None)
+
+def jb_get_features(request,ref_name=''):
+    '''Serve the alignment of a strain to the reference over a window.
 
-    #tst_seq = "AAAACCCGATTGGC"
-    #cig = "14M"
-    #md = "8T5"
+    This is the features endpoint of the JBrowse REST API.  The window is
+    given by the (0-based, half-open) start and end parameters, and the strain
+    by its symbol.  A single feature with the strain's bases, CIGAR and MD
+    strings is computed from the strain and reference ChromosomeBase files.
 
-        ref_seq = "AAAACCCGTTTGGC"
-        tst_start = 23
+    '''
+
+    try:
+        start_position, end_position = _jb_window(request)
+    except ValueError:
+        return _jb_bad_request('Invalid window')
+
+    max_window = getattr(settings, 'JBROWSE_FEATURES_MAX_WINDOW', 500000)
+    if end_position + 1 - start_position > max_window:
+        return _jb_bad_request('Window larger than %s bases' % max_window)
+
+    strain_cb, ref_cb = _jb_chromosome_bases(ref_name,
+      request.GET.get('strain', None))
+    if strain_cb is None or ref_cb is None or strain_cb.missing_data() or \
+      ref_cb.missing_data():
+        return _jb_json_response({'features': []})
+
+    # The data files of a ChromosomeBase never change in place (a re-import
+    # gets a new file tag), so the file tags identify the response.
+    etag = '"%s"' % hashlib.md5('%s:%s:%s:%s' % (strain_cb.file_tag,
+      ref_cb.file_tag, start_position, end_position)).hexdigest()
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        return HttpResponseNotModified()
+
+    features = []
+    alignment = strain_cb.alignment_to(ref_cb, start_position, end_position)
+    if alignment is not None:
+        feature_start = alignment['start_position'] - 1
+        feature_end = alignment['end_position']
+        feature_id = '%s_%s_%s' % (strain_cb.file_tag, feature_start,
+          feature_end)
+        features.append({"type": "match", "name": strain_cb.strain.name,
+          "id": feature_id, "uniqueID": feature_id,
+          "seq": alignment['seq'], "seq_length": len(alignment['seq']),
+          "length_on_ref": feature_end - feature_start, "unmapped": False,
+          "qc_failed": False, "duplicate": False,
+          "secondary_alignment": False, "supplementary_alignment": False,
+          "score": 0, "template_length": 0, "MQ": 0,
+          "start": feature_start, "end": feature_end, "strand": 1,
+          "tags": ["seq", "CIGAR", "MD", "length_on_ref", "seq_length",
+            "unmapped", "qc_failed", "duplicate", "secondary_alignment",
+            "supplementary_alignment", "template_length", "MQ"],
+          "cigar": alignment['cigar'], "md": alignment['md']})
+
+    response = _jb_json_response({'features': features},
+      max_age=getattr(settings, 'JBROWSE_FEATURES_CACHE_SECONDS', 86400))
+    response['ETag'] = etag
+    return response
+
+def jb_coverage_features(request, ref_name=''):
+    '''Serve the coverage of a strain over a window as a JBrowse quantitative track.
+
+    Each feature is a span of positions with the mean coverage as its score
+    (and the minimum and maximum coverage as minScore and maxScore).  Spans
+    are taken from the precomputed coverage zoom levels at the finest
+    resolution giving no more than the requested number of points (the
+    window divided by the basesPerSpan parameter if given, limited by the
+    JBROWSE_COVERAGE_MAX_POINTS setting).
+
+    '''
+
+    try:
+        start_position, end_position = _jb_window(request)
+        bases_per_span = float(request.GET.get('basesPerSpan', '0'))
+    except ValueError:
+        return _jb_bad_request('Invalid window')
+
+    max_points = getattr(settings, 'JBROWSE_COVERAGE_MAX_POINTS', 2000)
+    if bases_per_span > 0:
+        max_points = max(1, min(max_points,
+          int((end_position + 1 - start_position) / bases_per_span)))
+
+    strain_cb = _jb_chromosome_bases(ref_name,
+      request.GET.get('strain', None))[0]
+    if strain_cb is None or strain_cb.missing_data():
+        return _jb_json_response({'features': []})
+
+    etag = '"%s"' % hashlib.md5('coverage:%s:%s:%s:%s' % (strain_cb.file_tag,
+      start_position, end_position, max_points)).hexdigest()
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        return HttpResponseNotModified()
+
+    features = [{'start': b.start_position - 1, 'end': b.end_position,
+      'score': b.mean, 'minScore': b.min, 'maxScore': b.max}
+      for b in coverage_range(strain_cb, start_position, end_position,
+        max_points)]
+
+    response = _jb_json_response({'features': features},
+      max_age=getattr(settings, 'JBROWSE_FEATURES_CACHE_SECONDS', 86400))
+    response['ETag'] = etag
+    return response
+
+def _bulk_query_values(request, name):
+    '''Return the list of values of a bulk sequence query parameter.
+
+    Parameters can be repeated or hold several values separated by commas or
+    whitespace, and can also be given as lists in a POSTed JSON object.
+    Raises BulkQueryError if the JSON isn't such an object.
+
+    '''
+
+    if request.method == 'POST' and \
+      request.META.get('CONTENT_TYPE', '').startswith('application/json'):
+        try:
+            body = json.loads(request.body)
+        except ValueError:
+            raise BulkQueryError('Invalid JSON')
+        if not isinstance(body, dict):
+            raise BulkQueryError('Invalid JSON: not an object')
+        values = body.get(name, [])
+        if isinstance(values, basestring):
+            values = [values]
+        if not isinstance(values, list) or not all(
+          isinstance(value, basestring) for value in values):
+            raise BulkQueryError('Invalid %s: not a list of strings' % name)
+    else:
+        values = request.REQUEST.getlist(name)
+    return [v for value in values for v in re.split(r'[\s,]+', value) if v]
 
-        tst_seq = "AAACCCGATTGAAGC"
+@csrf_exempt
+def bulk_sequences(request):
+    '''Serve the sequences of many regions and genes in one request.
 
-        cig = "1M1D10M2I2M"
-        md = "1^A6T5"
+    The regions, genes and species parameters list the regions (as
+    "chromosome:start-end"), gene symbols and species symbols wanted; the
+    sequences of every strain of the species are streamed back as JSON, or
+    as FASTA if the output parameter is "fasta".  See
+    common.bulk_sequences.
 
-    elif strain == 'ARIZ':
-        ref_seq = "AAAACCCGTTTGGC"
-        tst_start = 23
+    '''
 
-        tst_seq = "AAAATCCGTTTGGC"
+    try:
+        params = dict((name, _bulk_query_values(request, name)) for name in
+          ('regions', 'genes', 'species'))
+        query = BulkQuery(**params)
+    except BulkQueryError as e:
+        return _jb_bad_request(str(e))
 
-        cig = "14M"
-        md = "4C9"
+    ip_address = log_search_request(request, 'bulk_sequences', params)
+    log.info('Bulk sequence request. Species: %s IP: %s' % (
+      ','.join(s.symbol for s in query.species), ip_address))
 
-    elif strain == 'Flg16':
-        ref_seq = "TAGCCCCCCCCCCCCCCCCCCCCCCCCCCCCCA"
-        tst_seq = "TAGCCCCCCCACCCCCCCCCCCCCCCCCCCCCA"
-        tst_start = 45
-        cig = "33M"
-        md = "10C22"
+    if request.REQUEST.get('output', 'json') == 'fasta':
+        return StreamingHttpResponse(query.fasta_chunks(),
+          content_type='text/plain')
+    return StreamingHttpResponse(query.json_chunks(),
+      content_type='application/json')
 
+def variable_sites(request, ref_name=''):
+    '''Serve only the variable sites of some strains over a range.
 
-    tst_end = tst_start + len(ref_seq)
+    The strains parameter lists the strains (by symbol, all of one release)
+    and start and end the (1-based, inclusive) range.  Each site where any
+    of the strains differs from the reference is returned with the bases of
+    the reference and of each strain, from the variable site index (see
+    chromosome.variable_sites).
 
+    '''
 
+    try:
+        start_position = int(request.GET.get('start', '1'))
+        end_position = int(request.GET.get('end', '0'))
+    except ValueError:
+        return _jb_bad_request('Invalid range')
+    if start_position < 1 or end_position < start_position:
+        return _jb_bad_request('Invalid range')
+
+    strains = []
+    for symbol in _bulk_query_values(request, 'strains'):
+        strain = _jb_strain(symbol)
+        if strain is None:
+            return _jb_bad_request('Unknown strain: %s' % symbol)
+        strains.append(strain)
+    if not strains:
+        return _jb_bad_request('No strains given')
+    if len(set(strain.release_id for strain in strains)) != 1:
+        return _jb_bad_request('Strains are not all of one release')
+
+    chromosome_bases = dict((cb.strain_id, cb) for cb in
+      ChromosomeBase.objects.filter(chromosome__name=ref_name,
+      strain__release=strains[0].release).select_related('strain'))
+    references = [cb for cb in chromosome_bases.values()
+      if cb.strain.is_reference]
+    cbs = [chromosome_bases.get(strain.id) for strain in strains]
+    if not references or None in cbs:
+        raise Http404
 
-    if start < tst_end and  end > tst_start:
-        response_data = {
-          "features": [
-            {"type":"match","name":"test","id":"test1","seq": tst_seq, "seq_length":len(tst_seq),"length_on_ref":len(ref_seq),"unmapped":False,"qc_failed":False,"duplicate":False,"secondary_alignment":False,"supplementary_alignment":False,"score":0,"template_length":0,"MQ":0,"start": tst_start, "end":tst_end , "strand":1,"tags":["seq","CIGAR","MD","length_on_ref","seq_length","unmapped","qc_failed","duplicate","secondary_alignment","supplementary_alignment","template_length","MQ"],"cigar":cig, "md":md}
-          ]
-        }
+    log_search_request(request, 'variable_sites', {'chromosome': ref_name,
+      'start': start_position, 'end': end_position,
+      'strains': [strain.name for strain in strains]})
+    try:
+        columns = variable_columns(cbs, references[0], start_position,
+          end_position, getattr(settings, 'VARIABLE_SITES_MAX_SITES', 100000))
+    except ValueError as e:
+        return _jb_bad_request('%s; ask for a smaller range' % e)
+    if columns is None:
+        return HttpResponse(json.dumps({'error':
+          'No variable site index for these strains'}), status=404,
+          content_type='application/json')
+
+    return _jb_json_response({'chromosome': ref_name,
+      'reference': references[0].strain.name,
+      'strains': [strain.name for strain in strains],
+      'start': start_position, 'end': end_position,
+      'columns': [{'position': position, 'reference': ref_bases,
+        'bases': bases} for position, ref_bases, bases in columns]})
+
+
+def sequence_search(request):
+    '''Serve the matches of a short sequence (such as a primer) in strains.
+
+    The sequence parameter gives the sequence and mismatches the number of
+    mismatched bases allowed (defaulting to none).  Both strands of the
+    strains listed by the strains parameter (by symbol) are searched, or of
+    every strain of the release parameter (defaulting to the current
+    release), on the chromosome parameter if given, using their k-mer
+    indexes (see chromosome.kmers).
+
+    '''
+
+    sequence = request.GET.get('sequence', '')
+    try:
+        mismatches = int(request.GET.get('mismatches', '0'))
+    except ValueError:
+        return _jb_bad_request('Invalid number of mismatches')
+
+    cbs = ChromosomeBase.objects.select_related('strain__release',
+      'chromosome')
+    strain_symbols = _bulk_query_values(request, 'strains')
+    if strain_symbols:
+        strains = []
+        for symbol in strain_symbols:
+            strain = _jb_strain(symbol)
+            if strain is None:
+                return _jb_bad_request('Unknown strain: %s' % symbol)
+            strains.append(strain)
+        cbs = cbs.filter(strain__in=strains)
     else:
-        response_data = {
-            "features": [
+        cbs = cbs.filter(strain__release__name=request.GET.get('release',
+          settings.CURRENT_FLYBASE_RELEASE_VERSION))
+    if request.GET.get('chromosome'):
+        cbs = cbs.filter(chromosome__name=request.GET['chromosome'])
+    cbs = [cb for cb in cbs.order_by('-strain__is_reference',
+      'strain__species__id', 'strain__name', 'chromosome__name')
+      if not cb.missing_data()]
+
+    log_search_request(request, 'sequence', {'sequence': sequence,
+      'mismatches': mismatches, 'chromosome': request.GET.get('chromosome'),
+      'strains': [cb.strain.name for cb in cbs]})
+    try:
+        hits, unindexed = find_sequence(cbs, sequence, mismatches,
+          getattr(settings, 'SEQUENCE_SEARCH_MAX_HITS', 10000))
+    except ValueError as e:
+        return _jb_bad_request(str(e))
+
+    return _jb_json_response({'sequence': sequence.strip().upper(),
+      'mismatches': mismatches,
+      'hits': [{'strain': cb.strain.name, 'chromosome': cb.chromosome.name,
+        'position': position, 'strand': strand, 'bases': bases,
+        'mismatches': count} for cb, position, strand, bases, count in hits],
+      'unindexed': ['%s %s' % (cb.strain.name, cb.chromosome.name)
+        for cb in unindexed]})
+
+
+def _indexed_gene_data(gene):
+    '''Return the JSON data of an IndexedGene and its transcripts.'''
+
+    return {'gene': gene.import_code, 'start': gene.start_position,
+      'end': gene.end_position, 'strand': gene.strand,
+      'transcripts': [{'name': mrna.name, 'start': mrna.start_position,
+        'end': mrna.end_position, 'cds': [[start, end] for start, end in
+        mrna.cds]} for mrna in gene.mrnas]}
+
+def genes(request, ref_name=''):
+    '''Serve the genes overlapping a range of a chromosome.
 
-            ]
-        }
+    The start and end parameters give the (1-based, inclusive) range, and
+    release the name of the release (defaulting to the current one).  Each
+    gene overlapping the range is returned with its transcripts and their
+    CDS regions, from the gene interval index (see gene.interval_index).
 
-    return HttpResponse(json.dumps(response_data), content_type="application/json")
+    '''
 
+    try:
+        start_position = int(request.GET.get('start', '1'))
+        end_position = int(request.GET.get('end', '0'))
+    except ValueError:
+        return _jb_bad_request('Invalid range')
+    if start_position < 1 or end_position < start_position:
+        return _jb_bad_request('Invalid range')
+
+    release_name = request.GET.get('release',
+      settings.CURRENT_FLYBASE_RELEASE_VERSION)
+    try:
+        release = Release.objects.get(name=release_name)
+        chromosome = Chromosome.objects.get(name=ref_name)
+    except (Release.DoesNotExist, Chromosome.DoesNotExist):
+        raise Http404
+
+    chromosome_genes = get_interval_index().chromosome(release.id,
+      chromosome.id)
+    return _jb_json_response({'chromosome': ref_name,
+      'release': release.name, 'start': start_position, 'end': end_position,
+      'genes': [_indexed_gene_data(gene) for gene in
+        chromosome_genes.overlapping_genes(start_position, end_position)]})
+
+def gene_region(request, symbol=''):
+    '''Serve the region of a gene (given by any of its symbols).
+
+    The gene is returned with its chromosome, transcripts and CDS regions in
+    each release it has been imported for, from the gene interval index.
+
+    '''
+
+    match = get_symbol_index().resolve_one(symbol)
+    if match is None:
+        raise Http404
+
+    releases = dict(Release.objects.values_list('id', 'name'))
+    chromosomes = dict(Chromosome.objects.values_list('id', 'name'))
+    regions = []
+    for release_id, chromosome_id, gene in \
+      get_interval_index().gene_regions(match.all_symbols):
+        data = _indexed_gene_data(gene)
+        data['release'] = releases.get(release_id)
+        data['chromosome'] = chromosomes[chromosome_id]
+        regions.append(data)
+    if not regions:
+        raise Http404
+    return _jb_json_response({'symbol': match.symbol,
+      'flybase_id': match.flybase_id, 'regions': regions})
@@ -2,11 +2,12 @@
 
 from django.contrib import admin
 
-from gene.models import Gene, GeneSymbol, GeneBatchProcess, MRNA, CDS, GeneImportLog, GeneSymbolImportLog
+from gene.models import Gene, GeneSymbol, GeneSymbolGroup, GeneBatchProcess, MRNA, CDS, GeneImportLog, GeneSymbolImportLog
 
 
 admin.site.register(Gene)
 admin.site.register(GeneSymbol)
+admin.site.register(GeneSymbolGroup)
 admin.site.register(GeneBatchProcess)
 admin.site.register(MRNA)
 admin.site.register(CDS)
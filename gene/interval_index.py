@@ -0,0 +1,311 @@
+'''An in-process interval index of the genes, mRNAs and CDS of chromosomes.
+
+Annotating a chromosome search with the genes it overlaps, or jumping from a
+gene to its region and coding sequences, needs the features overlapping a
+range of positions.  Rather than query the Gene, MRNA and CDS tables for
+every range, the features of a release and chromosome are loaded once per
+process (the first time the chromosome is asked for) into nested containment
+lists, which find the k features overlapping a range in O(log n + k).
+
+A nested containment list sorts intervals by start (and longest first), and
+moves every interval contained in another into a sublist of the interval
+containing it.  The intervals of each list then have increasing ends as well
+as increasing starts, so the first one overlapping a range is found by
+bisecting the ends, and the rest follow it until one starts beyond the range
+(plus those in the sublists of the ones that matched).
+
+The index is versioned by the latest GeneImportLog, like the gene symbol
+index (see gene.symbol_index), so each process starts a new one the next
+time it notices a gene import has finished since it was started.  The import
+logs are only checked every INTERVAL_INDEX_CHECK_SECONDS seconds (a setting,
+defaulting to 60).
+
+'''
+
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class NCList(object):
+    '''A nested containment list of (start, end, item) intervals.
+
+    Intervals are inclusive at both ends.
+
+    '''
+
+    def __init__(self, intervals):
+        # Each list is (starts, ends, items, sublists), with sublists holding
+        # the list of the intervals contained in each interval (or None).
+        self._root = ([], [], [], [])
+        self._size = 0
+        # (list, end) of the intervals the next one may be contained in.
+        stack = [(self._root, None)]
+        for start, end, item in sorted(intervals,
+          key=lambda interval: (interval[0], -interval[1])):
+            while stack[-1][1] is not None and stack[-1][1] < end:
+                stack.pop()
+            starts, ends, items, sublists = stack[-1][0]
+            starts.append(start)
+            ends.append(end)
+            items.append(item)
+            sublist = ([], [], [], [])
+            sublists.append(sublist)
+            stack.append((sublist, end))
+            self._size += 1
+        self._prune(self._root)
+
+    def _prune(self, nclist):
+        '''Replace the empty sublists under nclist with None.'''
+
+        pending = [nclist]
+        while pending:
+            sublists = pending.pop()[3]
+            for i, sublist in enumerate(sublists):
+                if sublist[0]:
+                    pending.append(sublist)
+                else:
+                    sublists[i] = None
+
+    def __len__(self):
+        return self._size
+
+    def overlapping(self, start, end):
+        '''Return the (start, end, item) of the intervals overlapping a range.
+
+        The intervals are sorted by start (and longest first).
+
+        '''
+
+        found = []
+        pending = [self._root]
+        while pending:
+            starts, ends, items, sublists = pending.pop()
+            i = bisect.bisect_left(ends, start)
+            while i < len(starts) and starts[i] <= end:
+                found.append((starts[i], ends[i], items[i]))
+                if sublists[i] is not None:
+                    pending.append(sublists[i])
+                i += 1
+        found.sort(key=lambda interval: (interval[0], -interval[1]))
+        return found
+
+
+class IndexedGene(object):
+    '''A gene of the interval index, with its mRNAs and their CDS regions.'''
+
+    __slots__ = ('id', 'import_code', 'start_position', 'end_position',
+      'strand', 'mrnas')
+
+    def __init__(self, id, import_code, start_position, end_position, strand):
+        self.id = id
+        self.import_code = import_code
+        self.start_position = start_position
+        self.end_position = end_position
+        self.strand = strand
+        self.mrnas = []
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return self.import_code
+
+
+class IndexedMRNA(object):
+    '''An mRNA of the interval index, with its (start, end) CDS regions.'''
+
+    __slots__ = ('id', 'name', 'gene', 'cds')
+
+    def __init__(self, id, name, gene):
+        self.id = id
+        self.name = name
+        self.gene = gene
+        self.cds = []
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return self.name
+
+    @property
+    def start_position(self):
+        return min(start for start, end in self.cds)
+
+    @property
+    def end_position(self):
+        return max(end for start, end in self.cds)
+
+
+class ChromosomeGenes(object):
+    '''The genes, mRNAs and CDS regions of a release and chromosome.'''
+
+    def __init__(self, release_id, chromosome_id):
+        self.release_id = release_id
+        self.chromosome_id = chromosome_id
+        self._genes = {}   # import code -> IndexedGene
+
+    def load(self):
+        '''Load the features of the release and chromosome from the database.
+
+        Where strains of the release have their own copy of a gene, the
+        reference strain's is indexed.
+
+        '''
+
+        from gene.models import Gene, CDS
+
+        genes = Gene.objects.filter(strain__release=self.release_id,
+          chromosome=self.chromosome_id)
+        by_id = {}
+        for pk, import_code, start, end, strand in genes.order_by(
+          '-strain__is_reference', 'strain__species__id', 'strain__name',
+          'id').values_list('id', 'import_code', 'start_position',
+          'end_position', 'strand'):
+            if import_code not in self._genes:
+                gene = IndexedGene(pk, import_code, start, end, strand)
+                self._genes[import_code] = gene
+                by_id[pk] = gene
+
+        mrnas = {}
+        for gene_id, mrna_id, name, start, end in CDS.objects.filter(
+          mRNA__gene__in=genes).order_by('mRNA', 'num').values_list(
+          'mRNA__gene', 'mRNA', 'mRNA__name', 'start_position',
+          'end_position'):
+            gene = by_id.get(gene_id)
+            if gene is None:
+                continue
+            mrna = mrnas.get(mrna_id)
+            if mrna is None:
+                mrna = mrnas[mrna_id] = IndexedMRNA(mrna_id, name, gene)
+                gene.mrnas.append(mrna)
+            mrna.cds.append((start, end))
+
+        self.genes = NCList((g.start_position, g.end_position, g) for g in
+          self._genes.itervalues())
+        self.mrnas = NCList((m.start_position, m.end_position, m) for m in
+          mrnas.itervalues())
+        self.cds = NCList((start, end, m) for m in mrnas.itervalues() for
+          start, end in m.cds)
+
+        log.info('Loaded gene interval index of release %s chromosome %s: '
+          '%s genes, %s mRNAs, %s CDS regions' % (self.release_id,
+          self.chromosome_id, len(self.genes), len(self.mrnas),
+          len(self.cds)))
+        return self
+
+    def overlapping_genes(self, start_position, end_position):
+        '''Return the IndexedGenes overlapping a range, sorted by start.'''
+
+        return [gene for start, end, gene in self.genes.overlapping(
+          start_position, end_position)]
+
+    def overlapping_mrnas(self, start_position, end_position):
+        '''Return the IndexedMRNAs overlapping a range, sorted by start.'''
+
+        return [mrna for start, end, mrna in self.mrnas.overlapping(
+          start_position, end_position)]
+
+    def overlapping_cds(self, start_position, end_position):
+        '''Return the (start, end, IndexedMRNA) of the CDS regions
+        overlapping a range, sorted by start.
+
+        '''
+
+        return self.cds.overlapping(start_position, end_position)
+
+    def gene(self, import_code):
+        '''Return the IndexedGene with import_code (or None).'''
+
+        return self._genes.get(import_code)
+
+
+class GeneIntervalIndex(object):
+    '''The ChromosomeGenes of every release and chromosome, loaded lazily.'''
+
+    def __init__(self, version=None):
+        self.version = version
+        self._chromosomes = {}
+        self._lock = threading.Lock()
+
+    def chromosome(self, release_id, chromosome_id):
+        '''Return the ChromosomeGenes of a release and chromosome.'''
+
+        key = (release_id, chromosome_id)
+        chromosome_genes = self._chromosomes.get(key)
+        if chromosome_genes is None:
+            with self._lock:
+                chromosome_genes = self._chromosomes.get(key)
+                if chromosome_genes is None:
+                    chromosome_genes = ChromosomeGenes(release_id,
+                      chromosome_id).load()
+                    self._chromosomes[key] = chromosome_genes
+        return chromosome_genes
+
+    def gene_regions(self, import_codes):
+        '''Return the IndexedGenes with any of import_codes in each release.
+
+        Each is returned as (release id, chromosome id, IndexedGene), sorted
+        by release and chromosome.
+
+        '''
+
+        from gene.models import Gene
+
+        regions = []
+        for release_id, chromosome_id in sorted(set(Gene.objects.filter(
+          import_code__in=import_codes).values_list('strain__release',
+          'chromosome'))):
+            chromosome_genes = self.chromosome(release_id, chromosome_id)
+            for import_code in import_codes:
+                gene = chromosome_genes.gene(import_code)
+                if gene is not None:
+                    regions.append((release_id, chromosome_id, gene))
+        return regions
+
+
+def interval_index_version():
+    '''Return the current version of the gene data (or None).'''
+
+    from gene.models import GeneImportLog
+    return GeneImportLog.data_version()
+
+
+def invalidate_interval_index():
+    '''Make this process start a new gene interval index when next used.
+
+    Other processes start theirs when they notice the import log of the
+    change, so this should be called whenever the gene data changes.
+
+    '''
+
+    global _index
+    with _index_lock:
+        _index = None
+
+
+_index = None
+_index_checked_at = 0
+_index_lock = threading.Lock()
+
+
+def get_interval_index():
+    '''Return this process's gene interval index, replacing it if stale.'''
+
+    global _index, _index_checked_at
+
+    check_seconds = getattr(settings, 'INTERVAL_INDEX_CHECK_SECONDS', 60)
+    index = _index
+    if index is not None and time.time() - _index_checked_at < check_seconds:
+        return index
+
+    with _index_lock:
+        version = interval_index_version()
+        # With no import logs to go by, a started index is kept.
+        if _index is None or (version is not None and
+          _index.version != version):
+            _index = GeneIntervalIndex(version)
+        _index_checked_at = time.time()
+        return _index
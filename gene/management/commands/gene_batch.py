@@ -1,37 +1,99 @@
 '''A custom Django administrative command to process "batch gene" requests.
 
-NOTE: Currently, this is designed to be run by cron periodically.  We may have
-to implement locking or some sort of collision avoidance mechanism.
+NOTE: Currently, this is designed to be run by cron periodically.  Pending
+requests are claimed under a row lock before processing, so overlapping cron
+runs will not process the same request twice.
 
-NOTE: This will scale horribly, and generally be inefficient.  The current 
-usage expectations predict that it shouldn't matter.  If the usage 
-expectations change dramatically, this may have to be altered to use a more 
-distributed, efficient and sane method of batch processing.
+Gene symbols within a request can be resolved and rendered by a pool of worker
+processes (see the --workers option).  Each result is compressed straight
+into the delivery zip (see common.delivery) as it is produced, so no
+intermediate files are created and the current working directory is never
+changed.
 
 '''
 
-import csv
 import datetime
+import itertools
+import multiprocessing
 import os
-import re
-import shutil
-import sys
-import tempfile
-import zipfile
+from optparse import make_option
 
 import django.utils.timezone
 from django.conf import settings
 from django.core.mail import send_mail, mail_managers, EmailMessage
 from django.core.management.base import BaseCommand
-from django.db import connection, transaction
-from django.template.loader import render_to_string
+from django.db import connection
 
-from gene.models import Gene, GeneSymbol, GeneBatchProcess
+from gene.models import Gene, GeneBatchProcess
+from gene.symbol_index import get_symbol_index
+from common.delivery import DeliveryZip
 from common.models import Species
 import logging
 log = logging.getLogger(__name__)
 
 
+# Name of the directory (within the delivery zip) holding all result files.
+RESULTS_DIRECTORY = 'pseudobase_results'
+
+# Number of gene symbols handed to a worker process at a time.
+SYMBOLS_PER_TASK = 8
+
+# Species objects looked up by the current (worker) process, keyed by id.
+_species_cache = {}
+
+
+def _lines_to_text(lines):
+    '''Return lines as a single string, one CRLF-terminated line each.'''
+    return ''.join('%s\r\n' % line for line in lines)
+
+
+def _not_found_message(gene_symbol):
+    '''Return the report message for a gene symbol that couldn't be found.'''
+    return 'Gene symbol "%s" does not exist in Pseudobase.' % gene_symbol
+
+
+def _init_worker():
+    '''Make sure each worker process opens its own database connection.'''
+    connection.close()
+
+
+def _lookup_species(species_ids):
+    '''Return the Species objects for species_ids, caching per process.'''
+
+    for pk in species_ids:
+        if pk not in _species_cache:
+            _species_cache[pk] = Species.objects.get(id=pk)
+    return [_species_cache[pk] for pk in species_ids]
+
+
+def _render_gene_symbol(task):
+    '''Render the multi-FASTA output of a single (resolved) gene symbol.
+
+    task is a (gene_symbol, species_ids, show_aligned) tuple.  This is a
+    module level function so that it can be handed to a multiprocessing pool.
+
+    Returns a dict with the symbol, whether it succeeded, an error message and
+    the rendered text.
+
+    '''
+
+    gene_symbol, species_ids, show_aligned = task
+    result = {'symbol': gene_symbol, 'success': False, 'message': None,
+      'data': None}
+    try:
+        fasta_output = []
+        for h, b in Gene.multi_gene_fasta(gene_symbol,
+          _lookup_species(species_ids), show_aligned=show_aligned):
+            fasta_output.append(h)
+            fasta_output.append('\r\n'.join(b))
+
+        result['data'] = _lines_to_text(fasta_output)
+        result['success'] = True
+    except Exception as e:
+        log.warning('Gene symbol not rendered: ' + gene_symbol + ' error: ' + str(e))
+        result['message'] = _not_found_message(gene_symbol)
+    return result
+
 
 class Command(BaseCommand):
     '''A custom command to process "batch gene" requests.
@@ -43,37 +105,36 @@ class Command(BaseCommand):
     '''
   
     help = 'Process any outstanding "batch gene" requests.'
-  
-    def _setup_work_area(self, results_directory='pseudobase_results'):
-        '''Set up temporary directories for storing any intermediate files.'''
 
-        working_directory = tempfile.mkdtemp()
-        results_directory = os.path.join(working_directory, results_directory)
-        os.mkdir(results_directory)
-        os.chdir(working_directory)
-        return (working_directory,results_directory)
-
-    def _teardown_work_area(self, working_directory):
-        '''Tear down temporary directories created for temporary storage.'''
-        shutil.rmtree(working_directory)
-
-    def _write_file(self, file_name, file_data):
-        '''Write a line to file file_name per line of file_data.'''
-        
-        f = open(file_name, 'w')
-        for line in file_data:
-            f.write('%s\r\n' % line)
-        f.close()
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers',
+                    dest='workers',
+                    type=int,
+                    default=1,
+                    help='Number of worker processes used to render gene '
+                         'symbols (default 1, ie no worker pool)'),
+        make_option('-b', '--batches',
+                    dest='batches',
+                    type=int,
+                    default=None,
+                    help='Max number of pending requests to claim in this '
+                         'run (default all)'),
+    )
+  
+    def _write_entry(self, r_zip, file_name, file_data):
+        '''Write file_data into the results directory of the delivery zip.'''
+        r_zip.write('%s/%s' % (RESULTS_DIRECTORY, file_name), file_data)
 
-    def _write_request(self, request, request_filename='request.txt'):
+    def _write_request(self, r_zip, request, request_filename='request.txt'):
         '''Write a file with data about the original "batch gene" request.'''
-        self._write_file(request_filename, 
-          (g_s.strip() for g_s in request.original_request.split('\n')))
+        self._write_entry(r_zip, request_filename, _lines_to_text(
+          g_s.strip() for g_s in request.original_request.split('\n')))
+
+    def _write_report(self, r_zip, report_text, report_filename='report.txt'):
+        '''Write a report file with data about the processing of the request.'''
+        self._write_entry(r_zip, report_filename,
+          _lines_to_text(report_text))
 
-    def _write_report(self, report_text, report_filename='report.txt'):
-      '''Write a report file with data about the processing of the request.'''
-      self._write_file(report_filename, report_text)
-  
     def _generate_report_text(self, report_data):
         '''Generate the text of the processing report for the request.'''
         
@@ -105,94 +166,90 @@ class Command(BaseCommand):
         
         return report
 
-    def _process_batch_request(self, request):
-        '''Process a "batch gene" request and prepare the results.'''
+    def _resolve_gene_symbols(self, request, gene_status):
+        '''Resolve the gene symbols of request, in request order.
+
+        All symbols are resolved in bulk against the gene symbol index.  The
+        distinct resolved symbols are returned; symbols that can't be resolved
+        are recorded as failures in gene_status.
+
+        '''
+
+        requested = [g_s.strip() for g_s in
+          request.original_request.split('\n') if g_s.strip()]
+        matches = get_symbol_index().resolve(requested)
+
+        gene_symbols = []
+        for g_s in requested:
+            if matches[g_s] is None:
+                log.warning('Gene symbol not found: ' + g_s)
+                gene_status[g_s] = {'success': False,
+                  'message': _not_found_message(g_s)}
+            elif matches[g_s].symbol not in gene_symbols:
+                gene_symbols.append(matches[g_s].symbol)
+        return gene_symbols
+
+    def _process_batch_request(self, request, pool=None):
+        '''Process a "batch gene" request and prepare the results.
+
+        The request is expected to have already been claimed (ie marked as
+        active).  If pool is given, gene symbols are rendered by its worker
+        processes; otherwise they are rendered in this process.
+
+        '''
     
         request_status = {'partial': False}
+        r_zip = None
         try:
-            # Set up our work area.
-            working_directory, results_directory = self._setup_work_area()
-
-            # Indicate that the request is currently being processed.
-            request.start()
-  
             # Used to track gene processing status.
             gene_status = dict()
   
-            # Get the species to process.
-            gene_species = request.original_species.split(',')
-            gene_species = [Species.objects.get(id=pk) for pk in gene_species]
+            # Get the species to process (looking them up here makes sure
+            # the whole request fails early if a species no longer exists).
+            species_ids = [int(pk) for pk in
+              request.original_species.split(',')]
+            _lookup_species(species_ids)
 
             show_aligned = request.show_aligned
 
-            # Get the list (actually a generator) of gene symbols to process.
-            gene_symbols = (g_s.strip() for g_s in \
-              request.original_request.split('\n'))
-  
-            os.chdir(results_directory)
+            # Results are streamed into a partial zip in the delivery area,
+            # which is only renamed into place once it is complete.
+            r_zip = DeliveryZip(os.path.join(request.delivery_tag,
+              settings.PSEUDOBASE_RESULTS_FILENAME))
+
+            tasks = [(gene_symbol, species_ids, show_aligned) for gene_symbol
+              in self._resolve_gene_symbols(request, gene_status)]
+            if pool is None:
+                results = itertools.imap(_render_gene_symbol, tasks)
+            else:
+                results = pool.imap(_render_gene_symbol, tasks,
+                  SYMBOLS_PER_TASK)
+
             # Process each gene.
-            for gene_symbol in gene_symbols:
-                if not gene_symbol: continue
-                gene_status[gene_symbol] = {'success': False, 'message': None}
-                try:
-                    fasta_output = []
-                    try:
-                        symbol_record = GeneSymbol.objects.get(
-                            symbol=GeneSymbol.normalize(gene_symbol))
-                    except:
-                        # Try case insensitive
-                        symbol_record = GeneSymbol.objects.get(
-                            symbol__iexact=GeneSymbol.normalize(gene_symbol))
-                        # Found case-insensitive matching symbol, re-initialise gene_symbol:
-                        del gene_status[gene_symbol]
-                        gene_symbol = symbol_record.symbol
-                        gene_status[gene_symbol] = {'success': False, 'message': None}
-
-                    for h, b in Gene.multi_gene_fasta(gene_symbol, 
-                      gene_species,show_aligned=show_aligned):
-                        fasta_output.append(h)
-                        fasta_output.append('\r\n'.join(b))
-                        
+            for result in results:
+                gene_symbol = result['symbol']
+                gene_status[gene_symbol] = {'success': result['success'],
+                  'message': result['message']}
+                if result['success']:
                     # Save the output to a file with the same name as the 
                     # gene_symbol with a "results" postfix.
-                    self._write_file('%s-results.txt' % gene_symbol, 
-                      fasta_output)
-                    gene_status[gene_symbol]['success'] = True
-                except Exception as e:
-                    log.warning('Gene symbol not found: ' + gene_symbol + ' error: ' + str(e))
+                    self._write_entry(r_zip, '%s-results.txt' % gene_symbol,
+                      result['data'])
+
+            for status in gene_status.values():
+                if not status['success']:
                     request_status['partial'] = True
-                    gene_status[gene_symbol]['message'] = \
-                      'Gene symbol "%s" does not exist in Pseudobase.' % \
-                        gene_symbol
 
             # Output a "report.txt" with information about the processing.
             report_data = self._generate_report_data(gene_status)
             report_text = self._generate_report_text(report_data)
-            self._write_report(report_text)
+            self._write_report(r_zip, report_text)
   
             # Output a "request.txt" with information about the request.
-            self._write_request(request)
+            self._write_request(r_zip, request)
 
-            os.chdir(working_directory)
-            # Zip up the results and associated metadata about the request.
-            r_zip = zipfile.ZipFile(settings.PSEUDOBASE_RESULTS_FILENAME, 'w')
-            for g_f in os.listdir(results_directory):
-                r_zip.write(os.path.join('pseudobase_results', g_f.strip()))
             r_zip.close()
-
-            delivery_path = os.path.join(settings.PSEUDOBASE_DELIVERY_ROOT, 
-              request.delivery_tag)
-
-            # Move the zip into a web-accessible holding area for delivery.
-            try:
-                os.makedirs(delivery_path)
-            except:
-                # This just means the path already exists, which is OK.
-                raise
-            shutil.move(settings.PSEUDOBASE_RESULTS_FILENAME, delivery_path)
-  
-            # Tear down the work area.
-            self._teardown_work_area(working_directory)
+            r_zip = None
     
             # If there were partial failures (of individual genes), mail the 
             # admins.
@@ -226,6 +283,8 @@ class Command(BaseCommand):
             request.stop()
             request.save()
         except Exception as e:
+            if r_zip is not None:
+                r_zip.abort()
             request.stop(batch_status='F')
             request.batch_start = None
             request.batch_end = None
@@ -237,11 +296,41 @@ class Command(BaseCommand):
     def handle(self, **options):
         '''The main entry point for the Django management command.
 
-         Finds all GeneBatchProcess objects that haven't yet been processed
+         Claims GeneBatchProcess objects that haven't yet been processed
          and prepares the results for delivery.
     
         '''
-    
-        for pending_request in GeneBatchProcess.objects.filter(
-          batch_status='P'):  
-            self._process_batch_request(pending_request)
+
+        claimed_requests = GeneBatchProcess.objects.claim_pending_batches(
+          limit=options['batches'])
+        if not claimed_requests:
+            print('No pending gene batches to process')
+            return
+
+        # Load the symbol index up front, so worker processes inherit it.
+        get_symbol_index()
+
+        pool = None
+        if options['workers'] > 1:
+            # Don't let the worker processes inherit our db connection.
+            connection.close()
+            pool = multiprocessing.Pool(options['workers'], _init_worker)
+
+        failed = 0
+        try:
+            for claimed_request in claimed_requests:
+                try:
+                    self._process_batch_request(claimed_request, pool)
+                except Exception:
+                    # Keep going, so other claimed requests aren't left
+                    # stranded in the active state.
+                    log.exception('Gene batch failed: ' + claimed_request.delivery_tag)
+                    failed += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if failed:
+            raise Exception('%s of %s gene batch requests failed' % (failed,
+              len(claimed_requests)))
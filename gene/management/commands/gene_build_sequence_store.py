@@ -0,0 +1,68 @@
+'''A custom Django administrative command for building gene sequence stores.
+
+Gene searches read each strain's gene sequences from a ".genes" sidecar file
+of its ChromosomeBase (see gene.sequence_store).  This command builds them,
+and should be run after strains or genes are imported, e.g.:
+
+  # ./manage.py gene_build_sequence_store
+  # ./manage.py gene_build_sequence_store --missing
+  # ./manage.py gene_build_sequence_store -s FLG14 -c 2
+
+'''
+
+import os
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+
+from chromosome.models import ChromosomeBase
+from gene.sequence_store import build_gene_sequences
+
+
+class Command(BaseCommand):
+    '''A custom command to build the gene sequence stores of strains.'''
+
+    help = 'Build the gene sequence sidecar files of existing chromosome data.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-s', '--strain',
+                    dest='strain_symbols',
+                    default=[],
+                    action='append',
+                    help='Only build stores for this strain symbol (repeatable)'),
+        make_option('-c', '--chromosome',
+                    dest='chromosome_names',
+                    default=[],
+                    action='append',
+                    help='Only build stores for this chromosome (repeatable)'),
+        make_option('-m', '--missing',
+                    dest='missing',
+                    action='store_true',
+                    default=False,
+                    help='Only build stores which do not exist yet'),
+    )
+
+    def handle(self, **options):
+        '''The main entry point for the Django management command.'''
+
+        cbs = ChromosomeBase.objects.select_related('strain', 'chromosome')
+        if options['strain_symbols']:
+            cbs = cbs.filter(strain__strainsymbol__symbol__in=[
+              s.upper() for s in options['strain_symbols']])
+        if options['chromosome_names']:
+            cbs = cbs.filter(chromosome__name__in=options['chromosome_names'])
+
+        built = 0
+        for cb in cbs.order_by('strain__name', 'chromosome__name'):
+            if cb.missing_data():
+                print('Missing chromosomebase data: ', cb)
+                continue
+            if options['missing'] and os.path.exists(
+              cb.gene_sequences_file_path):
+                continue
+
+            print('Building gene sequence store: %s (%s genes)' % (cb,
+              build_gene_sequences(cb)))
+            built += 1
+
+        print('Gene sequence stores built: ', built)
@@ -17,6 +17,9 @@ Field 5: strain code (translate into appropriate full strain name)
 Field 6: bases (sequence data)
   e.g. ATGCGCCGG...
 
+Alternatively, genes (with their mRNAs and CDS regions) can be imported from
+a gzipped GFF3 file (*.gff.gz or *.gff3.gz), which is read as a stream.
+
 '''
 
 import csv
@@ -24,7 +27,6 @@ import os
 import re
 import sys
 import gzip
-import pandas as pd
 
 import django.utils.timezone
 from django.conf import settings
@@ -32,519 +34,273 @@ from django.core.management.base import BaseCommand
 from django.db import connection, transaction
 
 from common.models import Chromosome, StrainSymbol
+from gene.interval_index import invalidate_interval_index
 from gene.models import Gene, GeneImportLog, MRNA, CDS
 
 from optparse import make_option
 
-class GFFReader():
-    def __init__(self,command,fPath,excl_match=True,excl_gold_path = True,chrom_names=None,ignore_fasta=True, limit=None):
-        self.fPath = fPath
-        self.command = command
-        self.excl_match = excl_match
-        self.excl_gold_path = excl_gold_path
-        self.chrom_names = chrom_names
-
-        gff_list = []
-
-        all_chrom_info = {}
+class GFFGene(object):
+    '''A gene read from a GFF3 file, along with its mRNA transcripts.'''
 
-        comments = []
+    __slots__ = ('seqid', 'start', 'end', 'strand', 'import_code',
+      'transcripts')
 
-        fasta_stuff = []
+    def __init__(self, seqid, start, end, strand, import_code):
+        self.seqid = seqid
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.import_code = import_code
+        self.transcripts = []
 
-        fin = gzip.open(self.fPath, 'r')
+    def coding_transcripts(self):
+        '''Return the transcripts of this gene which have CDS regions.'''
+        return [t for t in self.transcripts if t.cds]
 
-        print('Reading gff file')
-        for i, line in enumerate(fin):
 
-            if i % 1000000 == 0:
-                 sys.stdout.write('.')
-                 sys.stdout.flush()
+class GFFTranscript(object):
+    '''An mRNA transcript read from a GFF3 file, along with its CDS regions.'''
 
-            if limit is None:
-                pass
-            else:
-                if i > limit:
-                    break
-
-            line_str = line.decode('utf-8').rstrip()
-            line_parsed = line_str.split('\t')
-
-            if line_parsed[0][:2] == '##':
-                comments.append([i, line_parsed])
-                continue
-            elif len(line_parsed) < 2:
-                if ignore_fasta:
-                    pass
-                else:
-                    fasta_stuff.append([i, line_parsed])
-                continue
+    __slots__ = ('name', 'cds')
 
-            if self.excl_match:
-                if line_parsed[2] == 'match':
-                    continue
+    def __init__(self, name):
+        self.name = name
+        self.cds = []
 
-                if line_parsed[2] == 'match_part':
-                    continue
 
-            if self.excl_gold_path:
-                if line_parsed[2] == 'golden_path_region':
-                    continue  # causes chunk size problems in jbrowse
-
-            if self.chrom_names is None: # incl all
-                gff_list.append(line_parsed)
-            elif line_parsed[0] in self.chrom_names:  # == chrom_name:
-                # print('i: ' + str(i) + ' line: ' + line_str[:150])
-                gff_list.append(line_parsed)
-
-            if line_parsed[2] == 'gene':
-                if line_parsed[0] in all_chrom_info:
-                    all_chrom_info[line_parsed[0]]['num_genes'] += 1
-                    if line_parsed[6] == '+':
-                        all_chrom_info[line_parsed[0]]['num_pos'] += 1
-                    else:
-                        all_chrom_info[line_parsed[0]]['num_neg'] += 1
-                else:
-                    all_chrom_info[line_parsed[0]] = {'num_genes': 1}
-                    if line_parsed[6] == '+':
-                        all_chrom_info[line_parsed[0]]['num_pos'] = 1
-                        all_chrom_info[line_parsed[0]]['num_neg'] = 0
-                    else:
-                        all_chrom_info[line_parsed[0]]['num_neg'] = 1
-                        all_chrom_info[line_parsed[0]]['num_pos'] = 0
-
-        fin.close()
-        df = pd.DataFrame(gff_list,
-                          columns=['seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes'])
-        self.df = df
-        self.all_chrom_info = all_chrom_info
-        self.comments = comments
-        self.fasta_stuff = fasta_stuff
-
-
-    def gleanr(self,name_list):
-        for name in name_list:
-            if name[:11] == 'dpse_GLEANR':
-                return name
-        return ''
-
-
-    def attr_to_name_list(self,attr):
-        attr_list = attr.split(';')
-        #attr_dict = {x.split('=')[0]: x.split('=')[1] for x in attr_list}
-        attr_dict = dict((x.split('=')[0], x.split('=')[1]) for x in attr_list)
-        names = []
-        if 'ID' in attr_dict:
-            names.append(attr_dict['ID'])
-        if 'Name' in attr_dict:
-            names.append(attr_dict['Name'])
-        if 'Alias' in attr_dict:
-            aliases = attr_dict['Alias'].split(',')
-            names.extend(aliases)
-        return names
-
-
-    def attr_split(self,attr):
-        attr_list = attr.split(';')
-        #attr_dict = {x.split('=')[0]: x.split('=')[1] for x in attr_list}
-        attr_dict = dict((x.split('=')[0], x.split('=')[1]) for x in attr_list)
-        all_names = self.attr_to_name_list(attr)
-        import_code = ''
-        # for name in all_names:
-        #     if name[:11] == 'dpse_GLEANR':
-        #         import_code = name
-        #         break
-        if 'ID' in attr_dict:
-            import_code = attr_dict['ID']
-
-        return pd.Series(
-            [attr_dict['ID'] if 'ID' in attr_dict else '', attr_dict['Parent'] if 'Parent' in attr_dict else '',
-             attr_dict['Name'] if 'Name' in attr_dict else '', import_code,
-             attr_dict['Alias'] if 'Alias' in attr_dict else ''])
-
-    def split_attributes(self,df):
-        print(' ')
-        print('Splitting attributes')
-        df_spl = df.copy()
-        df_spl[['ID', 'Parent', 'Name', 'Import_Code', 'Alias']] = df_spl['attributes'].apply(self.attr_split)
-        df_spl.head()
-        return df_spl
-
-
-    def pre_parse(self,df):
-        print('Pre-parsing')
-        parent_dict = {}
-        gene_dict = {}
-        mrna_dict = {}
-
-        i = 0
-        for index, row in df.iterrows():
-
-            if i % 10000 == 0:
-                print('Processing: ', i, ' / ', df.shape[0])
-            i += 1
-
-            if row['type'] == 'gene':
-                if row['ID'] in gene_dict:
-                    print('Dup found: ', row['ID'])
-                else:
-                    gene_dict[row['ID']] = row
-            if row['type'] == 'mRNA':
-                if row['ID'] in mrna_dict:
-                    print('Dup found: ', row['ID'])
-                else:
-                    mrna_dict[row['ID']] = row
+class GFFReader(object):
+    '''A streaming reader of the genes in a gzipped GFF3 file.
 
-            if (row['ID'] == '') or (row['Parent'] == ''):
-                pass
-            else:
-                if row['ID'] in parent_dict:
-                    print('Dup parent rec found: ', row['ID'])
-                else:
-                    parent_dict[row['ID']] = row['Parent']
-
-        self.parent_dict = parent_dict
-        self.gene_dict = gene_dict
-        self.mrna_dict = mrna_dict
-
-    def find_gene(self,parent):
-        # print('finding: ',parent)
-        done = False
-        curr_parent = parent
-        while not done:
-            if curr_parent in self.gene_dict:
-                return curr_parent
-
-            if curr_parent in self.parent_dict:
-                curr_parent = self.parent_dict[curr_parent]
-            else:
-                done = True
-                return None
-
-    def find_mrna(self,parent):
-        # print('finding: ',parent)
-        done = False
-        curr_parent = parent
-        while not done:
-            if curr_parent in self.mrna_dict:
-                return curr_parent
-
-            if curr_parent in self.parent_dict:
-                curr_parent = self.parent_dict[curr_parent]
-            else:
-                done = True
-                return None
+    The file is read in a single pass, building the gene -> mRNA -> CDS
+    hierarchy as it goes.  Each gene is yielded as soon as it closes (ie when
+    the next gene, a different sequence region, a "###" directive or the end
+    of the features is reached), so only one gene is held in memory at a time.
 
-    def allocate_gene_and_mrna_per_record(self,df):
+    Parent features are expected to precede their children (as they do in
+    FlyBase releases).  Features whose parent isn't part of the currently open
+    gene can't be placed, and are only counted (as orphans).
 
-        print('Allocating gene and mrna per record')
-        gene_list = []
-        mrna_list = []
+    '''
 
-        df_new = df.copy()
+    # Genes are saved as the reference strain's genes.
+    REF_STRAIN_SYMBOL = 'MV2-25'
 
-        i = 0
-        for index, row in df.iterrows():
+    # Number of genes saved (and committed) together.
+    GENES_PER_CHUNK = 1000
 
-            if i % 10000 == 0:
-                print('Processing: ', i, ' / ', df.shape[0])
-            i += 1
-
-            if row['type'] == 'gene':
-                gene_list.append(row['ID'])
-                mrna_list.append(None)
-            else:
-                if row['type'] == 'mRNA':
-                    mrna_list.append(row['ID'])
-                else:
-                    if row['Parent'] == '':
-                        mrna_list.append(None)
-                    else:
-                        mrna = self.find_mrna(row['Parent'])
-                        if mrna is None:
-                            mrna_list.append(None)
-                        else:
-                            mrna_list.append(mrna)
-
-                if row['Parent'] == '':
-                    gene_list.append(None)
-                else:
-                    gene = self.find_gene(row['Parent'])
-                    if gene is None:
-                        gene_list.append(None)
-                    else:
-                        gene_list.append(gene)
-
-        df_new['gene'] = gene_list
-        df_new['mrna'] = mrna_list
-        return df_new
-
-    def mrna_rows_for_gene(self,gene_row, mrna_dict):
-        # mrna_dict[row['ID']]= {'Name':row['Name'],'CDS':[]}
-
-        out_rows = []
-        if len(mrna_dict) == 0:
-            out_row = gene_row.copy()
-            out_row['mrna_name'] = ''
-            out_row['CDS'] = []
-            out_rows.append(out_row)
-        else:
-            for mrna_id in mrna_dict:
-                out_row = gene_row.copy()
-                entry = mrna_dict[mrna_id]
-                out_row['mrna_name'] = entry['Name']
-                out_row['CDS'] = entry['CDS']
-                out_rows.append(out_row)
-
-        return out_rows
-
-
-    def find_mrnas_and_cds_per_gene(self,df):
-        gene_list = []
-        gene_cds_regions = []
-
-        mrna_dict = {}
-
-        cds_dict = {}
-
-        in_gene = False
-
-        out_row = None
-
-        gene_import_code = ''
-        gene_row = None
-        first_gene = True
-
-        num_genes = 0
-        num_genes_with_mrna = 0
-        num_genes_with_multi_mrna = 0
-        num_genes_with_CDS = 0
-
-        gene_parents = []
-        gene_id = None
-
-
-        i = 0
-        for index, row in df.iterrows():
-
-            if i % 10000 == 0:
-                #print('\r', 'Processing: ', i, ' / ', df.shape[0], end='')
-                print('Processing: ', i, ' / ', df.shape[0])
-            i += 1
-
-            if row['type'] == 'gene':
-                in_gene = True
-                # print('last gene parents: ',gene_parents)
-                if first_gene:
-                    first_gene = False
-                else:
-                    #             gene_row['mrna_dict'] = mrna_dict
-                    #             gene_list.append(gene_row)
-                    gene_list.extend(self.mrna_rows_for_gene(gene_row, mrna_dict))
-
-                    num_genes += 1
-                    if len(mrna_dict) == 0:
-                        pass
-                    else:
-                        num_genes_with_mrna += 1
-                        if len(mrna_dict) > 1:
-                            num_genes_with_multi_mrna += 1
-                        for mrna_id in mrna_dict:
-                            if len(mrna_dict[mrna_id]['CDS']) > 0:
-                                num_genes_with_CDS += 1
-                                break
-
-                # gene_cds_regions.append([gene_id,gene_import_code,mrna_dict])
-                mrna_dict = {}
-                gene_parents = [row['ID']]
-                #         gene_id = row['ID']
-                #         gene_name = row['Name']
-                #         gene_import_code = row['Import_Code']
-                #         row['parent_gene_id'] = gene_id
-                #         row['parent_gene_name'] = row['Name']
-                #         row['mrna_dict'] = mrna_dict
-                gene_row = row.copy()
-                # gene_list.append(row)
-            else:
-                if row['Parent'] in gene_parents:
-                    # row['parent_gene_id'] = gene_id
-                    # row['parent_gene_name'] = gene_name
-                    if row['ID'] == '':
-                        pass
-                    else:
-                        gene_parents.append(row['ID'])
-                    # gene_list.append(row)
-                    if row['type'] == 'mRNA':
-                        if row['ID'] in mrna_dict:
-                            print('Oh oh - already in: ', row['ID'])
-                        else:
-                            mrna_dict[row['ID']] = {'Name': row['Name'], 'CDS': []}
-
-                    if row['type'] == 'CDS':
-                        if row['Parent'] in mrna_dict:
-                            mrna_dict[row['Parent']]['CDS'].append([row['start'], row['end']])
-
-                        else:
-                            print('Parent mrna not found for: ', row['ID'])
-
-                        if gene_id in cds_dict:
-                            cds_dict[gene_id].append([[row['start'], row['end']]])
-                        else:
-                            cds_dict[gene_id] = [[row['start'], row['end']]]
+    def __init__(self,command,fPath,chrom_names=None,limit=None):
+        self.fPath = fPath
+        self.command = command
+        self.chromosomes = {}
+        # No chromosome names means all chromosomes.
+        self.chrom_names = chrom_names or None
+        self.limit = limit
+
+        self.duplicates = 0
+        self.orphans = 0
+
+    @staticmethod
+    def parse_attributes(attributes):
+        '''Return a dict of the attributes (column 9) of a GFF3 feature.'''
+
+        attr_dict = {}
+        for attr in attributes.split(';'):
+            if '=' in attr:
+                key, value = attr.split('=', 1)
+                attr_dict[key.strip()] = value
+        return attr_dict
+
+    def genes(self):
+        '''Yield a GFFGene for each gene in the file, in file order.'''
+
+        gene = None
+        # Feature ID -> the GFFGene or GFFTranscript that feature belongs to,
+        # for all features of the open gene.
+        owners = {}
+        gene_ids = set()
 
-                else:
-                    pass
-        #           in_gene = False
-        #           gene_parents = []
-        #           gene_id = None
+        fin = gzip.open(self.fPath, 'r')
+        try:
+            for i, line in enumerate(fin):
 
+                if i % 1000000 == 0:
+                    sys.stdout.write('.')
+                    sys.stdout.flush()
 
-        # gene_cds_regions.append([gene_id,gene_import_code,mrna_dict])
-        gene_list.extend(self.mrna_rows_for_gene(gene_row, mrna_dict))
-        num_genes += 1
-        if len(mrna_dict) == 0:
-            pass
-        else:
-            num_genes_with_mrna += 1
-            if len(mrna_dict) > 1:
-                num_genes_with_multi_mrna += 1
-            for mrna_id in mrna_dict:
-                if len(mrna_dict[mrna_id]['CDS']) > 0:
-                    num_genes_with_CDS += 1
+                if self.limit is not None and i > self.limit:
                     break
 
-        df_gene_ids = pd.DataFrame(gene_list)
+                line_str = line.decode('utf-8').rstrip('\r\n')
+
+                if line_str.startswith('#'):
+                    # "###" closes all open features and "##FASTA" ends the
+                    # features altogether.
+                    if line_str.startswith('###') or \
+                      line_str.startswith('##FASTA'):
+                        if gene is not None:
+                            yield gene
+                        gene = None
+                        owners = {}
+                        if line_str.startswith('##FASTA'):
+                            break
+                    continue
 
-        print('Num genes: ',num_genes)
-        print('Num genes with mrna: ',num_genes_with_mrna)
-        print('Num genes with CDS: ',num_genes_with_CDS)
-        print('Num genes with multi mRNA: ',num_genes_with_multi_mrna)
+                line_parsed = line_str.split('\t')
+                if len(line_parsed) < 9:
+                    continue
 
-        return df_gene_ids
+                seqid = line_parsed[0]
+                feature_type = line_parsed[2]
+                if self.chrom_names is not None and \
+                  seqid not in self.chrom_names:
+                    continue
 
+                if gene is not None and (feature_type == 'gene' or
+                  seqid != gene.seqid):
+                    yield gene
+                    gene = None
+                    owners = {}
+
+                attr_dict = self.parse_attributes(line_parsed[8])
+                feature_id = attr_dict.get('ID', '')
+
+                if feature_type == 'gene':
+                    if feature_id in gene_ids:
+                        print('Dup found: ', feature_id)
+                        self.duplicates += 1
+                        continue
+                    gene_ids.add(feature_id)
+                    gene = GFFGene(seqid, int(line_parsed[3]),
+                      int(line_parsed[4]), line_parsed[6], feature_id)
+                    owners[feature_id] = gene
+                    continue
 
-    def write_genes(self,df,import_log):
+                parents = [owners[p] for p in
+                  attr_dict.get('Parent', '').split(',') if p in owners]
+                if not parents:
+                    self.orphans += 1
+                    continue
 
-        ref_strain_symbol = 'MV2-25'
+                if feature_type == 'mRNA':
+                    transcript = GFFTranscript(attr_dict.get('Name', ''))
+                    gene.transcripts.append(transcript)
+                    if feature_id:
+                        owners[feature_id] = transcript
+                elif feature_type == 'CDS':
+                    for parent in parents:
+                        if isinstance(parent, GFFTranscript):
+                            parent.cds.append((int(line_parsed[3]),
+                              int(line_parsed[4])))
+                elif feature_id:
+                    # Any other feature (eg an exon) belongs to whatever its
+                    # parent belongs to.
+                    owners[feature_id] = parents[0]
+
+            if gene is not None:
+                yield gene
+        finally:
+            fin.close()
+
+    def _coding_genes(self, resume_after=None):
+        '''Yield (gene, coding transcripts) for each gene with CDS regions.
+
+        If resume_after is specified, genes up to and including the gene with
+        that import code are skipped.
 
-        df_gene_grouped = df[df['type'] == 'CDS'].groupby(['gene'])
-        for gene_id, gene_records in df_gene_grouped:
-            import_log.gene_count += 1
-            # A simple progress indicator, since processing can take a while.
-            # Show progress after every thousand genes processed.
-            if (import_log.gene_count % (1000)) == 1:
-                sys.stdout.write('.')
-                sys.stdout.flush()
+        '''
 
-            gene_row = self.gene_dict[gene_id]
-            chromosome_name = gene_row['seqid']
-            start_position = int(gene_row['start'])
-            end_position = int(gene_row['end'])
-            import_code = gene_row['Import_Code']
-            strand = gene_row['strand']
-            bases = ''  # Bases are now derived from ChromosomeBase, unless overriddenn here
+        skipping = bool(resume_after)
+        for gene in self.genes():
+            transcripts = gene.coding_transcripts()
+            if not transcripts:
+                continue
+            if skipping:
+                skipping = gene.import_code != resume_after
+                continue
+            yield gene, transcripts
 
-            try:
-                current_g = self._save_gene(chromosome_name, ref_strain_symbol, start_position,
-                                                import_code,strand, bases, end_position=end_position)
-                df_mrna_grouped = gene_records.groupby(['mrna'])
-                for mrna_id, mrna_cds_records in df_mrna_grouped:
-                    mrna_row = self.mrna_dict[mrna_id]
-                    mRNA = self._save_mrna(current_g, mrna_row,mrna_cds_records) # mRNA_name, row['CDS'])
-                    #mRNA_name = row['mrna_name']
-                    # for i, row in mrna_cds_records.iterrows():
-                    #     print('       CDS: ', row['start'], row['end'])
-            except:
-                self.command._rollback_db()
-                raise
+    def write_genes(self,import_log,resume_after=None):
+        '''Save every gene which has CDS regions, with its mRNAs and CDS.
 
-        # current_g = None
-        # for index,row in df.iterrows():
-        #
-        #     if len(row['CDS']) == 0:
-        #         continue
-        #
-        #     import_log.gene_count += 1
-        #     # A simple progress indicator, since processing can take a while.
-        #     # Show progress after every thousand genes processed.
-        #     if (import_log.gene_count % (1000)) == 1:
-        #         sys.stdout.write('.')
-        #         sys.stdout.flush()
-        #
-        #     chromosome_name = row['seqid']
-        #     start_position =  int(row['CDS'][0][0])
-        #     end_position = int(row['CDS'][-1][-1])
-        #     import_code = row['Import_Code']
-        #     mRNA_name = row['mrna_name']
-        #     strand = row['strand']
-        #
-        #     # Process strain.
-        #
-        #     bases = ''  #Bases are now derived from ChromosomeBase, unless overriddenn here
-        #
-        #     try:
-        #         if current_g is not None and current_g.import_code == import_code:
-        #             pass
-        #         else:
-        #             current_g = self._save_gene(chromosome_name, ref_strain_symbol, start_position,
-        #                         import_code, bases,end_position=end_position)
-        #         mRNA = self._save_mrna(current_g, mRNA_name, row['CDS'])
-        #     except:
-        #         self.command._rollback_db()
-        #         raise
-
-    def _save_gene(self, chromosome_name, strain_name, start_position,
-                   import_code, strand, bases, end_position=None):
-        '''Create and save a new gene constructed from the passed data.
-
-        Type coercion can happen here, but any other data munging should
-        occur before this method is called.
+        Genes are saved in chunks of GENES_PER_CHUNK using bulk INSERTs.  Each
+        chunk is committed along with import_log, which records the import
+        code of the last gene saved so that an interrupted import can be
+        resumed.  If resume_after is specified, genes up to and including the
+        gene with that import code are skipped.
 
         '''
 
+        chunk = []
+        for gene, transcripts in self._coding_genes(resume_after):
+            chunk.append((gene, transcripts))
+            if len(chunk) == self.GENES_PER_CHUNK:
+                self._write_chunk(chunk, import_log)
+                chunk = []
+        if chunk:
+            self._write_chunk(chunk, import_log)
 
-        g = Gene()
-        g.strain = self.command._lookup_strain(strain_name)[0]
-        g.chromosome = self.command._lookup_chromosome(chromosome_name)[0]
-        g.start_position = int(start_position)
-        if end_position is None:
-            g.end_position = int(start_position + (len(bases) - 1))
-        else:
-            g.end_position = int(end_position)
-        g.import_code = import_code
-        g.strand = strand
-        g.bases = bases
-        g.save()
-        return g
+        print('')
+        print('Duplicate genes skipped: ', self.duplicates)
+        print('Orphan features skipped: ', self.orphans)
 
-    def _save_cds(self,m,st,end,num):
-        cds = CDS()
-        cds.mRNA = m
-        cds.start_position = st
-        cds.end_position = end
-        cds.num = num
-        cds.save()
+    def _write_chunk(self, chunk, import_log):
+        '''Save and commit a chunk of (gene, coding transcripts) pairs.
 
+        The ids of the new Gene and MRNA rows are assigned up front, so that
+        the rows referring to them can be built before anything is saved.
 
-    def _save_mrna(self, g, mrna_row,mrna_cds_records): # name, cds_ranges):
-        try:
-            mRNA = MRNA()
-            mRNA.name = mrna_row['Name']
-            mRNA.gene = g
-            mRNA.save()
-            num = 0
-            for index, cds_row in mrna_cds_records.iterrows():
-               # print('       CDS: ', row['start'], row['end'])
-               # for i,cds_range in enumerate(cds_ranges):
-                num += 1
-                self._save_cds(mRNA,int(cds_row['start']),int(cds_row['end']),num)
-
+        '''
 
+        ref_strain = self.command._lookup_strain(self.REF_STRAIN_SYMBOL)[0]
+        bases = ''  # Bases are now derived from ChromosomeBase, unless overriddenn here
 
+        try:
+            next_gene_id = Gene.objects.next_id()
+            next_mrna_id = MRNA.objects.next_id()
+
+            genes = []
+            mrnas = []
+            cds_regions = []
+            for gene, transcripts in chunk:
+                if gene.seqid not in self.chromosomes:
+                    self.chromosomes[gene.seqid] = \
+                      self.command._lookup_chromosome(gene.seqid)[0]
+                g = Gene(id=next_gene_id, strain=ref_strain,
+                  chromosome=self.chromosomes[gene.seqid],
+                  start_position=gene.start, end_position=gene.end,
+                  import_code=gene.import_code, strand=gene.strand,
+                  bases=bases)
+                genes.append(g)
+                next_gene_id += 1
+
+                for transcript in transcripts:
+                    mrnas.append(MRNA(id=next_mrna_id, name=transcript.name,
+                      gene_id=g.id))
+                    for num, (start, end) in enumerate(transcript.cds, 1):
+                        cds_regions.append(CDS(mRNA_id=next_mrna_id,
+                          start_position=start, end_position=end, num=num))
+                    next_mrna_id += 1
+
+            Gene.objects.bulk_create(genes)
+            Gene.objects.reset_id_sequence()
+            MRNA.objects.bulk_create(mrnas)
+            MRNA.objects.reset_id_sequence()
+            CDS.objects.bulk_create_chunked(cds_regions)
+
+            import_log.gene_count += len(genes)
+            import_log.last_import_code = genes[-1].import_code
+            import_log.end = django.utils.timezone.now()
+            import_log.calculate_run_time()
+            import_log.save()
+            transaction.commit()
         except:
             self.command._rollback_db()
             raise
 
+        # A simple progress indicator, since processing can take a while.
+        sys.stdout.write('\n  Genes saved: %s' % import_log.gene_count)
+        sys.stdout.flush()
+
 class Command(BaseCommand):
     '''A custom command to import gene data from a CSV-like file.'''
     
@@ -562,6 +318,11 @@ class Command(BaseCommand):
                     default = [],
                     action = 'append',
                     help='import chromosome name'),
+        make_option('-r', '--resume',
+                    dest='resume',
+                    action='store_true',
+                    default=False,
+                    help='Resume the last interrupted import of the (GFF) file, using the same options'),
 
     )
 
@@ -675,10 +436,6 @@ class Command(BaseCommand):
         if len(name_split) > 2:
             if ((name_split[-2] == 'gff') or (name_split[-2] == 'gff3')) and name_split[-1] == 'gz':
                 gff_reader = GFFReader(self,gene_data,chrom_names = options['chrom_list'],limit=options['limit'])
-                gff_reader.df = gff_reader.split_attributes(gff_reader.df)
-                gff_reader.pre_parse(gff_reader.df)
-                gff_reader.df = gff_reader.allocate_gene_and_mrna_per_record(gff_reader.df)
-                #gff_reader.df_gene_ids = gff_reader.find_mrnas_and_cds_per_gene(gff_reader.df)
             else:
                 gff_based_import = False
         else:
@@ -695,9 +452,20 @@ class Command(BaseCommand):
         transaction.enter_transaction_management()
         transaction.managed(True)
         
-        # Create a new ImportLog object to store metadata about the import.
-        import_log = GeneImportLog(start=time_begin, 
-          file_path=os.path.abspath(gene_data), gene_count=0)
+        # Create a new ImportLog object to store metadata about the import,
+        # unless an interrupted import is being resumed.
+        import_log = None
+        if gff_based_import and options['resume']:
+            try:
+                import_log = GeneImportLog.objects.filter(
+                  file_path=os.path.abspath(gene_data),
+                  completed=False).order_by('-start')[0]
+                print('Resuming after gene: ', import_log.last_import_code)
+            except IndexError:
+                print('No interrupted import to resume')
+        if import_log is None:
+            import_log = GeneImportLog(start=time_begin, 
+              file_path=os.path.abspath(gene_data), gene_count=0)
     
         split_search = re.compile(r'^(.+)_(\d+)$').search
         char_search = re.compile(r'[^ACTGN\_]').search
@@ -705,7 +473,8 @@ class Command(BaseCommand):
 
         print('Writing genes')
         if gff_based_import:
-            gff_reader.write_genes(gff_reader.df,import_log)
+            gff_reader.write_genes(import_log,
+              resume_after=import_log.last_import_code)
         else:
             for line in gene_reader:
                 # Skip empty lines.
@@ -757,6 +526,7 @@ class Command(BaseCommand):
         # Finish populating the import meta-data.
         import_log.end = django.utils.timezone.now()
         import_log.calculate_run_time()
+        import_log.completed = True
 
         # Only save the import metadata if we actually did anything.
         if import_log.gene_count > 0:    
@@ -770,6 +540,9 @@ class Command(BaseCommand):
         transaction.commit()
         transaction.leave_transaction_management()
         connection.close()
+
+        # Have every process rebuild its gene interval index.
+        invalidate_interval_index()
     
         # All lines of gene data have been processed, so we can print a short
         # summary of what we did.
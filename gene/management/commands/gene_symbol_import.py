@@ -23,7 +23,8 @@ from django.core.management.base import BaseCommand
 from django.db import connection, transaction
 
 from common.models import Strain, Chromosome
-from gene.models import Gene, GeneSymbol, GeneSymbolImportLog
+from gene.models import Gene, GeneSymbol, GeneSymbolGroup, GeneSymbolImportLog
+from gene.symbol_index import invalidate_symbol_index
 
 
 class Command(BaseCommand):
@@ -174,37 +175,41 @@ class Command(BaseCommand):
                   t['gene_name']).group(1)
                 del t['gene_name']
 
+    def _report_progress(self, model, count):
+        '''Show the number of rows of model saved so far.'''
+        sys.stdout.write('\n  %s rows saved: %s' % (model._meta.object_name,
+          count))
+        sys.stdout.flush()
+
     def _save_translations_to_db(self, master_translation_table, import_log):
-        '''Save all translations to the database, including associations.'''
+        '''Save all translations to the database as groups of gene symbols.
 
-        count = 0
-        for k in master_translation_table:
-            count += 1
+        All the GeneSymbolGroup and GeneSymbol rows are built in memory first
+        and then saved using chunked bulk INSERTs.
 
-            # A simple progress indicator, since processing can take a while.
-            # Show progress after every thousand lines of gene symbols saved.
-            if (count % 1000) == 1:
-                sys.stdout.write('.')
-                sys.stdout.flush()
+        '''
 
+        next_group_id = GeneSymbolGroup.objects.next_id()
+        groups = []
+        symbols = []
+        for k in master_translation_table:
             t = master_translation_table[k]
-            symbols = []
-            # First, constrct all the GeneSymbol objects.
+
+            # The table is keyed by FlyBase ID, which identifies the group.
+            group = GeneSymbolGroup(id=next_group_id,
+              flybase_id=k if k.startswith('FBgn') else None)
+            groups.append(group)
+            next_group_id += 1
+
             for s in self._get_unique_symbols(t.values()):
-                gene_symbol = GeneSymbol()
-                gene_symbol.symbol = s
-                gene_symbol.save()
-                symbols.append(gene_symbol)
-                import_log.symbol_count += 1
-
-            # Next, link all the GeneSymbol objects to each other.
-            for s in symbols:
-                for s2 in symbols:
-                    if s is s2:
-                        continue
-                    s.translations.add(s2)
-                    import_log.translation_count += 1
-                s.save()
+                symbols.append(GeneSymbol(symbol=s, group_id=group.id))
+
+        import_log.symbol_count = len(symbols)
+        import_log.translation_count = len(groups)
+        print 'Saving %s gene symbols in %s groups:' % (len(symbols),
+          len(groups))
+        GeneSymbol.objects.bulk_create_groups(groups, symbols,
+          progress=self._report_progress)
 
     def handle(self, *translation_files, **options):
         '''The main entry point for the Django management command.
@@ -237,8 +242,11 @@ class Command(BaseCommand):
         transaction.managed(True)
     
         try:
-            # Truncate the existing gene symbol translation table.
+            # Truncate the existing gene symbol tables.  The symbols are
+            # removed first, so that deleting the groups doesn't need to
+            # collect them.
             GeneSymbol.objects.all().delete()
+            GeneSymbolGroup.objects.all().delete()
       
             count = self._save_translations_to_db(master_translation_table, 
               import_log)
@@ -260,6 +268,9 @@ class Command(BaseCommand):
         transaction.commit()
         transaction.leave_transaction_management()
         connection.close()
+
+        # Make running processes reload their gene symbol index.
+        invalidate_symbol_index()
     
         # All lines of gene symbol data have been processed, so we can print a
         # short summary of what we did.
@@ -267,5 +278,5 @@ class Command(BaseCommand):
         print '\nProcessing complete in %s days, %s.%s seconds.' % (td.days, 
           td.seconds, td.microseconds)
         print '  Gene symbols constructed: %s' % import_log.symbol_count
-        print '  Gene symbols translations constructed: %s' % \
+        print '  Gene symbol groups constructed: %s' % \
           import_log.translation_count
@@ -27,6 +27,7 @@ from django.db import connection, transaction
 
 from common.models import Strain, Chromosome
 from gene.models import Gene, GeneSymbol, GeneSymbolImportLog
+from gene.symbol_index import invalidate_symbol_index
 
 
 class Command(BaseCommand):
@@ -56,62 +57,52 @@ class Command(BaseCommand):
         return master_translation_table
 
 
+    def _report_progress(self, model, count):
+        '''Show the number of rows of model saved so far.'''
+        sys.stdout.write('\n  %s rows saved: %s' % (model._meta.object_name,
+          count))
+        sys.stdout.flush()
+
     def _save_translations_to_db(self, master_translation_table, import_log):
-        '''Save all translations to the database, including associations.'''
+        '''Save all translations to the database, including associations.
 
-        count = 0
-        skipped = 0
-        for translation_rec in master_translation_table:
-            count += 1
+        Each new GeneSymbol joins the group of its reference symbol.  The new
+        rows are built in memory first and then saved using chunked bulk
+        INSERTs.
 
-            # A simple progress indicator, since processing can take a while.
-            # Show progress after every thousand lines of gene symbols saved.
-            if (count % 100) == 1:
-                sys.stdout.write('.')
-                sys.stdout.flush()
+        Return the number of records skipped.
 
-            symbol = translation_rec[0]
-            dpse_fbgn_id = translation_rec[1]
+        '''
 
-            # Ensure reference dpse_fbgn_id already exists. If not, skip this record
-            try:
-                dpse_fbgn_sym = GeneSymbol.objects.get(symbol=dpse_fbgn_id)
-            except:
-                skipped+= 1
-                continue
+        symbol_groups = {}
+        for symbol, group_id in GeneSymbol.objects.values_list(
+          'symbol', 'group').order_by('id'):
+            symbol_groups.setdefault(symbol, group_id)
 
-            #  Ensure new symbol does not already exist. If it already exists, skip this record
-            new_sym = None
-            try:
-                new_sym = GeneSymbol.objects.get(symbol=symbol)
-            except:
-                pass
+        skipped = 0
+        symbols = []
+        for translation_rec in master_translation_table:
+            symbol = translation_rec[0]
+            dpse_fbgn_id = translation_rec[1]
 
-            if new_sym is not None:
+            # Ensure reference dpse_fbgn_id already exists (in a group), and
+            # the new symbol does not.  Otherwise, skip this record.
+            if symbol_groups.get(dpse_fbgn_id) is None or \
+              symbol in symbol_groups:
                 skipped += 1
                 continue
 
+            # Construct the new GeneSymbol object.
+            symbols.append(GeneSymbol(symbol=symbol,
+              group_id=symbol_groups[dpse_fbgn_id]))
+            symbol_groups[symbol] = symbol_groups[dpse_fbgn_id]
 
-            symbol_translations = dpse_fbgn_sym.translations.all()
-
-            # First, construct the new GeneSymbol object
-            gene_symbol = GeneSymbol()
-            gene_symbol.symbol = symbol
-            gene_symbol.save()
-            import_log.symbol_count += 1
-
-            gene_symbol.translations.add(dpse_fbgn_sym)
-            for s in symbol_translations:
-                gene_symbol.translations.add(s)
-                import_log.translation_count += 1
-            gene_symbol.save()
-
-            dpse_fbgn_sym.translations.add(gene_symbol)
-            for s in symbol_translations:
-                s.translations.add(gene_symbol)
-                import_log.translation_count += 1
-                s.save()
-
+        import_log.symbol_count = len(symbols)
+        import_log.translation_count = len(symbols)
+        print 'Saving %s gene symbols:' % len(symbols)
+        GeneSymbol.objects.bulk_create_chunked(symbols,
+          progress=self._report_progress)
+        return skipped
 
     def handle(self, translation_file, **options):
         '''The main entry point for the Django management command.
@@ -131,7 +122,7 @@ class Command(BaseCommand):
     
         try:
             master_translation_table = self._build_translation_table_from_file(translation_file)
-            count = self._save_translations_to_db(master_translation_table,
+            skipped = self._save_translations_to_db(master_translation_table,
               import_log)
   
             # Finish populating the import meta-data.
@@ -151,6 +142,9 @@ class Command(BaseCommand):
         transaction.commit()
         transaction.leave_transaction_management()
         connection.close()
+
+        # Make running processes reload their gene symbol index.
+        invalidate_symbol_index()
     
         # All lines of gene symbol data have been processed, so we can print a
         # short summary of what we did.
@@ -158,5 +152,6 @@ class Command(BaseCommand):
         print '\nProcessing complete in %s days, %s.%s seconds.' % (td.days, 
           td.seconds, td.microseconds)
         print '  Gene symbols constructed: %s' % import_log.symbol_count
-        print '  Gene symbols translations constructed: %s' % \
+        print '  Gene symbols added to groups: %s' % \
           import_log.translation_count
+        print '  Records skipped: %s' % skipped
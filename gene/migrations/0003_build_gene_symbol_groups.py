@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Put every gene symbol into a group with the symbols it translates to."
+
+        GeneSymbol = orm['gene.GeneSymbol']
+        GeneSymbolGroup = orm['gene.GeneSymbolGroup']
+        through = GeneSymbol.translations.through
+
+        symbols = dict(GeneSymbol.objects.values_list('id', 'symbol'))
+
+        # The groups are the connected components of the translations, which
+        # are found using union-find.
+        parent = {}
+
+        def find(i):
+            root = i
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while i != root:
+                parent[i], i = root, parent.get(i, i)
+            return root
+
+        for from_id, to_id in through.objects.values_list(
+          'from_genesymbol_id', 'to_genesymbol_id').iterator():
+            from_root, to_root = find(from_id), find(to_id)
+            if from_root != to_root:
+                parent[max(from_root, to_root)] = min(from_root, to_root)
+
+        groups = {}
+        for pk in sorted(symbols):
+            groups.setdefault(find(pk), []).append(pk)
+
+        for root in sorted(groups):
+            member_ids = groups[root]
+            flybase_ids = [symbols[pk] for pk in member_ids
+              if symbols[pk].startswith('FBgn')]
+            group = GeneSymbolGroup.objects.create(
+              flybase_id=flybase_ids[0] if flybase_ids else None)
+            for i in range(0, len(member_ids), 500):
+                GeneSymbol.objects.filter(
+                  id__in=member_ids[i:i + 500]).update(group=group)
+
+    def backwards(self, orm):
+        "Link every gene symbol to every other symbol in its group."
+
+        GeneSymbol = orm['gene.GeneSymbol']
+        GeneSymbolGroup = orm['gene.GeneSymbolGroup']
+        through = GeneSymbol.translations.through
+
+        groups = {}
+        for pk, group_id in GeneSymbol.objects.filter(
+          group__isnull=False).values_list('id', 'group'):
+            groups.setdefault(group_id, []).append(pk)
+
+        through.objects.all().delete()
+        through.objects.bulk_create([through(from_genesymbol_id=from_id,
+          to_genesymbol_id=to_id) for member_ids in groups.values()
+          for from_id in member_ids for to_id in member_ids
+          if from_id != to_id], batch_size=5000)
+
+        GeneSymbol.objects.update(group=None)
+        GeneSymbolGroup.objects.all().delete()
+
+    models = {
+        u'common.chromosome': {
+            'Meta': {'object_name': 'Chromosome'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        u'common.release': {
+            'Meta': {'object_name': 'Release'},
+            'description': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '20'})
+        },
+        u'common.species': {
+            'Meta': {'object_name': 'Species'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'symbol': ('django.db.models.fields.CharField', [], {'max_length': '16'})
+        },
+        u'common.strain': {
+            'Meta': {'ordering': "('release__name', 'species__name', '-is_reference')", 'object_name': 'Strain'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_reference': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'release': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Release']", 'null': 'True'}),
+            'species': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Species']"})
+        },
+        u'gene.cds': {
+            'Meta': {'object_name': 'CDS'},
+            'end_position': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'mRNA': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['gene.MRNA']"}),
+            'num': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'start_position': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'gene.gene': {
+            'Meta': {'ordering': "('strain__species__pk', 'strain__name')", 'object_name': 'Gene'},
+            'bases': ('django.db.models.fields.TextField', [], {}),
+            'chromosome': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Chromosome']"}),
+            'end_position': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'import_code': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'start_position': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'strain': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['common.Strain']"}),
+            'strand': ('django.db.models.fields.CharField', [], {'max_length': '1'})
+        },
+        u'gene.genebatchprocess': {
+            'Meta': {'object_name': 'GeneBatchProcess'},
+            'batch_end': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'batch_start': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'batch_status': ('django.db.models.fields.CharField', [], {'default': "'P'", 'max_length': '1', 'db_index': 'True'}),
+            'delivery_tag': ('django.db.models.fields.CharField', [], {'max_length': '32', 'null': 'True'}),
+            'expiration': ('django.db.models.fields.DateTimeField', [], {'null': 'True'}),
+            'failed_symbols': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True'}),
+            'final_report': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'original_request': ('django.db.models.fields.TextField', [], {}),
+            'original_species': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'show_aligned': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'submitted_at': ('django.db.models.fields.DateTimeField', [], {}),
+            'submitter_email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'null': 'True'}),
+            'total_symbols': ('django.db.models.fields.PositiveIntegerField', [], {'null': 'True'})
+        },
+        u'gene.geneimportlog': {
+            'Meta': {'object_name': 'GeneImportLog'},
+            'end': ('django.db.models.fields.DateTimeField', [], {}),
+            'file_path': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'gene_count': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'run_microseconds': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'start': ('django.db.models.fields.DateTimeField', [], {})
+        },
+        u'gene.genesymbol': {
+            'Meta': {'object_name': 'GeneSymbol'},
+            'group': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'symbols'", 'null': 'True', 'to': u"orm['gene.GeneSymbolGroup']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'symbol': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'translations': ('django.db.models.fields.related.ManyToManyField', [], {'related_name': "'translations_rel_+'", 'to': u"orm['gene.GeneSymbol']"})
+        },
+        u'gene.genesymbolgroup': {
+            'Meta': {'object_name': 'GeneSymbolGroup'},
+            'flybase_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        u'gene.genesymbolimportlog': {
+            'Meta': {'object_name': 'GeneSymbolImportLog'},
+            'end': ('django.db.models.fields.DateTimeField', [], {}),
+            'file_path': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'run_microseconds': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'start': ('django.db.models.fields.DateTimeField', [], {}),
+            'symbol_count': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'translation_count': ('django.db.models.fields.PositiveIntegerField', [], {})
+        },
+        u'gene.mrna': {
+            'Meta': {'object_name': 'MRNA'},
+            'gene': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['gene.Gene']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        }
+    }
+
+    complete_apps = ['gene']
+    symmetrical = True
@@ -7,7 +7,7 @@ import string
 import textwrap
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 
 from common.models import Strain, Chromosome, StrainManager
 from common.models import BatchProcess, ImportLog
@@ -15,6 +15,59 @@ from common.models import BatchProcess, ImportLog
 from chromosome.models import ChromosomeBase
 
 
+class BulkInsertManager(models.Manager):
+    '''A manager providing the pieces needed to bulk insert many rows.'''
+
+    # Number of rows written by each bulk INSERT.
+    BULK_CHUNK_SIZE = 5000
+
+    def next_id(self):
+        '''Return the primary key following the largest one in use.'''
+        max_id = self.aggregate(max_id=models.Max('id'))['max_id']
+        return (max_id or 0) + 1
+
+    def reset_id_sequence(self):
+        '''Bring the id sequence up to date after saving explicit ids.
+
+        This does nothing on databases without id sequences.
+
+        '''
+
+        from django.core.management.color import no_style
+        from django.db import connection
+
+        cursor = connection.cursor()
+        for sql in connection.ops.sequence_reset_sql(no_style(), [self.model]):
+            cursor.execute(sql)
+
+    def bulk_create_chunked(self, objs, progress=None):
+        '''Save the objects in objs (an iterable) using chunked bulk INSERTs.
+
+        If progress is specified, it is called with the model and the number
+        of rows saved so far after each chunk is written.
+
+        Return the number of rows saved.
+
+        '''
+
+        count = 0
+        chunk = []
+        for obj in objs:
+            chunk.append(obj)
+            if len(chunk) == self.BULK_CHUNK_SIZE:
+                self.bulk_create(chunk)
+                count += len(chunk)
+                chunk = []
+                if progress is not None:
+                    progress(self.model, count)
+        if chunk:
+            self.bulk_create(chunk)
+            count += len(chunk)
+            if progress is not None:
+                progress(self.model, count)
+        return count
+
+
 # class GeneManager(models.Manager):
 #     def ref_strain_gene_for_chrom_and_code(self,chrom_name,import_code):
 #         ref_strain_gene = None
@@ -35,6 +88,7 @@ class Gene(models.Model):
     bases = models.TextField() #(editable=False)
 
     # objects = GeneManager()
+    objects = BulkInsertManager()
 
     def __str__(self):
         '''Define the string representation of this class of object.'''
@@ -55,6 +109,23 @@ class Gene(models.Model):
     def bases_for_largest_transcript(self):
         pass
 
+    def _stored_sequence(self, strain, cb=None):
+        '''Return the StoredGeneSequence of this gene in strain (or None).
+
+        cb is the strain's ChromosomeBase of this gene's chromosome, if
+        already known.  Lookups are remembered for the life of this object
+        (see gene.sequence_store).
+
+        '''
+
+        from gene.sequence_store import stored_sequence
+        if not hasattr(self, '_stored_sequences'):
+            self._stored_sequences = {}
+        if strain.id not in self._stored_sequences:
+            self._stored_sequences[strain.id] = stored_sequence(self, strain,
+              cb)
+        return self._stored_sequences[strain.id]
+
 
     def max_bases_per_position(self,strains):
         # Used in post alignment
@@ -63,7 +134,11 @@ class Gene(models.Model):
 
         bases_per_position = []
         for strain in strains:
-            bases_per_position.append(self.largest_transcript().base_positions_for_strain(strain))
+            stored = self._stored_sequence(strain)
+            if stored is not None:
+                bases_per_position.append(stored.positions)
+            else:
+                bases_per_position.append(self.largest_transcript().base_positions_for_strain(strain))
 
         bases_len = len(bases_per_position[0])
         max_bases_per_pos = []
@@ -91,10 +166,17 @@ class Gene(models.Model):
 
         strain = self.strain if use_strain is None else use_strain
 
-        largest_transcript = self.largest_transcript()
+        stored = self._stored_sequence(strain)
+        if stored is not None:
+            transcript_start = stored.transcript_start
+            transcript_name = stored.transcript_name
+        else:
+            largest_transcript = self.largest_transcript()
+            transcript_start = self.start_position if largest_transcript is None else largest_transcript.start_position()
+            transcript_name = '' if largest_transcript is None else largest_transcript.name
         return r'>%s' % delimiter.join((strain.species.name,
           strain.name,strain.release.name,
-          '%s_%s %s' %(self.chromosome.name, self.start_position if largest_transcript is None else largest_transcript.start_position(), '' if largest_transcript is None else largest_transcript.name),
+          '%s_%s %s' %(self.chromosome.name, transcript_start, transcript_name),
           self.symbols()))
   
     def fasta_bases(self, wrapped=True,use_strain=None, max_bases_per_pos = None):
@@ -111,8 +193,9 @@ class Gene(models.Model):
 
         strain = self.strain if use_strain is None else use_strain
 
-        largest_transcript = self.largest_transcript()
-        if largest_transcript is None:
+        stored = self._stored_sequence(strain)
+        largest_transcript = None if stored is not None else self.largest_transcript()
+        if stored is None and largest_transcript is None:
             bases = self.bases
         else:
             #ref_strain = Strain.objects.get(name__contains='refer',release__name__contain='3')
@@ -121,9 +204,17 @@ class Gene(models.Model):
             #     bases = self.bases
             # else:
             if max_bases_per_pos is None:
-                bases = largest_transcript.bases_for_strain(strain)   #(self.strain)
+                if stored is not None:
+                    bases = stored.spliced
+                    if self.strand == '-':
+                        bases = MRNA.reverse_complement(bases)
+                else:
+                    bases = largest_transcript.bases_for_strain(strain)   #(self.strain)
             else: # use post alignment
-                base_positions = largest_transcript.base_positions_for_strain(strain)
+                if stored is not None:
+                    base_positions = stored.positions
+                else:
+                    base_positions = largest_transcript.base_positions_for_strain(strain)
                 bases_aligned = []
                 for i, base in enumerate(base_positions):
                     if len(base_positions[i]) < max_bases_per_pos[i]:
@@ -155,8 +246,12 @@ class Gene(models.Model):
 
     def symbols(self):
         '''Return all symbols that represent this gene.'''
-        return ','.join(
-          GeneSymbol.objects.get(symbol=self.import_code).all_symbols())
+        from gene.symbol_index import get_symbol_index
+        match = get_symbol_index().lookup(self.import_code)
+        if match is None:
+            raise GeneSymbol.DoesNotExist(
+              'No gene symbol: %s' % self.import_code)
+        return ','.join(match.all_symbols)
 
     @staticmethod  
     def multi_gene_fasta(symbol, species, show_aligned=False):
@@ -174,11 +269,19 @@ class Gene(models.Model):
         
         This method primarily handles the "search by gene" functionality from 
         the web interface.
+
+        The strains, the genes with the symbol and the strains'
+        ChromosomeBases are each fetched in one query, and the sequences are
+        read from each strain's gene sequence store where it holds them (see
+        gene.sequence_store).
         
         '''
     
-        n_symbols = GeneSymbol.objects.get(
-          symbol=GeneSymbol.normalize(symbol)).all_symbols()
+        from gene.symbol_index import get_symbol_index
+        match = get_symbol_index().resolve_one(symbol)
+        if match is None:
+            raise GeneSymbol.DoesNotExist('No gene symbol: %s' % symbol)
+        n_symbols = match.all_symbols
 
 
         #Old Method - check for original release (pse1) formatted genes
@@ -190,71 +293,89 @@ class Gene(models.Model):
 
 
         #New method Flybase release r3.04 onwards
-        all_strains = Strain.objects.strains_in_species_list(species,release_to_exclude=settings.ORIGINAL_RELEASE_VERSION)
+        # The strains are ordered as by Strain.objects.strains_in_species_list,
+        # but fetched (with their species and release) in one query.
+        species = list(species)
+        species_order = dict((s.pk, i) for i, s in enumerate(species))
+        all_strains = list(Strain.objects.filter(species__in=species).exclude(
+          release__name=settings.ORIGINAL_RELEASE_VERSION).select_related(
+          'species', 'release'))
+        all_strains.sort(key=lambda strain: species_order[strain.species_id])
+        all_strains.sort(key=lambda strain: strain.is_reference, reverse=True)
+
+        # The genes with any of the symbols in the strains' releases, by
+        # strain, and by release as (reference strain id, genes) of the first
+        # reference strain with any.  The chromosome of a release is that of
+        # its first gene.
+        genes = Gene.objects.filter(import_code__in=n_symbols,
+          strain__release__in=set(strain.release_id for strain in all_strains
+          if strain.release_id is not None)).select_related(
+          'strain__species', 'strain__release', 'chromosome').order_by(
+          '-strain__is_reference', 'strain__species__id', 'strain__name')
+        strain_genes = {}
+        ref_genes = {}
+        release_chromosomes = {}
+        for gene in genes:
+            strain_genes.setdefault(gene.strain_id, []).append(gene)
+            if gene.strain.is_reference:
+                ref_strain_id, release_ref_genes = ref_genes.setdefault(
+                  gene.strain.release_id, (gene.strain_id, []))
+                if gene.strain_id == ref_strain_id:
+                    release_ref_genes.append(gene)
+            release_chromosomes.setdefault(gene.strain.release_id,
+              gene.chromosome_id)
+
+        def only_gene(genes):
+            # Strains with several genes of the symbol are left out, as
+            # Gene.objects.get would.
+            return genes[0] if genes is not None and len(genes) == 1 else None
+
+        chromosome_bases = dict(((cb.strain_id, cb.chromosome_id), cb) for cb in
+          ChromosomeBase.objects.filter(strain__in=all_strains,
+          chromosome__in=set(release_chromosomes.values())))
+
+        # (strain, gene, whether the strain uses the reference gene's base
+        # positions) of each strain with data.
         strains = []
         for strain in all_strains:
-            try:
-                genes = Gene.objects.filter(
-                    import_code__in=n_symbols, strain__release__name=strain.release.name).order_by(
-                    '-strain__is_reference',
-                    'strain__species__id', 'strain__name')
-                cb = ChromosomeBase.objects.get(strain=strain, chromosome=genes[0].chromosome)
-                if cb.missing_data():
-                    print('Missing chromosomebase data for strain: ',strain)
-                else:
-                    strains.append(strain)
-            except:
+            cb = chromosome_bases.get((strain.id,
+              release_chromosomes.get(strain.release_id)))
+            if cb is None:
                 print('Missing chromosomebase record for strain: ',strain)
-                pass # Only process strain if chromosomebase data actually exists
-
+                continue # Only process strain if chromosomebase data actually exists
+            if cb.missing_data():
+                print('Missing chromosomebase data for strain: ',strain)
+                continue
+            cb.strain = strain
+
+            gene = only_gene(strain_genes.get(strain.id))
+            uses_ref_gene = strain.is_reference
+            if gene is None and not strain.is_reference:
+                # Strain uses ref gene base positions
+                gene = only_gene(ref_genes.get(strain.release_id,
+                  (None, None))[1])
+                uses_ref_gene = True
+            if gene is None:
+                continue
+            # Open the strain's gene sequence store once, with its
+            # ChromosomeBase at hand.
+            gene._stored_sequence(strain, cb)
+            strains.append((strain, gene, uses_ref_gene))
 
         #Pre-process to determine post-alignment
-        alignment_strains = []
-        for strain in strains:
-            if strain.is_reference:
-                try:
-                    ref_gene = Gene.objects.get(strain=strain, import_code__in=n_symbols)
-                    alignment_strains.append(strain)  # ref gene exists
-                except:
-                    pass
-            else:
-                strain_gene = None
-                try:
-                    strain_gene = Gene.objects.get(strain=strain, import_code__in=n_symbols)
-                except:
-                    pass
-                if strain_gene is None:
-                    ref_strain = Strain.objects.ref_strain_for_release(strain.release.name)
-                    try:
-                        ref_gene = Gene.objects.get(strain=ref_strain, import_code__in=n_symbols)
-                        alignment_strains.append(strain) # Strain uses ref gene base positions, and ref gene exists
-                    except:
-                        pass
-        if len(alignment_strains) < 2 or (not show_aligned):
-            pass
-        else:
-            for alignment_strain in alignment_strains:
-                strains.remove(alignment_strain)
+        alignment_strains = [(strain, gene) for strain, gene, uses_ref_gene in
+          strains if uses_ref_gene]
+        if len(alignment_strains) >= 2 and show_aligned:
+            ref_gene = alignment_strains[-1][1]
+            alignment_strains = [strain for strain, gene in alignment_strains]
+            strains = [entry for entry in strains
+              if entry[0] not in alignment_strains]
             max_bases_per_pos = ref_gene.max_bases_per_position(alignment_strains)
             for alignment_strain in alignment_strains:
                 yield (ref_gene.fasta_header(use_strain=alignment_strain), ref_gene.fasta_bases(use_strain=alignment_strain, max_bases_per_pos = max_bases_per_pos))
 
-        for strain in strains: # Remaining strains which don't use ref gene base positions
-            strain_gene = None
-            try:
-              strain_gene = Gene.objects.get(strain=strain,import_code__in=n_symbols)
-            except:
-                pass
-
-            if strain_gene is None:
-                ref_strain = Strain.objects.ref_strain_for_release(strain.release.name)
-                try:
-                    ref_gene = Gene.objects.get(strain=ref_strain, import_code__in=n_symbols)
-                    yield (ref_gene.fasta_header(use_strain=strain), ref_gene.fasta_bases(use_strain=strain))
-                except:
-                    pass
-            else:
-                yield (strain_gene.fasta_header(), strain_gene.fasta_bases())
+        for strain, gene, uses_ref_gene in strains: # Remaining strains which don't use ref gene base positions
+            yield (gene.fasta_header(use_strain=strain), gene.fasta_bases(use_strain=strain))
 
 
 
@@ -267,6 +388,8 @@ class MRNA(models.Model):
     name = models.CharField(max_length=255)
     gene = models.ForeignKey(Gene)
 
+    objects = BulkInsertManager()
+
     def __str__(self):
         '''Define the string representation of this class of object.'''
         return '%s, %s' % (self.gene.import_code, self.name)
@@ -370,6 +493,8 @@ class CDS(models.Model):
     end_position = models.PositiveIntegerField()
     num = models.PositiveIntegerField()
 
+    objects = BulkInsertManager()
+
     def __str__(self):
         '''Define the string representation of this class of object.'''
         return '%s, %s' % (self.mRNA.name, self.num)
@@ -380,25 +505,51 @@ class CDS(models.Model):
     def length(self):
         return self.end_position - self.start_position + 1
 
-class GeneSymbolManager(models.Manager):
+class GeneSymbolGroup(models.Model):
+    '''A group of equivalent gene symbols (ie translations of each other).'''
+
+    flybase_id = models.CharField(max_length=255, null=True, blank=True)
+
+    objects = BulkInsertManager()
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return self.flybase_id or 'Gene symbol group %s' % self.pk
+
+
+class GeneSymbolManager(BulkInsertManager):
+    def bulk_create_groups(self, groups, symbols, progress=None):
+        '''Save new gene symbol groups and gene symbols using bulk INSERTs.
+
+        groups is a list of unsaved GeneSymbolGroups with their ids already
+        assigned (see next_id), so that the group_id of each of the unsaved
+        GeneSymbols in symbols can refer to them.
+
+        This must be run inside a transaction.
+
+        '''
+
+        GeneSymbolGroup.objects.bulk_create_chunked(groups, progress)
+        GeneSymbolGroup.objects.reset_id_sequence()
+        return self.bulk_create_chunked(symbols, progress)
+
     def gene_symbols_no_flybase_ID(self):
-        symbols_without_flybase_ID = []
-
-        all_symbols = self.all()
-        print('Num symbols: ',len(all_symbols))
-        for i,symbol in enumerate(all_symbols):
-            if (i % 10000 == 0):
-                print('Processing: ',i)
-            flybase_id = symbol.flybase_ID()
-            if flybase_id is None:
-               symbols_without_flybase_ID.append(symbol.symbol)
-        return symbols_without_flybase_ID
+        '''Return all gene symbols whose group has no FlyBase ID.'''
+        return list(self.filter(models.Q(group__isnull=True) |
+          models.Q(group__flybase_id__isnull=True)).values_list(
+          'symbol', flat=True))
 
 class GeneSymbol(models.Model):
-    '''Data about a symbol representing a gene in different systems.'''
+    '''Data about a symbol representing a gene in different systems.
+
+    Equivalent symbols (eg the GA ID, gene name and FlyBase ID of a gene) all
+    belong to the same GeneSymbolGroup.
+
+    '''
  
-    symbol = models.CharField(max_length=255)
-    translations = models.ManyToManyField('self')
+    symbol = models.CharField(max_length=255, db_index=True)
+    group = models.ForeignKey(GeneSymbolGroup, null=True, blank=True,
+      related_name='symbols')
 
     objects = GeneSymbolManager()
 
@@ -408,18 +559,30 @@ class GeneSymbol(models.Model):
   
     def all_symbols(self):
         '''Return a list of all translations of this gene symbol.'''
-        return([self.symbol] + [t.symbol for t in self.translations.all()])
+        if self.group_id is None:
+            return [self.symbol]
+        return([self.symbol] + list(GeneSymbol.objects.filter(
+          group=self.group_id).exclude(pk=self.pk).values_list(
+          'symbol', flat=True)))
 
     def flybase_ID(self):
-        all_translations = self.all_symbols()
-        for trans in all_translations:
-            if trans[:4] == 'FBgn':
-                return trans
-        return None
+        if self.group_id is None:
+            return None
+        return self.group.flybase_id
 
     @staticmethod
-    def normalize(symbol):
-        '''Return the normalized version of symbol.'''
+    def normalize(symbol, symbol_exists=None):
+        '''Return the normalized version of symbol.
+
+        FlyBase IDs may be stored with a species prefix (eg dmel_FBgnXXXXXX),
+        so the candidate forms are checked for existence.  If symbol_exists is
+        specified, it is used for that check (eg by the in-memory symbol
+        index) instead of querying the database.
+
+        '''
+
+        if symbol_exists is None:
+            symbol_exists = lambda s: GeneSymbol.objects.filter(symbol=s).exists()
     
         dpse_match = re.compile(r'dpse\\(.+)', flags=re.I).match
         ga_match = re.compile(r'ga(\d+)', flags=re.I).match
@@ -449,18 +612,11 @@ class GeneSymbol(models.Model):
         fbgn_matched = fbgn_match(normalized_symbol)
         if fbgn_matched:
             normalized_symbol = ''.join(('FBgn', fbgn_matched.group(1)))
-            try:
-                sym = GeneSymbol.objects.get(symbol=normalized_symbol)
-            except:
-                try:
-                    sym =  GeneSymbol.objects.get(symbol='dmel_' + normalized_symbol)
-                    normalized_symbol = 'dmel_' + normalized_symbol
-                except:
-                    try:
-                        sym = GeneSymbol.objects.get(symbol='dper_' + normalized_symbol)
-                        normalized_symbol = 'dper_' + normalized_symbol
-                    except:
-                        pass
+            if not symbol_exists(normalized_symbol):
+                for prefix in ('dmel_', 'dper_'):
+                    if symbol_exists(prefix + normalized_symbol):
+                        normalized_symbol = prefix + normalized_symbol
+                        break
 
         # "GLEANR" symbols should be in the format: dpse_GLEANR_XXXXXX
         gleanr_matched = gleanr_match(normalized_symbol)
@@ -479,6 +635,10 @@ class GeneSymbol(models.Model):
 class GeneImportLog(ImportLog):
     '''Metadata about the import of a particular Gene object.'''
     gene_count = models.PositiveIntegerField()
+    # Imports are committed in chunks.  Until an import is completed, the
+    # import code of the last gene committed marks where to resume it from.
+    last_import_code = models.CharField(max_length=255, blank=True, default='')
+    completed = models.BooleanField(default=False)
 
     def __str__(self):
         '''Define the string representation of this class of object.'''
@@ -495,6 +655,45 @@ class GeneSymbolImportLog(ImportLog):
         '''Define the string representation of this class of object.'''
         return 'Imported: %s File Path: %s'  % (str(self.end), self.file_path)
 
+class GeneBatchProcessManager(models.Manager):
+    def claim_pending_batches(self, limit=None):
+        '''Mark up to limit pending batches as active and return them.
+
+        The pending rows are locked (SELECT ... FOR UPDATE) while they are
+        claimed, and each row is only switched to active if it is still
+        pending, so two overlapping cron runs can never process the same
+        batch.
+
+        '''
+
+        claimed = []
+
+        transaction.commit_unless_managed()
+        transaction.enter_transaction_management()
+        transaction.managed(True)
+        try:
+            pending = self.select_for_update().filter(
+              batch_status='P').order_by('submitted_at', 'id')
+            if limit is not None:
+                pending = pending[:limit]
+
+            for batch in pending:
+                batch.start()
+                updated = self.filter(pk=batch.pk, batch_status='P').update(
+                  batch_status=batch.batch_status,
+                  batch_start=batch.batch_start)
+                if updated:
+                    claimed.append(batch)
+        except:
+            transaction.rollback()
+            transaction.leave_transaction_management()
+            raise
+
+        transaction.commit()
+        transaction.leave_transaction_management()
+        return claimed
+
+
 class GeneBatchProcess(BatchProcess):
     '''Metadata about the processing of a "batch gene" request.'''
     original_species = models.CharField(max_length=255)
@@ -503,6 +702,8 @@ class GeneBatchProcess(BatchProcess):
     total_symbols = models.PositiveIntegerField(null=True)
     failed_symbols = models.PositiveIntegerField(null=True)
 
+    objects = GeneBatchProcessManager()
+
     def __str__(self):
         '''Define the string representation of this class of object.'''
         return '%s, %s, %s' % (self.submitted_at,self.submitter_email,self.batch_status)
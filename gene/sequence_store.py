@@ -0,0 +1,305 @@
+'''Precomputed gene sequences of each strain.
+
+Every gene search (and every line of a gene batch) splices the CDS regions of
+a gene's largest transcript out of each strain's ChromosomeBase, reading the
+data file once per region and strain, and finding the largest transcript
+again each time.  A ".genes" sidecar file of each ChromosomeBase instead
+holds, for every gene on its chromosome, the largest transcript's name and
+start, and the strain's bases at every position of its CDS regions (from
+which both the spliced sequence and the aligned form are made).
+
+A strain's genes are the ones imported for the strain, and otherwise those
+of the reference strain of its release, as in Gene.multi_gene_fasta.  Only
+genes with transcripts are held; others are read as before.
+
+The sidecar is named after (and records) the file tag of its
+ChromosomeBase, so importing a strain again leaves it to be rebuilt, by the
+gene_build_sequence_store command.  Gene imports only add genes (with new
+ids), which are read as before until the sidecars are rebuilt.
+
+Sidecar layout:
+  HEADER: magic, version, file tag, number of genes
+  RECORD (one per gene, sorted by gene id): gene id, offset, size
+  genes: each zlib compressed, being ENTRY (transcript start, length of the
+    transcript name, number of positions, length of the spliced sequence if
+    it isn't the bases with deletions removed, else 0), the transcript name,
+    the number of bases at each position (COUNT_TYPE, only if there are
+    insertions), the bases, then the spliced sequence (if held)
+
+'''
+
+import array
+import mmap
+import os
+import struct
+import zlib
+
+import logging
+log = logging.getLogger(__name__)
+
+
+MAGIC = 'PBGS'
+VERSION = 1
+
+HEADER = struct.Struct('<4sH32sI')
+RECORD = struct.Struct('<IQI')
+ENTRY = struct.Struct('<iHII')
+
+COUNT_TYPE = 'H'
+
+DELETION_CHAR = '-'
+
+# Number of genes whose transcripts are read by each query.
+QUERY_CHUNK_SIZE = 500
+
+
+class StoredGeneSequence(object):
+    '''The sequence of a gene in a strain, read from a sidecar.'''
+
+    __slots__ = ('transcript_name', 'transcript_start', 'positions',
+      'spliced')
+
+    def __init__(self, transcript_name, transcript_start, positions,
+      spliced):
+        self.transcript_name = transcript_name
+        self.transcript_start = transcript_start
+        # The strain's bases at each position of the CDS regions.
+        self.positions = positions
+        # The spliced (forward strand) sequence of the CDS regions.
+        self.spliced = spliced
+
+
+def _largest_transcripts(gene_ids):
+    '''Return (name, [(start, end)] CDS regions) of the largest transcript
+    of each of gene_ids which has one, by gene id.
+
+    Ties go to the first transcript, as in Gene.largest_transcript.
+
+    '''
+
+    from gene.models import CDS
+
+    gene_ids = sorted(gene_ids)
+    transcripts = {}
+    for first in xrange(0, len(gene_ids), QUERY_CHUNK_SIZE):
+        for gene_id, mrna_id, name, start, end in CDS.objects.filter(
+          mRNA__gene__in=gene_ids[first:first + QUERY_CHUNK_SIZE]).order_by(
+          'mRNA__gene', 'mRNA', 'id').values_list('mRNA__gene', 'mRNA',
+          'mRNA__name', 'start_position', 'end_position'):
+            gene_transcripts = transcripts.setdefault(gene_id, [])
+            if not gene_transcripts or gene_transcripts[-1][0] != mrna_id:
+                gene_transcripts.append((mrna_id, name, []))
+            gene_transcripts[-1][2].append((start, end))
+
+    largest = {}
+    for gene_id, gene_transcripts in transcripts.iteritems():
+        largest_size = -1
+        for mrna_id, name, cds in gene_transcripts:
+            size = sum(end - start + 1 for start, end in cds)
+            if size > largest_size:
+                largest_size = size
+                largest[gene_id] = (name, cds)
+    return largest
+
+
+def _cds_positions(cb, start_position, end_position):
+    '''Return the bases of cb at each position of a CDS region.'''
+
+    first, bases = cb.bases_in_range(start_position, end_position)
+    if not bases:
+        return [cb.pad_char] * (end_position + 1 - start_position)
+    return [cb.pad_char] * (first - start_position) + bases + \
+      [cb.pad_char] * (end_position + 1 - first - len(bases))
+
+
+def _pack_entry(transcript_name, transcript_start, positions, spliced):
+    '''Return the compressed sidecar entry of a gene.'''
+
+    bases = ''.join(positions)
+    if spliced == bases.replace(DELETION_CHAR, ''):
+        spliced = ''
+    pieces = [ENTRY.pack(transcript_start, len(transcript_name),
+      len(positions), len(spliced)), transcript_name]
+    if len(bases) != len(positions):
+        pieces.append(array.array(COUNT_TYPE,
+          [len(b) for b in positions]).tostring())
+    pieces.append(bases)
+    pieces.append(spliced)
+    return zlib.compress(''.join(pieces))
+
+
+def _unpack_entry(data):
+    '''Return the StoredGeneSequence of a compressed sidecar entry.'''
+
+    data = zlib.decompress(data)
+    (transcript_start, name_length, num_positions,
+      spliced_length) = ENTRY.unpack_from(data)
+    offset = ENTRY.size
+    transcript_name = data[offset:offset + name_length]
+    offset += name_length
+
+    end = len(data) - spliced_length
+    if end - offset == num_positions:
+        positions = list(data[offset:end])
+    else:
+        counts = array.array(COUNT_TYPE)
+        counts_size = num_positions * counts.itemsize
+        counts.fromstring(data[offset:offset + counts_size])
+        offset += counts_size
+        positions = []
+        for count in counts:
+            positions.append(data[offset:offset + count])
+            offset += count
+    spliced = data[end:] if spliced_length else \
+      ''.join(positions).replace(DELETION_CHAR, '')
+    return StoredGeneSequence(transcript_name, transcript_start, positions,
+      spliced)
+
+
+def strain_genes(cb):
+    '''Return the genes (Gene objects) whose sequences cb's sidecar holds.'''
+
+    from gene.models import Gene
+
+    strain = cb.strain
+    genes = list(Gene.objects.filter(strain=strain,
+      chromosome=cb.chromosome_id))
+    if strain.release_id is not None and not strain.is_reference:
+        own = set(gene.import_code for gene in genes)
+        genes.extend([gene for gene in Gene.objects.filter(
+          strain__release=strain.release_id, strain__is_reference=True,
+          chromosome=cb.chromosome_id) if gene.import_code not in own])
+    return genes
+
+
+def build_gene_sequences(cb):
+    '''Write the gene sequence sidecar file of ChromosomeBase cb.
+
+    Returns the number of genes in the sidecar.
+
+    '''
+
+    genes = dict((gene.id, gene) for gene in strain_genes(cb))
+    transcripts = _largest_transcripts(genes.keys())
+    gene_ids = sorted(transcripts)
+
+    tmp_path = cb.gene_sequences_file_path + '.part'
+    f = open(tmp_path, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, VERSION, str(cb.file_tag), len(gene_ids)))
+        f.write(RECORD.pack(0, 0, 0) * len(gene_ids))
+        records = []
+        for gene_id in gene_ids:
+            name, cds = transcripts[gene_id]
+            if genes[gene_id].strand == '-':
+                transcript_start = cds[-1][-1]
+            else:
+                transcript_start = cds[0][0]
+            positions = []
+            spliced = []
+            for start, end in cds:
+                cds_positions = _cds_positions(cb, start, end)
+                positions.extend(cds_positions)
+                if start > cb.end_position:
+                    # The message fasta_bases gives instead of bases.
+                    spliced.append(''.join(cb.fasta_bases(start, end)))
+                else:
+                    spliced.append(''.join(cds_positions).replace(
+                      DELETION_CHAR, ''))
+            entry = _pack_entry(name, transcript_start, positions,
+              ''.join(spliced))
+            records.append(RECORD.pack(gene_id, f.tell(), len(entry)))
+            f.write(entry)
+
+        f.seek(HEADER.size)
+        f.write(''.join(records))
+    except:
+        f.close()
+        os.remove(tmp_path)
+        raise
+    f.close()
+    os.rename(tmp_path, cb.gene_sequences_file_path)
+    return len(gene_ids)
+
+
+class GeneSequenceStore(object):
+    '''Read access to the gene sequence sidecar of a ChromosomeBase.'''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            magic, version, file_tag, self.num_genes = HEADER.unpack(
+              f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a version %s gene sequence file: %s' % (
+                  VERSION, path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        self.file_tag = file_tag.rstrip('\0')
+
+    @classmethod
+    def for_chromosome_base(cls, cb):
+        '''Return the store of cb, or None if there is none for its data.'''
+
+        if not os.path.exists(cb.gene_sequences_file_path):
+            return None
+        store = cls(cb.gene_sequences_file_path)
+        if store.file_tag != str(cb.file_tag):
+            store.close()
+            return None
+        return store
+
+    def close(self):
+        self._map.close()
+
+    def _record(self, n):
+        return RECORD.unpack_from(self._map, HEADER.size + n * RECORD.size)
+
+    def sequence(self, gene_id):
+        '''Return the StoredGeneSequence of gene_id (or None).'''
+
+        lo, hi = 0, self.num_genes
+        while lo < hi:
+            middle = (lo + hi) // 2
+            if self._record(middle)[0] < gene_id:
+                lo = middle + 1
+            else:
+                hi = middle
+        if lo == self.num_genes:
+            return None
+        record_gene_id, offset, size = self._record(lo)
+        if record_gene_id != gene_id:
+            return None
+        return _unpack_entry(self._map[offset:offset + size])
+
+
+def stored_sequence(gene, strain, cb=None):
+    '''Return the StoredGeneSequence of gene in strain.
+
+    cb is the strain's ChromosomeBase of the gene's chromosome, which is
+    looked up if not given.  Returns None if it has no (up to date) store
+    holding the gene.
+
+    '''
+
+    from chromosome.models import ChromosomeBase
+
+    if cb is None:
+        cbs = ChromosomeBase.objects.filter(strain=strain,
+          chromosome=gene.chromosome_id)[:1]
+        if not cbs:
+            return None
+        cb = cbs[0]
+    try:
+        store = GeneSequenceStore.for_chromosome_base(cb)
+        if store is None:
+            return None
+        try:
+            return store.sequence(gene.id)
+        finally:
+            store.close()
+    except (IOError, ValueError, struct.error, zlib.error):
+        log.exception('Error reading gene sequence store')
+        return None
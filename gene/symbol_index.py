@@ -0,0 +1,179 @@
+'''An in-process index for resolving gene symbols without database queries.
+
+Every gene search (and every line of a gene batch) has to resolve a user
+supplied symbol to the group of equivalent GeneSymbols and its FlyBase ID.
+Doing that against the database costs several queries per symbol, so the
+whole symbol table is instead loaded into memory once per process.
+
+The index is versioned by the latest GeneSymbolImportLog, so each process
+reloads its index the next time it notices a gene symbol import has finished
+since it was loaded (and the importers also reload the index of their own
+process).  The import logs are only checked every SYMBOL_INDEX_CHECK_SECONDS
+seconds (a setting, defaulting to 60), so resolving a symbol normally
+involves no I/O at all.
+
+'''
+
+import threading
+import time
+
+from django.conf import settings
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class SymbolMatch(object):
+    '''The result of resolving a gene symbol against the index.'''
+
+    def __init__(self, symbol, all_symbols, flybase_id=None):
+        self.symbol = symbol
+        self.all_symbols = all_symbols
+        self.flybase_id = flybase_id
+
+    def __str__(self):
+        '''Define the string representation of this class of object.'''
+        return self.symbol
+
+
+class GeneSymbolIndex(object):
+    '''Maps every gene symbol to the group of symbols it translates to.'''
+
+    def __init__(self, version=None):
+        self.version = version
+        self._symbol_groups = {}   # symbol -> group key
+        self._folded_symbols = {}  # lower case symbol -> symbol (or None)
+        self._groups = {}          # group key -> list of symbols
+        self._flybase_ids = {}     # group key -> FlyBase ID (or None)
+
+    def __contains__(self, symbol):
+        return symbol in self._symbol_groups
+
+    def __len__(self):
+        return len(self._symbol_groups)
+
+    def add_group(self, key, symbols, flybase_id=None):
+        '''Add a group of equivalent symbols to the index.'''
+
+        group = self._groups.setdefault(key, [])
+        self._flybase_ids[key] = flybase_id
+        for symbol in symbols:
+            if symbol in self._symbol_groups:
+                # Duplicated symbol; the first group loaded wins.
+                continue
+            self._symbol_groups[symbol] = key
+            group.append(symbol)
+
+            folded = symbol.lower()
+            if folded in self._folded_symbols:
+                # Case-insensitively ambiguous, so it can only be matched
+                # exactly.
+                self._folded_symbols[folded] = None
+            else:
+                self._folded_symbols[folded] = symbol
+
+    def load(self):
+        '''Load all gene symbols and their groups from the database.'''
+
+        from gene.models import GeneSymbol, GeneSymbolGroup
+
+        flybase_ids = dict(GeneSymbolGroup.objects.values_list(
+          'id', 'flybase_id'))
+
+        groups = {}
+        for pk, symbol, group_id in GeneSymbol.objects.values_list(
+          'id', 'symbol', 'group').order_by('id'):
+            # Symbols without a group are only equivalent to themselves.
+            key = group_id if group_id is not None else -pk
+            groups.setdefault(key, []).append(symbol)
+        for key in sorted(groups):
+            self.add_group(key, groups[key], flybase_ids.get(key))
+
+        log.info('Loaded gene symbol index: %s symbols, %s groups' % (
+          len(self._symbol_groups), len(self._groups)))
+        return self
+
+    def lookup(self, symbol):
+        '''Return the SymbolMatch for exactly symbol (or None).'''
+
+        if symbol not in self._symbol_groups:
+            return None
+        key = self._symbol_groups[symbol]
+        return SymbolMatch(symbol, [symbol] + [s for s in self._groups[key]
+          if s != symbol], self._flybase_ids[key])
+
+    def normalize(self, symbol):
+        '''Return the normalized version of symbol, checked against the index.'''
+
+        from gene.models import GeneSymbol
+        return GeneSymbol.normalize(symbol, symbol_exists=self.__contains__)
+
+    def resolve_one(self, symbol):
+        '''Resolve a user supplied symbol to a SymbolMatch (or None).
+
+        The symbol is normalized and looked up exactly, falling back to a
+        case insensitive match.
+
+        '''
+
+        normalized = self.normalize(symbol)
+        match = self.lookup(normalized)
+        if match is None:
+            folded = self._folded_symbols.get(normalized.lower())
+            if folded is not None:
+                match = self.lookup(folded)
+        return match
+
+    def resolve(self, symbols):
+        '''Resolve many symbols, returning a dict of symbol -> SymbolMatch.
+
+        Symbols which can't be resolved map to None.
+
+        '''
+
+        return dict((symbol, self.resolve_one(symbol)) for symbol in symbols)
+
+
+def symbol_index_version():
+    '''Return the current version of the gene symbol data (or None).'''
+
+    from gene.models import GeneSymbolImportLog
+    return GeneSymbolImportLog.data_version()
+
+
+def invalidate_symbol_index():
+    '''Make this process reload its gene symbol index when next used.
+
+    Other processes reload theirs when they notice the import log of the
+    change, so this should be called whenever the gene symbol data changes.
+
+    '''
+
+    global _index
+    with _index_lock:
+        _index = None
+
+
+_index = None
+_index_checked_at = 0
+_index_lock = threading.Lock()
+
+
+def get_symbol_index():
+    '''Return this process's gene symbol index, (re)loading it if stale.'''
+
+    global _index, _index_checked_at
+
+    check_seconds = getattr(settings, 'SYMBOL_INDEX_CHECK_SECONDS', 60)
+    index = _index
+    if index is not None and time.time() - _index_checked_at < check_seconds:
+        return index
+
+    with _index_lock:
+        version = symbol_index_version()
+        # With no import logs to go by, a loaded index is kept.
+        if _index is None or (version is not None and
+          _index.version != version):
+            _index = GeneSymbolIndex(version).load()
+        _index_checked_at = time.time()
+        return _index
@@ -0,0 +1,303 @@
+import os
+import shutil
+import StringIO
+import gzip
+import sys
+import tempfile
+import zipfile
+
+import django.utils.timezone
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from common.models import Chromosome, Species, Strain, StrainSymbol
+from gene.management.commands.gene_import import GFFReader
+from gene.models import (CDS, Gene, GeneBatchProcess, GeneImportLog,
+    GeneSymbol, GeneSymbolGroup, GeneSymbolImportLog)
+from gene.interval_index import NCList, get_interval_index
+from gene.symbol_index import (GeneSymbolIndex, get_symbol_index,
+    invalidate_symbol_index)
+
+
+class GeneBatchProcessTests(TestCase):
+
+    def setUp(self):
+        self.species = Species.objects.create(name='just a test species', symbol='SYM')
+        self.delivery_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.delivery_root)
+
+    def _add_batch(self, symbols):
+        return GeneBatchProcess.objects.create(
+            submitted_at=django.utils.timezone.now(),
+            submitter_email='someone@example.com',
+            original_species=str(self.species.pk),
+            original_request='\n'.join(symbols),
+            delivery_tag=GeneBatchProcess.generate_unique_tag())
+
+    def test_claim_pending_batches(self):
+        first = self._add_batch(['GA26895'])
+        self._add_batch(['GA10064'])
+
+        claimed = GeneBatchProcess.objects.claim_pending_batches(limit=1)
+        self.assertEquals([b.pk for b in claimed], [first.pk])
+        self.assertEquals(GeneBatchProcess.objects.get(pk=first.pk).batch_status, 'A')
+
+        # Already claimed batches are never handed out again.
+        claimed = GeneBatchProcess.objects.claim_pending_batches()
+        self.assertEquals(len(claimed), 1)
+        self.assertNotEquals(claimed[0].pk, first.pk)
+        self.assertEquals(len(GeneBatchProcess.objects.claim_pending_batches()), 0)
+
+    def test_batch_results_written_to_delivery_zip(self):
+        batch = self._add_batch(['nosuchgene', 'nosuchgene', ''])
+        cwd = os.getcwd()
+
+        with override_settings(PSEUDOBASE_DELIVERY_ROOT=self.delivery_root):
+            call_command('gene_batch')
+
+        self.assertEquals(os.getcwd(), cwd)
+        batch = GeneBatchProcess.objects.get(pk=batch.pk)
+        self.assertEquals(batch.batch_status, 'C')
+        self.assertEquals(batch.total_symbols, 1)
+        self.assertEquals(batch.failed_symbols, 1)
+
+        results = zipfile.ZipFile(os.path.join(self.delivery_root,
+            batch.delivery_tag, 'pseudobase_results.zip'))
+        self.assertEquals(sorted(results.namelist()),
+            ['pseudobase_results/report.txt', 'pseudobase_results/request.txt'])
+        self.assertTrue('1 tried, 0 succeeded, 1 failed' in
+            results.read('pseudobase_results/report.txt'))
+        self.assertEquals(set(i.compress_type for i in results.infolist()),
+            set([zipfile.ZIP_DEFLATED]))
+        self.assertFalse(os.path.exists(os.path.join(self.delivery_root,
+            batch.delivery_tag, 'pseudobase_results.zip.part')))
+
+
+class GeneSymbolIndexTests(TestCase):
+
+    def setUp(self):
+        group = GeneSymbolGroup.objects.create(flybase_id='FBgn0248267')
+        for s in ['FBgn0248267', 'GA26895', 'atl']:
+            GeneSymbol.objects.create(symbol=s, group=group)
+        GeneSymbol.objects.create(symbol='GA10064',
+            group=GeneSymbolGroup.objects.create())
+
+    def test_resolve(self):
+        index = GeneSymbolIndex().load()
+        matches = index.resolve(['ga26895', 'fbgn0248267', 'ATL', 'GA10064',
+            'nosuchgene'])
+
+        self.assertEquals(matches['ga26895'].symbol, 'GA26895')
+        self.assertEquals(sorted(matches['ga26895'].all_symbols),
+            ['FBgn0248267', 'GA26895', 'atl'])
+        self.assertEquals(matches['ga26895'].flybase_id, 'FBgn0248267')
+        self.assertEquals(matches['fbgn0248267'].symbol, 'FBgn0248267')
+        self.assertEquals(matches['ATL'].all_symbols[0], 'atl')
+        self.assertEquals(matches['GA10064'].all_symbols, ['GA10064'])
+        self.assertEquals(matches['GA10064'].flybase_id, None)
+        self.assertEquals(matches['nosuchgene'], None)
+
+    def test_invalidate(self):
+        with override_settings(SYMBOL_INDEX_CHECK_SECONDS=0):
+            index = get_symbol_index()
+            self.assertTrue(get_symbol_index() is index)
+            invalidate_symbol_index()
+            self.assertFalse(get_symbol_index() is index)
+
+            # Other processes notice imports through the import logs.
+            index = get_symbol_index()
+            now = django.utils.timezone.now()
+            GeneSymbolImportLog.objects.create(start=now, end=now,
+                run_microseconds=0, file_path='symbols.txt', symbol_count=1,
+                translation_count=0)
+            self.assertFalse(get_symbol_index() is index)
+            index = get_symbol_index()
+            self.assertTrue(get_symbol_index() is index)
+
+
+class GeneSymbolImportTests(TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.data_dir)
+
+    def _write_file(self, name, lines):
+        path = os.path.join(self.data_dir, name)
+        with open(path, 'w') as f:
+            f.write('\n'.join(['\t'.join(line) for line in lines]) + '\n')
+        return path
+
+    def test_import(self):
+        call_command('gene_symbol_import', self._write_file('fbgn_gleanr.tsv', [
+            ['Dpse\\GA26895', 'FBgn0248267', 'GLEANR_4729'],
+            ['Dpse\\GA10064', 'FBgn0070102', 'GLEANR_1234']]))
+        call_command('gene_symbol_import_additional_symbols',
+            self._write_file('additional.tsv', [
+                ['GL16052', 'FBgn0070102'],
+                ['Dmel_FBgn0035724', 'GLEANR_1234'],
+                ['GA26895', 'FBgn0070102'],
+                ['GL99999', 'FBgn9999999']]))
+
+        self.assertEquals(GeneSymbol.objects.count(), 8)
+        self.assertEquals(sorted(GeneSymbolGroup.objects.values_list(
+            'flybase_id', flat=True)), ['FBgn0070102', 'FBgn0248267'])
+        self.assertEquals(GeneSymbol.objects.get(symbol='GL16052').flybase_ID(),
+            'FBgn0070102')
+        index = GeneSymbolIndex().load()
+        self.assertEquals(sorted(index.lookup('GL16052').all_symbols),
+            ['Dmel_FBgn0035724', 'FBgn0070102', 'GA10064', 'GL16052',
+             'GLEANR_1234'])
+        self.assertEquals(sorted(index.lookup('GA26895').all_symbols),
+            ['FBgn0248267', 'GA26895', 'GLEANR_4729'])
+        self.assertEquals(index.lookup('GL99999'), None)
+
+
+class GFFReaderTests(TestCase):
+
+    GFF = [
+        '##gff-version 3',
+        '2\tFlyBase\tgene\t100\t500\t.\t+\t.\tID=FBgn01;Name=atl',
+        '2\tFlyBase\tmRNA\t100\t500\t.\t+\t.\tID=FBtr01;Parent=FBgn01;Name=atl-RA',
+        '2\tFlyBase\texon\t100\t200\t.\t+\t.\tID=ex1;Parent=FBtr01',
+        '2\tFlyBase\tCDS\t120\t200\t.\t+\t0\tParent=FBtr01',
+        '2\tFlyBase\tmRNA\t100\t500\t.\t+\t.\tID=FBtr02;Parent=FBgn01;Name=atl-RB',
+        '2\tFlyBase\tCDS\t300\t450\t.\t+\t1\tParent=FBtr01,FBtr02',
+        '2\tFlyBase\tCDS\t310\t450\t.\t+\t0\tParent=FBtr02',
+        '2\tFlyBase\tgene\t900\t1000\t.\t-\t.\tID=FBgn02;Name=nc',
+        '2\tFlyBase\tncRNA\t900\t1000\t.\t-\t.\tID=FBtr03;Parent=FBgn02',
+        '###',
+        '2\tFlyBase\tCDS\t900\t950\t.\t+\t0\tParent=FBtr01',
+        '3\tFlyBase\tgene\t5\t50\t.\t-\t.\tID=FBgn03',
+        '3\tFlyBase\tmRNA\t5\t50\t.\t-\t.\tID=FBtr04;Parent=FBgn03;Name=x-RA',
+        '3\tFlyBase\tCDS\t5\t50\t.\t-\t0\tParent=FBtr04',
+        '##FASTA',
+        '>2',
+        'ACGT']
+
+    def setUp(self):
+        fd, self.gff_path = tempfile.mkstemp(suffix='.gff3.gz')
+        os.close(fd)
+        f = gzip.open(self.gff_path, 'w')
+        f.write('\n'.join(self.GFF) + '\n')
+        f.close()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.remove(self.gff_path)
+
+    def test_genes(self):
+        reader = GFFReader(None, self.gff_path)
+        genes = list(reader.genes())
+
+        self.assertEquals([g.import_code for g in genes],
+            ['FBgn01', 'FBgn02', 'FBgn03'])
+        self.assertEquals((genes[0].seqid, genes[0].start, genes[0].end,
+            genes[0].strand), ('2', 100, 500, '+'))
+        self.assertEquals([(t.name, t.cds) for t in genes[0].transcripts],
+            [('atl-RA', [(120, 200), (300, 450)]),
+             ('atl-RB', [(300, 450), (310, 450)])])
+        self.assertEquals(genes[1].coding_transcripts(), [])
+        self.assertEquals(genes[2].transcripts[0].cds, [(5, 50)])
+        self.assertEquals(reader.orphans, 1)
+
+    def test_chrom_names(self):
+        reader = GFFReader(None, self.gff_path, chrom_names=['3'])
+        self.assertEquals([g.import_code for g in reader.genes()], ['FBgn03'])
+
+    def _import_genes(self, **options):
+        Chromosome.objects.create(name='2')
+        Chromosome.objects.create(name='3')
+        species = Species.objects.create(name='just a test species', symbol='SYM')
+        strain = Strain.objects.create(name='just a test strain', species=species)
+        StrainSymbol.objects.create(symbol='MV2-25', strain=strain)
+
+        genes_per_chunk = GFFReader.GENES_PER_CHUNK
+        GFFReader.GENES_PER_CHUNK = 1
+        try:
+            call_command('gene_import', self.gff_path, **options)
+        finally:
+            GFFReader.GENES_PER_CHUNK = genes_per_chunk
+
+    def test_import(self):
+        self._import_genes()
+
+        self.assertEquals(sorted(Gene.objects.values_list('import_code', flat=True)),
+            ['FBgn01', 'FBgn03'])
+        gene = Gene.objects.get(import_code='FBgn01')
+        self.assertEquals([(m.name, m.cds_list()) for m in gene.mrna_set.order_by('name')],
+            [('atl-RA', [[120, 200], [300, 450]]), ('atl-RB', [[300, 450], [310, 450]])])
+        self.assertEquals(CDS.objects.count(), 5)
+
+        import_log = GeneImportLog.objects.get()
+        self.assertEquals(import_log.gene_count, 2)
+        self.assertEquals(import_log.last_import_code, 'FBgn03')
+        self.assertTrue(import_log.completed)
+
+    def test_resume_import(self):
+        now = django.utils.timezone.now()
+        GeneImportLog.objects.create(start=now, end=now, run_microseconds=0,
+            file_path=self.gff_path, gene_count=1, last_import_code='FBgn01')
+        self._import_genes(resume=True)
+
+        self.assertEquals(list(Gene.objects.values_list('import_code', flat=True)),
+            ['FBgn03'])
+        import_log = GeneImportLog.objects.get()
+        self.assertEquals(import_log.gene_count, 2)
+        self.assertTrue(import_log.completed)
+
+    def test_interval_index(self):
+        with override_settings(INTERVAL_INDEX_CHECK_SECONDS=0):
+            index = get_interval_index()
+            self._import_genes()
+            self.assertFalse(get_interval_index() is index)
+            index = get_interval_index()
+
+        chromosome = Chromosome.objects.get(name='2')
+        chromosome_genes = index.chromosome(None, chromosome.id)
+        self.assertTrue(index.chromosome(None, chromosome.id) is
+            chromosome_genes)
+        self.assertEquals([str(g) for g in
+            chromosome_genes.overlapping_genes(450, 950)], ['FBgn01'])
+        self.assertEquals(chromosome_genes.overlapping_genes(501, 899), [])
+        self.assertEquals([str(m) for m in
+            chromosome_genes.overlapping_mrnas(100, 119)], [])
+        self.assertEquals([(start, end, str(m)) for start, end, m in
+            chromosome_genes.overlapping_cds(200, 305)],
+            [(120, 200, 'atl-RA'), (300, 450, 'atl-RA'), (300, 450, 'atl-RB')])
+
+        regions = index.gene_regions(['FBgn01', 'FBgn03'])
+        self.assertEquals([(release_id, chromosome_id, str(g)) for
+            release_id, chromosome_id, g in regions],
+            [(None, chromosome.id, 'FBgn01'),
+             (None, Chromosome.objects.get(name='3').id, 'FBgn03')])
+        self.assertEquals([(m.name, m.start_position, m.end_position) for m in
+            regions[0][2].mrnas], [('atl-RA', 120, 450), ('atl-RB', 300, 450)])
+
+
+class NCListTests(TestCase):
+
+    def test_overlapping(self):
+        intervals = [(1, 100, 'a'), (10, 20, 'b'), (10, 20, 'c'),
+            (15, 120, 'd'), (50, 60, 'e'), (55, 58, 'f'), (130, 140, 'g'),
+            (135, 135, 'h')]
+        nclist = NCList(intervals)
+        self.assertEquals(len(nclist), len(intervals))
+        for start in range(0, 150, 5):
+            for end in range(start, 150, 7):
+                expected = sorted([i for i in intervals
+                    if i[0] <= end and i[1] >= start],
+                    key=lambda i: (i[0], -i[1]))
+                self.assertEquals(sorted(nclist.overlapping(start, end)),
+                    sorted(expected))
+                self.assertEquals([i[:2] for i in nclist.overlapping(start,
+                    end)], [i[:2] for i in expected])
@@ -263,4 +263,19 @@ JBROWSE_PERL_GUNZIP_PATH = '/usr/bin/gunzip'
 JBROWSE_PERL_BGZIP_PATH = '/usr/local/bin/bgzip'
 JBROWSE_PERL_TABIX_PATH = '/usr/local/bin/tabix'
 
-LOG_FILE_PREFIX = 'logs/'
\ No newline at end of file
+LOG_FILE_PREFIX = 'logs/'
+
+# Geolocation of search request IP addresses (see common.geolocation).  The
+# URL has %s in place of the IP address.
+IP_GEOLOCATION_URL = 'https://ipapi.co/%s/json/'
+IP_GEOLOCATION_TIMEOUT = 10
+IP_GEOLOCATION_BATCH_SIZE = 100
+IP_GEOLOCATION_MAX_AGE_DAYS = 30
+IP_GEOLOCATION_RETRY_MINUTES = 10
+
+# Packaging and serving of deliveries (see common.delivery).  SENDFILE can be
+# None (files are served by Django), 'x-sendfile' or 'x-accel-redirect' (with
+# ACCEL_PREFIX the internal nginx location of PSEUDOBASE_DELIVERY_ROOT).
+PSEUDOBASE_DELIVERY_COMPRESSION_LEVEL = 6
+PSEUDOBASE_DELIVERY_SENDFILE = None
+PSEUDOBASE_DELIVERY_ACCEL_PREFIX = '/protected_delivery/'
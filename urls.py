@@ -29,9 +29,23 @@ urlpatterns = patterns('',
 
    url(r'^jb/stats/global$','common.views.jb_stats_global',name='jb_stats_global'),
 
+   url(r'^jb/stats/region/(?P<ref_name>.+)$', 'common.views.jb_stats_region', name='jb_stats_region'),
+
+   url(r'^jb/stats/regionFeatureDensities/(?P<ref_name>.+)$', 'common.views.jb_stats_region_feature_densities', name='jb_stats_region_feature_densities'),
+
    url(r'^jb/features/(?P<ref_name>.+)$', 'common.views.jb_get_features', name='jb_get_features'),
+
+   url(r'^jb/coverage/features/(?P<ref_name>.+)$', 'common.views.jb_coverage_features', name='jb_coverage_features'),
+
+  # Bulk sequence retrieval for pipelines
+   url(r'^api/sequences/$', 'common.views.bulk_sequences', name='bulk_sequences'),
+   url(r'^api/variable_sites/(?P<ref_name>[^/]+)$', 'common.views.variable_sites', name='variable_sites'),
+   url(r'^api/sequence_search/$', 'common.views.sequence_search', name='sequence_search'),
+   url(r'^api/genes/(?P<ref_name>[^/]+)$', 'common.views.genes', name='genes'),
+   url(r'^api/gene_region/(?P<symbol>[^/]+)$', 'common.views.gene_region', name='gene_region'),
    
-  # The page handling file deliveries
+  # The page handling file deliveries, and the delivered files themselves
+  url(r'^delivery/(?P<path>.+\.(?:zip|gz))$', 'common.views.delivery_file', name='delivery_file'),
   (r'^delivery/(.+)$', 'common.views.delivery'),
   
   # Uncomment the admin/doc line below to enable admin documentation: